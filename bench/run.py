@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2017  Red Hat, Inc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Measures the overhead system-buildah adds on top of the tools it drives.
+
+Every scenario runs the real CLI in a new interpreter against the stub
+tools from stub_tools.py. Wall time, the time spent inside the stubs,
+peak RSS of the CLI process and bytes written are reported as JSON.
+
+Example::
+
+    $ python3 bench/run.py --iterations 5 --tar-size 2G -o results.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import stub_tools
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+#: name -> (manager, command line after the manager switch)
+SCENARIOS = {
+    'generate-files': (None, [
+        'generate-files', '-D', 'a=b', '-c=--cwd=/root', 'context']),
+    'generate-files-ocitools': (None, [
+        'generate-files', '--ocitools', '-c=--cwd=/root', 'context']),
+    'generate-dockerfile': (None, [
+        'generate-dockerfile', '-o', 'context', '-A', 'extra.txt=/etc/x',
+        'image']),
+    'build': ('moby', ['build', '-p', 'context', 'image:latest']),
+    'tar': ('moby', ['tar', 'image:latest']),
+    'tar-gzip': ('moby', ['tar', '--compress', 'gzip', 'image:latest']),
+    'export-layout': ('moby', [
+        'export-layout', '-o', 'layout', 'a:1', 'b:1', 'c:1', 'd:1']),
+    'build-buildah': ('buildah', ['build', '-p', 'context', 'image:latest']),
+    'tar-buildah': ('buildah', ['tar', 'image:latest']),
+}
+
+
+def _parse_size(value):
+    """
+    Parses sizes such as 512, 10M or 2G.
+
+    :param value: The size to parse.
+    :type value: str
+    :returns: The size in bytes
+    :rtype: int
+    """
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+    if value and value[-1].upper() in units:
+        return int(float(value[:-1]) * units[value[-1].upper()])
+    return int(value)
+
+
+def _snapshot(path):
+    """
+    Returns the size and mtime of every file below path.
+
+    :param path: Directory to walk.
+    :type path: str
+    :returns: Mapping of file path to (size, mtime)
+    :rtype: dict
+    """
+    files = {}
+    for root, _, names in os.walk(path):
+        for name in names:
+            full_path = os.path.join(root, name)
+            stat = os.stat(full_path)
+            files[full_path] = (stat.st_size, stat.st_mtime_ns)
+    return files
+
+
+def _bytes_written(before, after):
+    """
+    Returns the bytes in files created or changed between snapshots.
+
+    :param before: Snapshot taken before the run.
+    :type before: dict
+    :param after: Snapshot taken after the run.
+    :type after: dict
+    :returns: Bytes written
+    :rtype: int
+    """
+    return sum(size for path, (size, mtime) in after.items()
+               if before.get(path) != (size, mtime))
+
+
+def _stub_seconds(log):
+    """
+    Returns the time spent in stubs and clears the log.
+
+    :param log: The STUB_LOG file.
+    :type log: str
+    :returns: Seconds spent in stubs
+    :rtype: float
+    """
+    if not os.path.exists(log):
+        return 0.0
+    with open(log) as log_file:
+        total = sum(float(line.split()[1]) for line in log_file)
+    os.unlink(log)
+    return total
+
+
+def _prepare(work_dir):
+    """
+    Creates an empty work directory holding only a small build context.
+
+    :param work_dir: The work directory.
+    :type work_dir: str
+    """
+    if os.path.exists(work_dir):
+        shutil.rmtree(work_dir)
+    os.makedirs(os.path.join(work_dir, 'context'))
+    with open(os.path.join(work_dir, 'context', 'extra.txt'), 'w') as f:
+        f.write('extra\n')
+
+
+def run_once(work_dir, env, manager, args):
+    """
+    Runs the CLI once in a fresh work directory.
+
+    :param work_dir: Directory to run in.
+    :type work_dir: str
+    :param env: Environment for the CLI.
+    :type env: dict
+    :param manager: Manager to use or None.
+    :type manager: str or None
+    :param args: CLI arguments.
+    :type args: list
+    :returns: Measurements of the run
+    :rtype: dict
+    """
+    command = [sys.executable, '-m', 'system_buildah.cli'] + args
+    if manager:
+        command[4:4] = ['--manager', manager]
+    _prepare(work_dir)
+    before = _snapshot(work_dir)
+    start = time.monotonic()
+    # A pipe nobody reads during wait4() would block a chatty CLI
+    with tempfile.TemporaryFile() as stderr:
+        process = subprocess.Popen(
+            command, cwd=work_dir, env=env,
+            stdout=subprocess.DEVNULL, stderr=stderr)
+        _, status, rusage = os.wait4(process.pid, 0)
+        wall = time.monotonic() - start
+        process.returncode = (
+            -os.WTERMSIG(status) if os.WIFSIGNALED(status)
+            else os.WEXITSTATUS(status))
+        if process.returncode:
+            stderr.seek(0)
+            raise RuntimeError('{} failed with {}: {}'.format(
+                ' '.join(args), process.returncode,
+                stderr.read().decode('utf-8')))
+    stub = _stub_seconds(env['STUB_LOG'])
+    return {
+        'wall_seconds': wall,
+        'stub_seconds': stub,
+        'overhead_seconds': wall - stub,
+        # ru_maxrss is reported in KiB on Linux
+        'max_rss_bytes': rusage.ru_maxrss * 1024,
+        'bytes_written': _bytes_written(before, _snapshot(work_dir)),
+    }
+
+
+def _summarize(name, manager, runs):
+    """
+    Combines the runs of one scenario.
+
+    :param name: Name of the scenario.
+    :type name: str
+    :param manager: Manager used.
+    :type manager: str or None
+    :param runs: Measurements of each run.
+    :type runs: list
+    :returns: The summary
+    :rtype: dict
+    """
+    summary = {'scenario': name, 'manager': manager, 'runs': runs}
+    for key in ('wall_seconds', 'stub_seconds', 'overhead_seconds'):
+        summary[key] = {
+            'median': statistics.median(x[key] for x in runs),
+            'min': min(x[key] for x in runs),
+            'max': max(x[key] for x in runs),
+        }
+    summary['max_rss_bytes'] = max(x['max_rss_bytes'] for x in runs)
+    summary['bytes_written'] = max(x['bytes_written'] for x in runs)
+    return summary
+
+
+def run(scenarios, iterations, latency, tar_size):
+    """
+    Runs the benchmark scenarios.
+
+    :param scenarios: Names of the scenarios to run.
+    :type scenarios: list
+    :param iterations: Runs per scenario.
+    :type iterations: int
+    :param latency: Seconds each stub invocation sleeps.
+    :type latency: float
+    :param tar_size: Bytes of layer data in exported archives.
+    :type tar_size: int
+    :returns: The results
+    :rtype: dict
+    """
+    temp_dir = tempfile.mkdtemp(prefix='system-buildah-bench-')
+    try:
+        bin_dir = os.path.join(temp_dir, 'bin')
+        work_dir = os.path.join(temp_dir, 'work')
+        os.mkdir(bin_dir)
+        stub_tools.install(bin_dir)
+        env = dict(
+            os.environ,
+            PATH=os.pathsep.join([bin_dir, os.environ.get('PATH', '')]),
+            PYTHONPATH=os.path.join(ROOT, 'src'),
+            XDG_CACHE_HOME=os.path.join(temp_dir, 'cache'),
+            STUB_LATENCY=str(latency), STUB_TAR_SIZE=str(tar_size),
+            STUB_LOG=os.path.join(temp_dir, 'stub.log'),
+            PYTHONWARNINGS='ignore')
+        results = []
+        for name in scenarios:
+            manager, args = SCENARIOS[name]
+            runs = [run_once(work_dir, env, manager, args)
+                    for _ in range(iterations)]
+            results.append(_summarize(name, manager, runs))
+    finally:
+        shutil.rmtree(temp_dir)
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'iterations': iterations,
+        'stub_latency_seconds': latency,
+        'tar_size_bytes': tar_size,
+        'results': results,
+    }
+
+
+def main():
+    """
+    Command line entry point.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument(
+        '-s', '--scenario', action='append', choices=sorted(SCENARIOS),
+        help='Scenario to run. May be repeated. Default: all')
+    parser.add_argument(
+        '-n', '--iterations', type=int, default=3,
+        help='Runs per scenario')
+    parser.add_argument(
+        '--latency', type=float, default=0.0,
+        help='Seconds each stub invocation sleeps')
+    parser.add_argument(
+        '--tar-size', type=_parse_size, default='1M',
+        help='Layer data in exported archives, such as 512K or 2G')
+    parser.add_argument(
+        '-o', '--output', default='-',
+        help='File to write the JSON results to. Default: stdout')
+    args = parser.parse_args()
+
+    results = run(args.scenario or list(SCENARIOS), args.iterations,
+                  args.latency, args.tar_size)
+    if args.output == '-':
+        json.dump(results, sys.stdout, indent=8, sort_keys=True)
+        sys.stdout.write('\n')
+    else:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=8, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2017  Red Hat, Inc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Stand ins for docker, buildah and ocitools used by the benchmarks.
+
+Behavior is controlled with environment variables:
+
+* STUB_LATENCY: seconds every invocation sleeps (default 0)
+* STUB_TAR_SIZE: bytes of layer data in exported archives (default 1MiB)
+* STUB_LOG: file each invocation appends "tool elapsed" to
+"""
+
+import hashlib
+import json
+import os
+import stat
+import sys
+import tarfile
+import time
+
+#: Size of the chunks written to exported archives.
+CHUNK_SIZE = 1024 * 1024
+
+TOOLS = ('docker', 'buildah', 'ocitools')
+
+
+def install(bin_dir):
+    """
+    Writes executable stubs for every tool into bin_dir.
+
+    :param bin_dir: Directory to write the stubs to.
+    :type bin_dir: str
+    """
+    here = os.path.dirname(os.path.realpath(__file__))
+    for tool in TOOLS:
+        path = os.path.join(bin_dir, tool)
+        with open(path, 'w') as stub:
+            stub.write(
+                '#!{}\nimport sys\nsys.path.insert(0, {!r})\n'
+                'import stub_tools\nstub_tools.main({!r}, sys.argv[1:])\n'
+                .format(sys.executable, here, tool))
+        os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR)
+
+
+def _image_id(image):
+    """Returns a stable fake image ID"""
+    return 'sha256:' + hashlib.sha256(image.encode('utf-8')).hexdigest()
+
+
+def _write_member(destination, name, size, chunks):
+    """Writes one tar member from an iterable of chunks"""
+    info = tarfile.TarInfo(name)
+    info.size = size
+    destination.write(info.tobuf(tarfile.GNU_FORMAT))
+    for chunk in chunks:
+        destination.write(chunk)
+    destination.write(b'\0' * (-size % tarfile.BLOCKSIZE))
+
+
+def _data_chunks(size):
+    """Yields size bytes of file data in chunks"""
+    chunk = b'stub layer data\n' * (CHUNK_SIZE // 16)
+    while size > 0:
+        yield chunk[:min(size, CHUNK_SIZE)]
+        size -= CHUNK_SIZE
+
+
+def _layer(size):
+    """
+    Returns the size and chunks of a layer tar holding one big file.
+
+    :param size: Approximate size of the layer.
+    :type size: int
+    :returns: The exact layer size and a generator of its chunks
+    :rtype: tuple(int, generator)
+    """
+    data_size = max(0, size - 3 * tarfile.BLOCKSIZE) // tarfile.BLOCKSIZE \
+        * tarfile.BLOCKSIZE
+    info = tarfile.TarInfo('stub/data')
+    info.size = data_size
+
+    def chunks():
+        yield info.tobuf(tarfile.GNU_FORMAT)
+        yield from _data_chunks(data_size)
+        yield b'\0' * tarfile.BLOCKSIZE * 2
+    return data_size + 3 * tarfile.BLOCKSIZE, chunks()
+
+
+def write_archive(destination, images, size):
+    """
+    Writes a docker-archive where each image has one layer of size bytes.
+
+    The layers are streamed in chunks so multi GB archives need no memory.
+    Every layer holds the same data, like images sharing a base would.
+
+    :param destination: Binary stream to write to.
+    :type destination: file
+    :param images: Name of the image, or names of several.
+    :type images: str or list
+    :param size: Bytes of layer data.
+    :type size: int
+    """
+    if isinstance(images, str):
+        images = [images]
+    manifest = [_write_image(destination, x, size) for x in images]
+    manifest = json.dumps(manifest).encode('utf-8')
+    _write_member(destination, 'manifest.json', len(manifest), [manifest])
+    destination.write(b'\0' * tarfile.BLOCKSIZE * 2)
+
+
+def _write_image(destination, image, size):
+    """Writes the layer and config of an image and returns its manifest"""
+    layer_id = _image_id(image)[7:]
+    layer_size, chunks = _layer(size)
+    digest = hashlib.sha256()
+
+    def hashed():
+        for chunk in chunks:
+            digest.update(chunk)
+            yield chunk
+    _write_member(destination, '{}/layer.tar'.format(layer_id),
+                  layer_size, hashed())
+    config = json.dumps({
+        'rootfs': {'type': 'layers',
+                   'diff_ids': ['sha256:' + digest.hexdigest()]},
+        'history': [{'created_by': '/bin/sh -c #(nop) COPY stub'}],
+    }).encode('utf-8')
+    config_name = '{}.json'.format(hashlib.sha256(config).hexdigest())
+    _write_member(destination, config_name, len(config), [config])
+    return {
+        'Config': config_name,
+        'RepoTags': [image],
+        'Layers': ['{}/layer.tar'.format(layer_id)],
+    }
+
+
+def _context_size(path):
+    """Reads every file in a build context like a real upload would"""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            with open(os.path.join(root, name), 'rb') as source:
+                total += len(source.read())
+    return total
+
+
+def _export(images, target):
+    """Writes the archive to a path or stdout"""
+    size = int(os.environ.get('STUB_TAR_SIZE', CHUNK_SIZE))
+    if target in (None, '/dev/stdout'):
+        write_archive(sys.stdout.buffer, images, size)
+        sys.stdout.buffer.flush()
+        return
+    with open(target, 'wb') as destination:
+        write_archive(destination, images, size)
+
+
+def docker(args):
+    """Emulates the docker commands system-buildah runs"""
+    while args and args[0].startswith('--'):
+        args = args[1:]
+    if args[0] == 'build':
+        _context_size('.')
+    elif args[0] == 'save':
+        if args[1] == '-o':
+            _export(args[3:], args[2])
+        else:
+            _export(args[1:], None)
+    elif args[:2] == ['image', 'inspect']:
+        if 'RootFS' in args[-2]:
+            # Unknown layers make system-buildah read the image
+            print('null')
+        else:
+            print(_image_id(args[-1]))
+
+
+def buildah(args):
+    """Emulates the buildah commands system-buildah runs"""
+    if args[0] == 'bud':
+        _context_size('.')
+    elif args[0] == 'push':
+        image, target = [x for x in args[1:] if not x.startswith('--')]
+        path = target.split(':')[1]
+        _export(image, path)
+    elif args[0] == 'inspect':
+        print(_image_id(args[-1]))
+
+
+def ocitools(args):
+    """Emulates ocitools generate by writing the default spec"""
+    from system_buildah import oci
+    with open('config.json', 'w') as config:
+        json.dump(oci.generate([]), config, indent=4)
+
+
+def main(tool, args):
+    """
+    Entry point of a stub.
+
+    :param tool: Which tool to emulate.
+    :type tool: str
+    :param args: Command line arguments.
+    :type args: list
+    """
+    start = time.monotonic()
+    time.sleep(float(os.environ.get('STUB_LATENCY', 0)))
+    globals()[tool](args)
+    log = os.environ.get('STUB_LOG')
+    if log:
+        with open(log, 'a') as log_file:
+            log_file.write('{} {:.6f}\n'.format(
+                tool, time.monotonic() - start))
@@ -17,6 +17,7 @@ Package containing CLI actions.
 """
 
 import argparse
+import importlib
 import logging
 
 
@@ -51,5 +52,95 @@ class SystemBuildahAction(argparse.Action):
         :type option_string: str or None
         :raises: subprocess.CalledProcessError
         """
+        # Imported here so building the parser does not load json
+        from system_buildah import metrics, trace, util
+
         self._setup_logger(namespace)
-        return self.run(parser, namespace, values, option_string)
+        trace_file = getattr(namespace, 'trace_file', None)
+        metrics_file = getattr(namespace, 'metrics_file', None)
+        with metrics.recording(
+                metrics_file and util._expand_path(metrics_file)), \
+                trace.tracing(trace_file and util._expand_path(trace_file),
+                              getattr(namespace, 'trace_format', None)):
+            with trace.span(type(self).__name__, values=values,
+                            manager=getattr(namespace, 'manager', None)):
+                return self.run(parser, namespace, values, option_string)
+
+
+class LazyAction(argparse.Action):
+    """
+    Stands in for an action until it is invoked.
+
+    The module holding the real action, and everything it imports, is only
+    loaded when the command is dispatched so building the parser stays cheap.
+    """
+
+    def __init__(self, module, name, option_strings, dest, **kwargs):
+        """
+        Initializes a new LazyAction.
+
+        :name module: Module holding the real action.
+        :type module: str
+        :name name: Class name of the real action.
+        :type name: str
+        :name option_strings: Option strings for the argument.
+        :type option_strings: list
+        :name dest: Destination in the namespace.
+        :type dest: str
+        :name kwargs: Any other argparse.Action arguments.
+        :type kwargs: dict
+        """
+        super().__init__(option_strings, dest, **kwargs)
+        self._module = module
+        self._name = name
+        self._kwargs = kwargs
+
+    def load(self):
+        """
+        Imports and creates the real action.
+
+        :returns: The real action
+        :rtype: argparse.Action
+        :raises: ImportError
+        :raises: AttributeError
+        """
+        # Not logging.debug() as that would configure logging before the
+        # action sets the requested level
+        logging.getLogger(__name__).debug(
+            'Loading %s from "%s"', self._name, self._module)
+        cls = getattr(importlib.import_module(self._module), self._name)
+        return cls(self.option_strings, self.dest, **self._kwargs)
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        """
+        Loads the real action and calls it.
+
+        :name parser: The argument parser in use.
+        :type parser: argparse.ArgumentParser
+        :name namespace: The namespace for parsed args.
+        :type namespace: argparse.Namespace
+        :name values: Values for the action.
+        :type values: mixed
+        :name option_string: Option string.
+        :type option_string: str or None
+        """
+        return self.load()(parser, namespace, values, option_string)
+
+
+def lazy(name):
+    """
+    Returns an argparse action factory importing the action on first use.
+
+    :name name: Action class name such as TarAction. The module is derived
+        from it, for instance system_buildah.actions.tar_action.
+    :type name: str
+    :returns: A factory usable as the action of add_argument
+    :rtype: callable
+    """
+    module = 'system_buildah.actions.{}'.format(
+        ''.join('_' + c.lower() if c.isupper() else c
+                for c in name).lstrip('_'))
+
+    def factory(option_strings, dest, **kwargs):
+        return LazyAction(module, name, option_strings, dest, **kwargs)
+    return factory
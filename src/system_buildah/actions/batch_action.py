@@ -0,0 +1,71 @@
+# Copyright (C) 2017 Red Hat
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+BatchAction for CLI.
+"""
+
+import sys
+
+from system_buildah import batch
+from system_buildah.actions import SystemBuildahAction
+
+
+class BatchAction(SystemBuildahAction):
+    """
+    Runs the commands of a batch file concurrently.
+    """
+
+    def _report(self, parser, results):
+        """
+        Prints per command results.
+
+        :name parser: The argument parser in use.
+        :type parser: argparse.ArgumentParser
+        :name results: Results in the order of the batch.
+        :type results: list
+        """
+        for result in results:
+            line = '{:<8} {:>9.2f}s {}'.format(
+                'failed' if result.exit_code else 'success',
+                result.duration, ' '.join(result.command.argv))
+            if result.exit_code:
+                line += ' (exit code {})'.format(result.exit_code)
+            parser._print_message(line + '\n', sys.stdout)
+
+    def run(self, parser, namespace, values, dest, option_string=None):
+        """
+        Execution of the action.
+
+        :name parser: The argument parser in use.
+        :type parser: argparse.ArgumentParser
+        :name namespace: The namespace for parsed args.
+        :type namespace: argparse.Namespace
+        :name values: Values for the action.
+        :type values: mixed
+        :name option_string: Option string.
+        :type option_string: str or None
+        """
+        try:
+            commands = batch.read_batch(values)
+        except (IOError, OSError, ValueError) as error:
+            parser.error('Unable to read {}: {}'.format(values, error))
+        if not commands:
+            parser.error('No commands in {}'.format(values))
+        results = batch.run(commands, namespace.jobs)
+        self._report(parser, results)
+        failures = [x for x in results if x.exit_code]
+        if failures:
+            parser.exit(1, '{} of {} commands failed\n'.format(
+                len(failures), len(results)))
@@ -16,7 +16,7 @@
 BuildAction for CLI.
 """
 
-from system_buildah import util
+from system_buildah import cache, util
 from system_buildah.actions import SystemBuildahAction
 
 
@@ -41,4 +41,8 @@ class BuildAction(SystemBuildahAction):
         """
         builder = util.get_manager_class(namespace.manager)()
         tag = values
-        builder.build(namespace, tag)
+        try:
+            cache.build(
+                builder, namespace, tag, cache.from_namespace(namespace))
+        finally:
+            builder.close()
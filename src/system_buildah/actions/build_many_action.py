@@ -0,0 +1,266 @@
+# Copyright (C) 2017 Red Hat
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+BuildManyAction for CLI.
+"""
+
+import copy
+import logging
+import os
+import subprocess
+import sys
+import time
+
+from collections import namedtuple
+from concurrent import futures
+
+from system_buildah import cache, dockerfile, prefetch, util
+from system_buildah.actions import SystemBuildahAction
+
+
+#: The outcome of building a single image in a batch.
+BuildResult = namedtuple(
+    'BuildResult', ['tag', 'path', 'status', 'duration', 'error'])
+
+
+class BuildManyAction(SystemBuildahAction):
+    """
+    Builds many system images concurrently.
+    """
+
+    def _collect_images(self, namespace, values, parser):
+        """
+        Gathers the (path, tag) pairs to build.
+
+        :name namespace: The namespace for parsed args.
+        :type namespace: argparse.Namespace
+        :name values: Items in the form of path=tag.
+        :type values: list
+        :name parser: The argument parser in use.
+        :type parser: argparse.ArgumentParser
+        :returns: (path, tag) pairs
+        :rtype: list
+        """
+        images = []
+        for item in values:
+            try:
+                path, tag = item.split('=')
+                images.append((util._expand_path(path), tag))
+            except ValueError:
+                parser._print_message(
+                    '{} not in path=tag format. Skipping...\n'.format(item))
+        if namespace.directory:
+            directory = util._expand_path(namespace.directory)
+            for name in sorted(os.listdir(directory)):
+                path = os.path.sep.join([directory, name])
+                if os.path.isfile(os.path.sep.join([path, 'Dockerfile'])):
+                    images.append((path, name))
+        return images
+
+    def _dependencies(self, images):
+        """
+        Finds which images in the batch are based on other images in it.
+
+        :name images: (path, tag) pairs to build.
+        :type images: list
+        :returns: Mapping of tag to the set of tags it must wait for.
+        :rtype: dict
+        """
+        tags = {dockerfile.normalize_reference(tag): tag for _, tag in images}
+        deps = {}
+        for path, tag in images:
+            deps[tag] = set()
+            try:
+                base = dockerfile.get_base(dockerfile.parse_file(path))
+            except (IOError, OSError) as error:
+                logging.warning('Unable to read Dockerfile in "%s": %s',
+                                path, error)
+                continue
+            if base:
+                parent = tags.get(dockerfile.normalize_reference(base))
+                if parent and parent != tag:
+                    deps[tag].add(parent)
+        return deps
+
+    def _prefetch(self, builder, namespace, images):
+        """
+        Pulls the bases of the batch that are not built by it.
+
+        :name builder: The image manager to pull with.
+        :type builder: system_buildah.managers.ImageManager
+        :name namespace: The namespace for parsed args.
+        :type namespace: argparse.Namespace
+        :name images: (path, tag) pairs to build.
+        :type images: list
+        :returns: The pinned reference, or None, keyed by reference
+        :rtype: dict
+        """
+        bases = []
+        for path, _ in images:
+            try:
+                bases.append(dockerfile.get_bases(
+                    dockerfile.parse_file(path)))
+            except (IOError, OSError):
+                # Already reported while finding dependencies
+                continue
+        references = prefetch.collect(bases, [tag for _, tag in images])
+        return prefetch.prefetch(
+            builder, namespace, references, namespace.pull_jobs)
+
+    def _build_one(self, builder, namespace, path, tag, build_cache,
+                   pins=None):
+        """
+        Builds a single image and times it.
+
+        :name builder: The image manager to build with.
+        :type builder: system_buildah.managers.ImageManager
+        :name namespace: The namespace for parsed args.
+        :type namespace: argparse.Namespace
+        :name path: Path to the Dockerfile directory.
+        :type path: str
+        :name tag: Tag for the new image.
+        :type tag: str
+        :name build_cache: The cache to use, if any.
+        :type build_cache: system_buildah.cache.BuildCache or None
+        :name pins: Pinned bases keyed by normalized reference.
+        :type pins: dict or None
+        :returns: The result of the build
+        :rtype: BuildResult
+        """
+        image_namespace = copy.copy(namespace)
+        image_namespace.path = path
+        if pins:
+            image_namespace.rendered_files = prefetch.pinned_files(
+                path, pins)
+        start = time.monotonic()
+        try:
+            cache.build(builder, image_namespace, tag, build_cache)
+        except (subprocess.CalledProcessError, OSError, ValueError) as error:
+            return BuildResult(
+                tag, path, 'failed', time.monotonic() - start, str(error))
+        return BuildResult(tag, path, 'success', time.monotonic() - start, '')
+
+    def _schedule(self, builder, namespace, images, deps, build_cache=None,
+                  pins=None):
+        """
+        Runs the builds honoring dependencies and the job limit.
+
+        :name builder: The image manager to build with.
+        :type builder: system_buildah.managers.ImageManager
+        :name namespace: The namespace for parsed args.
+        :type namespace: argparse.Namespace
+        :name images: (path, tag) pairs to build.
+        :type images: list
+        :name deps: Mapping of tag to the tags it must wait for.
+        :type deps: dict
+        :name build_cache: The cache to use, if any.
+        :type build_cache: system_buildah.cache.BuildCache or None
+        :name pins: Pinned bases keyed by normalized reference.
+        :type pins: dict or None
+        :returns: Results keyed by tag
+        :rtype: dict
+        """
+        paths = {tag: path for path, tag in images}
+        pending = [tag for _, tag in images]
+        results = {}
+        running = {}
+        build_one = util.bind_working_directory(self._build_one)
+        with futures.ThreadPoolExecutor(max_workers=namespace.jobs) as pool:
+            while pending or running:
+                for tag in list(pending):
+                    failed = [x for x in deps[tag] if x in results]
+                    failed = [
+                        x for x in failed if results[x].status != 'success']
+                    if failed:
+                        pending.remove(tag)
+                        results[tag] = BuildResult(
+                            tag, paths[tag], 'skipped', 0.0,
+                            '{} did not build'.format(', '.join(failed)))
+                    elif deps[tag].issubset(results):
+                        pending.remove(tag)
+                        logging.info('Scheduling build of "%s"', tag)
+                        running[pool.submit(
+                            build_one, builder, namespace,
+                            paths[tag], tag, build_cache, pins)] = tag
+                if not running:
+                    # Whatever is left waits on itself
+                    for tag in pending:
+                        results[tag] = BuildResult(
+                            tag, paths[tag], 'skipped', 0.0,
+                            'dependency cycle')
+                    break
+                done, _ = futures.wait(
+                    running, return_when=futures.FIRST_COMPLETED)
+                for future in done:
+                    results[running.pop(future)] = future.result()
+        return results
+
+    def _report(self, parser, images, results):
+        """
+        Prints per image results.
+
+        :name parser: The argument parser in use.
+        :type parser: argparse.ArgumentParser
+        :name images: (path, tag) pairs that were requested.
+        :type images: list
+        :name results: Results keyed by tag.
+        :type results: dict
+        """
+        for _, tag in images:
+            result = results[tag]
+            line = '{:<8} {:>9.2f}s {}'.format(
+                result.status, result.duration, tag)
+            if result.error:
+                line += ' ({})'.format(result.error)
+            parser._print_message(line + '\n', sys.stdout)
+
+    def run(self, parser, namespace, values, dest, option_string=None):
+        """
+        Execution of the action.
+
+        :name parser: The argument parser in use.
+        :type parser: argparse.ArgumentParser
+        :name namespace: The namespace for parsed args.
+        :type namespace: argparse.Namespace
+        :name values: Values for the action.
+        :type values: mixed
+        :name option_string: Option string.
+        :type option_string: str or None
+        """
+        if namespace.jobs < 1:
+            parser.error('--jobs must be at least 1')
+        images = self._collect_images(namespace, values, parser)
+        if not images:
+            parser.error('No images to build')
+        duplicates = dockerfile.duplicate_references([x for _, x in images])
+        if duplicates:
+            parser.error('Tags given more than once: {}'.format(
+                ', '.join(duplicates)))
+        deps = self._dependencies(images)
+        builder = util.get_manager_class(namespace.manager)()
+        try:
+            pins = None
+            if getattr(namespace, 'prefetch', False):
+                pins = self._prefetch(builder, namespace, images)
+            results = self._schedule(
+                builder, namespace, images, deps,
+                cache.from_namespace(namespace), pins)
+        finally:
+            builder.close()
+        self._report(parser, images, results)
+        failures = [x for x in results.values() if x.status != 'success']
+        if failures:
+            parser.exit(1, '{} of {} images did not build\n'.format(
+                len(failures), len(images)))
@@ -0,0 +1,60 @@
+# Copyright (C) 2017 Red Hat
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+ExportLayoutAction for CLI.
+"""
+
+import sys
+
+from system_buildah import layout, util
+from system_buildah.actions import SystemBuildahAction
+
+
+class ExportLayoutAction(SystemBuildahAction):
+    """
+    Exports images into one OCI image layout.
+    """
+
+    def run(self, parser, namespace, values, dest, option_string=None):
+        """
+        Execution of the action.
+
+        :name parser: The argument parser in use.
+        :type parser: argparse.ArgumentParser
+        :name namespace: The namespace for parsed args.
+        :type namespace: argparse.Namespace
+        :name values: Values for the action.
+        :type values: mixed
+        :name option_string: Option string.
+        :type option_string: str or None
+        :raises: subprocess.CalledProcessError
+        """
+        output = util._expand_path(namespace.output)
+        archive = None
+        if output.endswith('.tar'):
+            # The directory is kept so the next export can reuse its blobs
+            archive, output = output, output[:-len('.tar')]
+        builder = util.get_manager_class(namespace.manager)()
+        try:
+            result = layout.export(builder, namespace, values, output)
+        except ValueError as error:
+            parser.error(str(error))
+        if archive:
+            layout.write_archive(output, archive)
+        parser._print_message(
+            'Exported {} images to {}: {} bytes written, {} bytes '
+            'reused\n'.format(len(values), archive or output,
+                              result.bytes_written, result.bytes_skipped),
+            sys.stdout)
@@ -0,0 +1,86 @@
+# Copyright (C) 2017 Red Hat
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+ExtractAction for CLI.
+"""
+
+import logging
+import sys
+
+from system_buildah import tarindex, trace, util
+from system_buildah.actions import SystemBuildahAction
+
+
+class ExtractAction(SystemBuildahAction):
+    """
+    Reads one file out of an exported image through its index.
+    """
+
+    def _load_index(self, archive):
+        """
+        Returns the index of an archive, indexing it if needed.
+
+        :name archive: Path to the archive.
+        :type archive: str
+        :returns: The index
+        :rtype: dict
+        :raises: OSError
+        :raises: system_buildah.tarindex.TarIndexError
+        """
+        index = tarindex.load(archive)
+        if index is not None:
+            return index
+        logging.info('Indexing "%s"', archive)
+        with trace.span('index', path=archive):
+            index = tarindex.build(archive)
+        try:
+            tarindex.save(archive, index)
+        except OSError as error:
+            logging.warning('Unable to save the index of "%s": %s',
+                            archive, error)
+        return index
+
+    def run(self, parser, namespace, values, dest, option_string=None):
+        """
+        Execution of the action.
+
+        :name parser: The argument parser in use.
+        :type parser: argparse.ArgumentParser
+        :name namespace: The namespace for parsed args.
+        :type namespace: argparse.Namespace
+        :name values: Values for the action.
+        :type values: mixed
+        :name option_string: Option string.
+        :type option_string: str or None
+        """
+        archive = util._expand_path(namespace.archive)
+        try:
+            index = self._load_index(archive)
+            # Fails before an output file is created
+            tarindex.lookup(index, values, namespace.image)
+            with trace.span('extract', path=values) as span:
+                if namespace.output == '-':
+                    span['bytes_written'] = tarindex.extract(
+                        archive, index, values,
+                        util.standard_stream(sys.stdout),
+                        namespace.image)
+                    return
+                output = util._expand_path(namespace.output)
+                with open(output, 'wb') as destination:
+                    span['bytes_written'] = tarindex.extract(
+                        archive, index, values, destination, namespace.image)
+        except (OSError, ValueError) as error:
+            parser.error(str(error))
+        logging.info('Wrote "%s"', output)
@@ -16,19 +16,157 @@
 GenerateDockerfile Action.
 """
 
+import copy
 import os
+import sys
 
-import jinja2
-
-from system_buildah import util
+from system_buildah import dockerfile, render, util
 from system_buildah.actions import SystemBuildahAction
 
 
+#: Template rendered for each --style.
+TEMPLATES = {
+    'classic': 'Dockerfile.j2',
+    'compact': 'Dockerfile.compact.j2',
+    'cache-friendly': 'Dockerfile.cache-friendly.j2',
+}
+
+#: Options whose change --explain can show.
+EXPLAINABLE = (
+    'from_base', 'name', 'maintainer', 'license', 'summary', 'version',
+    'help_text', 'architecture', 'scope')
+
+
 class GenerateDockerfileAction(SystemBuildahAction):
     """
     Creates a new Dockerfile.
     """
 
+    def _group_copies(self, add_files, context_dir):
+        """
+        Groups added files into as few COPY instructions as possible.
+
+        Files keeping their name on the host are copied together into their
+        host directory. Anything else, including directories and files not
+        in the context yet, gets its own COPY as in the classic style.
+
+        :name add_files: Host path keyed by local path.
+        :type add_files: dict
+        :name context_dir: Directory the local paths are relative to.
+        :type context_dir: str
+        :returns: (sources, destination) pairs
+        :rtype: list
+        """
+        groups = {}
+        copies = []
+        for local, host in sorted(add_files.items()):
+            destination = '/export/hostfs' + host
+            if os.path.basename(local) == os.path.basename(host) and (
+                    os.path.isfile(os.path.join(context_dir, local))):
+                groups.setdefault(
+                    os.path.dirname(destination) + '/', []).append(local)
+            else:
+                copies.append(([local], destination))
+        return [(v, k) for k, v in sorted(groups.items())] + copies
+
+    def render_dockerfile(self, namespace, values, context_dir='.'):
+        """
+        Renders the Dockerfile without writing it.
+
+        :name namespace: The namespace for parsed args.
+        :type namespace: argparse.Namespace
+        :name values: Name of the image.
+        :type values: str
+        :name context_dir: Directory the added files are relative to.
+        :type context_dir: str
+        :returns: The Dockerfile
+        :rtype: str
+        """
+        hostfs_dirs = []
+        add_files = {}
+        for item in namespace.add_file:
+            local, host = item.split('=')
+            hostfs_dirs.append(os.path.dirname(host))
+            add_files[local] = host
+
+        style = getattr(namespace, 'style', None) or 'classic'
+        return render.render(
+            TEMPLATES[style], getattr(namespace, 'template_dir', None),
+            from_base=namespace.from_base, name=values,
+            maintainer=namespace.maintainer,
+            license_name=namespace.license, summary=namespace.summary,
+            version=namespace.version, help_text=namespace.help_text,
+            architecture=namespace.architecture, scope=namespace.scope,
+            add_files=add_files, hostfs_dirs=set(hostfs_dirs),
+            copies=self._group_copies(add_files, context_dir))
+
+    def _first_invalidated(self, namespace, values, context_dir, change):
+        """
+        Finds the first build step a change of an input invalidates.
+
+        :name namespace: The namespace for parsed args.
+        :type namespace: argparse.Namespace
+        :name values: Name of the image.
+        :type values: str
+        :name context_dir: Directory the added files are relative to.
+        :type context_dir: str
+        :name change: An option from EXPLAINABLE or a file of the context.
+        :type change: str
+        :returns: Index of the first invalidated instruction or None
+        :rtype: int or None
+        """
+        instructions = dockerfile.parse(
+            self.render_dockerfile(namespace, values, context_dir))
+        if change in EXPLAINABLE:
+            # Render with another value and see where the output differs
+            changed = copy.copy(namespace)
+            name = values
+            if change == 'name':
+                name = values + '-changed'
+            else:
+                setattr(changed, change, getattr(namespace, change) + '-x')
+            other = dockerfile.parse(
+                self.render_dockerfile(changed, name, context_dir))
+            for index, pair in enumerate(zip(instructions, other)):
+                if pair[0] != pair[1]:
+                    return index
+            return None
+        for index, item in enumerate(instructions):
+            if item.instruction in ('COPY', 'ADD') and change in (
+                    dockerfile.split_copy_arguments(item.arguments)[0]):
+                return index
+        return None
+
+    def explain(self, namespace, values, context_dir, change):
+        """
+        Describes the build steps a change of an input invalidates.
+
+        :name namespace: The namespace for parsed args.
+        :type namespace: argparse.Namespace
+        :name values: Name of the image.
+        :type values: str
+        :name context_dir: Directory the added files are relative to.
+        :type context_dir: str
+        :name change: An option from EXPLAINABLE or a file of the context.
+        :type change: str
+        :returns: The description
+        :rtype: str
+        """
+        instructions = dockerfile.parse(
+            self.render_dockerfile(namespace, values, context_dir))
+        first = self._first_invalidated(
+            namespace, values, context_dir, change)
+        if first is None:
+            return 'Changing {} invalidates no steps\n'.format(change)
+        invalidated = instructions[first:]
+        lines = ['Changing {} invalidates {} of {} steps ({} layers):'.format(
+            change, len(invalidated), len(instructions),
+            dockerfile.count_layers(invalidated))]
+        for index, item in enumerate(invalidated, first + 1):
+            lines.append('  {:>3} {} {}'.format(
+                index, item.instruction, item.arguments[:60]))
+        return '\n'.join(lines) + '\n'
+
     def run(self, parser, namespace, values, dest, option_string=None):
         """
         Execution of the action.
@@ -43,22 +181,27 @@ class GenerateDockerfileAction(SystemBuildahAction):
         :type option_string: str or None
         :raises: subprocess.CalledProcessError
         """
-        hostfs_dirs = []
-        add_files = {}
-        for item in namespace.add_file:
-            local, host = item.split('=')
-            hostfs_dirs.append(os.path.dirname(host))
-            add_files[local] = host
-
         output = util.mkdir(namespace.output)
-        with open(os.path.sep.join([output, 'Dockerfile']), 'w') as dockerfile:
-            loader = jinja2.PackageLoader('system_buildah')
-            rendered = loader.load(
-                jinja2.Environment(), 'Dockerfile.j2').render(
-                    from_base=namespace.from_base, name=values,
-                    maintainer=namespace.maintainer,
-                    license_name=namespace.license, summary=namespace.summary,
-                    version=namespace.version, help_text=namespace.help_text,
-                    architecture=namespace.architecture, scope=namespace.scope,
-                    add_files=add_files, hostfs_dirs=set(hostfs_dirs))
-            dockerfile.write(rendered)
+        rendered = self.render_dockerfile(namespace, values, output)
+        inputs = EXPLAINABLE + tuple(
+            dockerfile.get_sources(dockerfile.parse(rendered)))
+        unknown = [x for x in getattr(namespace, 'explain', None) or []
+                   if x not in inputs]
+        if unknown:
+            parser.error('Unable to explain {}. Valid inputs are: {}'.format(
+                ', '.join(unknown), ', '.join(inputs)))
+        util.write_files(output, {'Dockerfile': rendered})
+        if getattr(namespace, 'style', None) not in (None, 'classic'):
+            classic = copy.copy(namespace)
+            classic.style = 'classic'
+            before = dockerfile.count_layers(dockerfile.parse(
+                self.render_dockerfile(classic, values, output)))
+            parser._print_message(
+                'Dockerfile layers: {} with the classic style, {} with the '
+                '{} style\n'.format(
+                    before, dockerfile.count_layers(
+                        dockerfile.parse(rendered)), namespace.style),
+                sys.stdout)
+        for change in getattr(namespace, 'explain', None) or []:
+            parser._print_message(
+                self.explain(namespace, values, output, change), sys.stdout)
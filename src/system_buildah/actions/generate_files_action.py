@@ -17,15 +17,15 @@ GenerateFilesAction CLI Action.
 """
 
 import json
+import logging
 import os
 import shutil
 import subprocess
 import tempfile
 
-import jinja2
+from concurrent import futures
 
-
-from system_buildah import util
+from system_buildah import inventory, oci, render, trace, util
 from system_buildah.actions import SystemBuildahAction
 
 
@@ -68,10 +68,9 @@ class GenerateFilesAction(SystemBuildahAction):
         :returns: Rendered template
         :rtype: str
         """
-        loader = jinja2.PackageLoader('system_buildah')
-        return loader.load(
-            jinja2.Environment(), 'service.template.j2').render(
-                description=namespace.description)
+        return render.render(
+            'service.template.j2', getattr(namespace, 'template_dir', None),
+            description=namespace.description)
 
     def _render_init_template(self, namespace):
         """
@@ -82,9 +81,8 @@ class GenerateFilesAction(SystemBuildahAction):
         :returns: Rendered template
         :rtype: str
         """
-        loader = jinja2.PackageLoader('system_buildah')
-        return loader.load(
-            jinja2.Environment(), 'init.sh.j2').render()
+        return render.render(
+            'init.sh.j2', getattr(namespace, 'template_dir', None))
 
     def _generate_ocitools_command(self, namespace, parser):
         """
@@ -108,6 +106,177 @@ class GenerateFilesAction(SystemBuildahAction):
                         '{} not in a=b format. Skipping...'.format(item))
         return ocitools_cmd
 
+    def _parse_config_options(self, namespace, parser):
+        """
+        Splits the ocitools options into (option, value) pairs.
+
+        :name parser: The argument parser in use.
+        :type parser: argparse.ArgumentParser
+        :name namespace: The namespace for parsed args.
+        :type namespace: argparse.Namespace
+        :returns: (option, value) pairs
+        :rtype: list
+        """
+        options = []
+        if namespace.config:
+            for item in namespace.config.split(' '):
+                if '=' not in item:
+                    parser._print_message(
+                        '{} not in a=b format. Skipping...'.format(item))
+                    continue
+                options.append(tuple(item.split('=', 1)))
+        return options
+
+    def _run_ocitools(self, namespace, parser):
+        """
+        Generates the runtime configuration with ocitools.
+
+        :name parser: The argument parser in use.
+        :type parser: argparse.ArgumentParser
+        :name namespace: The namespace for parsed args.
+        :type namespace: argparse.Namespace
+        :returns: The runtime configuration
+        :rtype: dict
+        :raises: subprocess.CalledProcessError
+        """
+        temp_dir = tempfile.mkdtemp()
+        ocitools_cmd = self._generate_ocitools_command(namespace, parser)
+        try:
+            trace.call(subprocess.check_call, ocitools_cmd, cwd=temp_dir)
+            with open(os.path.join(temp_dir, 'config.json'),
+                      'r') as config_file:
+                return json.load(config_file)
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def _generate_config(self, namespace, parser):
+        """
+        Generates the runtime configuration.
+
+        The configuration is built in process unless ocitools was requested
+        or an option is only understood by ocitools.
+
+        :name parser: The argument parser in use.
+        :type parser: argparse.ArgumentParser
+        :name namespace: The namespace for parsed args.
+        :type namespace: argparse.Namespace
+        :returns: The runtime configuration
+        :rtype: dict
+        :raises: subprocess.CalledProcessError
+        """
+        if not getattr(namespace, 'ocitools', False):
+            try:
+                with trace.span('oci.generate'):
+                    return oci.generate(
+                        self._parse_config_options(namespace, parser),
+                        read_only=True)
+            except oci.UnsupportedOption as error:
+                logging.info('%s. Falling back to ocitools.', error)
+        return self._run_ocitools(namespace, parser)
+
+    def _render_config(self, namespace, parser):
+        """
+        Renders and returns the config.json.template.
+
+        :name namespace: The namespace for parsed args.
+        :type namespace: argparse.Namespace
+        :name parser: The argument parser in use.
+        :type parser: argparse.ArgumentParser
+        :returns: Rendered configuration
+        :rtype: str
+        :raises: subprocess.CalledProcessError
+        """
+        configuration = self._generate_config(namespace, parser)
+        configuration['process']['terminal'] = False
+        return json.dumps(configuration, indent=8, sort_keys=True)
+
+    def render_files(self, namespace, parser, shared=None):
+        """
+        Renders the files of a system image without writing them.
+
+        :name namespace: The namespace for parsed args.
+        :type namespace: argparse.Namespace
+        :name parser: The argument parser in use.
+        :type parser: argparse.ArgumentParser
+        :name shared: Files rendered for earlier images, reused when the
+                      options they depend on are the same.
+        :type shared: dict or None
+        :returns: Content keyed by file name
+        :rtype: dict
+        :raises: subprocess.CalledProcessError
+        """
+        shared = {} if shared is None else shared
+        template_dir = getattr(namespace, 'template_dir', None)
+        keys = {
+            'service.template': (template_dir, namespace.description),
+            'init.sh': (template_dir,),
+            'config.json.template': (
+                namespace.config, getattr(namespace, 'ocitools', False)),
+        }
+        renderers = {
+            'service.template': self._render_service_template,
+            'init.sh': self._render_init_template,
+            'config.json.template': lambda x: self._render_config(
+                x, parser),
+        }
+        files = {'manifest.json': json.dumps(
+            self._create_manifest(namespace, parser), indent=8)}
+        for name, key in keys.items():
+            if (name, key) not in shared:
+                shared[(name, key)] = renderers[name](namespace)
+            files[name] = shared[(name, key)]
+        return files
+
+    def _run_inventory(self, parser, namespace, output):
+        """
+        Generates the files of every image of an inventory.
+
+        Files are rendered once per distinct set of options and written
+        by namespace.jobs threads.
+
+        :name parser: The argument parser in use.
+        :type parser: argparse.ArgumentParser
+        :name namespace: The namespace for parsed args.
+        :type namespace: argparse.Namespace
+        :name output: The directory entry paths are relative to.
+        :type output: str
+        :raises: subprocess.CalledProcessError
+        """
+        output = util._expand_path(output)
+        try:
+            entries = inventory.load(util._expand_path(namespace.inventory))
+        except (IOError, OSError, ValueError) as error:
+            parser.error('Unable to read {}: {}'.format(
+                namespace.inventory, error))
+        shared = {}
+        rendered = []
+        for entry in entries:
+            try:
+                entry_namespace, directory = inventory.entry_namespace(
+                    namespace, entry, output)
+            except ValueError as error:
+                parser.error(str(error))
+            rendered.append((directory, self.render_files(
+                entry_namespace, parser, shared)))
+        with futures.ThreadPoolExecutor(
+                max_workers=max(1, namespace.jobs)) as pool:
+            write = util.bind_working_directory(self._write)
+            for result in [pool.submit(write, *x) for x in rendered]:
+                result.result()
+        logging.info('Generated files of %d images', len(rendered))
+
+    def _write(self, directory, files):
+        """
+        Writes the files of one image, creating missing parents.
+
+        :name directory: The directory to write to.
+        :type directory: str
+        :name files: Content keyed by file name.
+        :type files: dict
+        """
+        os.makedirs(os.path.dirname(directory), exist_ok=True)
+        util.write_files(util.mkdir(directory), files)
+
     def run(self, parser, namespace, values, dest, option_string=None):
         """
         Execution of the action.
@@ -122,41 +291,7 @@ class GenerateFilesAction(SystemBuildahAction):
         :type option_string: str or None
         :raises: subprocess.CalledProcessError
         """
-        output = util.mkdir(values)
-        manifest_struct = self._create_manifest(namespace, parser)
-
-        # Generate the manifest.json
-        manifest_out = os.path.sep.join([output, 'manifest.json'])
-        with open(manifest_out, 'w') as manifest:
-            json.dump(manifest_struct, manifest, indent=8)
-
-        # Generate the service.template
-        rendered = self._render_service_template(namespace)
-        service_out = os.path.sep.join([output, 'service.template'])
-        with open(service_out, 'w') as service:
-            service.write(rendered)
-
-        # Generate the init.sh file
-        rendered_init = self._render_init_template(namespace)
-        init_out = os.path.sep.join([output, 'init.sh'])
-        with open(init_out, 'w') as init:
-            init.write(rendered_init)
-
-        # Generate config.json using ocitools
-        temp_dir = tempfile.mkdtemp()
-        ocitools_cmd = self._generate_ocitools_command(namespace, parser)
-        with util.pushd(temp_dir):
-            try:
-                subprocess.check_call(ocitools_cmd)
-                config_out = os.path.sep.join([output, 'config.json.template'])
-                try:
-                    with open('config.json', 'r') as config_file:
-                        configuration = json.load(config_file)
-                        configuration['process']['terminal'] = False
-                    with open(config_out, 'w') as dest:
-                        json.dump(
-                            configuration, dest, indent=8, sort_keys=True)
-                finally:
-                    os.unlink('config.json')
-            finally:
-                shutil.rmtree(temp_dir)
+        if getattr(namespace, 'inventory', None):
+            return self._run_inventory(parser, namespace, values)
+        util.write_files(util.mkdir(values),
+                         self.render_files(namespace, parser))
@@ -0,0 +1,76 @@
+# Copyright (C) 2017 Red Hat
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+InspectTarAction for CLI.
+"""
+
+import json
+import sys
+
+from system_buildah import dockerfile, inspection, trace, util
+from system_buildah.actions import SystemBuildahAction
+
+
+class InspectTarAction(SystemBuildahAction):
+    """
+    Reports the layers of an exported image and what makes it large.
+    """
+
+    def _scan(self, archive):
+        """
+        Scans an archive, - meaning stdin.
+
+        :name archive: Path to the archive or -.
+        :type archive: str
+        :returns: What the archive holds
+        :rtype: system_buildah.inspection.Scan
+        :raises: system_buildah.inspection.InspectError
+        :raises: ValueError when stdin can not be used
+        :raises: OSError
+        """
+        with trace.span('scan', path=archive):
+            if archive == '-':
+                return inspection.scan(util.standard_stream(sys.stdin))
+            with open(util._expand_path(archive), 'rb') as source:
+                return inspection.scan(source)
+
+    def run(self, parser, namespace, values, dest, option_string=None):
+        """
+        Execution of the action.
+
+        :name parser: The argument parser in use.
+        :type parser: argparse.ArgumentParser
+        :name namespace: The namespace for parsed args.
+        :type namespace: argparse.Namespace
+        :name values: Values for the action.
+        :type values: mixed
+        :name option_string: Option string.
+        :type option_string: str or None
+        """
+        instructions = None
+        try:
+            if namespace.path:
+                instructions = dockerfile.parse_file(
+                    util._expand_path(namespace.path))
+            report = inspection.report(
+                self._scan(values), namespace.image, instructions,
+                namespace.top)
+        except (OSError, ValueError) as error:
+            parser.error(str(error))
+        if namespace.json:
+            output = json.dumps(report, indent=2, sort_keys=True) + '\n'
+        else:
+            output = inspection.format_report(report)
+        parser._print_message(output, sys.stdout)
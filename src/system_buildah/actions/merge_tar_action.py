@@ -0,0 +1,50 @@
+# Copyright (C) 2017 Red Hat
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+MergeTarAction for CLI.
+"""
+
+import logging
+import tarfile
+
+from system_buildah import delta, util
+from system_buildah.actions import SystemBuildahAction
+
+
+class MergeTarAction(SystemBuildahAction):
+    """
+    Rebuilds a complete archive from a base archive and a delta.
+    """
+
+    def run(self, parser, namespace, values, dest, option_string=None):
+        """
+        Execution of the action.
+
+        :name parser: The argument parser in use.
+        :type parser: argparse.ArgumentParser
+        :name namespace: The namespace for parsed args.
+        :type namespace: argparse.Namespace
+        :name values: Values for the action.
+        :type values: mixed
+        :name option_string: Option string.
+        :type option_string: str or None
+        """
+        output = util._expand_path(namespace.output)
+        try:
+            delta.merge(util._expand_path(namespace.base),
+                        util._expand_path(values), output)
+        except (OSError, ValueError, tarfile.TarError) as error:
+            parser.error(str(error))
+        logging.info('Wrote "%s"', output)
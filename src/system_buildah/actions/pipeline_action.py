@@ -0,0 +1,83 @@
+# Copyright (C) 2017 Red Hat
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+PipelineAction for CLI.
+"""
+
+import sys
+
+from system_buildah import cache, pipeline, util
+from system_buildah.actions import SystemBuildahAction
+
+
+class PipelineAction(SystemBuildahAction):
+    """
+    Generates, builds and exports the images of a spec.
+    """
+
+    def _report(self, parser, images, results):
+        """
+        Prints per image results.
+
+        :name parser: The argument parser in use.
+        :type parser: argparse.ArgumentParser
+        :name images: Images of the spec.
+        :type images: list
+        :name results: Results keyed by tag.
+        :type results: dict
+        """
+        for image in images:
+            result = results[image['tag']]
+            line = '{:<8} {}'.format(result.status, ' '.join(
+                '{:>8.2f}s'.format(result.durations.get(x, 0.0))
+                for x in pipeline.STAGES))
+            line += ' {}'.format(result.tag)
+            if result.error:
+                line += ' ({} {})'.format(result.stage, result.error)
+            parser._print_message(line + '\n', sys.stdout)
+
+    def run(self, parser, namespace, values, dest, option_string=None):
+        """
+        Execution of the action.
+
+        :name parser: The argument parser in use.
+        :type parser: argparse.ArgumentParser
+        :name namespace: The namespace for parsed args.
+        :type namespace: argparse.Namespace
+        :name values: Values for the action.
+        :type values: mixed
+        :name option_string: Option string.
+        :type option_string: str or None
+        """
+        try:
+            images = pipeline.load_spec(values)
+        except (IOError, OSError, ValueError) as error:
+            parser.error('Unable to read {}: {}'.format(values, error))
+        if not images:
+            parser.error('No images in {}'.format(values))
+        jobs = {x: getattr(namespace, '{}_jobs'.format(x))
+                for x in pipeline.STAGES}
+        builder = util.get_manager_class(namespace.manager)()
+        runner = pipeline.Pipeline(
+            parser, namespace, builder, jobs, cache.from_namespace(namespace))
+        try:
+            results = runner.run(images)
+        finally:
+            builder.close()
+        self._report(parser, images, results)
+        failures = [x for x in results.values() if x.status != 'success']
+        if failures:
+            parser.exit(1, '{} of {} images did not make it through\n'.format(
+                len(failures), len(images)))
@@ -0,0 +1,59 @@
+# Copyright (C) 2017 Red Hat
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+ServeAction for CLI.
+"""
+
+import signal
+import threading
+
+from system_buildah import server
+from system_buildah.actions import SystemBuildahAction
+
+
+class ServeAction(SystemBuildahAction):
+    """
+    Runs commands sent over a unix socket until interrupted.
+    """
+
+    def run(self, parser, namespace, values, dest, option_string=None):
+        """
+        Execution of the action.
+
+        :name parser: The argument parser in use.
+        :type parser: argparse.ArgumentParser
+        :name namespace: The namespace for parsed args.
+        :type namespace: argparse.Namespace
+        :name values: Values for the action.
+        :type values: mixed
+        :name option_string: Option string.
+        :type option_string: str or None
+        """
+        if namespace.jobs < 1 or namespace.queue_size < 0:
+            parser.error('--jobs must be at least 1 and --queue-size positive')
+        stop = threading.Event()
+        try:
+            instance = server.Server(
+                values or server.default_socket(), namespace.jobs,
+                namespace.queue_size)
+        except OSError as error:
+            parser.error(str(error))
+        instance.warm_up()
+        signal.signal(signal.SIGTERM, lambda *args: stop.set())
+        with instance:
+            try:
+                stop.wait()
+            except KeyboardInterrupt:
+                pass
@@ -0,0 +1,75 @@
+# Copyright (C) 2017 Red Hat
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+SubmitAction for CLI.
+"""
+
+import logging
+import sys
+
+from system_buildah import server, util
+from system_buildah.actions import SystemBuildahAction
+
+
+class SubmitAction(SystemBuildahAction):
+    """
+    Sends a command to a server and relays its output.
+    """
+
+    def _relay(self, event):
+        """
+        Writes an event from the server to the matching local stream.
+
+        :name event: The event sent by the server.
+        :type event: dict
+        """
+        if 'stream' in event:
+            stream = sys.stdout if event['stream'] == 'stdout' else sys.stderr
+            stream.write(event['data'])
+            stream.flush()
+        elif 'log' in event:
+            sys.stderr.write(event['log'] + '\n')
+        elif 'error' in event:
+            sys.stderr.write(event['error'] + '\n')
+        elif 'status' in event:
+            logging.debug('Job is %s', event['status'])
+
+    def run(self, parser, namespace, values, dest, option_string=None):
+        """
+        Execution of the action.
+
+        :name parser: The argument parser in use.
+        :type parser: argparse.ArgumentParser
+        :name namespace: The namespace for parsed args.
+        :type namespace: argparse.Namespace
+        :name values: Values for the action.
+        :type values: mixed
+        :name option_string: Option string.
+        :type option_string: str or None
+        """
+        arguments = list(values)
+        if arguments[:1] == ['--']:
+            arguments = arguments[1:]
+        if not arguments:
+            parser.error('No command to submit')
+        socket_path = namespace.socket or server.default_socket()
+        try:
+            exit_code = server.submit(
+                socket_path, arguments, util.getcwd(), self._relay)
+        except OSError as error:
+            parser.error('Unable to reach the server at "{}": {}'.format(
+                socket_path, error))
+        if exit_code:
+            parser.exit(exit_code)
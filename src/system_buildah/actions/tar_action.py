@@ -16,7 +16,11 @@
 Tar CLI action.
 """
 
-from system_buildah import util
+import logging
+import os
+import sys
+
+from system_buildah import cache, compression, trace, util
 from system_buildah.actions import SystemBuildahAction
 
 
@@ -25,6 +29,162 @@ class TarAction(SystemBuildahAction):
     Exports an image as a tar file.
     """
 
+    def _stream(self, builder, namespace, image, output):
+        """
+        Streams the image through the compressor into output.
+
+        :name builder: The image manager to export with.
+        :type builder: system_buildah.managers.ImageManager
+        :name namespace: The namespace for parsed args.
+        :type namespace: argparse.Namespace
+        :name image: The image to export.
+        :type image: str
+        :name output: File to write to or - for stdout.
+        :type output: str
+        :raises: subprocess.CalledProcessError
+        :raises: ValueError when stdout can not be used
+        """
+        if output == '-':
+            stdout = util.standard_stream(sys.stdout)
+            with trace.span('compress', image=image, output=output,
+                            codec=namespace.compress,
+                            manager=namespace.manager) as span, \
+                    builder.stream(namespace, image) as source:
+                span['bytes_read'], span['bytes_written'] = (
+                    compression.compress_stream(
+                        source, stdout, namespace.compress,
+                        namespace.threads))
+            return
+        # Write next to the target so a failed export leaves nothing behind
+        partial = '{}.part'.format(output)
+        try:
+            with trace.span('compress', image=image, output=output,
+                            codec=namespace.compress,
+                            manager=namespace.manager) as span, \
+                    builder.stream(namespace, image) as source, \
+                    open(partial, 'wb') as destination:
+                span['bytes_read'], span['bytes_written'] = (
+                    compression.compress_stream(
+                        source, destination, namespace.compress,
+                        namespace.threads))
+            os.rename(partial, output)
+        finally:
+            if os.path.exists(partial):
+                os.unlink(partial)
+        logging.info('Wrote "%s"', output)
+
+    def _delta(self, builder, namespace, image, output):
+        """
+        Writes a delta against the archive named by --since into output.
+
+        :name builder: The image manager to export with.
+        :type builder: system_buildah.managers.ImageManager
+        :name namespace: The namespace for parsed args.
+        :type namespace: argparse.Namespace
+        :name image: The image to export.
+        :type image: str
+        :name output: File to write to.
+        :type output: str
+        :raises: subprocess.CalledProcessError
+        :raises: system_buildah.delta.DeltaError
+        """
+        from system_buildah import delta
+
+        known = set(delta.read_layers(util._expand_path(namespace.since)))
+        with trace.span('delta', image=image, output=output,
+                        since=namespace.since,
+                        manager=namespace.manager) as span, \
+                builder.stream(namespace, image) as source:
+            span['bytes_skipped'], span['bytes_written'] = delta.write_delta(
+                source, known, output)
+        logging.info('Wrote "%s" leaving out %d bytes already in "%s"',
+                     output, span['bytes_skipped'], namespace.since)
+
+    def _index(self, path):
+        """
+        Writes the index of an export unless it is up to date.
+
+        :name path: Path to the export.
+        :type path: str
+        :raises: ValueError when the export can not be indexed
+        """
+        from system_buildah import tarindex
+
+        if tarindex.load(path) is not None:
+            logging.info('The index of "%s" is up to date', path)
+            return
+        try:
+            with trace.span('index', path=path):
+                tarindex.save(path, tarindex.build(path))
+        except (OSError, ValueError) as error:
+            raise ValueError('Unable to index {}: {}'.format(path, error))
+
+    def export_image(self, builder, namespace, image, build_cache=None):
+        """
+        Exports an image as the tar command was asked to.
+
+        :name builder: The image manager to export with.
+        :type builder: system_buildah.managers.ImageManager
+        :name namespace: The namespace for parsed args.
+        :type namespace: argparse.Namespace
+        :name image: The image to export.
+        :type image: str
+        :name build_cache: The cache to use, if any.
+        :type build_cache: system_buildah.cache.BuildCache or None
+        :raises: subprocess.CalledProcessError
+        :raises: ValueError on options that can not be combined or a
+                 delta or index that can not be written
+        """
+        codec = getattr(namespace, 'compress', None)
+        if getattr(namespace, 'index', False) and (
+                codec or getattr(namespace, 'since', None)):
+            raise ValueError('--index needs an export without --compress '
+                             'or --since')
+        if getattr(namespace, 'since', None):
+            if codec:
+                raise ValueError(
+                    '--since can not be combined with --compress')
+            output = util._expand_path(
+                namespace.output or '{}.delta.tar'.format(
+                    builder.tar_path(image)[:-len('.tar')]))
+            try:
+                return self._delta(builder, namespace, image, output)
+            except OSError as error:
+                raise ValueError(str(error))
+        if codec:
+            if not compression.available(codec):
+                raise ValueError(
+                    '{} compression is not available'.format(codec))
+            output = namespace.output or '{}{}'.format(
+                builder.tar_path(image), compression.EXTENSIONS[codec])
+            if output != '-':
+                output = util._expand_path(output)
+            return self._stream(builder, namespace, image, output)
+        path = cache.tar(builder, namespace, image, build_cache)
+        if getattr(namespace, 'index', False):
+            self._index(path)
+
+    def export(self, parser, builder, namespace, image, build_cache=None):
+        """
+        Exports an image, reporting unusable options through the parser.
+
+        :name parser: The argument parser in use.
+        :type parser: argparse.ArgumentParser
+        :name builder: The image manager to export with.
+        :type builder: system_buildah.managers.ImageManager
+        :name namespace: The namespace for parsed args.
+        :type namespace: argparse.Namespace
+        :name image: The image to export.
+        :type image: str
+        :name build_cache: The cache to use, if any.
+        :type build_cache: system_buildah.cache.BuildCache or None
+        :raises: subprocess.CalledProcessError
+        """
+        try:
+            self.export_image(builder, namespace, image, build_cache)
+        except ValueError as error:
+            parser.error(str(error))
+
     def run(self, parser, namespace, values, option_string=None):
         """
         Execution of the action.
@@ -39,5 +199,5 @@ class TarAction(SystemBuildahAction):
         :type option_string: str or None
         :raises: subprocess.CalledProcessError
         """
-        builder = util.get_manager_class(namespace.manager)()
-        builder.tar(namespace, values)
+        self.export(parser, util.get_manager_class(namespace.manager)(),
+                    namespace, values, cache.from_namespace(namespace))
@@ -0,0 +1,147 @@
+# Copyright (C) 2017 Red Hat
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Runs many independent commands concurrently in one interpreter.
+
+A batch file holds one command line per line, such as::
+
+    # Comments and empty lines are ignored
+    generate-files -d etcd images/etcd
+    -C images/flannel generate-dockerfile -o . flannel
+    tar --compress zstd base:1
+
+A line starting with -C DIR resolves its relative paths against DIR, like
+git -C. Commands run on a pool of threads sharing one parser and the
+loaded actions and templates. None of them changes the working directory
+of the process, so they do not see each other's directories.
+
+Commands are not ordered. Images depending on each other belong in a
+pipeline.
+"""
+
+import logging
+import shlex
+import subprocess
+import sys
+import time
+
+from collections import namedtuple
+from concurrent import futures
+
+from system_buildah import cli, util
+
+#: One command of a batch.
+Command = namedtuple('Command', ['argv', 'cwd'])
+
+#: The outcome of one command of a batch.
+CommandResult = namedtuple(
+    'CommandResult', ['command', 'exit_code', 'duration'])
+
+
+def parse_line(line, cwd):
+    """
+    Reads the command of a batch line.
+
+    :param line: The line.
+    :type line: str
+    :param cwd: Directory -C is relative to.
+    :type cwd: str
+    :returns: The command, or None for empty and comment lines
+    :rtype: Command or None
+    :raises: ValueError on a malformed line
+    """
+    argv = shlex.split(line, comments=True)
+    if not argv:
+        return None
+    if argv[0] == '-C':
+        if len(argv) < 3:
+            raise ValueError('-C needs a directory and a command')
+        cwd, argv = util._expand_path(argv[1]), argv[2:]
+    if argv[0] in util.FORBIDDEN_COMMANDS:
+        raise ValueError('{} can not be run in a batch'.format(argv[0]))
+    return Command(argv, cwd)
+
+
+def read_batch(path):
+    """
+    Reads a batch file.
+
+    :param path: Path to the batch file.
+    :type path: str
+    :returns: The commands
+    :rtype: list
+    :raises: ValueError on a malformed line
+    :raises: IOError
+    """
+    cwd = util.getcwd()
+    commands = []
+    with open(util._expand_path(path)) as batch_file:
+        for number, line in enumerate(batch_file, 1):
+            try:
+                command = parse_line(line, cwd)
+            except ValueError as error:
+                raise ValueError('{}:{}: {}'.format(path, number, error))
+            if command is not None:
+                commands.append(command)
+    return commands
+
+
+def run_command(parser, command):
+    """
+    Runs one command in the calling thread.
+
+    :param parser: The parser of the whole CLI.
+    :type parser: argparse.ArgumentParser
+    :param command: The command to run.
+    :type command: Command
+    :returns: The result
+    :rtype: CommandResult
+    """
+    start = time.monotonic()
+    exit_code = 0
+    try:
+        with util.working_directory(command.cwd):
+            parser.parse_args(command.argv)
+    except SystemExit as error:
+        # parser.error() and parser.exit()
+        exit_code = error.code if isinstance(error.code, int) else 1
+    except subprocess.CalledProcessError as error:
+        parser._print_message(
+            'Unable to execute command: {}\n'.format(error), sys.stderr)
+        exit_code = 2
+    except Exception:
+        logging.exception('Command %s failed', command.argv)
+        exit_code = 1
+    return CommandResult(command, exit_code, time.monotonic() - start)
+
+
+def run(commands, jobs, parser=None):
+    """
+    Runs commands on a pool of threads.
+
+    :param commands: The commands to run.
+    :type commands: list
+    :param jobs: Number of commands to run at the same time.
+    :type jobs: int
+    :param parser: The parser of the whole CLI. Default: a new one.
+    :type parser: argparse.ArgumentParser or None
+    :returns: The results in the order of commands
+    :rtype: list
+    """
+    parser = parser or cli.build_parser()
+    run_one = util.bind_working_directory(
+        lambda x: run_command(parser, x))
+    with futures.ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        return list(pool.map(run_one, commands))
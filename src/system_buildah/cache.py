@@ -0,0 +1,338 @@
+# Copyright (C) 2017 Red Hat
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Content addressed cache for builds and exports.
+"""
+
+import fcntl
+import glob
+import hashlib
+import json
+import logging
+import os
+import shutil
+import subprocess
+import threading
+import time
+
+from contextlib import contextmanager
+
+from system_buildah import dockerfile, trace, util
+
+#: Files generated by system-buildah that are always part of a context.
+CONTEXT_FILES = (
+    'Dockerfile', 'manifest.json', 'service.template',
+    'config.json.template', 'init.sh')
+
+#: Build options that change the image produced from the same context.
+BUILD_OPTIONS = ('scripted', 'reuse_container', 'full_context')
+
+
+def _hash_path(digest, context, relative):
+    """
+    Feeds a file, or every file below a directory, into a digest.
+
+    :param digest: The digest to update.
+    :type digest: hashlib.sha256
+    :param context: The build context directory.
+    :type context: str
+    :param relative: Path of the file relative to the context.
+    :type relative: str
+    """
+    path = os.path.normpath(os.path.sep.join([context, relative]))
+    if os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                _hash_path(digest, context, os.path.relpath(
+                    os.path.sep.join([root, name]), context))
+        return
+    digest.update(relative.encode('utf-8') + b'\0')
+    with open(path, 'rb') as source:
+        for chunk in iter(lambda: source.read(1024 * 1024), b''):
+            digest.update(chunk)
+    digest.update(b'\0')
+
+
+def context_digest(context, manager, data=None, options=None):
+    """
+    Computes the digest of everything that goes into a build.
+
+    :param context: The build context directory.
+    :type context: str
+    :param manager: Name of the manager doing the build.
+    :type manager: str
+    :param data: Dockerfile sent in place of the one in context, such as
+                 one with pinned bases.
+    :type data: str or None
+    :param options: Values of BUILD_OPTIONS used for the build.
+    :type options: dict or None
+    :returns: A sha256 hex digest
+    :rtype: str
+    :raises: IOError
+    """
+    if data is None:
+        instructions = dockerfile.parse_file(context)
+    else:
+        instructions = dockerfile.parse(data)
+    digest = hashlib.sha256()
+    digest.update('manager={}\0base={}\0'.format(
+        manager, dockerfile.get_base(instructions)).encode('utf-8'))
+    options = options or {}
+    for name in BUILD_OPTIONS:
+        digest.update('{}={}\0'.format(
+            name, bool(options.get(name))).encode('utf-8'))
+    relatives = [x for x in CONTEXT_FILES + ('.dockerignore', )
+                 if os.path.exists(os.path.sep.join([context, x]))]
+    for source in dockerfile.get_sources(instructions):
+        matches = glob.glob(os.path.sep.join([context, source]))
+        relatives.extend(os.path.relpath(x, context) for x in matches)
+    for relative in sorted(set(relatives)):
+        _hash_path(digest, context, relative)
+    return digest.hexdigest()
+
+
+class BuildCache(object):
+    """
+    Records image IDs per build context and tar files per image ID.
+    """
+
+    #: Serializes index updates between threads of one process.
+    _lock = threading.Lock()
+
+    def __init__(self, path=None, max_entries=256, max_age=30 * 86400):
+        """
+        Initializes the cache.
+
+        :param path: Directory holding the cache index.
+        :type path: str or None
+        :param max_entries: Most entries kept per section.
+        :type max_entries: int
+        :param max_age: Seconds an unused entry is kept.
+        :type max_age: int
+        """
+        self.path = util.mkdir(path) if path else util.get_cache_dir()
+        self.index_path = os.path.sep.join([self.path, 'index.json'])
+        self.max_entries = max_entries
+        self.max_age = max_age
+
+    @contextmanager
+    def _index(self):
+        """
+        Loads the index under a lock and saves it on exit.
+        """
+        with self._lock, open(os.path.sep.join(
+                [self.path, 'index.lock']), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                with open(self.index_path, 'r') as index_file:
+                    index = json.load(index_file)
+            except (IOError, ValueError):
+                index = {}
+            index.setdefault('builds', {})
+            index.setdefault('tars', {})
+            self._evict(index)
+            yield index
+            self._evict(index)
+            temp_path = '{}.{}'.format(self.index_path, os.getpid())
+            with open(temp_path, 'w') as index_file:
+                json.dump(index, index_file, indent=8, sort_keys=True)
+            os.replace(temp_path, self.index_path)
+
+    def _evict(self, index):
+        """
+        Drops entries that are too old or over the size limit.
+
+        :param index: The loaded index.
+        :type index: dict
+        """
+        oldest = time.time() - self.max_age
+        for section in index.values():
+            for key in [k for k, v in section.items() if v['used'] < oldest]:
+                logging.debug('Evicting expired cache entry %s', key)
+                del section[key]
+            by_use = sorted(section, key=lambda k: section[k]['used'])
+            for key in by_use[:max(0, len(section) - self.max_entries)]:
+                logging.debug('Evicting cache entry %s', key)
+                del section[key]
+
+    def get(self, section, key):
+        """
+        Returns an entry and marks it as used.
+
+        :param section: Either builds or tars.
+        :type section: str
+        :param key: The entry key.
+        :type key: str
+        :returns: The entry or None if there is no entry.
+        :rtype: dict or None
+        """
+        with self._index() as index:
+            entry = index[section].get(key)
+            if entry:
+                entry['used'] = time.time()
+            return entry
+
+    def put(self, section, key, **data):
+        """
+        Records an entry.
+
+        :param section: Either builds or tars.
+        :type section: str
+        :param key: The entry key.
+        :type key: str
+        :param data: Values to store in the entry.
+        :type data: dict
+        """
+        with self._index() as index:
+            data['used'] = time.time()
+            index[section][key] = data
+
+    def drop(self, section, key):
+        """
+        Removes an entry if it exists.
+
+        :param section: Either builds or tars.
+        :type section: str
+        :param key: The entry key.
+        :type key: str
+        """
+        with self._index() as index:
+            index[section].pop(key, None)
+
+
+def from_namespace(namespace):
+    """
+    Returns the cache requested on the command line.
+
+    :param namespace: Namespace passed in via CLI.
+    :type namespace: argparse.Namespace
+    :returns: The cache to use or None when caching is off.
+    :rtype: BuildCache or None
+    """
+    if not getattr(namespace, 'cache', False):
+        return None
+    return BuildCache(
+        namespace.cache_dir, namespace.cache_max_entries,
+        namespace.cache_max_age * 86400)
+
+
+def build(builder, namespace, tag, build_cache=None):
+    """
+    Builds an image unless the same context was built before.
+
+    :param builder: The image manager to build with.
+    :type builder: system_buildah.managers.ImageManager
+    :param namespace: Namespace passed in via CLI.
+    :type namespace: argparse.Namespace
+    :param tag: The tag to use when building.
+    :type tag: str
+    :param build_cache: The cache to use, if any.
+    :type build_cache: BuildCache or None
+    :returns: True if the build was skipped
+    :rtype: bool
+    :raises: subprocess.CalledProcessError
+    """
+    with trace.span('build', tag=tag, path=namespace.path,
+                    manager=namespace.manager) as span:
+        span['cached'] = _build(builder, namespace, tag, build_cache)
+        if build_cache is not None:
+            span['cache'] = 'hit' if span['cached'] else 'miss'
+        return span['cached']
+
+
+def _build(builder, namespace, tag, build_cache):
+    """
+    Implements build().
+    """
+    rendered = getattr(namespace, 'rendered_files', None) or {}
+    try:
+        key = build_cache and context_digest(
+            util._expand_path(namespace.path), namespace.manager,
+            rendered.get('Dockerfile'),
+            {x: getattr(namespace, x, False) for x in BUILD_OPTIONS})
+    except (IOError, OSError) as error:
+        logging.warning('Unable to digest the build context: %s', error)
+        key = None
+    if not key:
+        builder.build(namespace, tag)
+        return False
+    entry = build_cache.get('builds', key)
+    if entry:
+        try:
+            builder.tag_image(namespace, entry['image_id'], tag)
+            logging.info('Context unchanged, reusing image %s for "%s"',
+                         entry['image_id'], tag)
+            return True
+        except subprocess.CalledProcessError:
+            logging.info('Cached image %s is gone. Rebuilding.',
+                         entry['image_id'])
+            build_cache.drop('builds', key)
+    builder.build(namespace, tag)
+    build_cache.put('builds', key, image_id=builder.image_id(namespace, tag),
+                    tag=tag)
+    return False
+
+
+def tar(builder, namespace, image, build_cache=None):
+    """
+    Exports an image unless the same image was exported before.
+
+    :param builder: The image manager to export with.
+    :type builder: system_buildah.managers.ImageManager
+    :param namespace: Namespace passed in via CLI.
+    :type namespace: argparse.Namespace
+    :param image: The image to export.
+    :type image: str
+    :param build_cache: The cache to use, if any.
+    :type build_cache: BuildCache or None
+    :returns: Path to the tar file
+    :rtype: str
+    :raises: subprocess.CalledProcessError
+    """
+    with trace.span('tar', image=image, manager=namespace.manager) as span:
+        path, cached = _tar(builder, namespace, image, build_cache)
+        if build_cache is not None:
+            span['cache'] = 'hit' if cached else 'miss'
+        if trace.active():
+            span['bytes_written'] = os.path.getsize(path)
+        return path
+
+
+def _tar(builder, namespace, image, build_cache):
+    """
+    Implements tar().
+
+    :returns: The path and whether it was reused
+    :rtype: tuple(str, bool)
+    """
+    if build_cache is None:
+        return builder.tar(namespace, image), False
+    image_id = builder.image_id(namespace, image)
+    expected = util._expand_path(builder.tar_path(image))
+    entry = build_cache.get('tars', image_id)
+    if entry and os.path.isfile(entry['path']):
+        stat = os.stat(entry['path'])
+        if (stat.st_size, stat.st_mtime) == (entry['size'], entry['mtime']):
+            logging.info('Image %s unchanged, reusing "%s"',
+                         image_id, entry['path'])
+            if entry['path'] != expected:
+                shutil.copyfile(entry['path'], expected)
+            return expected, True
+    path = builder.tar(namespace, image)
+    stat = os.stat(path)
+    build_cache.put('tars', image_id, path=path, size=stat.st_size,
+                    mtime=stat.st_mtime)
+    return path, False
@@ -18,26 +18,42 @@ System Image build tool.
 
 import argparse
 import logging
-import platform
 import subprocess
+import sys
 
-# CLI Actions
-from system_buildah.actions.tar_action import TarAction
-from system_buildah.actions.build_action import BuildAction
-from system_buildah.actions.generate_files_action import GenerateFilesAction
-from system_buildah.actions.generate_dockerfile_action import (
-    GenerateDockerfileAction)
+# CLI Actions are imported only when their command is dispatched
+from system_buildah.actions import lazy
 
 
-def main():  # pragma: no cover
+class _HostAction(argparse.Action):
     """
-    Main entry point.
+    Keeps every -H in hosts and the first one in host.
     """
-    # Default to info logging
-    parser = argparse.ArgumentParser()
-    # Verify that we are being executed with Python 3+
-    if int(platform.python_version_tuple()[0]) <= 2:
-        parser.error('system-buildah requires Python 3.x')
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        namespace.hosts = (getattr(namespace, 'hosts', None) or []) + [
+            values]
+        if namespace.host is None:
+            namespace.host = values
+
+
+#: Codecs tar can compress with. Kept in sync with compression.COMPRESSORS
+#: without importing it.
+COMPRESSION_CODECS = ('gzip', 'xz', 'zstd')
+
+
+def build_parser(parser_class=argparse.ArgumentParser):
+    """
+    Creates the command line parser.
+
+    No action module is imported until its command is dispatched.
+
+    :param parser_class: Class of the parser and of every command parser.
+    :type parser_class: type
+    :returns: The parser
+    :rtype: argparse.ArgumentParser
+    """
+    parser = parser_class()
 
     # Parent parser used by all commands
     parent_parser = argparse.ArgumentParser(add_help=False)
@@ -45,25 +61,99 @@ def main():  # pragma: no cover
         '--log-level', default='info',
         choices=('debug', 'info', 'warn', 'fatal'))
     parent_parser.add_argument(
-        '--manager', default='moby', choices=('moby', 'buildah'))
+        '--manager', default='moby', choices=('moby', 'moby-api', 'buildah'))
+    parent_parser.add_argument(
+        '--command-timeout', type=float, default=None, metavar='SECONDS',
+        help='Kill docker or buildah commands running longer than this')
+    parent_parser.add_argument(
+        '--trace-file', default=None,
+        help='Write timing spans of every phase to this file')
+    parent_parser.add_argument(
+        '--trace-format', default=None, choices=('chrome', 'jsonl'),
+        help=('Format of the trace file. Default: jsonl for .jsonl files, '
+              'otherwise the Chrome trace event format'))
+    parent_parser.add_argument(
+        '--metrics-file', default=None,
+        help=('Prometheus textfile to add build, export and cache metrics '
+              'to, such as for the node_exporter textfile collector'))
 
     # Parent parser to use with commands that may use moby/docker
     extra_moby_switches = argparse.ArgumentParser(add_help=False)
     extra_moby_switches.add_argument(
-        '-H', '--host',
-        help='Remote Docker host to connect to (Docker specific)')
+        '-H', '--host', action=_HostAction,
+        help=('Remote Docker host to connect to. Repeat to spread builds '
+              'over several hosts (Docker specific)'))
+    extra_moby_switches.add_argument(
+        '--hosts-file', default=None,
+        help=('File listing Docker hosts to spread builds over, one '
+              '"HOST [JOBS]" per line (Docker specific)'))
+    extra_moby_switches.add_argument(
+        '--host-jobs', type=int, default=2,
+        help='Builds each host runs at once (Docker specific)')
+    extra_moby_switches.add_argument(
+        '--placement', default='least-loaded',
+        choices=('least-loaded', 'round-robin'),
+        help='How builds are spread over hosts (Docker specific)')
+    extra_moby_switches.set_defaults(hosts=None)
     extra_moby_switches.add_argument(
         '--tlsverify', action="store_true",
         help='Enable TLS Verification (Docker specific)')
 
+    # Parent parser to use with commands that can skip unchanged work
+    cache_switches = argparse.ArgumentParser(add_help=False)
+    cache_switches.add_argument(
+        '--cache', action='store_true',
+        help='Reuse earlier results when the input has not changed')
+    cache_switches.add_argument(
+        '--cache-dir', default=None,
+        help='Cache location. Default: ~/.cache/system-buildah')
+    cache_switches.add_argument(
+        '--cache-max-entries', type=int, default=256,
+        help='Most builds and exports to remember')
+    cache_switches.add_argument(
+        '--cache-max-age', type=int, default=30,
+        help='Days to remember an unused build or export')
+
+    # Parent parser to use with commands that send build contexts
+    context_switches = argparse.ArgumentParser(add_help=False)
+    context_switches.add_argument(
+        '--full-context', action='store_true',
+        help=('Send the whole directory as build context instead of only '
+              'the files COPY and ADD use (Docker specific)'))
+    context_switches.add_argument(
+        '--scripted', action='store_true',
+        help=('Build with buildah from, run, copy, config and commit, '
+              'adding one layer (buildah specific)'))
+    context_switches.add_argument(
+        '--reuse-container', action='store_true',
+        help=('Implies --scripted. Reuse one working container for images '
+              'sharing a base where possible (buildah specific)'))
+
+    # Parent parser to use with commands that build many images at once
+    prefetch_switches = argparse.ArgumentParser(add_help=False)
+    prefetch_switches.add_argument(
+        '--prefetch', action='store_true',
+        help=('Pull the base images concurrently before any build starts '
+              'and pin the builds to the digests they resolve to'))
+    prefetch_switches.add_argument(
+        '--pull-jobs', type=int, default=4,
+        help='Base images to pull at the same time with --prefetch')
+
     subparsers = parser.add_subparsers(
         title='commands', description='commands')
 
+    # Parent parser to use with commands that render templates
+    template_switches = argparse.ArgumentParser(add_help=False)
+    template_switches.add_argument(
+        '--template-dir', default=None,
+        help=('Directory of templates overriding the packaged ones. '
+              'Default: $SYSTEM_BUILDAH_TEMPLATE_DIR'))
+
     # generate-files command
     files_command = subparsers.add_parser(
         'generate-files',
         help='Generates manifest.json, config.template, and service.template',
-        parents=[parent_parser])
+        parents=[template_switches, parent_parser])
     files_command.add_argument(
         '-d', '--description',
         default='UNKNOWN', help='Description of image')
@@ -71,20 +161,31 @@ def main():  # pragma: no cover
         '-c', '--config', default=None,
         help=('Options to pass to ocitools generate. '
               'Example: -c "--cwd=/tmp --os=linux"'))
+    files_command.add_argument(
+        '--ocitools', action='store_true',
+        help=('Always run ocitools generate instead of building the '
+              'configuration in process'))
     files_command.add_argument(
         '-D', '--default',
         action='append',
         default=[],
         help='Default manifest values in the form of key=value')
+    files_command.add_argument(
+        '-i', '--inventory', default=None,
+        help=('JSON or YAML file describing many images to generate files '
+              'for. Their paths are relative to output'))
+    files_command.add_argument(
+        '-j', '--jobs', type=int, default=4,
+        help='Number of images to write at the same time')
     files_command.add_argument(
         'output',
         help='Path to write the new files',
-        action=GenerateFilesAction)
+        action=lazy('GenerateFilesAction'))
 
     # generate-dockerfile command
     dockerfile_command = subparsers.add_parser(
         'generate-dockerfile', help='Generate a new Dockerfile',
-        parents=[parent_parser])
+        parents=[template_switches, parent_parser])
     dockerfile_command.add_argument(
         '-o', '--output', default='.', help='Path to write the new Dockerfile')
     dockerfile_command.add_argument(
@@ -114,26 +215,216 @@ def main():  # pragma: no cover
         default=[],
         help=('Add a file to the host on install. '
               'file=/full/host/path EX: file.txt=/etc/file.txt'))
+    dockerfile_command.add_argument(
+        '--style', default='classic',
+        choices=('classic', 'compact', 'cache-friendly'),
+        help=('Instruction layout. compact creates every directory in one '
+              'RUN and copies files sharing a host directory together, '
+              'reporting the layer count of both styles. cache-friendly '
+              'does the same with the labels last so a new version only '
+              'rebuilds them'))
+    dockerfile_command.add_argument(
+        '--explain', action='append', default=[], metavar='INPUT',
+        help=('Show the build steps a change of INPUT invalidates. INPUT '
+              'is an option such as version or a file such as init.sh. '
+              'May be repeated'))
     dockerfile_command.add_argument(
         'name',
         help='Name for the new system image',
-        action=GenerateDockerfileAction)
+        action=lazy('GenerateDockerfileAction'))
 
     # build command
     build_command = subparsers.add_parser(
         'build', help='Builds a new system image',
-        parents=[extra_moby_switches, parent_parser])
+        parents=[extra_moby_switches, context_switches, cache_switches,
+                 parent_parser])
     build_command.add_argument(
         '-p', '--path', default='.', help='Path to the Dockerfile directory')
     build_command.add_argument(
-        'tag', help='Tag for the new image', action=BuildAction)
+        'tag', help='Tag for the new image', action=lazy('BuildAction'))
+
+    # build-many command
+    build_many_command = subparsers.add_parser(
+        'build-many', help='Builds many system images concurrently',
+        parents=[extra_moby_switches, context_switches, cache_switches,
+                 prefetch_switches, parent_parser])
+    build_many_command.add_argument(
+        '-j', '--jobs', type=int, default=4,
+        help='Number of images to build at the same time')
+    build_many_command.add_argument(
+        '-d', '--directory', default=None,
+        help=('Directory of image contexts. Each subdirectory holding a '
+              'Dockerfile is built and tagged with its name'))
+    build_many_command.add_argument(
+        'images', nargs='*', action=lazy('BuildManyAction'),
+        help='Images to build in the form of path=tag')
 
     # tar command
     tar_command = subparsers.add_parser(
         'tar', help='Exports an image as a tar file',
-        parents=[extra_moby_switches, parent_parser])
+        parents=[extra_moby_switches, cache_switches, parent_parser])
+    tar_command.add_argument(
+        '-z', '--compress', default=None,
+        choices=COMPRESSION_CODECS,
+        help='Stream the export through a compressor instead of saving it')
+    tar_command.add_argument(
+        '-o', '--output', default=None,
+        help=('File to write the compressed export or the delta to, or - '
+              'for stdout when compressing. Default: the image name with '
+              'the codec or .delta.tar extension'))
+    tar_command.add_argument(
+        '--since', default=None, metavar='ARCHIVE',
+        help=('Write a delta holding only the layers missing from this '
+              'previously shipped archive. See merge-tar'))
+    tar_command.add_argument(
+        '--threads', type=int, default=None,
+        help='Compression threads. Default: number of CPUs')
+    tar_command.add_argument(
+        '--index', action='store_true',
+        help=('Also write an index of the files in the export to '
+              'ARCHIVE.index.json for extract'))
     tar_command.add_argument(
-        'image', help='Name of the image', action=TarAction)
+        'image', help='Name of the image', action=lazy('TarAction'))
+
+    # pipeline command
+    pipeline_command = subparsers.add_parser(
+        'pipeline',
+        help='Generates, builds and exports the images of a spec at once',
+        parents=[
+            extra_moby_switches, context_switches, cache_switches,
+            prefetch_switches, template_switches, parent_parser])
+    pipeline_command.add_argument(
+        '--generate-jobs', type=int, default=2,
+        help='Images to render at the same time')
+    pipeline_command.add_argument(
+        '--build-jobs', type=int, default=1,
+        help='Images to build at the same time')
+    pipeline_command.add_argument(
+        '--export-jobs', type=int, default=1,
+        help='Images to export at the same time')
+    pipeline_command.add_argument(
+        'spec', action=lazy('PipelineAction'),
+        help='JSON file listing the images and their options')
+
+    # batch command
+    batch_command = subparsers.add_parser(
+        'batch', help='Runs the commands of a file concurrently',
+        parents=[parent_parser])
+    batch_command.add_argument(
+        '-j', '--jobs', type=int, default=4,
+        help='Number of commands to run at the same time')
+    batch_command.add_argument(
+        'batch_file', action=lazy('BatchAction'),
+        help=('File holding one command line per line, optionally starting '
+              'with -C DIR'))
+
+    # merge-tar command
+    merge_command = subparsers.add_parser(
+        'merge-tar',
+        help='Rebuilds a complete archive from a base archive and a delta',
+        parents=[parent_parser])
+    merge_command.add_argument(
+        '-o', '--output', required=True,
+        help='File to write the complete archive to')
+    merge_command.add_argument(
+        'base', help='The archive the delta was made against')
+    merge_command.add_argument(
+        'delta', action=lazy('MergeTarAction'),
+        help='The delta written by tar --since')
+
+    # extract command
+    extract_command = subparsers.add_parser(
+        'extract', help='Reads one file out of an exported image',
+        parents=[parent_parser])
+    extract_command.add_argument(
+        '-o', '--output', default='-',
+        help='File to write to. Default: stdout')
+    extract_command.add_argument(
+        '--image', default=None,
+        help=('Image whose files to read when the archive holds several. '
+              'Default: the first one'))
+    extract_command.add_argument(
+        'archive', help='Archive written by tar, indexed first if needed')
+    extract_command.add_argument(
+        'file', action=lazy('ExtractAction'),
+        help=('Path in the image such as /exports/manifest.json, or a '
+              'member of the archive such as manifest.json'))
+
+    # inspect-tar command
+    inspect_command = subparsers.add_parser(
+        'inspect-tar',
+        help='Reports layer sizes and what makes an exported image large',
+        parents=[parent_parser])
+    inspect_command.add_argument(
+        '-p', '--path', default=None,
+        help=('Dockerfile, or its directory, the image was built from. '
+              'Attributes layers to its instructions instead of the image '
+              'history'))
+    inspect_command.add_argument(
+        '--image', default=None,
+        help=('Image to report on when the archive holds several. '
+              'Default: the first one'))
+    inspect_command.add_argument(
+        '--top', type=int, default=10,
+        help='Number of files to list in each section')
+    inspect_command.add_argument(
+        '--json', action='store_true', help='Print the report as JSON')
+    inspect_command.add_argument(
+        'archive', action=lazy('InspectTarAction'),
+        help=('Archive written by tar, plain or compressed with gzip or xz, '
+              'or - for stdin'))
+
+    # export-layout command
+    layout_command = subparsers.add_parser(
+        'export-layout',
+        help='Exports images into one OCI image layout sharing their blobs',
+        parents=[extra_moby_switches, parent_parser])
+    layout_command.add_argument(
+        '-o', '--output', required=True,
+        help=('OCI layout directory to create or update. A name ending in '
+              '.tar also writes the layout as an archive, keeping the '
+              'directory without .tar to reuse blobs from later'))
+    layout_command.add_argument(
+        'images', nargs='+', action=lazy('ExportLayoutAction'),
+        help='Names of the images')
+
+    # serve command
+    serve_command = subparsers.add_parser(
+        'serve', help='Runs commands sent by submit in one warm process',
+        parents=[parent_parser])
+    serve_command.add_argument(
+        '-j', '--jobs', type=int, default=4,
+        help='Number of commands to run at the same time')
+    serve_command.add_argument(
+        '--queue-size', type=int, default=16,
+        help='Number of commands that may wait to run before more are refused')
+    serve_command.add_argument(
+        'socket', nargs='?', default=None, action=lazy('ServeAction'),
+        help=('Unix socket to listen on. Default: $SYSTEM_BUILDAH_SOCKET or '
+              '$XDG_RUNTIME_DIR/system-buildah.sock'))
+
+    # submit command
+    submit_command = subparsers.add_parser(
+        'submit', help='Runs a command in a system-buildah serve process',
+        parents=[parent_parser])
+    submit_command.add_argument(
+        '-s', '--socket', default=None,
+        help=('Unix socket of the server. Default: $SYSTEM_BUILDAH_SOCKET or '
+              '$XDG_RUNTIME_DIR/system-buildah.sock'))
+    submit_command.add_argument(
+        'arguments', nargs=argparse.REMAINDER, action=lazy('SubmitAction'),
+        help='The command to run, such as: build -p ./image image:latest')
+    return parser
+
+
+def main():  # pragma: no cover
+    """
+    Main entry point.
+    """
+    parser = build_parser()
+    # Verify that we are being executed with Python 3+
+    if sys.version_info[0] <= 2:
+        parser.error('system-buildah requires Python 3.x')
 
     try:
         parser.parse_args()
@@ -0,0 +1,131 @@
+# Copyright (C) 2017 Red Hat
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Block parallel stream compression.
+
+Input is cut into fixed size blocks which are compressed independently on a
+thread pool and written out in order. gzip, xz and zstd all define a stream
+made of concatenated members/frames as valid, so the output decompresses
+with the standard tools.
+"""
+
+import gzip
+import logging
+import lzma
+import os
+
+from collections import deque
+from concurrent import futures
+
+#: Default size of a block handed to a compression thread.
+BLOCK_SIZE = 4 * 1024 * 1024
+
+#: File extension per codec.
+EXTENSIONS = {
+    'gzip': '.gz',
+    'xz': '.xz',
+    'zstd': '.zst',
+}
+
+
+def _zstd_compress(data):
+    """
+    Compresses a block as a zstd frame.
+
+    :param data: The data to compress.
+    :type data: bytes
+    :returns: A complete zstd frame
+    :rtype: bytes
+    """
+    import zstandard
+    return zstandard.ZstdCompressor().compress(data)
+
+
+#: Compression function per codec. Each returns a self contained member.
+COMPRESSORS = {
+    'gzip': lambda data: gzip.compress(data, mtime=0),
+    'xz': lzma.compress,
+    'zstd': _zstd_compress,
+}
+
+
+def available(codec):
+    """
+    Checks if a codec can be used.
+
+    :param codec: Name of the codec.
+    :type codec: str
+    :returns: True if the codec can be used
+    :rtype: bool
+    """
+    if codec == 'zstd':
+        try:
+            import zstandard  # noqa: F401
+        except ImportError:
+            return False
+    return codec in COMPRESSORS
+
+
+def compress_stream(source, destination, codec,
+                    threads=None, block_size=BLOCK_SIZE):
+    """
+    Compresses a readable stream into a writable stream.
+
+    :param source: Binary stream to read from.
+    :type source: file
+    :param destination: Binary stream to write to.
+    :type destination: file
+    :param codec: Name of the codec to use.
+    :type codec: str
+    :param threads: Number of compression threads. Default: cpu count.
+    :type threads: int or None
+    :param block_size: Size of each independently compressed block.
+    :type block_size: int
+    :returns: The number of bytes read and written
+    :rtype: tuple(int, int)
+    """
+    compress = COMPRESSORS[codec]
+    threads = threads or os.cpu_count() or 1
+    read = written = 0
+    pending = deque()
+    with futures.ThreadPoolExecutor(max_workers=threads) as pool:
+        for block in iter(lambda: source.read(block_size), b''):
+            read += len(block)
+            pending.append(pool.submit(compress, block))
+            # Bound memory use to a couple of blocks per thread
+            while len(pending) > threads * 2:
+                written += _write(destination, pending.popleft())
+        while pending:
+            written += _write(destination, pending.popleft())
+    destination.flush()
+    logging.info('Compressed %d bytes to %d bytes with %s',
+                 read, written, codec)
+    return read, written
+
+
+def _write(destination, future):
+    """
+    Writes the result of a compression job.
+
+    :param destination: Binary stream to write to.
+    :type destination: file
+    :param future: A finished or running compression job.
+    :type future: concurrent.futures.Future
+    :returns: Number of bytes written
+    :rtype: int
+    """
+    data = future.result()
+    destination.write(data)
+    return len(data)
@@ -0,0 +1,326 @@
+# Copyright (C) 2017 Red Hat
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Build contexts holding only what the Dockerfile uses.
+
+plan() reads the COPY and ADD sources of the Dockerfile and picks the files
+they match, so stray files in the directory are not sent to the daemon.
+When the sources can not be resolved, such as when they use build
+arguments, the whole directory is sent. Either way files excluded by
+.dockerignore are left out, as docker build would.
+"""
+
+import fnmatch
+import glob
+import logging
+import os
+import re
+import tarfile
+import time
+
+from collections import namedtuple
+
+from system_buildah import dockerfile, util
+
+#: Size of the chunks files are read in.
+CHUNK_SIZE = 64 * 1024
+
+#: Files sent with every minimal context.
+ALWAYS = ('Dockerfile', '.dockerignore')
+
+#: The members of a context and how much of the directory they leave out.
+ContextPlan = namedtuple(
+    'ContextPlan', ['members', 'bytes_sent', 'bytes_skipped'])
+
+
+def walk(path):
+    """
+    Returns every file and directory below path.
+
+    :param path: The context directory.
+    :type path: str
+    :returns: Paths relative to path, parents before children
+    :rtype: list
+    """
+    names = []
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(dirs + files):
+            names.append(os.path.relpath(os.path.join(root, name), path))
+    return names
+
+
+def _compile(pattern):
+    """
+    Turns a .dockerignore pattern into a regular expression.
+
+    :param pattern: The pattern, without a leading !.
+    :type pattern: str
+    :returns: The expression matching whole relative paths
+    :rtype: re.Pattern
+    """
+    regex = ''
+    i = 0
+    while i < len(pattern):
+        end = pattern.find(']', i + 1)
+        if pattern.startswith('**/', i):
+            # Any number of directories, including none
+            regex += '(?:.*/)?'
+            i += 3
+        elif pattern.startswith('**', i):
+            regex += '.*'
+            i += 2
+        elif pattern[i] == '*':
+            regex += '[^/]*'
+            i += 1
+        elif pattern[i] == '?':
+            regex += '[^/]'
+            i += 1
+        elif pattern[i] == '[' and end > 0:
+            group = pattern[i + 1:end].replace('\\', '\\\\')
+            regex += '[^' + group[1:] + ']' if group.startswith('!') else (
+                '[' + group + ']')
+            i = end + 1
+        else:
+            regex += re.escape(pattern[i])
+            i += 1
+    return re.compile(regex + r'\Z')
+
+
+def read_dockerignore(path):
+    """
+    Reads the .dockerignore of a context directory.
+
+    :param path: The context directory.
+    :type path: str
+    :returns: (exception, expression) pairs in file order
+    :rtype: list
+    """
+    try:
+        with open(os.path.join(path, '.dockerignore')) as ignore_file:
+            lines = ignore_file.read().splitlines()
+    except (IOError, OSError):
+        return []
+    patterns = []
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        exception = line.startswith('!')
+        line = os.path.normpath(line.lstrip('!').strip().lstrip('/'))
+        patterns.append((exception, _compile(line)))
+    return patterns
+
+
+def ignored(name, patterns):
+    """
+    Checks if .dockerignore patterns exclude a path.
+
+    The last pattern matching the path, or a directory holding it,
+    decides.
+
+    :param name: Path relative to the context directory.
+    :type name: str
+    :param patterns: Patterns from read_dockerignore().
+    :type patterns: list
+    :returns: True when the path is excluded
+    :rtype: bool
+    """
+    parts = name.split(os.path.sep)
+    paths = ['/'.join(parts[:x]) for x in range(1, len(parts) + 1)]
+    result = False
+    for exception, regex in patterns:
+        if any(regex.match(x) for x in paths):
+            result = not exception
+    return result
+
+
+def included(path, names):
+    """
+    Returns the names .dockerignore leaves in a context.
+
+    Dockerfile and .dockerignore are sent even when excluded.
+
+    :param path: The context directory.
+    :type path: str
+    :param names: Paths relative to path.
+    :type names: list
+    :returns: The names that are not excluded
+    :rtype: list
+    """
+    patterns = read_dockerignore(path)
+    return [x for x in names if x in ALWAYS or not ignored(x, patterns)]
+
+
+def _size(path):
+    """
+    Returns the size of a regular file and 0 for anything else.
+    """
+    return os.path.getsize(path) if os.path.isfile(path) and not (
+        os.path.islink(path)) else 0
+
+
+def _matches(path, source):
+    """
+    Returns the context paths a COPY or ADD source refers to.
+
+    :param path: The context directory.
+    :type path: str
+    :param source: The source as written in the Dockerfile.
+    :type source: str
+    :returns: Relative paths, or None when the source can not be resolved
+    :rtype: list or None
+    """
+    source = os.path.normpath(source.lstrip('/')) if source.strip(
+        '/.') else '.'
+    if '$' in source or source.startswith('..'):
+        return None
+    if source == '.':
+        return walk(path)
+    if glob.has_magic(source):
+        # Wildcards do not cross directories but do match dot files
+        parts = source.split(os.path.sep)
+        found = [os.path.join(path, x) for x in walk(path) if len(
+            x.split(os.path.sep)) == len(parts) and all(
+                fnmatch.fnmatchcase(*pair)
+                for pair in zip(x.split(os.path.sep), parts))]
+    else:
+        found = [os.path.join(path, source)] if os.path.lexists(
+            os.path.join(path, source)) else []
+    if not found:
+        return None
+    names = []
+    for match in found:
+        relative = os.path.relpath(match, path)
+        names.append(relative)
+        if os.path.isdir(match) and not os.path.islink(match):
+            names.extend(os.path.join(relative, x) for x in walk(match))
+    return names
+
+
+def plan(path):
+    """
+    Picks the members of a minimal build context.
+
+    :param path: The context directory holding a Dockerfile.
+    :type path: str
+    :returns: The plan, or None when the whole directory must be sent
+    :rtype: ContextPlan or None
+    """
+    try:
+        instructions = dockerfile.parse_file(path)
+    except (IOError, OSError, ValueError) as error:
+        logging.debug('Sending the whole context: %s', error)
+        return None
+    members = set(x for x in ALWAYS if os.path.lexists(
+        os.path.join(path, x)))
+    for source in dockerfile.get_sources(instructions):
+        names = _matches(path, source)
+        if names is None:
+            logging.info('Unable to resolve "%s". Sending the whole context.',
+                         source)
+            return None
+        members.update(names)
+    # Parents first, as a directory walk would list them
+    members = included(path, sorted(
+        members, key=lambda x: x.split(os.path.sep)))
+    sent = sum(_size(os.path.join(path, x)) for x in members)
+    total = sum(_size(os.path.join(path, x)) for x in walk(path))
+    return ContextPlan(members, sent, total - sent)
+
+
+def tar_stream(path, names, rendered=None):
+    """
+    Yields a tar archive of some files of a directory without buffering it.
+
+    :param path: The context directory.
+    :type path: str
+    :param names: Paths relative to path to archive.
+    :type names: list
+    :param rendered: Content keyed by file name sent instead of the files
+                     of that name at the top of the directory.
+    :type rendered: dict or None
+    :returns: Chunks of the archive
+    :rtype: generator
+    """
+    rendered = rendered or {}
+    for name in sorted(rendered):
+        data = rendered[name].encode('utf-8')
+        info = tarfile.TarInfo(name)
+        info.size, info.mode, info.mtime = len(data), 0o644, int(time.time())
+        yield info.tobuf(tarfile.PAX_FORMAT, 'utf-8', 'surrogateescape')
+        yield data + b'\0' * (-len(data) % tarfile.BLOCKSIZE)
+    for name in names:
+        if name not in rendered:
+            yield from _tar_member(os.path.join(path, name), name)
+    yield b'\0' * tarfile.BLOCKSIZE * 2
+
+
+def _tar_member(full_path, arcname):
+    """
+    Yields the header and content of one archive member.
+
+    :param full_path: Path to the file on disk.
+    :type full_path: str
+    :param arcname: Name of the member in the archive.
+    :type arcname: str
+    :returns: Chunks of the member
+    :rtype: generator
+    """
+    stat = os.lstat(full_path)
+    info = tarfile.TarInfo(arcname)
+    info.mode = stat.st_mode & 0o7777
+    info.mtime = int(stat.st_mtime)
+    if os.path.islink(full_path):
+        info.type = tarfile.SYMTYPE
+        info.linkname = os.readlink(full_path)
+    elif os.path.isdir(full_path):
+        info.type = tarfile.DIRTYPE
+    else:
+        info.size = stat.st_size
+    yield info.tobuf(tarfile.PAX_FORMAT, 'utf-8', 'surrogateescape')
+    if info.type != tarfile.REGTYPE:
+        return
+    with open(full_path, 'rb') as source:
+        for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+            yield chunk
+    remainder = info.size % tarfile.BLOCKSIZE
+    if remainder:
+        yield b'\0' * (tarfile.BLOCKSIZE - remainder)
+
+
+def build_context(namespace):
+    """
+    Returns the archive to send for a build and logs what it leaves out.
+
+    :param namespace: Namespace passed in via CLI. Uses path,
+                      full_context and rendered_files.
+    :type namespace: argparse.Namespace
+    :returns: A callable returning chunks of the archive and the plan,
+              which is None when the whole directory is sent
+    :rtype: tuple(callable, ContextPlan or None)
+    """
+    path = util._expand_path(namespace.path)
+    rendered = getattr(namespace, 'rendered_files', None)
+    context_plan = None
+    if not getattr(namespace, 'full_context', False):
+        context_plan = plan(path)
+    if context_plan is None:
+        return lambda: tar_stream(
+            path, included(path, walk(path)), rendered), None
+    logging.info('Sending %d bytes of build context, skipping %d bytes',
+                 context_plan.bytes_sent, context_plan.bytes_skipped)
+    return (lambda: tar_stream(path, context_plan.members, rendered),
+            context_plan)
@@ -0,0 +1,261 @@
+# Copyright (C) 2017 Red Hat
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Delta docker-archives holding only the layers a base archive lacks.
+
+A delta is a docker-archive without the layers of the base archive plus a
+delta.json member naming each omitted member and its digest. merge() puts
+the omitted layers back from the base to rebuild a loadable archive.
+"""
+
+import hashlib
+import io
+import json
+import logging
+import os
+import posixpath
+import tarfile
+import tempfile
+
+#: Member of a delta describing what was left out.
+DELTA_MEMBER = 'delta.json'
+
+#: Size of the chunks members are copied in.
+CHUNK_SIZE = 1024 * 1024
+
+#: Bytes of a layer held in memory before it spills to a temporary file.
+SPOOL_SIZE = 64 * 1024 * 1024
+
+
+class DeltaError(ValueError):
+    """
+    A delta can not be written or merged.
+    """
+    pass
+
+
+def _is_layer(name):
+    """
+    Checks if an archive member may hold a layer.
+
+    :param name: Name of the member.
+    :type name: str
+    :returns: True for layer.tar files and blobs
+    :rtype: bool
+    """
+    return name.endswith('/layer.tar') or name.startswith('blobs/sha256/')
+
+
+def _resolve(archive, member):
+    """
+    Follows links to the member holding the data.
+
+    :param archive: An archive opened for random access.
+    :type archive: tarfile.TarFile
+    :param member: The member to resolve.
+    :type member: tarfile.TarInfo
+    :returns: The regular file member or None
+    :rtype: tarfile.TarInfo or None
+    """
+    for _ in range(8):
+        if member.isfile():
+            return member
+        if member.issym():
+            name = posixpath.normpath(posixpath.join(
+                posixpath.dirname(member.name), member.linkname))
+        elif member.islnk():
+            name = member.linkname
+        else:
+            return None
+        try:
+            member = archive.getmember(name.lstrip('/'))
+        except KeyError:
+            return None
+    return None
+
+
+def read_layers(path):
+    """
+    Returns the layers of every image in an archive.
+
+    Works with full archives and with deltas, whose configs still list
+    every layer.
+
+    :param path: Path to a docker-archive, optionally gzip or xz compressed.
+    :type path: str
+    :returns: Member holding each layer keyed by digest. The member is None
+              for layers a delta left out.
+    :rtype: dict
+    :raises: DeltaError
+    """
+    layers = {}
+    try:
+        archive = tarfile.open(path, 'r:*')
+    except tarfile.TarError as error:
+        raise DeltaError('{} is not an archive: {}'.format(path, error))
+    with archive:
+        try:
+            manifest = json.loads(archive.extractfile(
+                'manifest.json').read().decode('utf-8'))
+        except KeyError:
+            raise DeltaError('{} has no manifest.json'.format(path))
+        for entry in manifest:
+            config = json.loads(archive.extractfile(
+                entry['Config']).read().decode('utf-8'))
+            diff_ids = config.get('rootfs', {}).get('diff_ids', [])
+            for digest, name in zip(diff_ids, entry['Layers']):
+                try:
+                    member = _resolve(archive, archive.getmember(name))
+                except KeyError:
+                    member = None
+                if layers.get(digest) is None:
+                    layers[digest] = member and member.name
+    return layers
+
+
+def _hash_member(archive, member, spool):
+    """
+    Copies the data of a member from a streamed archive into a spool.
+
+    :param archive: The archive being read.
+    :type archive: tarfile.TarFile
+    :param member: The regular file member to copy.
+    :type member: tarfile.TarInfo
+    :param spool: File to copy the data to.
+    :type spool: file
+    :returns: The digest of the data
+    :rtype: str
+    """
+    digest = hashlib.sha256()
+    source = archive.extractfile(member)
+    for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+        digest.update(chunk)
+        spool.write(chunk)
+    spool.seek(0)
+    return 'sha256:' + digest.hexdigest()
+
+
+def write_delta(source, known, output):
+    """
+    Writes a delta of a docker-archive stream.
+
+    Layers are hashed into a temporary spool first and only written when
+    not found in known. Layers stored by digest are skipped without being
+    read at all.
+
+    :param source: Binary stream of the new docker-archive.
+    :type source: file
+    :param known: Digests of the layers the receiver already has.
+    :type known: set
+    :param output: Path of the delta to write.
+    :type output: str
+    :returns: Bytes of layers left out and bytes written
+    :rtype: tuple(int, int)
+    """
+    partial = output + '.part'
+    try:
+        with open(partial, 'wb') as delta_file:
+            omitted, skipped = _write_delta(source, known, delta_file)
+        os.rename(partial, output)
+    finally:
+        if os.path.exists(partial):
+            os.unlink(partial)
+    logging.info('Left out %d layers (%d bytes)', len(omitted), skipped)
+    return skipped, os.path.getsize(output)
+
+
+def _write_delta(source, known, delta_file):
+    """
+    Writes the members of a delta.
+
+    :param source: Binary stream of the new docker-archive.
+    :type source: file
+    :param known: Digests of the layers the receiver already has.
+    :type known: set
+    :param delta_file: File to write to.
+    :type delta_file: file
+    :returns: Digest per omitted member and bytes left out
+    :rtype: tuple(dict, int)
+    """
+    omitted = {}
+    skipped = 0
+    with tarfile.open(
+            fileobj=delta_file, mode='w',
+            format=tarfile.PAX_FORMAT) as delta, tarfile.open(
+                fileobj=source, mode='r|') as archive:
+        for member in archive:
+            if not member.isfile() or not _is_layer(member.name):
+                delta.addfile(member, archive.extractfile(member)
+                              if member.isfile() else None)
+                continue
+            name = 'sha256:' + member.name[len('blobs/sha256/'):]
+            # Layers named by digest are left out without being read
+            by_digest = member.name.startswith('blobs/sha256/')
+            if not (by_digest and name in known):
+                with tempfile.SpooledTemporaryFile(SPOOL_SIZE) as spool:
+                    name = _hash_member(archive, member, spool)
+                    if name not in known:
+                        delta.addfile(member, spool)
+                        continue
+            omitted[member.name] = name
+            skipped += member.size
+        info = json.dumps({'omitted': omitted}, sort_keys=True).encode(
+            'utf-8')
+        member = tarfile.TarInfo(DELTA_MEMBER)
+        member.size = len(info)
+        delta.addfile(member, io.BytesIO(info))
+    return omitted, skipped
+
+
+def merge(base, delta, output):
+    """
+    Rebuilds a complete archive from a base archive and a delta.
+
+    :param base: Path to the archive the delta was made against.
+    :type base: str
+    :param delta: Path to the delta.
+    :type delta: str
+    :param output: Path of the complete archive to write.
+    :type output: str
+    :raises: DeltaError when the base lacks a layer the delta left out
+    """
+    layers = read_layers(base)
+    partial = output + '.part'
+    try:
+        with tarfile.open(base, 'r:*') as base_archive, tarfile.open(
+                delta, 'r:*') as delta_archive, tarfile.open(
+                    partial, 'w', format=tarfile.PAX_FORMAT) as merged:
+            try:
+                omitted = json.loads(delta_archive.extractfile(
+                    DELTA_MEMBER).read().decode('utf-8'))['omitted']
+            except KeyError:
+                raise DeltaError('{} is not a delta'.format(delta))
+            for name, digest in sorted(omitted.items()):
+                if not layers.get(digest):
+                    raise DeltaError('{} lacks layer {}'.format(base, digest))
+                source = base_archive.getmember(layers[digest])
+                member = tarfile.TarInfo(name)
+                member.size, member.mode = source.size, source.mode
+                member.mtime = source.mtime
+                merged.addfile(member, base_archive.extractfile(source))
+            for member in delta_archive:
+                if member.name == DELTA_MEMBER:
+                    continue
+                merged.addfile(member, delta_archive.extractfile(member)
+                               if member.isfile() else None)
+        os.rename(partial, output)
+    finally:
+        if os.path.exists(partial):
+            os.unlink(partial)
@@ -0,0 +1,242 @@
+# Copyright (C) 2017 Red Hat
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Minimal Dockerfile parsing.
+"""
+
+import json
+import os
+import re
+
+from collections import namedtuple
+
+
+#: A single Dockerfile instruction. instruction is always upper case.
+Instruction = namedtuple('Instruction', ['instruction', 'arguments'])
+
+#: The image of a FROM line, after any --platform style flags.
+_FROM_LINE = re.compile(
+    r'^(\s*FROM\s+(?:--\S+\s+)*)(\S+)', re.IGNORECASE | re.MULTILINE)
+
+
+def parse(data):
+    """
+    Parses Dockerfile content into a list of instructions.
+
+    Comments and blank lines are dropped and line continuations are joined.
+
+    :param data: The content of a Dockerfile.
+    :type data: str
+    :returns: The instructions in the order they appear.
+    :rtype: list
+    """
+    instructions = []
+    current = ''
+    for line in data.splitlines():
+        stripped = line.strip()
+        if not stripped or stripped.startswith('#'):
+            continue
+        if stripped.endswith('\\'):
+            current += stripped[:-1].rstrip() + ' '
+            continue
+        current += stripped
+        parts = current.split(None, 1)
+        instructions.append(Instruction(
+            parts[0].upper(), parts[1].strip() if len(parts) > 1 else ''))
+        current = ''
+    return instructions
+
+
+def parse_file(path):
+    """
+    Parses a Dockerfile from disk.
+
+    :param path: Path to a Dockerfile or a directory holding one.
+    :type path: str
+    :returns: The instructions in the order they appear.
+    :rtype: list
+    """
+    if os.path.isdir(path):
+        path = os.path.sep.join([path, 'Dockerfile'])
+    with open(path, 'r') as dockerfile:
+        return parse(dockerfile.read())
+
+
+def get_base(instructions):
+    """
+    Returns the base image of the final stage.
+
+    :param instructions: Parsed Dockerfile instructions.
+    :type instructions: list
+    :returns: The base image reference or None if there is no FROM.
+    :rtype: str or None
+    """
+    base = None
+    for item in instructions:
+        if item.instruction == 'FROM':
+            base = [x for x in item.arguments.split()
+                    if not x.startswith('--')][0]
+    return base
+
+
+def get_bases(instructions):
+    """
+    Returns the images every stage starts from.
+
+    Stages based on an earlier stage, scratch and references built from
+    build arguments are left out as there is nothing to pull for them.
+
+    :param instructions: Parsed Dockerfile instructions.
+    :type instructions: list
+    :returns: Image references in order of first use.
+    :rtype: list
+    """
+    bases = []
+    stages = set()
+    for item in instructions:
+        if item.instruction != 'FROM':
+            continue
+        parts = [x for x in item.arguments.split() if not x.startswith('--')]
+        image = parts[0]
+        if image.lower() not in stages and image != 'scratch' and (
+                '$' not in image and image not in bases):
+            bases.append(image)
+        if len(parts) > 2 and parts[1].lower() == 'as':
+            stages.add(parts[2].lower())
+    return bases
+
+
+def pin_bases(data, pins):
+    """
+    Replaces the images of FROM lines with the references they are
+    pinned to.
+
+    :param data: The content of a Dockerfile.
+    :type data: str
+    :param pins: Pinned references keyed by normalized reference. Images
+                 missing or mapped to None are left alone.
+    :type pins: dict
+    :returns: The content with pinned FROM lines.
+    :rtype: str
+    """
+    def replace(match):
+        pinned = pins.get(normalize_reference(match.group(2)))
+        return match.group(1) + (pinned or match.group(2))
+    return _FROM_LINE.sub(replace, data)
+
+
+def repository(reference):
+    """
+    Strips the tag or digest from an image reference.
+
+    :param reference: An image reference such as registry:5000/centos:7.
+    :type reference: str
+    :returns: The repository, such as registry:5000/centos.
+    :rtype: str
+    """
+    name = reference.split('@', 1)[0]
+    if ':' in name.rsplit('/', 1)[-1]:
+        name = name.rsplit(':', 1)[0]
+    return name
+
+
+def normalize_reference(reference):
+    """
+    Adds the implicit latest tag to an image reference.
+
+    :param reference: An image reference such as centos or centos:7.
+    :type reference: str
+    :returns: The reference with an explicit tag.
+    :rtype: str
+    """
+    if '@' in reference or ':' in reference.rsplit('/', 1)[-1]:
+        return reference
+    return '{}:latest'.format(reference)
+
+
+def duplicate_references(references):
+    """
+    Finds image references given more than once.
+
+    :param references: Image references such as centos and centos:latest.
+    :type references: list
+    :returns: The references naming an image named before, in order
+    :rtype: list
+    """
+    seen = set()
+    duplicates = []
+    for reference in references:
+        normalized = normalize_reference(reference)
+        if normalized in seen:
+            duplicates.append(reference)
+        seen.add(normalized)
+    return duplicates
+
+
+def split_copy_arguments(arguments):
+    """
+    Splits the arguments of a COPY or ADD instruction.
+
+    :param arguments: The arguments of the instruction.
+    :type arguments: str
+    :returns: The sources and the destination
+    :rtype: tuple(list, str)
+    """
+    arguments = arguments.strip()
+    if arguments.startswith('['):
+        parts = json.loads(arguments)
+    else:
+        parts = [x for x in arguments.split() if not x.startswith('--')]
+    return parts[:-1], parts[-1]
+
+
+def get_sources(instructions):
+    """
+    Returns the local sources used by COPY and ADD instructions.
+
+    Remote ADD sources and COPY --from sources are not local and are skipped.
+
+    :param instructions: Parsed Dockerfile instructions.
+    :type instructions: list
+    :returns: Source paths relative to the build context in order of use.
+    :rtype: list
+    """
+    sources = []
+    for item in instructions:
+        if item.instruction not in ('COPY', 'ADD'):
+            continue
+        if '--from=' in item.arguments:
+            continue
+        for source in split_copy_arguments(item.arguments)[0]:
+            if '://' not in source and source not in sources:
+                sources.append(source)
+    return sources
+
+
+#: Instructions that add a filesystem layer.
+LAYER_INSTRUCTIONS = ('RUN', 'COPY', 'ADD')
+
+
+def count_layers(instructions):
+    """
+    Counts the layers the instructions add on top of the base image.
+
+    :param instructions: Parsed Dockerfile instructions.
+    :type instructions: list
+    :returns: The number of layers
+    :rtype: int
+    """
+    return len([x for x in instructions
+                if x.instruction in LAYER_INSTRUCTIONS])
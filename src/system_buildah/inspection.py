@@ -0,0 +1,497 @@
+# Copyright (C) 2017 Red Hat
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Reports what makes an exported image large.
+
+scan() reads a docker-archive, compressed or not, in one streaming pass
+without writing anything to disk. Each layer is read as it goes by,
+recording its size, the size gzip shrinks it to and the size and digest of
+each of its files. report() then stacks the layers of an image to find the
+largest files, files a later layer overwrites or deletes and contents
+stored more than once, and attributes each layer to the Dockerfile
+instruction that created it.
+"""
+
+import hashlib
+import json
+import logging
+import posixpath
+import tarfile
+import zlib
+
+from system_buildah import dockerfile, tarindex
+
+#: Size of the chunks files are read in.
+READ_SIZE = 1024 * 1024
+
+#: Largest member read as metadata such as manifest.json or a config.
+METADATA_LIMIT = 16 * 1024 * 1024
+
+#: Leading bytes of layers that are already compressed.
+COMPRESSED_MAGIC = (b'\x1f\x8b', b'\xfd7zXZ', b'BZh', b'\x28\xb5\x2f\xfd')
+
+#: Suffixes newer builders add to the created_by of history entries.
+HISTORY_SUFFIXES = (' # buildkit',)
+
+
+class InspectError(ValueError):
+    """
+    An archive can not be reported on.
+    """
+    pass
+
+
+class Layer(object):
+    """
+    What one layer of an archive holds.
+    """
+
+    def __init__(self, name, size):
+        """
+        Initializes a new Layer.
+
+        :param name: The member holding the layer.
+        :type name: str
+        :param size: Bytes the layer takes in the archive.
+        :type size: int
+        """
+        self.name = name
+        self.size = size
+        self.compressed = size
+        self.uncompressed = size
+        #: (size, sha256) keyed by path
+        self.files = {}
+        #: Paths the layer deletes
+        self.whiteouts = []
+        #: Directories whose content in lower layers the layer hides
+        self.opaque = []
+
+
+class _MeasuringReader(object):
+    """
+    Passes a stream through, measuring what gzip would shrink it to.
+    """
+
+    def __init__(self, source, head=b''):
+        """
+        :param source: The stream to read.
+        :type source: file
+        :param head: Bytes already read from source.
+        :type head: bytes
+        """
+        self._source = source
+        self._head = head
+        self._compressor = None
+        if not head.startswith(COMPRESSED_MAGIC):
+            # wbits of 31 writes the gzip format
+            self._compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        self.compressed = 0
+
+    @property
+    def was_compressed(self):
+        """
+        Whether the stream was compressed already.
+        """
+        return self._compressor is None
+
+    def read(self, size=-1):
+        if not self._head:
+            data = self._source.read(size)
+        elif size < 0:
+            data, self._head = self._head + self._source.read(), b''
+        else:
+            data, self._head = self._head[:size], self._head[size:]
+        if self._compressor is not None and data:
+            self.compressed += len(self._compressor.compress(data))
+        return data
+
+    def finish(self):
+        """
+        Reads what is left and returns the compressed size.
+
+        :returns: Bytes gzip would write, or None when already compressed
+        :rtype: int or None
+        """
+        while self.read(READ_SIZE):
+            pass
+        if self._compressor is None:
+            return None
+        self.compressed += len(self._compressor.flush())
+        return self.compressed
+
+
+class Scan(object):
+    """
+    What scan() found in an archive.
+    """
+
+    def __init__(self):
+        #: Layer keyed by member name
+        self.layers = {}
+        #: Parsed JSON members keyed by member name
+        self.metadata = {}
+        #: Link target keyed by member name
+        self.links = {}
+
+    def resolve(self, name):
+        """
+        Follows links to the member holding the data.
+
+        :param name: Name of a member.
+        :type name: str
+        :returns: Name of the member holding the data
+        :rtype: str
+        """
+        name = posixpath.normpath(name)
+        for _ in range(8):
+            if name not in self.links:
+                break
+            name = self.links[name]
+        return name
+
+
+def _scan_layer(reader, name, size):
+    """
+    Reads the files of a layer.
+
+    :param reader: The layer.
+    :type reader: _MeasuringReader
+    :param name: The member holding the layer.
+    :type name: str
+    :param size: Bytes the layer takes in the archive.
+    :type size: int
+    :returns: The layer
+    :rtype: Layer
+    :raises: tarfile.TarError when the member is not a tar
+    """
+    layer = Layer(name, size)
+    with tarfile.open(fileobj=reader, mode='r|*') as archive:
+        for item in archive:
+            path = tarindex._normalize(item.name)
+            parent, base = posixpath.split(path)
+            if base == tarindex.OPAQUE:
+                layer.opaque.append(parent)
+            elif base.startswith(tarindex.WHITEOUT):
+                layer.whiteouts.append(
+                    posixpath.join(parent, base[len(tarindex.WHITEOUT):]))
+            elif item.isfile():
+                digest = hashlib.sha256()
+                data = archive.extractfile(item)
+                for chunk in iter(lambda: data.read(READ_SIZE), b''):
+                    digest.update(chunk)
+                layer.files[path] = (item.size, digest.hexdigest())
+        if reader.was_compressed:
+            layer.uncompressed = archive.offset
+    compressed = reader.finish()
+    if compressed is not None:
+        layer.compressed = compressed
+    return layer
+
+
+def _scan_member(result, source, name, size):
+    """
+    Records a regular member of an archive as metadata or as a layer.
+
+    :param result: Where to record the member.
+    :type result: Scan
+    :param source: The content of the member.
+    :type source: file
+    :param name: Name of the member.
+    :type name: str
+    :param size: Size of the member.
+    :type size: int
+    """
+    head = source.read(512)
+    if name.endswith('.json') or head.lstrip().startswith((b'{', b'[')):
+        if size <= METADATA_LIMIT:
+            try:
+                result.metadata[name] = json.loads(
+                    (head + source.read()).decode('utf-8'))
+            except ValueError:
+                logging.debug('Skipping %s, which is not JSON', name)
+        return
+    try:
+        result.layers[name] = _scan_layer(
+            _MeasuringReader(source, head), name, size)
+    except tarfile.TarError:
+        logging.debug('Skipping %s, which is not a layer', name)
+
+
+def scan(source):
+    """
+    Reads an archive in one pass.
+
+    :param source: The archive, opened for binary reading. It does not
+                   need to be seekable.
+    :type source: file
+    :returns: What the archive holds
+    :rtype: Scan
+    :raises: InspectError
+    """
+    result = Scan()
+    try:
+        with tarfile.open(fileobj=source, mode='r|*') as archive:
+            for member in archive:
+                name = tarindex._normalize(member.name)
+                if member.issym():
+                    result.links[name] = tarindex._normalize(posixpath.join(
+                        posixpath.dirname(name), member.linkname))
+                elif member.islnk():
+                    result.links[name] = tarindex._normalize(member.linkname)
+                elif member.isfile():
+                    _scan_member(
+                        result, archive.extractfile(member), name,
+                        member.size)
+    except (tarfile.TarError, EOFError, OSError) as error:
+        raise InspectError('Unable to read the archive: {}'.format(error))
+    return result
+
+
+def _clean_history(created_by):
+    """
+    Turns the created_by of a history entry into an instruction.
+
+    :param created_by: Such as /bin/sh -c #(nop) COPY file:x in /a.
+    :type created_by: str
+    :returns: The instruction such as COPY file:x in /a
+    :rtype: str
+    """
+    for suffix in HISTORY_SUFFIXES:
+        if created_by.endswith(suffix):
+            created_by = created_by[:-len(suffix)]
+    if created_by.startswith('/bin/sh -c #(nop) '):
+        return created_by[len('/bin/sh -c #(nop) '):].strip()
+    if created_by.startswith('/bin/sh -c '):
+        return 'RUN ' + created_by[len('/bin/sh -c '):].strip()
+    return created_by.strip()
+
+
+def attribute(count, config=None, instructions=None):
+    """
+    Names what created each layer of an image.
+
+    Layers are matched to the RUN, COPY and ADD instructions of the final
+    stage of a Dockerfile from the top, the layers below them coming from
+    the base image. Without a Dockerfile the history of the image config
+    is used.
+
+    :param count: Number of layers of the image.
+    :type count: int
+    :param config: The image config.
+    :type config: dict or None
+    :param instructions: Parsed Dockerfile instructions.
+    :type instructions: list or None
+    :returns: What created each layer, None where unknown
+    :rtype: list
+    """
+    if instructions:
+        stage = []
+        for item in instructions:
+            stage = [] if item.instruction == 'FROM' else stage + [item]
+        steps = ['{} {}'.format(x.instruction, x.arguments) for x in stage
+                 if x.instruction in dockerfile.LAYER_INSTRUCTIONS]
+        if len(steps) <= count:
+            base = 'FROM {}'.format(dockerfile.get_base(instructions))
+            return [base] * (count - len(steps)) + steps
+        logging.warning('The Dockerfile adds more layers than the image has')
+    history = [x for x in (config or {}).get('history', [])
+               if not x.get('empty_layer')]
+    if len(history) != count:
+        return [None] * count
+    return [_clean_history(x.get('created_by', '')) for x in history]
+
+
+def _image_layers(result, image):
+    """
+    Returns the manifest entry and the layers of an image.
+
+    :raises: InspectError
+    """
+    manifest = result.metadata.get('manifest.json')
+    if not isinstance(manifest, list) or not manifest:
+        raise InspectError('The archive has no manifest.json')
+    entry = manifest[0]
+    if image is not None:
+        image = dockerfile.normalize_reference(image)
+        found = [x for x in manifest if image in [
+            dockerfile.normalize_reference(y)
+            for y in x.get('RepoTags') or []]]
+        if not found:
+            raise InspectError('{} is not in the archive'.format(image))
+        entry = found[0]
+    layers = []
+    for name in entry.get('Layers', []):
+        layer = result.layers.get(result.resolve(name))
+        if layer is None:
+            raise InspectError('Layer {} is missing from the archive'.format(
+                name))
+        layers.append(layer)
+    return entry, layers
+
+
+def _stack(layers):
+    """
+    Finds the files later layers overwrite or delete.
+
+    :param layers: The layers from the bottom.
+    :type layers: list
+    :returns: (path, size, layer, later layer, how) tuples
+    :rtype: list
+    """
+    visible = {}
+    hidden = []
+
+    def hide(prefix, number):
+        # A prefix of '' is the root directory
+        for path in [x for x in visible if x == prefix or x.startswith(
+                prefix + '/' if prefix else '')]:
+            lower, size = visible.pop(path)
+            hidden.append((path, size, lower, number, 'deleted'))
+
+    for number, layer in enumerate(layers, 1):
+        for directory in layer.opaque:
+            hide(directory, number)
+        for path in layer.whiteouts:
+            hide(path, number)
+        for path, (size, _) in layer.files.items():
+            if path in visible:
+                lower, lower_size = visible[path]
+                hidden.append((path, lower_size, lower, number, 'overwritten'))
+            visible[path] = (number, size)
+    return hidden
+
+
+def _duplicates(layers):
+    """
+    Finds contents stored more than once.
+
+    :param layers: The layers from the bottom.
+    :type layers: list
+    :returns: (size, [(layer, path)]) tuples
+    :rtype: list
+    """
+    copies = {}
+    for number, layer in enumerate(layers, 1):
+        for path, (size, digest) in layer.files.items():
+            if size:
+                copies.setdefault((size, digest), []).append((number, path))
+    return [(size, sorted(found)) for (size, _), found in copies.items()
+            if len(found) > 1]
+
+
+def report(result, image=None, instructions=None, top=10):
+    """
+    Reports on one image of a scanned archive.
+
+    :param result: What scan() returned.
+    :type result: Scan
+    :param image: The image to report on. Default: the first one.
+    :type image: str or None
+    :param instructions: The Dockerfile the image was built from, to
+                         attribute its layers.
+    :type instructions: list or None
+    :param top: Number of files to list in each section.
+    :type top: int
+    :returns: The report, which can be dumped as JSON
+    :rtype: dict
+    :raises: InspectError
+    """
+    entry, layers = _image_layers(result, image)
+    created_by = attribute(
+        len(layers), result.metadata.get(result.resolve(
+            entry.get('Config', ''))), instructions)
+    files = [(size, path, number) for number, layer in enumerate(layers, 1)
+             for path, (size, _) in layer.files.items()]
+    hidden = sorted(_stack(layers), key=lambda x: (-x[1], x[0]))
+    duplicates = sorted(_duplicates(layers),
+                        key=lambda x: (-x[0] * (len(x[1]) - 1), x[1]))
+    return {
+        'image': (entry.get('RepoTags') or [None])[0],
+        'layers': [{
+            'number': number, 'member': layer.name, 'size': layer.size,
+            'compressed': layer.compressed,
+            'uncompressed': layer.uncompressed,
+            'files': len(layer.files), 'created_by': created_by[number - 1],
+        } for number, layer in enumerate(layers, 1)],
+        'largest': [{'path': path, 'size': size, 'layer': number}
+                    for size, path, number in sorted(
+                        files, key=lambda x: (-x[0], x[1]))[:top]],
+        'hidden_bytes': sum(x[1] for x in hidden),
+        'hidden': [{'path': path, 'size': size, 'layer': lower,
+                    'by_layer': upper, 'how': how}
+                   for path, size, lower, upper, how in hidden[:top]],
+        'duplicate_bytes': sum(
+            size * (len(found) - 1) for size, found in duplicates),
+        'duplicates': [{'size': size, 'copies': [
+            {'layer': number, 'path': path} for number, path in found]}
+            for size, found in duplicates[:top]],
+    }
+
+
+def human_size(size):
+    """
+    Formats a number of bytes for people.
+
+    :param size: Number of bytes.
+    :type size: int
+    :returns: Such as 512 B or 1.5 MiB
+    :rtype: str
+    """
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if size < 1024 or unit == 'GiB':
+            break
+        size /= 1024.0
+    if unit == 'B':
+        return '{} B'.format(size)
+    return '{:.1f} {}'.format(size, unit)
+
+
+def format_report(data):
+    """
+    Formats a report as text.
+
+    :param data: What report() returned.
+    :type data: dict
+    :returns: The text
+    :rtype: str
+    """
+    layers = data['layers']
+    lines = ['Image {}: {} layers, {} in the archive, {} compressed'.format(
+        data['image'], len(layers), human_size(sum(
+            x['size'] for x in layers)), human_size(sum(
+                x['compressed'] for x in layers))), '',
+        '{:>3} {:>11} {:>13} {:>7}  {}'.format(
+            '#', 'Compressed', 'Uncompressed', 'Files', 'Created by')]
+    for layer in layers:
+        lines.append('{:>3} {:>11} {:>13} {:>7}  {}'.format(
+            layer['number'], human_size(layer['compressed']),
+            human_size(layer['uncompressed']), layer['files'],
+            layer['created_by'] or layer['member']))
+    lines += ['', 'Largest files']
+    lines += ['{:>11}  #{} /{}'.format(
+        human_size(x['size']), x['layer'], x['path'])
+        for x in data['largest']]
+    lines += ['', 'Overwritten or deleted in later layers ({} hidden)'.format(
+        human_size(data['hidden_bytes']))]
+    lines += ['{:>11}  #{} /{} {} by #{}'.format(
+        human_size(x['size']), x['layer'], x['path'], x['how'],
+        x['by_layer']) for x in data['hidden']]
+    lines += ['', 'Duplicate contents ({} stored more than once)'.format(
+        human_size(data['duplicate_bytes']))]
+    lines += ['{:>11}  x{} {}'.format(
+        human_size(x['size']), len(x['copies']), ', '.join(
+            '#{} /{}'.format(y['layer'], y['path']) for y in x['copies']))
+        for x in data['duplicates']]
+    return '\n'.join(lines) + '\n'
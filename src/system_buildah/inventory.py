@@ -0,0 +1,146 @@
+# Copyright (C) 2017 Red Hat
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Inventories describing the files of many system images.
+
+An inventory is a JSON or YAML file such as::
+
+    {
+        "defaults": {"config": "--cwd=/"},
+        "images": [
+            {"path": "etcd", "description": "etcd",
+             "default": {"ETCD_NAME": "default"}},
+            {"path": "flannel", "config": ["--cwd=/", "--os=linux"]}
+        ]
+    }
+
+Paths are relative to the output directory of generate-files. YAML needs
+PyYAML to be installed.
+"""
+
+import copy
+import json
+import os
+
+#: Keys an inventory entry may set besides path.
+KEYS = ('description', 'default', 'config', 'ocitools')
+
+
+def _parse(path):
+    """
+    Reads the JSON or YAML document of an inventory.
+
+    :param path: Path to the inventory.
+    :type path: str
+    :returns: The document
+    :rtype: mixed
+    :raises: ValueError
+    :raises: IOError
+    """
+    with open(path) as inventory_file:
+        if not path.endswith(('.yaml', '.yml')):
+            return json.load(inventory_file)
+        try:
+            import yaml
+        except ImportError:
+            raise ValueError('PyYAML is needed to read YAML inventories')
+        try:
+            return yaml.safe_load(inventory_file)
+        except yaml.YAMLError as error:
+            raise ValueError(str(error))
+
+
+def _normalize(entry, path):
+    """
+    Checks an entry and turns its values into generate-files options.
+
+    :param entry: The entry merged with the defaults.
+    :type entry: dict
+    :param path: Path to the inventory, for messages.
+    :type path: str
+    :returns: The entry
+    :rtype: dict
+    :raises: ValueError
+    """
+    result = {}
+    for key, value in entry.items():
+        if key not in KEYS + ('path',):
+            raise ValueError('Unknown key "{}" in {}'.format(key, path))
+        if key == 'default' and isinstance(value, dict):
+            value = ['{}={}'.format(k, v) for k, v in sorted(value.items())]
+        elif key == 'config' and isinstance(value, list):
+            value = ' '.join(value)
+        result[key] = value
+    if not result.get('path'):
+        raise ValueError('Every entry of {} needs a path'.format(path))
+    if not isinstance(result['path'], str):
+        raise ValueError('Path "{}" in {} is not a string'.format(
+            result['path'], path))
+    return result
+
+
+def load(path):
+    """
+    Reads an inventory.
+
+    :param path: Path to the inventory.
+    :type path: str
+    :returns: One dict of options per image
+    :rtype: list
+    :raises: ValueError on a malformed inventory
+    :raises: IOError
+    """
+    document = _parse(path)
+    if isinstance(document, list):
+        document = {'images': document}
+    if not isinstance(document, dict):
+        raise ValueError('{} holds no images'.format(path))
+    defaults = document.get('defaults') or {}
+    images = document.get('images') or []
+    if not isinstance(defaults, dict) or not isinstance(images, list) or [
+            x for x in images if not isinstance(x, dict)]:
+        raise ValueError(
+            'The defaults and images of {} must be objects'.format(path))
+    entries = [_normalize(dict(defaults, **x), path) for x in images]
+    paths = [os.path.normpath(x['path']) for x in entries]
+    if len(set(paths)) != len(paths):
+        raise ValueError('{} lists a path more than once'.format(path))
+    return entries
+
+
+def entry_namespace(namespace, entry, output):
+    """
+    Returns the namespace generate-files renders an entry with.
+
+    :param namespace: Namespace passed in via CLI.
+    :type namespace: argparse.Namespace
+    :param entry: The entry.
+    :type entry: dict
+    :param output: The directory entry paths are relative to.
+    :type output: str
+    :returns: The namespace and the directory to write to
+    :rtype: tuple(argparse.Namespace, str)
+    :raises: ValueError when the path leads out of output
+    """
+    output = os.path.realpath(output)
+    directory = os.path.realpath(os.path.join(output, entry['path']))
+    if os.path.commonpath([output, directory]) != output:
+        raise ValueError('Path "{}" is not inside {}'.format(
+            entry['path'], output))
+    result = copy.copy(namespace)
+    for key in KEYS:
+        if key in entry:
+            setattr(result, key, entry[key])
+    return result, directory
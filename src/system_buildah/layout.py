@@ -0,0 +1,371 @@
+# Copyright (C) 2017 Red Hat
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Export of many images into one OCI image layout.
+
+Every blob is stored once under blobs/sha256/ and each image gets a
+manifest and an entry in index.json. Images whose config and layers are
+already in the layout are not read from the daemon again, and the rest are
+read as one docker-archive stream when the manager supports it so shared
+layers cross the pipe once.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import posixpath
+import tarfile
+import tempfile
+
+from system_buildah import dockerfile, trace
+from system_buildah.managers import hosts
+
+#: Media types used in manifests and the index.
+MANIFEST_TYPE = 'application/vnd.oci.image.manifest.v1+json'
+CONFIG_TYPE = 'application/vnd.oci.image.config.v1+json'
+LAYER_TYPE = 'application/vnd.oci.image.layer.v1.tar'
+
+#: Annotation holding the image name in index.json.
+REF_NAME = 'org.opencontainers.image.ref.name'
+
+#: Size of the chunks blobs are copied in.
+CHUNK_SIZE = 1024 * 1024
+
+#: docker-archive members describing images rather than holding blobs.
+METADATA = ('manifest.json', 'repositories', 'index.json', 'oci-layout')
+
+
+class Layout(object):
+    """
+    An OCI image layout directory.
+    """
+
+    def __init__(self, path):
+        """
+        Opens, or creates, a layout.
+
+        :param path: The layout directory.
+        :type path: str
+        """
+        self.path = path
+        self.blobs = os.path.join(path, 'blobs', 'sha256')
+        os.makedirs(self.blobs, exist_ok=True)
+        with open(os.path.join(path, 'oci-layout'), 'w') as oci_layout:
+            json.dump({'imageLayoutVersion': '1.0.0'}, oci_layout)
+        self.index = {'schemaVersion': 2, 'manifests': []}
+        index_path = os.path.join(path, 'index.json')
+        if os.path.isfile(index_path):
+            with open(index_path) as index_file:
+                self.index = json.load(index_file)
+        self.bytes_written = 0
+        self.bytes_skipped = 0
+
+    def blob_path(self, digest):
+        """
+        Returns the path of a blob.
+
+        :param digest: Digest such as sha256:abc.
+        :type digest: str
+        :returns: The path of the blob
+        :rtype: str
+        """
+        return os.path.join(self.blobs, digest.split(':', 1)[-1])
+
+    def has_blob(self, digest):
+        """
+        Checks if a blob is stored.
+
+        :param digest: Digest such as sha256:abc.
+        :type digest: str
+        :returns: True if the blob is stored
+        :rtype: bool
+        """
+        return os.path.isfile(self.blob_path(digest))
+
+    def descriptor(self, digest, media_type):
+        """
+        Returns the descriptor of a stored blob.
+
+        :param digest: Digest such as sha256:abc.
+        :type digest: str
+        :param media_type: The media type of the blob.
+        :type media_type: str
+        :returns: The descriptor
+        :rtype: dict
+        """
+        return {'mediaType': media_type, 'digest': digest,
+                'size': os.path.getsize(self.blob_path(digest))}
+
+    def add_blob(self, source):
+        """
+        Stores a blob read from a stream unless it is already stored.
+
+        :param source: Binary stream of the blob.
+        :type source: file
+        :returns: The digest of the blob
+        :rtype: str
+        """
+        digest = hashlib.sha256()
+        handle, partial = tempfile.mkstemp(dir=self.blobs, prefix='.part-')
+        try:
+            with os.fdopen(handle, 'wb') as destination:
+                for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+                    digest.update(chunk)
+                    destination.write(chunk)
+            name = 'sha256:' + digest.hexdigest()
+            if self.has_blob(name):
+                self.bytes_skipped += os.path.getsize(partial)
+            else:
+                self.bytes_written += os.path.getsize(partial)
+                os.chmod(partial, 0o644)
+                os.rename(partial, self.blob_path(name))
+        finally:
+            if os.path.exists(partial):
+                os.unlink(partial)
+        return name
+
+    def add_json(self, data):
+        """
+        Stores a JSON document as a blob.
+
+        :param data: The document.
+        :type data: dict
+        :returns: The digest of the blob
+        :rtype: str
+        """
+        content = json.dumps(data, sort_keys=True).encode('utf-8')
+        name = 'sha256:' + hashlib.sha256(content).hexdigest()
+        if not self.has_blob(name):
+            with open(self.blob_path(name), 'wb') as blob:
+                blob.write(content)
+            self.bytes_written += len(content)
+        return name
+
+    def add_image(self, name, config, layers):
+        """
+        Writes the manifest of an image and points name at it.
+
+        :param name: The image name recorded in the index.
+        :type name: str
+        :param config: Digest of the image config.
+        :type config: str
+        :param layers: Digests of the layers, base first.
+        :type layers: list
+        """
+        manifest = self.add_json({
+            'schemaVersion': 2,
+            'mediaType': MANIFEST_TYPE,
+            'config': self.descriptor(config, CONFIG_TYPE),
+            'layers': [self.descriptor(x, LAYER_TYPE) for x in layers],
+        })
+        entry = self.descriptor(manifest, MANIFEST_TYPE)
+        entry['annotations'] = {REF_NAME: name}
+        self.index['manifests'] = [
+            x for x in self.index['manifests']
+            if x.get('annotations', {}).get(REF_NAME) != name] + [entry]
+        logging.info('Added %s as %s', name, manifest)
+
+    def save(self):
+        """
+        Writes index.json.
+        """
+        index_path = os.path.join(self.path, 'index.json')
+        with open(index_path + '.part', 'w') as index_file:
+            json.dump(self.index, index_file, indent=2, sort_keys=True)
+        os.rename(index_path + '.part', index_path)
+
+    def _is_metadata(self, name):
+        """
+        Checks if an archive member describes images rather than holds a blob.
+
+        :param name: Name of the member.
+        :type name: str
+        :returns: True for metadata
+        :rtype: bool
+        """
+        return name in METADATA or name.endswith(('/json', '/VERSION'))
+
+    def _store_member(self, archive, member):
+        """
+        Stores a regular file of a docker-archive as a blob.
+
+        :param archive: The archive being read.
+        :type archive: tarfile.TarFile
+        :param member: The member to store.
+        :type member: tarfile.TarInfo
+        :returns: The digest of the blob
+        :rtype: str
+        """
+        if member.name.startswith('blobs/sha256/'):
+            name = 'sha256:' + member.name[len('blobs/sha256/'):]
+            if self.has_blob(name):
+                # Named by digest, so the copy already stored is used
+                self.bytes_skipped += member.size
+                return name
+        return self.add_blob(archive.extractfile(member))
+
+    def _read_archive(self, source):
+        """
+        Stores the blobs of a docker-archive stream.
+
+        :param source: Binary stream of a docker-archive.
+        :type source: file
+        :returns: Digest per member name and the docker manifest
+        :rtype: tuple(dict, list)
+        """
+        members = {}
+        links = {}
+        manifest = []
+        with tarfile.open(fileobj=source, mode='r|') as archive:
+            for member in archive:
+                if member.issym():
+                    # Symbolic links are relative to their directory
+                    links[member.name] = posixpath.normpath(posixpath.join(
+                        posixpath.dirname(member.name), member.linkname))
+                elif member.islnk():
+                    links[member.name] = member.linkname
+                elif member.name == 'manifest.json':
+                    manifest = json.loads(
+                        archive.extractfile(member).read().decode('utf-8'))
+                elif member.isfile() and not self._is_metadata(member.name):
+                    members[member.name] = self._store_member(archive, member)
+        for name in links:
+            target = name
+            # Bounded so a link cycle can not loop forever
+            for _ in range(len(links)):
+                target = links.get(target, target).lstrip('/')
+            if target in members:
+                members[name] = members[target]
+        return members, manifest
+
+    def import_archive(self, source, images):
+        """
+        Stores the images of a docker-archive stream.
+
+        :param source: Binary stream of a docker-archive.
+        :type source: file
+        :param images: Names of the images to add to the index.
+        :type images: list
+        :returns: The names that were found in the archive
+        :rtype: list
+        """
+        members, manifest = self._read_archive(source)
+        wanted = {dockerfile.normalize_reference(x): x for x in images}
+        found = []
+        for entry in manifest:
+            for tag in entry.get('RepoTags') or []:
+                if tag not in wanted:
+                    continue
+                self.add_image(
+                    wanted[tag], members[entry['Config']],
+                    [members[x] for x in entry['Layers']])
+                found.append(wanted[tag])
+        return found
+
+
+def _known_image(layout, builder, namespace, image):
+    """
+    Returns the config and layer digests of an image stored in the layout.
+
+    :param layout: The target layout.
+    :type layout: Layout
+    :param builder: The image manager in use.
+    :type builder: system_buildah.managers.ImageManager
+    :param namespace: Namespace passed in via CLI.
+    :type namespace: argparse.Namespace
+    :param image: The image to look up.
+    :type image: str
+    :returns: (config, layers) or None when anything is missing
+    :rtype: tuple or None
+    :raises: subprocess.CalledProcessError
+    """
+    layers = builder.layer_digests(namespace, image)
+    if layers is None:
+        return None
+    config = builder.image_id(namespace, image)
+    if not config.startswith('sha256:'):
+        config = 'sha256:' + config
+    if all(layout.has_blob(x) for x in [config] + layers):
+        return config, layers
+    return None
+
+
+def export(builder, namespace, images, path):
+    """
+    Exports images into an OCI image layout directory.
+
+    :param builder: The image manager to export with.
+    :type builder: system_buildah.managers.ImageManager
+    :param namespace: Namespace passed in via CLI.
+    :type namespace: argparse.Namespace
+    :param images: The images to export.
+    :type images: list
+    :param path: The layout directory.
+    :type path: str
+    :returns: The layout
+    :rtype: Layout
+    :raises: subprocess.CalledProcessError
+    :raises: ValueError when an image is missing from the export
+    """
+    layout = Layout(path)
+    missing = []
+    for image in images:
+        known = _known_image(layout, builder, namespace, image)
+        if known:
+            logging.info('All blobs of %s are in the layout', image)
+            layout.add_image(image, *known)
+        else:
+            missing.append(image)
+
+    with trace.span('export-layout', images=missing,
+                    manager=getattr(namespace, 'manager', None)) as span:
+        found = []
+        if missing:
+            try:
+                with builder.stream_many(namespace, missing) as source:
+                    found = layout.import_archive(source, missing)
+            except (NotImplementedError, hosts.ImagesOnDifferentHosts):
+                for image in missing:
+                    with builder.stream(namespace, image) as source:
+                        found += layout.import_archive(source, [image])
+        span['bytes_written'] = layout.bytes_written
+        span['bytes_skipped'] = layout.bytes_skipped
+    layout.save()
+    not_found = [x for x in missing if x not in found]
+    if not_found:
+        raise ValueError('Not found in the export: {}'.format(
+            ', '.join(not_found)))
+    return layout
+
+
+def write_archive(path, output):
+    """
+    Packs a layout directory into a tar archive.
+
+    :param path: The layout directory.
+    :type path: str
+    :param output: The archive to write.
+    :type output: str
+    """
+    partial = output + '.part'
+    try:
+        with tarfile.open(partial, 'w') as archive:
+            for name in ('oci-layout', 'index.json', 'blobs'):
+                archive.add(os.path.join(path, name), name)
+        os.rename(partial, output)
+    finally:
+        if os.path.exists(partial):
+            os.unlink(partial)
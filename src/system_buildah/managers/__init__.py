@@ -16,7 +16,14 @@
 Managers for working with images.
 """
 
+import asyncio
+import subprocess
+
 from abc import ABCMeta, abstractmethod
+from contextlib import contextmanager
+
+from system_buildah import dockerfile, trace, util
+from system_buildah.managers import runner
 
 
 class ImageManager(metaclass=ABCMeta):
@@ -35,6 +42,252 @@ class ImageManager(metaclass=ABCMeta):
         """
         return data.replace(':', '-').replace('/', '-')
 
+    def tar_path(self, image):
+        """
+        Returns the file name tar writes an image to.
+
+        :param image: The image to export.
+        :type image: str
+        :returns: The tar file name relative to util.getcwd().
+        :rtype: str
+        """
+        return '{}.tar'.format(self._normalize_filename(image))
+
+    @contextmanager
+    def stream(self, namespace, image):
+        """
+        Streams an image as a docker-archive tar.
+
+        :param namespace: Namespace passed in via CLI.
+        :type namespace: argparse.Namespace
+        :param image: The image to export.
+        :type image: str
+        :returns: A binary stream of the archive.
+        :rtype: file
+        :raises: subprocess.CalledProcessError
+        """
+        with self._stream_output(
+                namespace, self.stream_command(namespace, image)) as output:
+            yield output
+
+    @contextmanager
+    def stream_many(self, namespace, images):
+        """
+        Streams several images as one docker-archive tar.
+
+        Layers shared between the images are only written once.
+
+        :param namespace: Namespace passed in via CLI.
+        :type namespace: argparse.Namespace
+        :param images: The images to export.
+        :type images: list
+        :returns: A binary stream of the archive.
+        :rtype: file
+        :raises: subprocess.CalledProcessError
+        :raises: NotImplementedError if the tool exports one image at a time
+        """
+        with self._stream_output(
+                namespace,
+                self.stream_many_command(namespace, images)) as output:
+            yield output
+
+    def stream_many_command(self, namespace, images):
+        """
+        Returns the command that writes several images to stdout.
+
+        :param namespace: Namespace passed in via CLI.
+        :type namespace: argparse.Namespace
+        :param images: The images to export.
+        :type images: list
+        :returns: The command to execute
+        :rtype: list
+        :raises: NotImplementedError if the tool exports one image at a time
+        """
+        raise NotImplementedError(
+            '{} exports one image at a time'.format(type(self).__module__))
+
+    def layer_digests(self, namespace, image):
+        """
+        Returns the digests of the uncompressed layers of an image.
+
+        :param namespace: Namespace passed in via CLI.
+        :type namespace: argparse.Namespace
+        :param image: The image to look up.
+        :type image: str
+        :returns: Digests, base layer first, or None if unknown
+        :rtype: list or None
+        :raises: subprocess.CalledProcessError
+        """
+        return None
+
+    def pull(self, namespace, image):
+        """
+        Pulls an image and resolves the digest it was pulled at.
+
+        :param namespace: Namespace passed in via CLI.
+        :type namespace: argparse.Namespace
+        :param image: The image to pull.
+        :type image: str
+        :returns: The image pinned to its digest, or None if the image has
+                  no digest such as when it was only built locally
+        :rtype: str or None
+        :raises: subprocess.CalledProcessError
+        :raises: NotImplementedError if the tool can not pull
+        """
+        raise NotImplementedError(
+            '{} can not pull images'.format(type(self).__module__))
+
+    def _pinned(self, image, digests):
+        """
+        Returns an image pinned to one of its digests.
+
+        :param image: The image reference.
+        :type image: str
+        :param digests: Digests, or repository@digest references, of the
+                        image.
+        :type digests: list
+        :returns: repository@digest, or None without digests
+        :rtype: str or None
+        """
+        name = dockerfile.repository(image)
+        for item in digests:
+            if item.split('@', 1)[0] == name:
+                return item
+        if not digests:
+            return None
+        return '{}@{}'.format(name, digests[0].rsplit('@', 1)[-1])
+
+    def close(self):
+        """
+        Releases anything the manager kept between builds.
+        """
+        pass
+
+    def _timeout(self, namespace):
+        """
+        Returns the seconds after which commands are killed.
+
+        :param namespace: Namespace passed in via CLI.
+        :type namespace: argparse.Namespace
+        :returns: The --command-timeout of the namespace
+        :rtype: float or None
+        """
+        return getattr(namespace, 'command_timeout', None)
+
+    def _call(self, namespace, command, **kwargs):
+        """
+        Runs a command and logs its output.
+
+        :param namespace: Namespace passed in via CLI.
+        :type namespace: argparse.Namespace
+        :param command: The command to execute.
+        :type command: list
+        :param kwargs: Keyword arguments for runner.check_call.
+        :type kwargs: dict
+        :raises: subprocess.CalledProcessError
+        """
+        trace.call(runner.check_call, command,
+                   timeout=self._timeout(namespace), **kwargs)
+
+    def _output(self, namespace, command):
+        """
+        Runs a command and returns its output.
+
+        :param namespace: Namespace passed in via CLI.
+        :type namespace: argparse.Namespace
+        :param command: The command to execute.
+        :type command: list
+        :returns: stdout of the command
+        :rtype: bytes
+        :raises: subprocess.CalledProcessError
+        """
+        return trace.call(runner.check_output, command,
+                          timeout=self._timeout(namespace))
+
+    async def _run(self, namespace, command, cwd=None, stdin=None,
+                   **details):
+        """
+        Runs a command on the running event loop inside a span.
+
+        :param namespace: Namespace passed in via CLI.
+        :type namespace: argparse.Namespace
+        :param command: The command to execute.
+        :type command: list
+        :param cwd: Directory to run in.
+        :type cwd: str or None
+        :param stdin: Chunks of bytes written to the stdin of the command.
+        :type stdin: iterable or None
+        :param details: More arguments to record in the span.
+        :type details: dict
+        :raises: subprocess.CalledProcessError
+        """
+        with trace.span('exec {}'.format(command[0]), argv=list(command),
+                        cwd=cwd, **details) as args:
+            try:
+                await runner.run(command, cwd=cwd, stdin=stdin,
+                                 timeout=self._timeout(namespace))
+            except subprocess.CalledProcessError as error:
+                args['exit_code'] = error.returncode
+                raise
+            args['exit_code'] = 0
+
+    async def build_async(self, namespace, tag):
+        """
+        Builds a specific image on the running event loop.
+
+        Managers without a native version run build in the default
+        executor of the loop.
+
+        :param namespace: Namespace passed in via CLI.
+        :type namespace: argparse.Namespace
+        :param tag: The tag to use when building.
+        :type tag: str
+        :raises: subprocess.CalledProcessError
+        """
+        await asyncio.get_event_loop().run_in_executor(
+            None, util.bind_working_directory(self.build), namespace, tag)
+
+    async def tar_async(self, namespace, output):
+        """
+        Exports a specific image to a tar file on the running event loop.
+
+        Managers without a native version run tar in the default executor
+        of the loop.
+
+        :param namespace: Namespace passed in via CLI.
+        :type namespace: argparse.Namespace
+        :param output: The name of the file to output.
+        :type output: str
+        :returns: Full path to the tar file
+        :rtype: str
+        :raises: subprocess.CalledProcessError
+        """
+        return await asyncio.get_event_loop().run_in_executor(
+            None, util.bind_working_directory(self.tar), namespace, output)
+
+    @contextmanager
+    def _stream_output(self, namespace, command):
+        """
+        Runs a command and yields its output.
+
+        :param namespace: Namespace passed in via CLI.
+        :type namespace: argparse.Namespace
+        :param command: The command to execute.
+        :type command: list
+        :returns: A binary stream of the output.
+        :rtype: file
+        :raises: subprocess.CalledProcessError
+        """
+        with trace.span('exec {}'.format(command[0]), argv=command) as args:
+            try:
+                with runner.stream(
+                        command, self._timeout(namespace)) as output:
+                    yield output
+            except subprocess.CalledProcessError as error:
+                args['exit_code'] = error.returncode
+                raise
+            args['exit_code'] = 0
+
     @abstractmethod
     def build(self, namespace, tag):  # pragma: no cover
         """
@@ -57,6 +310,52 @@ class ImageManager(metaclass=ABCMeta):
         :type namespace: argparse.Namespace
         :param output: The name of the file to output.
         :type output: str
+        :returns: Full path to the tar file
+        :rtype: str
         :raises: subprocess.CalledProcessError
         """
         pass
+
+    @abstractmethod
+    def image_id(self, namespace, image):  # pragma: no cover
+        """
+        Returns the ID of an image.
+
+        :param namespace: Namespace passed in via CLI.
+        :type namespace: argparse.Namespace
+        :param image: The image to look up.
+        :type image: str
+        :returns: The image ID
+        :rtype: str
+        :raises: subprocess.CalledProcessError
+        """
+        pass
+
+    @abstractmethod
+    def tag_image(self, namespace, image, tag):  # pragma: no cover
+        """
+        Adds a tag to an existing image.
+
+        :param namespace: Namespace passed in via CLI.
+        :type namespace: argparse.Namespace
+        :param image: The image, or image ID, to tag.
+        :type image: str
+        :param tag: The new tag.
+        :type tag: str
+        :raises: subprocess.CalledProcessError
+        """
+        pass
+
+    @abstractmethod
+    def stream_command(self, namespace, image):  # pragma: no cover
+        """
+        Returns the command that writes an image archive to stdout.
+
+        :param namespace: Namespace passed in via CLI.
+        :type namespace: argparse.Namespace
+        :param image: The image to export.
+        :type image: str
+        :returns: The command to execute
+        :rtype: list
+        """
+        pass
@@ -16,14 +16,17 @@
 buildah specific manager.
 """
 
+import asyncio
+import json
 import logging
 import os
 import subprocess
+import tempfile
+import threading
 import warnings
 
-from system_buildah import util, managers
-
-warnings.warn('The buildah manager is experimental!')
+from system_buildah import dockerfile, managers, script, trace, util
+from system_buildah.managers import runner
 
 
 class Manager(managers.ImageManager):
@@ -31,6 +34,15 @@ class Manager(managers.ImageManager):
     Works with buildah.
     """
 
+    def __init__(self):
+        """
+        Initializes a new Manager, warning that buildah support is new.
+        """
+        warnings.warn('The buildah manager is experimental!')
+        #: Reusable working containers per base image
+        self._idle = {}
+        self._lock = threading.Lock()
+
     def build(self, namespace, tag):
         """
         Builds a specific image.
@@ -41,10 +53,239 @@ class Manager(managers.ImageManager):
         :type tag: str
         :raises: subprocess.CalledProcessError
         """
+        build_script = self._scripted(namespace)
+        if build_script is not None:
+            return self._build_script(namespace, build_script, tag)
+        runner.wait(self.build_async(namespace, tag))
+
+    async def build_async(self, namespace, tag):
+        """
+        Builds a specific image on the running event loop.
+
+        Scripted builds run in the default executor of the loop. A
+        rendered Dockerfile, such as one with pinned bases, is built
+        instead of the one in the build directory.
+
+        :param namespace: namespace passed in via cli.
+        :type namespace: argparse.namespace
+        :param tag: The tag to use when building.
+        :type tag: str
+        :raises: subprocess.CalledProcessError
+        """
+        build_script = self._scripted(namespace)
+        if build_script is not None:
+            await asyncio.get_event_loop().run_in_executor(
+                None, util.bind_working_directory(self._build_script),
+                namespace, build_script, tag)
+            return
         logging.debug('buildah build will be used')
-        command = ['buildah', 'bud', '-t', tag, '.']
-        with util.pushd(namespace.path):
-            subprocess.check_call(command)
+        cwd = util._expand_path(namespace.path)
+        rendered = getattr(namespace, 'rendered_files', None) or {}
+        if 'Dockerfile' not in rendered:
+            await self._run(
+                namespace, ['buildah', 'bud', '-t', tag, '.'], cwd=cwd)
+            return
+        with tempfile.TemporaryDirectory(prefix='system-buildah-') as tmp:
+            path = os.path.join(tmp, 'Dockerfile')
+            with open(path, 'w') as dockerfile_file:
+                dockerfile_file.write(rendered['Dockerfile'])
+            await self._run(namespace, [
+                'buildah', 'bud', '-t', tag, '-f', path, '.'], cwd=cwd)
+
+    def _scripted(self, namespace):
+        """
+        Returns the script to build with when a scripted build was asked
+        for and the Dockerfile allows it.
+
+        :param namespace: namespace passed in via cli.
+        :type namespace: argparse.namespace
+        :returns: The script or None to use buildah bud
+        :rtype: system_buildah.script.Script or None
+        """
+        if not (getattr(namespace, 'scripted', False) or getattr(
+                namespace, 'reuse_container', False)):
+            return None
+        try:
+            return self._script(namespace)
+        except (script.UnsupportedInstruction, ValueError) as error:
+            logging.info('%s. Falling back to buildah bud.', error)
+            return None
+
+    def _script(self, namespace):
+        """
+        Returns the script for the Dockerfile of the build.
+
+        :param namespace: namespace passed in via cli.
+        :type namespace: argparse.namespace
+        :returns: The script
+        :rtype: system_buildah.script.Script
+        :raises: system_buildah.script.UnsupportedInstruction
+        """
+        rendered = getattr(namespace, 'rendered_files', None) or {}
+        if 'Dockerfile' in rendered:
+            instructions = dockerfile.parse(rendered['Dockerfile'])
+        else:
+            instructions = dockerfile.parse_file(
+                util._expand_path(namespace.path))
+        return script.from_instructions(instructions)
+
+    def _new_container(self, base):
+        """
+        Creates a working container and reads the config of its base.
+
+        :param base: The image to start from.
+        :type base: str
+        :returns: The container and the state used to reset it
+        :rtype: tuple(str, dict)
+        :raises: subprocess.CalledProcessError
+        """
+        container = trace.call(runner.check_output, [
+            'buildah', 'from', base]).decode('utf-8').strip()
+        config = json.loads(trace.call(runner.check_output, [
+            'buildah', 'inspect', '--type', 'container', '--format',
+            '{{json .OCIv1.Config}}', container]).decode('utf-8')) or {}
+        return container, {
+            'labels': config.get('Labels') or {},
+            'cmd': config.get('Cmd'),
+            'absent': set(),
+            'dirty_roots': set(),
+            'dirty_labels': set(),
+            'dirty_cmd': False,
+        }
+
+    def _absent(self, container, state, roots):
+        """
+        Checks that the base of a container has none of roots.
+
+        :returns: True when the paths can be removed to reset the container
+        :rtype: bool
+        """
+        missing = sorted(set(roots) - state['absent'])
+        if missing:
+            try:
+                trace.call(runner.check_call, [
+                    'buildah', 'run', container, '--', '/bin/sh', '-c',
+                    ' && '.join('test ! -e {}'.format(x) for x in missing)])
+            except subprocess.CalledProcessError:
+                return False
+            state['absent'].update(missing)
+        return True
+
+    def _acquire(self, build_script, reuse):
+        """
+        Returns a working container for a script.
+
+        An idle container on the same base is reset by removing what the
+        previous image added, as long as the base has none of it.
+
+        :returns: The container and its state
+        :rtype: tuple(str, dict)
+        :raises: subprocess.CalledProcessError
+        """
+        if reuse:
+            with self._lock:
+                idle = self._idle.get(build_script.base) or []
+                found = idle.pop() if idle else None
+            if found:
+                container, state = found
+                if state['dirty_roots']:
+                    command = ['buildah', 'run', container, '--', 'rm', '-rf']
+                    trace.call(runner.check_call,
+                               command + sorted(state['dirty_roots']))
+                    state['dirty_roots'] = set()
+                logging.info('Reusing working container %s', container)
+                return container, state
+        return self._new_container(build_script.base)
+
+    def _config_command(self, build_script, container, state):
+        """
+        Returns the one buildah config call applying labels and metadata.
+
+        Labels a previous image set on a reused container are put back to
+        the value of the base.
+        """
+        command = ['buildah', 'config']
+        for key in sorted(state['dirty_labels'] - set(build_script.labels)):
+            if key in state['labels']:
+                command += ['--label', '{}={}'.format(
+                    key, state['labels'][key])]
+            else:
+                command += ['--label', '{}-'.format(key)]
+        for key, value in sorted(build_script.labels.items()):
+            command += ['--label', '{}={}'.format(key, value)]
+        command += build_script.config
+        if '--cmd' not in build_script.config and state['dirty_cmd']:
+            command += ['--cmd', json.dumps(state['cmd']) if state[
+                'cmd'] else '']
+        return command + [container]
+
+    def _apply(self, namespace, build_script, container, state):
+        """
+        Runs the steps of a script in a container.
+
+        :raises: subprocess.CalledProcessError
+        """
+        cwd = util._expand_path(namespace.path)
+        for step in build_script.steps:
+            if step.kind == 'run':
+                command = ['buildah', 'run', container, '--'] + step.arguments
+            elif step.kind == 'config':
+                command = ['buildah', 'config'] + step.arguments + [container]
+            else:
+                # buildah takes no options after the container
+                flags = [x for x in step.arguments if x.startswith('--')]
+                command = ['buildah', step.kind] + flags + [
+                    container] + step.arguments[len(flags):]
+            self._call(namespace, command, cwd=cwd)
+        self._call(namespace, self._config_command(
+            build_script, container, state))
+
+    def _build_script(self, namespace, build_script, tag):
+        """
+        Builds an image by driving buildah with a script.
+
+        Every step runs in one working container that is committed once,
+        adding a single layer to the base.
+
+        :raises: subprocess.CalledProcessError
+        """
+        reuse = getattr(namespace, 'reuse_container', False) and (
+            build_script.reusable and set(build_script.config[::2]) <= {
+                '--cmd'})
+        container, state = self._acquire(build_script, reuse)
+        reuse = reuse and self._absent(container, state, build_script.roots)
+        try:
+            with trace.span('buildah script', tag=tag, container=container,
+                            steps=len(build_script.steps)):
+                self._apply(namespace, build_script, container, state)
+                self._call(namespace, ['buildah', 'commit', container, tag])
+        except subprocess.CalledProcessError:
+            self._remove(container)
+            raise
+        if not reuse:
+            return self._remove(container)
+        state['dirty_roots'] = set(build_script.roots)
+        state['dirty_labels'] = set(build_script.labels)
+        state['dirty_cmd'] = '--cmd' in build_script.config
+        with self._lock:
+            self._idle.setdefault(build_script.base, []).append(
+                (container, state))
+
+    def _remove(self, container):
+        """
+        Removes a working container.
+        """
+        trace.call(runner.check_call, ['buildah', 'rm', container])
+
+    def close(self):
+        """
+        Removes the working containers kept for reuse.
+        """
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for containers in idle.values():
+            for container, _ in containers:
+                self._remove(container)
 
     def tar(self, namespace, output):
         """
@@ -54,14 +295,95 @@ class Manager(managers.ImageManager):
         :type namespace: argparse.Namespace
         :param output: The name of the file to output.
         :type output: str
+        :returns: Full path to the tar file
+        :rtype: str
+        :raises: subprocess.CalledProcessError
+        """
+        return runner.wait(self.tar_async(namespace, output))
+
+    async def tar_async(self, namespace, output):
+        """
+        Exports a specific image to a tar file on the running event loop.
+
+        :param namespace: Namespace passed in via CLI.
+        :type namespace: argparse.Namespace
+        :param output: The name of the file to output.
+        :type output: str
+        :returns: Full path to the tar file
+        :rtype: str
         :raises: subprocess.CalledProcessError
         """
         logging.debug('buildah tar will be used')
-        tar_name = self._normalize_filename(output)
+        cwd = util.getcwd()
+        tar_name = os.path.join(cwd, self.tar_path(output))
         command = ['buildah', 'push', output,
                    'docker-archive:{}'.format(output)]
         # Export the layers
-        subprocess.check_call(command)
+        await self._run(namespace, command, cwd=cwd)
         # Rename the output file
         export_name, _ = output.split(':')
-        os.rename(export_name, '{}.tar'.format(tar_name))
+        os.rename(os.path.join(cwd, export_name), tar_name)
+        return tar_name
+
+    def stream_command(self, namespace, image):
+        """
+        Returns the command that writes an image archive to stdout.
+
+        :param namespace: Namespace passed in via CLI.
+        :type namespace: argparse.Namespace
+        :param image: The image to export.
+        :type image: str
+        :returns: The command to execute
+        :rtype: list
+        """
+        return ['buildah', 'push', '--quiet', image,
+                'docker-archive:/dev/stdout:{}'.format(image)]
+
+    def pull(self, namespace, image):
+        """
+        Pulls an image and resolves the digest it was pulled at.
+
+        :param namespace: Namespace passed in via CLI.
+        :type namespace: argparse.Namespace
+        :param image: The image to pull.
+        :type image: str
+        :returns: The image pinned to its digest, or None without one
+        :rtype: str or None
+        :raises: subprocess.CalledProcessError
+        """
+        self._call(namespace, ['buildah', 'pull', '--quiet', image])
+        command = ['buildah', 'inspect', '--type', 'image',
+                   '--format', '{{.FromImageDigest}}', image]
+        digest = self._output(namespace, command).decode('utf-8').strip()
+        return self._pinned(image, [digest] if digest else [])
+
+    def image_id(self, namespace, image):
+        """
+        Returns the ID of an image.
+
+        :param namespace: Namespace passed in via CLI.
+        :type namespace: argparse.Namespace
+        :param image: The image to look up.
+        :type image: str
+        :returns: The image ID
+        :rtype: str
+        :raises: subprocess.CalledProcessError
+        """
+        command = ['buildah', 'inspect', '--type', 'image',
+                   '--format', '{{.FromImageID}}', image]
+        output = self._output(namespace, command)
+        return output.decode('utf-8').strip()
+
+    def tag_image(self, namespace, image, tag):
+        """
+        Adds a tag to an existing image.
+
+        :param namespace: Namespace passed in via CLI.
+        :type namespace: argparse.Namespace
+        :param image: The image, or image ID, to tag.
+        :type image: str
+        :param tag: The new tag.
+        :type tag: str
+        :raises: subprocess.CalledProcessError
+        """
+        self._call(namespace, ['buildah', 'tag', image, tag])
@@ -0,0 +1,298 @@
+# Copyright (C) 2017 Red Hat
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Spreads builds over a pool of Docker hosts.
+
+Hosts come from repeated -H switches and --hosts-file. Each host runs at
+most its limit of builds at once. A host is health checked before its
+first build and excluded while the check fails, being checked again
+after RECHECK_SECONDS.
+"""
+
+import logging
+import subprocess
+import threading
+import time
+
+from concurrent import futures
+from contextlib import contextmanager
+
+from system_buildah import util
+
+#: How builds are placed on hosts.
+STRATEGIES = ('least-loaded', 'round-robin')
+
+#: Builds a host runs at once unless told otherwise.
+DEFAULT_JOBS = 2
+
+#: Seconds before an unhealthy host is checked again.
+RECHECK_SECONDS = 30.0
+
+
+class NoHealthyHost(subprocess.CalledProcessError):
+    """
+    Every host of a pool is unhealthy.
+    """
+
+    def __init__(self, hosts):
+        """
+        Initializes a new NoHealthyHost.
+
+        :param hosts: Addresses of the hosts in the pool.
+        :type hosts: list
+        """
+        super().__init__(1, 'host pool')
+        self.hosts = hosts
+
+    def __str__(self):
+        return 'None of the hosts are healthy: {}'.format(
+            ', '.join(self.hosts))
+
+
+class ImagesOnDifferentHosts(Exception):
+    """
+    Images to export together were built on different hosts.
+    """
+
+    def __init__(self, images):
+        """
+        Initializes a new ImagesOnDifferentHosts.
+
+        :param images: The images to export.
+        :type images: list
+        """
+        super().__init__(images)
+        self.images = images
+
+    def __str__(self):
+        return 'The images are on different hosts: {}'.format(
+            ', '.join(self.images))
+
+
+def read_hosts_file(path, limit=DEFAULT_JOBS):
+    """
+    Reads a hosts file.
+
+    Each line holds a host and optionally the builds it may run at once.
+    Empty lines and lines starting with # are ignored.
+
+    :param path: Path to the hosts file.
+    :type path: str
+    :param limit: Builds per host when a line does not say.
+    :type limit: int
+    :returns: (host, limit) pairs
+    :rtype: list
+    :raises: ValueError on a malformed line
+    :raises: IOError
+    """
+    hosts = []
+    with open(path) as hosts_file:
+        for number, line in enumerate(hosts_file, 1):
+            fields = line.split('#', 1)[0].split()
+            if not fields:
+                continue
+            try:
+                if len(fields) > 2 or (
+                        len(fields) == 2 and int(fields[1]) < 1):
+                    raise ValueError
+                hosts.append((fields[0], int(fields[1]) if len(
+                    fields) == 2 else limit))
+            except ValueError:
+                raise ValueError('{}:{}: expected "HOST [JOBS]"'.format(
+                    path, number))
+    return hosts
+
+
+def from_namespace(namespace):
+    """
+    Returns the hosts selected on the command line.
+
+    :param namespace: Namespace passed in via CLI. Uses hosts, hosts_file
+                      and host_jobs.
+    :type namespace: argparse.Namespace
+    :returns: (host, limit) pairs without duplicates
+    :rtype: list
+    :raises: ValueError on a malformed hosts file
+    :raises: IOError
+    """
+    limit = getattr(namespace, 'host_jobs', None) or DEFAULT_JOBS
+    hosts = [(x, limit) for x in getattr(namespace, 'hosts', None) or []]
+    if getattr(namespace, 'hosts_file', None):
+        hosts += read_hosts_file(
+            util._expand_path(namespace.hosts_file), limit)
+    seen = set()
+    result = []
+    for host, jobs in hosts:
+        if host not in seen:
+            seen.add(host)
+            result.append((host, jobs))
+    return result
+
+
+class Host(object):
+    """
+    The state of one host of a pool.
+    """
+
+    def __init__(self, address, limit):
+        """
+        Initializes a new Host.
+
+        :param address: The host as passed to -H.
+        :type address: str
+        :param limit: Builds the host runs at once.
+        :type limit: int
+        """
+        self.address = address
+        self.limit = limit
+        self.active = 0
+        self.placed = 0
+        self.healthy = None
+        self.checked = None
+
+
+class HostPool(object):
+    """
+    Hands out hosts to builds.
+    """
+
+    def __init__(self, hosts, check, strategy='least-loaded',
+                 recheck=RECHECK_SECONDS):
+        """
+        Initializes a new HostPool.
+
+        :param hosts: (host, limit) pairs.
+        :type hosts: list
+        :param check: Called with a host, returns True when it is healthy.
+        :type check: callable
+        :param strategy: One of STRATEGIES.
+        :type strategy: str
+        :param recheck: Seconds before an unhealthy host is checked again.
+        :type recheck: float
+        """
+        if strategy not in STRATEGIES:
+            raise ValueError('Unknown placement {}'.format(strategy))
+        self.hosts = [Host(*x) for x in hosts]
+        self.strategy = strategy
+        self.recheck = recheck
+        self._check_host = check
+        self._next = 0
+        self._condition = threading.Condition()
+
+    def _get(self, address):
+        """
+        Returns the Host of an address.
+        """
+        return next(x for x in self.hosts if x.address == address)
+
+    def check(self, address):
+        """
+        Health checks a host, excluding it when the check fails.
+
+        :param address: The host to check.
+        :type address: str
+        :returns: True when the host is healthy
+        :rtype: bool
+        """
+        host = self._get(address)
+        try:
+            healthy = bool(self._check_host(address))
+        except (subprocess.CalledProcessError, OSError) as error:
+            logging.debug('Health check of %s failed: %s', address, error)
+            healthy = False
+        if not healthy:
+            logging.warning('Excluding unhealthy host %s', address)
+        with self._condition:
+            host.healthy, host.checked = healthy, time.monotonic()
+            self._condition.notify_all()
+        return healthy
+
+    def _refresh(self):
+        """
+        Checks hosts never checked and unhealthy hosts due a new check.
+        """
+        now = time.monotonic()
+        with self._condition:
+            due = [x for x in self.hosts if x.checked is None or (
+                not x.healthy and now - x.checked >= self.recheck)]
+            for host in due:
+                # Keeps other threads from checking it at the same time
+                host.checked = now
+        if due:
+            with futures.ThreadPoolExecutor(max_workers=len(due)) as pool:
+                list(pool.map(util.bind_working_directory(self.check),
+                              [x.address for x in due]))
+
+    def healthy(self):
+        """
+        Returns the healthy hosts, checking those that are due.
+
+        :returns: Addresses of the healthy hosts
+        :rtype: list
+        :raises: NoHealthyHost
+        """
+        self._refresh()
+        with self._condition:
+            result = [x.address for x in self.hosts if x.healthy]
+        if not result:
+            raise NoHealthyHost([x.address for x in self.hosts])
+        return result
+
+    def _pick(self, free):
+        """
+        Picks the host for the next build.
+
+        :param free: Healthy hosts below their limit.
+        :type free: list
+        :returns: The host
+        :rtype: Host
+        """
+        if self.strategy == 'round-robin':
+            order = self.hosts[self._next:] + self.hosts[:self._next]
+            host = next(x for x in order if x in free)
+            self._next = (self.hosts.index(host) + 1) % len(self.hosts)
+            return host
+        return min(free, key=lambda x: (x.active / x.limit, x.placed))
+
+    @contextmanager
+    def acquire(self):
+        """
+        Waits for a healthy host with room for a build.
+
+        :returns: The address of the host
+        :rtype: str
+        :raises: NoHealthyHost
+        """
+        self._refresh()
+        with self._condition:
+            while True:
+                healthy = [x for x in self.hosts if x.healthy is not False]
+                if not healthy:
+                    raise NoHealthyHost([x.address for x in self.hosts])
+                free = [x for x in healthy
+                        if x.healthy and x.active < x.limit]
+                if free:
+                    break
+                self._condition.wait()
+            host = self._pick(free)
+            host.active += 1
+            host.placed += 1
+        logging.info('Placing build on %s', host.address)
+        try:
+            yield host.address
+        finally:
+            with self._condition:
+                host.active -= 1
+                self._condition.notify_all()
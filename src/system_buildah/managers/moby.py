@@ -16,10 +16,34 @@
 Moby/Docker specific manager.
 """
 
+import asyncio
+import copy
+import functools
+import json
 import logging
 import subprocess
+import threading
 
-from system_buildah import managers, util
+from system_buildah import context, dockerfile, managers, trace, util
+from system_buildah.managers import hosts, runner
+
+#: Seconds a health check of a host may take.
+HEALTH_TIMEOUT = 10
+
+
+def routed(method):
+    """
+    Runs a manager method against the host its image was built on.
+
+    :param method: A method taking a namespace and an image or images.
+    :type method: callable
+    :returns: The wrapped method
+    :rtype: callable
+    """
+    @functools.wraps(method)
+    def wrapper(self, namespace, image, *args):
+        return method(self, self._placed(namespace, image), image, *args)
+    return wrapper
 
 
 class Manager(managers.ImageManager):
@@ -27,6 +51,117 @@ class Manager(managers.ImageManager):
     Works with moby/docker.
     """
 
+    def __init__(self):
+        """
+        Initializes a new Manager.
+        """
+        self._pool = None
+        #: Host each image was built on when building on several hosts
+        self._placement = {}
+        self._lock = threading.Lock()
+
+    def _host_pool(self, namespace):
+        """
+        Returns the pool of hosts selected on the command line.
+
+        :param namespace: Namespace passed in via CLI.
+        :type namespace: argparse.Namespace
+        :returns: The pool, or None when there is at most one host
+        :rtype: system_buildah.managers.hosts.HostPool or None
+        :raises: ValueError on a malformed hosts file
+        :raises: IOError
+        """
+        if len(getattr(namespace, 'hosts', None) or []) < 2 and not getattr(
+                namespace, 'hosts_file', None):
+            return None
+        with self._lock:
+            if self._pool is None:
+                self._pool = hosts.HostPool(
+                    hosts.from_namespace(namespace),
+                    lambda x: self._healthy(self._on_host(namespace, x)),
+                    getattr(namespace, 'placement', None) or 'least-loaded')
+            return self._pool
+
+    def _on_host(self, namespace, host):
+        """
+        Returns a copy of namespace using one host of the pool.
+
+        :param namespace: Namespace passed in via CLI.
+        :type namespace: argparse.Namespace
+        :param host: The host to use.
+        :type host: str
+        :returns: The namespace for the host
+        :rtype: argparse.Namespace
+        """
+        namespace = copy.copy(namespace)
+        namespace.host = host
+        namespace.hosts = namespace.hosts_file = None
+        return namespace
+
+    def _healthy(self, namespace):
+        """
+        Checks that the daemon of namespace answers.
+
+        :param namespace: Namespace passed in via CLI.
+        :type namespace: argparse.Namespace
+        :returns: True when the daemon is healthy
+        :rtype: bool
+        :raises: subprocess.CalledProcessError
+        """
+        command = self._additional_switches(
+            namespace, ['docker', 'version', '--format',
+                        '{{.Server.Version}}'])
+        trace.call(runner.check_output, command, timeout=HEALTH_TIMEOUT)
+        return True
+
+    def _placed(self, namespace, images):
+        """
+        Returns namespace pointing at the host images were built on.
+
+        Images built by another process are looked up on every healthy
+        host of the pool.
+
+        :param namespace: Namespace passed in via CLI.
+        :type namespace: argparse.Namespace
+        :param images: An image or a list of images.
+        :type images: str or list
+        :returns: The namespace for the host
+        :rtype: argparse.Namespace
+        :raises: system_buildah.managers.hosts.ImagesOnDifferentHosts
+        """
+        pool = self._host_pool(namespace)
+        if pool is None:
+            return namespace
+        found = set()
+        images = [images] if isinstance(images, str) else list(images)
+        for image in images:
+            key = dockerfile.normalize_reference(image)
+            with self._lock:
+                host = self._placement.get(key)
+            found.add(host or self._locate(namespace, pool, key))
+        if len(found) > 1:
+            raise hosts.ImagesOnDifferentHosts(images)
+        return self._on_host(namespace, found.pop())
+
+    def _locate(self, namespace, pool, image):
+        """
+        Finds the host of the pool holding an image.
+
+        :returns: The host, or the first healthy host if none has it
+        :rtype: str
+        :raises: system_buildah.managers.hosts.NoHealthyHost
+        """
+        candidates = pool.healthy()
+        for host in candidates:
+            try:
+                self.image_id(self._on_host(namespace, host), image)
+            except (subprocess.CalledProcessError, OSError):
+                continue
+            with self._lock:
+                self._placement[image] = host
+            return host
+        return candidates[0]
+
     def _additional_switches(self, namespace, command):
         """
         Adds additional switches to the moby/docker command.
@@ -46,6 +181,49 @@ class Manager(managers.ImageManager):
         """
         Builds a specific image.
 
+        With several hosts the build goes to a healthy host with room for
+        it. A build failing because its host went down is retried on
+        another host.
+
+        :param namespace: namespace passed in via cli.
+        :type namespace: argparse.namespace
+        :param tag: The tag to use when building.
+        :type tag: str
+        :raises: subprocess.CalledProcessError
+        """
+        pool = self._host_pool(namespace)
+        if pool is None:
+            return self._build(namespace, tag)
+        while True:
+            with pool.acquire() as host:
+                try:
+                    self._build(self._on_host(namespace, host), tag)
+                except subprocess.CalledProcessError:
+                    if pool.check(host):
+                        raise
+                    logging.warning('Retrying "%s" on another host', tag)
+                    continue
+            with self._lock:
+                self._placement[dockerfile.normalize_reference(tag)] = host
+            return
+
+    def _build(self, namespace, tag):
+        """
+        Builds a specific image on the host of namespace.
+
+        :param namespace: namespace passed in via cli.
+        :type namespace: argparse.namespace
+        :param tag: The tag to use when building.
+        :type tag: str
+        :raises: subprocess.CalledProcessError
+        """
+        runner.wait(self.build_async(namespace, tag))
+
+    async def build_async(self, namespace, tag):
+        """
+        Builds a specific image on the running event loop and the host of
+        namespace.
+
         :param namespace: namespace passed in via cli.
         :type namespace: argparse.namespace
         :param tag: The tag to use when building.
@@ -53,13 +231,22 @@ class Manager(managers.ImageManager):
         :raises: subprocess.CalledProcessError
         """
         logging.debug('moby build will be used')
+        body, context_plan = context.build_context(namespace)
+        # Rendered files only reach the daemon inside a streamed context
+        streamed = context_plan is not None or bool(
+            getattr(namespace, 'rendered_files', None))
         command = self._additional_switches(
             namespace,
-            ['docker', 'build', '-t', tag, '.'])
-
-        with util.pushd(namespace.path):
-            logging.info('Executing "%s"', ' '.join(command))
-            subprocess.check_call(command)
+            ['docker', 'build', '-t', tag, '-' if streamed else '.'])
+        cwd = util._expand_path(namespace.path)
+        if not streamed:
+            await self._run(namespace, command, cwd=cwd)
+            return
+        details = {}
+        if context_plan is not None:
+            details = {'bytes_sent': context_plan.bytes_sent,
+                       'bytes_skipped': context_plan.bytes_skipped}
+        await self._run(namespace, command, cwd=cwd, stdin=body(), **details)
 
     def tar(self, namespace, output):
         """
@@ -69,14 +256,161 @@ class Manager(managers.ImageManager):
         :type namespace: argparse.Namespace
         :param output: The name of the file to output.
         :type output: str
+        :returns: Full path to the tar file
+        :rtype: str
+        :raises: subprocess.CalledProcessError
+        """
+        return runner.wait(self.tar_async(namespace, output))
+
+    async def tar_async(self, namespace, output):
+        """
+        Exports a specific image to a tar file on the running event loop.
+
+        :param namespace: Namespace passed in via CLI.
+        :type namespace: argparse.Namespace
+        :param output: The name of the file to output.
+        :type output: str
+        :returns: Full path to the tar file
+        :rtype: str
         :raises: subprocess.CalledProcessError
         """
         logging.debug('moby tar will be used')
-        tar = '{}.tar'.format(self._normalize_filename(output))
+        tar = util._expand_path(self.tar_path(output))
+        # Looking the image up on the hosts runs commands to completion
+        namespace = await asyncio.get_event_loop().run_in_executor(
+            None, util.bind_working_directory(
+                functools.partial(self._placed, namespace, output)))
 
         command = self._additional_switches(
             namespace,
             ['docker', 'save', '-o', tar, output])
+        await self._run(namespace, command)
+        return tar
+
+    @routed
+    def stream_command(self, namespace, image):
+        """
+        Returns the command that writes an image archive to stdout.
+
+        :param namespace: Namespace passed in via CLI.
+        :type namespace: argparse.Namespace
+        :param image: The image to export.
+        :type image: str
+        :returns: The command to execute
+        :rtype: list
+        """
+        return self._additional_switches(
+            namespace, ['docker', 'save', image])
+
+    @routed
+    def stream_many_command(self, namespace, images):
+        """
+        Returns the command that writes several images to stdout.
+
+        :param namespace: Namespace passed in via CLI.
+        :type namespace: argparse.Namespace
+        :param images: The images to export.
+        :type images: list
+        :returns: The command to execute
+        :rtype: list
+        """
+        return self._additional_switches(
+            namespace, ['docker', 'save'] + list(images))
+
+    @routed
+    def layer_digests(self, namespace, image):
+        """
+        Returns the digests of the uncompressed layers of an image.
+
+        :param namespace: Namespace passed in via CLI.
+        :type namespace: argparse.Namespace
+        :param image: The image to look up.
+        :type image: str
+        :returns: Digests, base layer first
+        :rtype: list
+        :raises: subprocess.CalledProcessError
+        """
+        command = self._additional_switches(
+            namespace, ['docker', 'image', 'inspect', '--format',
+                        '{{json .RootFS.Layers}}', image])
+        output = self._output(namespace, command)
+        return json.loads(output.decode('utf-8')) or []
+
+    def pull(self, namespace, image):
+        """
+        Pulls an image and resolves the digest it was pulled at.
+
+        With several hosts the image is pulled on every healthy host.
 
-        logging.info('Executing "%s"', ' '.join(command))
-        subprocess.check_call(command)
+        :param namespace: Namespace passed in via CLI.
+        :type namespace: argparse.Namespace
+        :param image: The image to pull.
+        :type image: str
+        :returns: The image pinned to its digest, or None without one
+        :rtype: str or None
+        :raises: subprocess.CalledProcessError
+        """
+        pool = self._host_pool(namespace)
+        targets = [namespace]
+        if pool is not None:
+            targets = [self._on_host(namespace, x) for x in pool.healthy()]
+        pinned = None
+        for target in targets:
+            pinned = self._pull(target, image) or pinned
+        return pinned
+
+    def _pull(self, namespace, image):
+        """
+        Pulls an image on the host of namespace.
+
+        :param namespace: Namespace passed in via CLI.
+        :type namespace: argparse.Namespace
+        :param image: The image to pull.
+        :type image: str
+        :returns: The image pinned to its digest, or None without one
+        :rtype: str or None
+        :raises: subprocess.CalledProcessError
+        """
+        self._call(namespace, self._additional_switches(
+            namespace, ['docker', 'pull', image]))
+        command = self._additional_switches(
+            namespace, ['docker', 'image', 'inspect', '--format',
+                        '{{json .RepoDigests}}', image])
+        output = self._output(namespace, command)
+        return self._pinned(image, json.loads(output.decode('utf-8')) or [])
+
+    @routed
+    def image_id(self, namespace, image):
+        """
+        Returns the ID of an image.
+
+        :param namespace: Namespace passed in via CLI.
+        :type namespace: argparse.Namespace
+        :param image: The image to look up.
+        :type image: str
+        :returns: The image ID
+        :rtype: str
+        :raises: subprocess.CalledProcessError
+        """
+        command = self._additional_switches(
+            namespace,
+            ['docker', 'image', 'inspect', '--format', '{{.Id}}', image])
+        output = self._output(namespace, command)
+        return output.decode('utf-8').strip()
+
+    @routed
+    def tag_image(self, namespace, image, tag):
+        """
+        Adds a tag to an existing image.
+
+        :param namespace: Namespace passed in via CLI.
+        :type namespace: argparse.Namespace
+        :param image: The image, or image ID, to tag.
+        :type image: str
+        :param tag: The new tag.
+        :type tag: str
+        :raises: subprocess.CalledProcessError
+        """
+        command = self._additional_switches(
+            namespace, ['docker', 'tag', image, tag])
+        self._call(namespace, command)
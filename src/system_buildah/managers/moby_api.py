@@ -0,0 +1,544 @@
+# Copyright (C) 2017 Red Hat
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Moby/Docker manager talking to the Engine API directly.
+
+Connections are kept alive and pooled per daemon, so a build followed by a
+tar, or every build in a batch, reuses the same connection instead of
+paying for a docker CLI start and a TLS handshake each time.
+"""
+
+import http.client
+import json
+import logging
+import os
+import socket
+import ssl
+import subprocess
+import threading
+
+from contextlib import contextmanager
+from urllib.parse import quote, urlencode, urlparse
+
+from system_buildah import context, dockerfile, managers, trace, util
+from system_buildah.managers import moby
+
+#: The daemon used when no host is given.
+DEFAULT_HOST = 'unix:///var/run/docker.sock'
+
+#: Size of the chunks read from and written to the daemon.
+CHUNK_SIZE = 64 * 1024
+
+#: Errors raised when a pooled connection was closed by the daemon.
+_STALE_ERRORS = (
+    http.client.RemoteDisconnected, http.client.CannotSendRequest,
+    BrokenPipeError, ConnectionResetError)
+
+
+class APIError(subprocess.CalledProcessError):
+    """
+    A request to the Engine API failed.
+
+    Subclasses CalledProcessError so callers handle failures from every
+    manager the same way. returncode holds the HTTP status.
+    """
+
+    def __str__(self):
+        """
+        Returns a readable description of the failure.
+        """
+        return '{} failed with status {}: {}'.format(
+            self.cmd, self.returncode, self.output)
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """
+    HTTP connection over a unix socket.
+    """
+
+    def __init__(self, path, timeout=None):
+        """
+        Initializes the connection.
+
+        :param path: Path to the unix socket.
+        :type path: str
+        :param timeout: Socket timeout in seconds.
+        :type timeout: float or None
+        """
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = path
+
+    def connect(self):
+        """
+        Connects to the unix socket.
+        """
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        self.sock = sock
+
+
+class Client(object):
+    """
+    Minimal Engine API client with a pool of keep-alive connections.
+    """
+
+    def __init__(self, host=None, tlsverify=False, max_idle=8):
+        """
+        Initializes the client.
+
+        :param host: Daemon address such as unix:///path or tcp://host:port.
+        :type host: str or None
+        :param tlsverify: Use TLS and verify the daemon certificate.
+        :type tlsverify: bool
+        :param max_idle: Most idle connections to keep open.
+        :type max_idle: int
+        """
+        self.host = host or os.environ.get('DOCKER_HOST') or DEFAULT_HOST
+        self.tlsverify = tlsverify
+        self.max_idle = max_idle
+        self.connections_made = 0
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _ssl_context(self):
+        """
+        Creates the TLS context using the docker client certificates.
+
+        :returns: A TLS context
+        :rtype: ssl.SSLContext
+        """
+        cert_path = os.path.expanduser(
+            os.environ.get('DOCKER_CERT_PATH') or '~/.docker')
+        context = ssl.create_default_context(
+            cafile=os.path.sep.join([cert_path, 'ca.pem']))
+        context.load_cert_chain(
+            os.path.sep.join([cert_path, 'cert.pem']),
+            os.path.sep.join([cert_path, 'key.pem']))
+        return context
+
+    def _connect(self):
+        """
+        Opens a new connection to the daemon.
+
+        :returns: A new connection
+        :rtype: http.client.HTTPConnection
+        """
+        url = urlparse(self.host if '://' in self.host else
+                       'tcp://{}'.format(self.host))
+        if url.scheme == 'unix':
+            return UnixHTTPConnection(url.path)
+        if self.tlsverify:
+            return http.client.HTTPSConnection(
+                url.hostname, url.port or 2376, context=self._ssl_context())
+        return http.client.HTTPConnection(url.hostname, url.port or 2375)
+
+    def _acquire(self):
+        """
+        Returns an idle connection or a new one.
+
+        :returns: A connection and whether it came from the pool
+        :rtype: tuple(http.client.HTTPConnection, bool)
+        """
+        with self._lock:
+            if self._idle:
+                return self._idle.pop(), True
+            self.connections_made += 1
+        return self._connect(), False
+
+    def _release(self, connection, response):
+        """
+        Returns a connection to the pool if it can be reused.
+
+        :param connection: The connection to release.
+        :type connection: http.client.HTTPConnection
+        :param response: The last response read from the connection.
+        :type response: http.client.HTTPResponse
+        """
+        # Drain what the caller did not read so the next request is clean
+        while not response.isclosed() and response.read(CHUNK_SIZE):
+            pass
+        with self._lock:
+            if not response.will_close and len(self._idle) < self.max_idle:
+                self._idle.append(connection)
+                return
+        connection.close()
+
+    def close(self):
+        """
+        Closes every idle connection.
+        """
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection in idle:
+            connection.close()
+
+    @contextmanager
+    def request(self, method, path, params=None, body=None, headers=None):
+        """
+        Sends a request and yields the response.
+
+        :param method: The HTTP method.
+        :type method: str
+        :param path: The API path.
+        :type path: str
+        :param params: Query parameters.
+        :type params: dict or None
+        :param body: Callable returning the request body in chunks. It may
+                     be called again if a pooled connection turns out to be
+                     closed.
+        :type body: callable or None
+        :param headers: Extra request headers.
+        :type headers: dict or None
+        :returns: The response, streamed.
+        :rtype: http.client.HTTPResponse
+        :raises: APIError
+        """
+        url = path
+        if params:
+            url = '{}?{}'.format(path, urlencode(params, doseq=True))
+        headers = dict(headers or {})
+        if body:
+            # http.client only frames iterables itself from Python 3.6
+            headers['Transfer-Encoding'] = 'chunked'
+        with trace.span('api {} {}'.format(method, path)) as args:
+            while True:
+                connection, reused = self._acquire()
+                try:
+                    connection.request(
+                        method, url, body=_chunked(body()) if body else None,
+                        headers=headers)
+                    response = connection.getresponse()
+                    break
+                except _STALE_ERRORS:
+                    connection.close()
+                    if not reused:
+                        raise
+                    logging.debug(
+                        'Pooled connection was closed. Reconnecting.')
+            args['status'] = response.status
+            try:
+                if response.status >= 400:
+                    raise APIError(
+                        response.status, '{} {}'.format(method, path),
+                        _error_message(response.read()))
+                yield response
+            finally:
+                self._release(connection, response)
+
+    def json(self, method, path, params=None):
+        """
+        Sends a request and decodes the JSON response.
+
+        :param method: The HTTP method.
+        :type method: str
+        :param path: The API path.
+        :type path: str
+        :param params: Query parameters.
+        :type params: dict or None
+        :returns: The decoded response or None for an empty body.
+        :rtype: mixed
+        :raises: APIError
+        """
+        with self.request(method, path, params) as response:
+            data = response.read()
+        return json.loads(data.decode('utf-8')) if data else None
+
+
+def _chunked(chunks):
+    """
+    Frames a body for chunked transfer encoding.
+
+    :param chunks: The body in chunks.
+    :type chunks: iterable of bytes
+    :returns: The framed body
+    :rtype: generator
+    """
+    for chunk in chunks:
+        if chunk:
+            yield '{:x}\r\n'.format(len(chunk)).encode('ascii')
+            yield chunk
+            yield b'\r\n'
+    yield b'0\r\n\r\n'
+
+
+def _error_message(data):
+    """
+    Extracts the message from an error body.
+
+    :param data: The response body.
+    :type data: bytes
+    :returns: The error message
+    :rtype: str
+    """
+    try:
+        return json.loads(data.decode('utf-8'))['message']
+    except (ValueError, KeyError, TypeError):
+        return data.decode('utf-8', 'replace').strip()
+
+
+def tar_context(path, rendered=None):
+    """
+    Yields a tar archive of a directory in chunks without buffering it.
+
+    :param path: The directory to archive.
+    :type path: str
+    :param rendered: Content keyed by file name sent instead of the files
+                     of that name at the top of the directory.
+    :type rendered: dict or None
+    :returns: Chunks of the archive
+    :rtype: generator
+    """
+    return context.tar_stream(path, context.walk(path), rendered)
+
+
+#: Clients shared by every manager in the process, keyed by daemon.
+_CLIENTS = {}
+_CLIENTS_LOCK = threading.Lock()
+
+
+def get_client(host, tlsverify):
+    """
+    Returns the shared client for a daemon.
+
+    :param host: Daemon address or None for the default.
+    :type host: str or None
+    :param tlsverify: Use TLS and verify the daemon certificate.
+    :type tlsverify: bool
+    :returns: The client for the daemon
+    :rtype: Client
+    """
+    key = (host, bool(tlsverify))
+    with _CLIENTS_LOCK:
+        if key not in _CLIENTS:
+            _CLIENTS[key] = Client(host, tlsverify)
+        return _CLIENTS[key]
+
+
+class Manager(moby.Manager):
+    """
+    Works with moby/docker through the Engine API.
+    """
+
+    def _client(self, namespace):
+        """
+        Returns the client for the daemon selected on the command line.
+
+        :param namespace: Namespace passed in via CLI.
+        :type namespace: argparse.Namespace
+        :returns: The client for the daemon
+        :rtype: Client
+        """
+        return get_client(namespace.host, namespace.tlsverify)
+
+    def _healthy(self, namespace):
+        """
+        Checks that the daemon of namespace answers.
+
+        :param namespace: Namespace passed in via CLI.
+        :type namespace: argparse.Namespace
+        :returns: True when the daemon is healthy
+        :rtype: bool
+        :raises: subprocess.CalledProcessError
+        """
+        with self._client(namespace).request('GET', '/_ping') as response:
+            response.read()
+        return True
+
+    def _build(self, namespace, tag):
+        """
+        Builds a specific image on the host of namespace.
+
+        :param namespace: namespace passed in via cli.
+        :type namespace: argparse.namespace
+        :param tag: The tag to use when building.
+        :type tag: str
+        :raises: subprocess.CalledProcessError
+        """
+        logging.debug('moby api build will be used')
+        body, _ = context.build_context(namespace)
+        with self._client(namespace).request(
+                'POST', '/build', {'t': tag, 'rm': 1}, body=body,
+                headers={'Content-Type': 'application/x-tar'}) as response:
+            for line in response:
+                message = json.loads(line.decode('utf-8'))
+                if 'error' in message:
+                    raise APIError(1, 'POST /build', message['error'])
+                if message.get('stream', '').strip():
+                    logging.info(message['stream'].rstrip())
+
+    async def build_async(self, namespace, tag):
+        """
+        Builds a specific image in the default executor of the running
+        event loop.
+
+        :param namespace: namespace passed in via cli.
+        :type namespace: argparse.namespace
+        :param tag: The tag to use when building.
+        :type tag: str
+        :raises: subprocess.CalledProcessError
+        """
+        await managers.ImageManager.build_async(self, namespace, tag)
+
+    async def tar_async(self, namespace, output):
+        """
+        Exports a specific image to a tar file in the default executor of
+        the running event loop.
+
+        :param namespace: Namespace passed in via CLI.
+        :type namespace: argparse.Namespace
+        :param output: The name of the file to output.
+        :type output: str
+        :returns: Full path to the tar file
+        :rtype: str
+        :raises: subprocess.CalledProcessError
+        """
+        return await managers.ImageManager.tar_async(self, namespace, output)
+
+    @moby.routed
+    @contextmanager
+    def stream(self, namespace, image):
+        """
+        Streams an image as a docker-archive tar.
+
+        :param namespace: Namespace passed in via CLI.
+        :type namespace: argparse.Namespace
+        :param image: The image to export.
+        :type image: str
+        :returns: A binary stream of the archive.
+        :rtype: file
+        :raises: subprocess.CalledProcessError
+        """
+        with self._client(namespace).request(
+                'GET', '/images/{}/get'.format(
+                    quote(image, safe='/:@'))) as response:
+            yield response
+
+    @moby.routed
+    @contextmanager
+    def stream_many(self, namespace, images):
+        """
+        Streams several images as one docker-archive tar.
+
+        :param namespace: Namespace passed in via CLI.
+        :type namespace: argparse.Namespace
+        :param images: The images to export.
+        :type images: list
+        :returns: A binary stream of the archive.
+        :rtype: file
+        :raises: subprocess.CalledProcessError
+        """
+        with self._client(namespace).request(
+                'GET', '/images/get', {'names': list(images)}) as response:
+            yield response
+
+    @moby.routed
+    def layer_digests(self, namespace, image):
+        """
+        Returns the digests of the uncompressed layers of an image.
+
+        :param namespace: Namespace passed in via CLI.
+        :type namespace: argparse.Namespace
+        :param image: The image to look up.
+        :type image: str
+        :returns: Digests, base layer first
+        :rtype: list
+        :raises: subprocess.CalledProcessError
+        """
+        info = self._client(namespace).json('GET', '/images/{}/json'.format(
+            quote(image, safe='/:@')))
+        return info.get('RootFS', {}).get('Layers') or []
+
+    def tar(self, namespace, output):
+        """
+        Exports a specific image to a tar file.
+
+        :param namespace: Namespace passed in via CLI.
+        :type namespace: argparse.Namespace
+        :param output: The name of the file to output.
+        :type output: str
+        :returns: Full path to the tar file
+        :rtype: str
+        :raises: subprocess.CalledProcessError
+        """
+        logging.debug('moby api tar will be used')
+        tar = util._expand_path(self.tar_path(output))
+        with self.stream(namespace, output) as source, open(
+                tar, 'wb') as destination:
+            for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+                destination.write(chunk)
+        return tar
+
+    def _pull(self, namespace, image):
+        """
+        Pulls an image on the host of namespace.
+
+        :param namespace: Namespace passed in via CLI.
+        :type namespace: argparse.Namespace
+        :param image: The image to pull.
+        :type image: str
+        :returns: The image pinned to its digest, or None without one
+        :rtype: str or None
+        :raises: subprocess.CalledProcessError
+        """
+        image = dockerfile.normalize_reference(image)
+        name = dockerfile.repository(image)
+        client = self._client(namespace)
+        with client.request('POST', '/images/create', {
+                'fromImage': name, 'tag': image[len(name) + 1:]}) as response:
+            for line in response:
+                message = json.loads(line.decode('utf-8'))
+                if 'error' in message:
+                    raise APIError(1, 'POST /images/create', message['error'])
+        info = client.json('GET', '/images/{}/json'.format(
+            quote(image, safe='/:@')))
+        return self._pinned(image, info.get('RepoDigests') or [])
+
+    @moby.routed
+    def image_id(self, namespace, image):
+        """
+        Returns the ID of an image.
+
+        :param namespace: Namespace passed in via CLI.
+        :type namespace: argparse.Namespace
+        :param image: The image to look up.
+        :type image: str
+        :returns: The image ID
+        :rtype: str
+        :raises: subprocess.CalledProcessError
+        """
+        return self._client(namespace).json('GET', '/images/{}/json'.format(
+            quote(image, safe='/:@')))['Id']
+
+    @moby.routed
+    def tag_image(self, namespace, image, tag):
+        """
+        Adds a tag to an existing image.
+
+        :param namespace: Namespace passed in via CLI.
+        :type namespace: argparse.Namespace
+        :param image: The image, or image ID, to tag.
+        :type image: str
+        :param tag: The new tag.
+        :type tag: str
+        :raises: subprocess.CalledProcessError
+        """
+        repo, _, version = tag.rpartition(':')
+        if not repo or '/' in version:
+            repo, version = tag, 'latest'
+        self._client(namespace).json(
+            'POST', '/images/{}/tag'.format(quote(image, safe='/:@')),
+            {'repo': repo, 'tag': version})
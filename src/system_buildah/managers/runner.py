@@ -0,0 +1,300 @@
+# Copyright (C) 2017 Red Hat
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Runs the commands of the managers on an event loop.
+
+run() is a coroutine, so many builds and exports can be awaited on one
+loop. Output is logged line by line as it arrives, a command running
+longer than its timeout is killed and raises CommandTimeout, and a
+cancelled run kills its command. check_call(), check_output() and wait()
+run commands from synchronous code on a loop of their own, and stream()
+hands the output of a command to synchronous code as it is written.
+
+Processes are waited for in the default executor of the loop instead of
+through a child watcher, so loops may run in any thread.
+"""
+
+import asyncio
+import collections
+import logging
+import signal
+import subprocess
+import threading
+
+from contextlib import contextmanager
+
+#: Lines of stderr kept for the exception of a failed command.
+STDERR_LINES = 20
+
+
+class CommandTimeout(subprocess.CalledProcessError):
+    """
+    A command ran longer than its timeout and was killed.
+    """
+
+    def __init__(self, cmd, timeout, output=None, stderr=None):
+        """
+        Initializes a new CommandTimeout.
+
+        :param cmd: The command that was killed.
+        :type cmd: list
+        :param timeout: Seconds the command was allowed to run.
+        :type timeout: float
+        """
+        super().__init__(-signal.SIGKILL, cmd, output, stderr)
+        self.timeout = timeout
+
+    def __str__(self):
+        return 'Command "{}" timed out after {} seconds'.format(
+            ' '.join(self.cmd), self.timeout)
+
+
+async def _pipe_reader(pipe, transports):
+    """
+    Returns a stream reading a pipe without blocking the loop.
+
+    :param pipe: A pipe of a process.
+    :type pipe: file
+    :param transports: List the transport of the pipe is added to.
+    :type transports: list
+    :returns: The reader
+    :rtype: asyncio.StreamReader
+    """
+    reader = asyncio.StreamReader()
+    transport, _ = await asyncio.get_event_loop().connect_read_pipe(
+        lambda: asyncio.StreamReaderProtocol(reader), pipe)
+    transports.append(transport)
+    return reader
+
+
+async def _log_lines(reader, name, kept=None):
+    """
+    Logs each line of a stream as it arrives.
+
+    :param reader: The stream to read.
+    :type reader: asyncio.StreamReader
+    :param name: Name to prefix each line with.
+    :type name: str
+    :param kept: Queue the last lines are kept in.
+    :type kept: collections.deque or None
+    """
+    while True:
+        try:
+            line = await reader.readline()
+        except ValueError:
+            logging.debug('%s: dropped a line too long to log', name)
+            continue
+        if not line:
+            return
+        line = line.decode('utf-8', 'replace').rstrip()
+        logging.info('%s: %s', name, line)
+        if kept is not None:
+            kept.append(line)
+
+
+def _write(pipe, chunks):
+    """
+    Writes chunks to the stdin of a process and closes it.
+
+    :param pipe: The stdin of the process.
+    :type pipe: file
+    :param chunks: Data to write.
+    :type chunks: iterable
+    """
+    try:
+        for chunk in chunks:
+            pipe.write(chunk)
+    except BrokenPipeError:
+        logging.debug('The command stopped reading its input')
+    finally:
+        try:
+            pipe.close()
+        except BrokenPipeError:
+            pass
+
+
+def _kill(process):
+    """
+    Kills a process that may already have exited.
+    """
+    try:
+        process.kill()
+    except ProcessLookupError:
+        pass
+
+
+async def run(command, cwd=None, timeout=None, capture=False, stdin=None):
+    """
+    Runs a command.
+
+    :param command: The command to execute.
+    :type command: list
+    :param cwd: Directory to run in.
+    :type cwd: str or None
+    :param timeout: Seconds after which the command is killed.
+    :type timeout: float or None
+    :param capture: Return stdout instead of logging it.
+    :type capture: bool
+    :param stdin: Chunks of bytes written to the stdin of the command.
+    :type stdin: iterable or None
+    :returns: stdout when capture is set, else None
+    :rtype: bytes or None
+    :raises: CommandTimeout
+    :raises: subprocess.CalledProcessError
+    :raises: OSError
+    """
+    logging.info('Executing "%s"', ' '.join(command))
+    loop = asyncio.get_event_loop()
+    process = subprocess.Popen(
+        command, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        stdin=subprocess.PIPE if stdin is not None else None)
+    name = command[0]
+    stderr = collections.deque(maxlen=STDERR_LINES)
+    transports = []
+    try:
+        out_reader = await _pipe_reader(process.stdout, transports)
+        err_reader = await _pipe_reader(process.stderr, transports)
+        steps = [
+            out_reader.read() if capture else _log_lines(out_reader, name),
+            _log_lines(err_reader, name, stderr),
+            loop.run_in_executor(None, process.wait),
+        ]
+        if stdin is not None:
+            steps.append(loop.run_in_executor(
+                None, _write, process.stdin, stdin))
+        output = (await asyncio.wait_for(
+            asyncio.gather(*steps), timeout))[0]
+    except asyncio.TimeoutError:
+        _kill(process)
+        await loop.run_in_executor(None, process.wait)
+        raise CommandTimeout(command, timeout, stderr='\n'.join(stderr))
+    except BaseException:
+        # Cancelled, or reading failed
+        _kill(process)
+        await asyncio.shield(loop.run_in_executor(None, process.wait))
+        raise
+    finally:
+        for transport in transports:
+            transport.close()
+    if process.returncode:
+        raise subprocess.CalledProcessError(
+            process.returncode, command, output, '\n'.join(stderr))
+    return output
+
+
+def wait(coroutine):
+    """
+    Runs a coroutine to completion on a new event loop.
+
+    :param coroutine: The coroutine to run, such as run().
+    :type coroutine: coroutine
+    :returns: What the coroutine returns
+    :rtype: mixed
+    """
+    try:
+        previous = asyncio.get_event_loop_policy().get_event_loop()
+    except RuntimeError:
+        # Threads other than the main one start without a loop
+        previous = None
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        asyncio.set_event_loop(previous)
+        loop.close()
+
+
+@contextmanager
+def stream(command, timeout=None):
+    """
+    Runs a command and yields its stdout to be read by the caller.
+
+    A command running longer than timeout is killed, which ends the
+    stream, and raises CommandTimeout once the context ends.
+
+    :param command: The command to execute.
+    :type command: list
+    :param timeout: Seconds after which the command is killed.
+    :type timeout: float or None
+    :returns: A binary stream of the output
+    :rtype: file
+    :raises: CommandTimeout
+    :raises: subprocess.CalledProcessError
+    :raises: OSError
+    """
+    logging.info('Executing "%s"', ' '.join(command))
+    process = subprocess.Popen(command, stdout=subprocess.PIPE)
+    expired = threading.Event()
+
+    def expire():
+        expired.set()
+        _kill(process)
+
+    timer = threading.Timer(timeout, expire) if timeout else None
+    if timer is not None:
+        timer.daemon = True
+        timer.start()
+    try:
+        yield process.stdout
+    except Exception:
+        # Reading a stream cut short fails in the caller
+        if not expired.is_set():
+            raise
+    finally:
+        if timer is not None:
+            timer.cancel()
+        process.stdout.close()
+        process.wait()
+    if expired.is_set():
+        raise CommandTimeout(command, timeout)
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, command)
+
+
+def check_call(command, cwd=None, timeout=None, stdin=None):
+    """
+    Runs a command, logging its output.
+
+    :param command: The command to execute.
+    :type command: list
+    :param cwd: Directory to run in.
+    :type cwd: str or None
+    :param timeout: Seconds after which the command is killed.
+    :type timeout: float or None
+    :param stdin: Chunks of bytes written to the stdin of the command.
+    :type stdin: iterable or None
+    :raises: CommandTimeout
+    :raises: subprocess.CalledProcessError
+    """
+    wait(run(command, cwd=cwd, timeout=timeout, stdin=stdin))
+
+
+def check_output(command, cwd=None, timeout=None):
+    """
+    Runs a command and returns its output.
+
+    :param command: The command to execute.
+    :type command: list
+    :param cwd: Directory to run in.
+    :type cwd: str or None
+    :param timeout: Seconds after which the command is killed.
+    :type timeout: float or None
+    :returns: stdout of the command
+    :rtype: bytes
+    :raises: CommandTimeout
+    :raises: subprocess.CalledProcessError
+    """
+    return wait(run(command, cwd=cwd, timeout=timeout, capture=True))
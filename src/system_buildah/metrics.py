@@ -0,0 +1,288 @@
+# Copyright (C) 2017 Red Hat
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Prometheus metrics written to a textfile for node_exporter.
+
+Metrics are taken from the trace spans that end while recording. Every
+metric is a counter or a histogram, so each run adds its samples to those
+already in the file and the file grows the way a long running exporter
+would. Runs sharing a file take turns through a lock next to it and the
+file is replaced atomically, so the collector never reads half of it.
+"""
+
+import fcntl
+import logging
+import os
+import re
+import threading
+
+from contextlib import contextmanager
+
+from system_buildah import trace
+
+#: Upper bounds in seconds of the buckets of duration histograms.
+BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1200, 1800, 3600)
+
+#: Histograms of durations and the spans they are taken from.
+HISTOGRAMS = {
+    'system_buildah_build_duration_seconds': (
+        'Seconds taken by image builds', ('build',)),
+    'system_buildah_export_duration_seconds': (
+        'Seconds taken by image exports',
+        ('tar', 'compress', 'delta', 'export-layout')),
+    'system_buildah_generate_duration_seconds': (
+        'Seconds taken to generate files and Dockerfiles',
+        ('GenerateFilesAction', 'GenerateDockerfileAction',
+         'pipeline generate')),
+}
+
+#: Help of the counters.
+COUNTERS = {
+    'system_buildah_export_bytes_total': 'Bytes written by image exports',
+    'system_buildah_subprocess_failures_total': (
+        'Commands that failed or timed out'),
+    'system_buildah_cache_lookups_total': (
+        'Builds and exports looked up in the cache'),
+}
+
+#: Kind of cache lookup per span.
+CACHE_KINDS = {'build': 'build', 'tar': 'export'}
+
+_SAMPLE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{(.*)\})?\s+(\S+)$')
+_LABEL = re.compile(r'([a-zA-Z_][a-zA-Z0-9_]*)="((?:[^"\\]|\\.)*)"')
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace(
+        '\n', '\\n')
+
+
+def _unescape(value):
+    return re.sub(r'\\(.)', lambda x: '\n' if x.group(1) == 'n' else (
+        x.group(1)), value)
+
+
+def _family(name):
+    """
+    Returns the metric a sample belongs to.
+    """
+    for suffix in ('_bucket', '_sum', '_count'):
+        if name.endswith(suffix) and name[:-len(suffix)] in HISTOGRAMS:
+            return name[:-len(suffix)]
+    return name
+
+
+def _order(key):
+    """
+    Sorts samples by metric and labels with buckets in numeric order.
+    """
+    name, labels = key
+    le = dict(labels).get('le')
+    return (_family(name), [x for x in labels if x[0] != 'le'],
+            name, float(le) if le else 0.0)
+
+
+def parse(text):
+    """
+    Reads the samples of a textfile.
+
+    :param text: Content in the Prometheus text format.
+    :type text: str
+    :returns: Values keyed by (name, sorted label pairs)
+    :rtype: dict
+    """
+    samples = {}
+    for line in text.splitlines():
+        match = _SAMPLE.match(line.strip())
+        if line.startswith('#') or not match:
+            continue
+        name, labels, value = match.groups()
+        labels = tuple(sorted(
+            (x, _unescape(y)) for x, y in _LABEL.findall(labels or '')))
+        try:
+            samples[(name, labels)] = float(value)
+        except ValueError:
+            logging.warning('Ignoring the metric sample "%s"', line)
+    return samples
+
+
+def format_samples(samples):
+    """
+    Writes samples in the Prometheus text format.
+
+    :param samples: Values keyed by (name, sorted label pairs).
+    :type samples: dict
+    :returns: The content of a textfile
+    :rtype: str
+    """
+    lines = []
+    family = None
+    for key in sorted(samples, key=_order):
+        name, labels = key
+        if _family(name) != family:
+            family = _family(name)
+            if family in HISTOGRAMS:
+                lines.append('# HELP {} {}'.format(
+                    family, HISTOGRAMS[family][0]))
+                lines.append('# TYPE {} histogram'.format(family))
+            elif family in COUNTERS:
+                lines.append('# HELP {} {}'.format(family, COUNTERS[family]))
+                lines.append('# TYPE {} counter'.format(family))
+        value = samples[key]
+        label_text = ','.join(
+            '{}="{}"'.format(x, _escape(y)) for x, y in labels)
+        lines.append('{}{} {}'.format(
+            name, '{' + label_text + '}' if labels else '',
+            int(value) if value.is_integer() else repr(value)))
+    return '\n'.join(lines) + '\n'
+
+
+def merge(path, samples):
+    """
+    Adds samples to those of a textfile, replacing it atomically.
+
+    :param path: The textfile.
+    :type path: str
+    :param samples: Values keyed by (name, sorted label pairs).
+    :type samples: dict
+    :raises: OSError
+    """
+    with open(path + '.lock', 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            with open(path) as textfile:
+                totals = parse(textfile.read())
+        except FileNotFoundError:
+            totals = {}
+        for key, value in samples.items():
+            totals[key] = totals.get(key, 0.0) + value
+        with open(path + '.part', 'w') as part:
+            part.write(format_samples(totals))
+        os.rename(path + '.part', path)
+
+
+class Recorder(object):
+    """
+    Turns the spans of a run into samples for a textfile.
+    """
+
+    def __init__(self, path):
+        """
+        Initializes a new Recorder.
+
+        :param path: The textfile to add samples to.
+        :type path: str
+        """
+        self.path = path
+        self.samples = {}
+        self._lock = threading.Lock()
+
+    def _add(self, name, value, **labels):
+        key = (name, tuple(sorted((x, str(y)) for x, y in labels.items())))
+        with self._lock:
+            self.samples[key] = self.samples.get(key, 0.0) + value
+
+    def _observe(self, name, value, **labels):
+        """
+        Adds an observation to a histogram.
+        """
+        for bound in BUCKETS:
+            if value <= bound:
+                self._add(name + '_bucket', 1, le=bound, **labels)
+        self._add(name + '_bucket', 1, le='+Inf', **labels)
+        self._add(name + '_sum', value, **labels)
+        self._add(name + '_count', 1, **labels)
+
+    def observe(self, name, duration, args):
+        """
+        Records the samples of a span that ended.
+
+        :param name: Name of the span.
+        :type name: str
+        :param duration: Seconds the span took.
+        :type duration: float
+        :param args: Arguments of the span.
+        :type args: dict
+        """
+        manager = args.get('manager') or 'unknown'
+        for metric, (_, spans) in HISTOGRAMS.items():
+            if name in spans:
+                self._observe(metric, duration, manager=manager)
+        if name in HISTOGRAMS[
+                'system_buildah_export_duration_seconds'][1] and args.get(
+                    'bytes_written'):
+            self._add('system_buildah_export_bytes_total',
+                      args['bytes_written'], manager=manager)
+        if name.startswith('exec ') and (
+                args.get('exit_code') or 'error' in args):
+            self._add('system_buildah_subprocess_failures_total', 1,
+                      command=name[len('exec '):])
+        if name in CACHE_KINDS and args.get('cache'):
+            self._add('system_buildah_cache_lookups_total', 1,
+                      kind=CACHE_KINDS[name], result=args['cache'])
+
+    __call__ = observe
+
+    def flush(self):
+        """
+        Adds the samples recorded so far to the textfile.
+
+        Samples that can not be written are kept for the next flush.
+        """
+        with self._lock:
+            samples, self.samples = self.samples, {}
+        if not samples:
+            return
+        try:
+            merge(self.path, samples)
+        except OSError as error:
+            logging.warning('Unable to write metrics to "%s": %s',
+                            self.path, error)
+            for key, value in samples.items():
+                self._add(key[0], value, **dict(key[1]))
+
+
+@contextmanager
+def recording(path):
+    """
+    Records metrics of the body of the context into path.
+
+    The samples are added to the textfile when the context ends. Only the
+    spans of the calling thread, and of the threads it hands work to
+    through util.bind_working_directory, are recorded, so jobs running at
+    the same time each write to their own textfile. Without a path, such
+    as for the commands of a batch or a server, the metrics go to the
+    enclosing textfile, which is still updated as each context ends.
+
+    :param path: The textfile to add samples to.
+    :type path: str or None
+    :returns: The active Recorder or None
+    :rtype: Recorder or None
+    """
+    current = trace.observer()
+    if not isinstance(current, Recorder):
+        current = None
+    recorder = Recorder(path) if path else current
+    if recorder is None:
+        yield None
+        return
+    try:
+        if recorder is current:
+            yield recorder
+        else:
+            with trace.observing(recorder):
+                yield recorder
+    finally:
+        recorder.flush()
@@ -0,0 +1,248 @@
+# Copyright (C) 2017 Red Hat
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+In process OCI runtime spec generation.
+
+Produces the same default spec as ``ocitools generate`` and applies the
+common ``--key=value`` options to it without spawning a process.
+"""
+
+import functools
+import json
+
+#: Capabilities granted by default.
+DEFAULT_CAPABILITIES = [
+    'CAP_CHOWN', 'CAP_DAC_OVERRIDE', 'CAP_FSETID', 'CAP_FOWNER',
+    'CAP_MKNOD', 'CAP_NET_RAW', 'CAP_SETGID', 'CAP_SETUID', 'CAP_SETFCAP',
+    'CAP_SETPCAP', 'CAP_NET_BIND_SERVICE', 'CAP_SYS_CHROOT', 'CAP_KILL',
+    'CAP_AUDIT_WRITE']
+
+#: Capability sets updated by --cap-add and --cap-drop.
+CAPABILITY_SETS = ('bounding', 'effective', 'inheritable', 'permitted')
+
+
+class UnsupportedOption(Exception):
+    """
+    The option can only be handled by ocitools.
+    """
+    pass
+
+
+@functools.lru_cache(maxsize=None)
+def _base_spec():
+    """
+    Returns the default spec serialized, built once per process.
+
+    :returns: The default spec as JSON
+    :rtype: str
+    """
+    capabilities = {x: list(DEFAULT_CAPABILITIES) for x in CAPABILITY_SETS}
+    return json.dumps({
+        'ociVersion': '1.0.0',
+        'process': {
+            'terminal': True,
+            'user': {'uid': 0, 'gid': 0},
+            'args': ['sh'],
+            'env': [
+                'PATH=/usr/local/sbin:/usr/local/bin:/usr/sbin:'
+                '/usr/bin:/sbin:/bin',
+                'TERM=xterm'],
+            'cwd': '/',
+            'capabilities': capabilities,
+            'rlimits': [
+                {'type': 'RLIMIT_NOFILE', 'hard': 1024, 'soft': 1024}],
+            'noNewPrivileges': True,
+        },
+        'root': {'path': 'rootfs', 'readonly': False},
+        'hostname': 'mrsdalloway',
+        'mounts': [
+            {'destination': '/proc', 'type': 'proc', 'source': 'proc'},
+            {'destination': '/dev', 'type': 'tmpfs', 'source': 'tmpfs',
+             'options': ['nosuid', 'strictatime', 'mode=755', 'size=65536k']},
+            {'destination': '/dev/pts', 'type': 'devpts',
+             'source': 'devpts',
+             'options': ['nosuid', 'noexec', 'newinstance', 'ptmxmode=0666',
+                         'mode=0620', 'gid=5']},
+            {'destination': '/dev/shm', 'type': 'tmpfs', 'source': 'shm',
+             'options': ['nosuid', 'noexec', 'nodev', 'mode=1777',
+                         'size=65536k']},
+            {'destination': '/dev/mqueue', 'type': 'mqueue',
+             'source': 'mqueue', 'options': ['nosuid', 'noexec', 'nodev']},
+            {'destination': '/sys', 'type': 'sysfs', 'source': 'sysfs',
+             'options': ['nosuid', 'noexec', 'nodev', 'ro']},
+        ],
+        'linux': {
+            'resources': {'devices': [{'allow': False, 'access': 'rwm'}]},
+            'namespaces': [
+                {'type': 'pid'}, {'type': 'network'}, {'type': 'ipc'},
+                {'type': 'uts'}, {'type': 'mount'}],
+            'maskedPaths': [
+                '/proc/kcore', '/proc/latency_stats', '/proc/timer_list',
+                '/proc/timer_stats', '/proc/sched_debug',
+                '/sys/firmware'],
+            'readonlyPaths': [
+                '/proc/asound', '/proc/bus', '/proc/fs', '/proc/irq',
+                '/proc/sys', '/proc/sysrq-trigger'],
+        },
+    }, sort_keys=True)
+
+
+def _bool(value):
+    """
+    Parses a command line boolean.
+
+    :param value: The value given on the command line.
+    :type value: str
+    :returns: The boolean value
+    :rtype: bool
+    :raises: UnsupportedOption
+    """
+    if value.lower() in ('true', '1'):
+        return True
+    if value.lower() in ('false', '0'):
+        return False
+    raise UnsupportedOption('"{}" is not a boolean'.format(value))
+
+
+def _int(value):
+    """
+    Parses a command line integer.
+
+    :param value: The value given on the command line.
+    :type value: str
+    :returns: The integer value
+    :rtype: int
+    :raises: UnsupportedOption
+    """
+    try:
+        return int(value)
+    except ValueError:
+        raise UnsupportedOption('"{}" is not an integer'.format(value))
+
+
+def _set_env(spec, value):
+    """
+    Adds or replaces an environment variable.
+
+    :param spec: The spec to update.
+    :type spec: dict
+    :param value: Variable in the form of NAME=value.
+    :type value: str
+    """
+    name = value.split('=', 1)[0]
+    env = [x for x in spec['process']['env']
+           if x.split('=', 1)[0] != name]
+    spec['process']['env'] = env + [value]
+
+
+def _add_capability(spec, value):
+    """
+    Adds a capability to every capability set.
+
+    :param spec: The spec to update.
+    :type spec: dict
+    :param value: The capability to add.
+    :type value: str
+    """
+    value = value.upper()
+    if not value.startswith('CAP_'):
+        value = 'CAP_' + value
+    for capabilities in spec['process']['capabilities'].values():
+        if value not in capabilities:
+            capabilities.append(value)
+
+
+def _drop_capability(spec, value):
+    """
+    Removes a capability from every capability set.
+
+    :param spec: The spec to update.
+    :type spec: dict
+    :param value: The capability to remove.
+    :type value: str
+    """
+    value = value.upper()
+    if not value.startswith('CAP_'):
+        value = 'CAP_' + value
+    for capabilities in spec['process']['capabilities'].values():
+        if value in capabilities:
+            capabilities.remove(value)
+
+
+def _set(*keys, convert=str):
+    """
+    Returns a patch setting a nested key.
+
+    :param keys: Path to the key to set.
+    :type keys: tuple
+    :param convert: Conversion applied to the value.
+    :type convert: callable
+    :returns: The patch function
+    :rtype: callable
+    """
+    def patch(spec, value):
+        target = spec
+        for key in keys[:-1]:
+            target = target.setdefault(key, {})
+        target[keys[-1]] = convert(value)
+    return patch
+
+
+#: Patches applied for each supported option.
+PATCHES = {
+    '--hostname': _set('hostname'),
+    '--cwd': _set('process', 'cwd'),
+    '--uid': _set('process', 'user', 'uid', convert=_int),
+    '--gid': _set('process', 'user', 'gid', convert=_int),
+    '--tty': _set('process', 'terminal', convert=_bool),
+    '--no-new-privileges': _set(
+        'process', 'noNewPrivileges', convert=_bool),
+    '--apparmor': _set('process', 'apparmorProfile'),
+    '--selinux-label': _set('process', 'selinuxLabel'),
+    '--mount-label': _set('linux', 'mountLabel'),
+    '--rootfs-path': _set('root', 'path'),
+    '--read-only': _set('root', 'readonly', convert=_bool),
+    '--env': _set_env,
+    '--cap-add': _add_capability,
+    '--cap-drop': _drop_capability,
+}
+
+
+def generate(options, read_only=False):
+    """
+    Generates a runtime spec.
+
+    :param options: (option, value) pairs such as ('--cwd', '/tmp').
+    :type options: list
+    :param read_only: Make the root filesystem read only.
+    :type read_only: bool
+    :returns: The runtime spec
+    :rtype: dict
+    :raises: UnsupportedOption
+    """
+    for option, _ in options:
+        if option not in PATCHES and option != '--args':
+            raise UnsupportedOption('{} is not supported'.format(option))
+    spec = json.loads(_base_spec())
+    spec['root']['readonly'] = read_only
+    args = []
+    for option, value in options:
+        if option == '--args':
+            args.append(value)
+        else:
+            PATCHES[option](spec, value)
+    if args:
+        spec['process']['args'] = args
+    return spec
@@ -0,0 +1,393 @@
+# Copyright (C) 2017 Red Hat
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Generate, build and export many images as one staged pipeline.
+
+Each stage has its own pool of threads, so the files of the next image are
+rendered and the previous image is exported while an image builds. The
+rendered files are handed to the build stage in memory.
+
+A spec is a JSON file such as::
+
+    {
+        "defaults": {"from_base": "centos:7", "maintainer": "me"},
+        "images": [
+            {"tag": "base:1", "path": "base"},
+            {"tag": "app:1", "path": "app", "from_base": "base:1",
+             "default": {"a": "b"}, "compress": "gzip"}
+        ]
+    }
+
+Keys are the long options of generate-files, generate-dockerfile and tar
+with dashes or underscores. Paths are relative to the spec.
+"""
+
+import copy
+import json
+import logging
+import os
+import subprocess
+import time
+
+from collections import namedtuple
+from concurrent import futures
+
+from system_buildah import cache, cli, dockerfile, prefetch, trace, util
+
+#: Stages in the order an image passes them.
+STAGES = ('generate', 'build', 'export')
+
+#: Commands whose options a spec may set.
+COMMANDS = ('generate-files', 'generate-dockerfile', 'tar')
+
+#: Spec keys holding key=value items that may also be given as an object.
+MAPPINGS = ('default', 'add_file')
+
+#: The outcome of one image in a pipeline.
+PipelineResult = namedtuple(
+    'PipelineResult', ['tag', 'status', 'stage', 'durations', 'error'])
+
+
+def command_defaults():
+    """
+    Returns the options of the commands a spec may set and their defaults.
+
+    :returns: Default per option dest
+    :rtype: dict
+    """
+    subparsers = cli.build_parser()._subparsers._group_actions[0]
+    defaults = {}
+    for command in COMMANDS:
+        for action in subparsers.choices[command]._actions:
+            if action.option_strings and action.dest != 'help':
+                defaults.setdefault(action.dest, action.default)
+    return defaults
+
+
+def _items(value):
+    """
+    Returns key=value items given as a list or an object.
+
+    :param value: The spec value.
+    :type value: list or dict
+    :returns: key=value items
+    :rtype: list
+    """
+    if isinstance(value, dict):
+        return ['{}={}'.format(k, v) for k, v in sorted(value.items())]
+    return list(value)
+
+
+def load_spec(path):
+    """
+    Reads a pipeline spec.
+
+    :param path: Path to the spec.
+    :type path: str
+    :returns: One dict of options per image
+    :rtype: list
+    :raises: ValueError on a malformed spec
+    :raises: IOError
+    """
+    path = util._expand_path(path)
+    with open(path) as spec_file:
+        spec = json.load(spec_file)
+    base_dir = os.path.dirname(path)
+    known = command_defaults()
+    images = []
+    for entry in spec.get('images', []):
+        image = {}
+        for key, value in dict(spec.get('defaults', {}), **entry).items():
+            key = key.replace('-', '_')
+            if key not in known and key not in ('tag', 'path', 'name'):
+                raise ValueError('Unknown option "{}" in {}'.format(key, path))
+            image[key] = _items(value) if key in MAPPINGS else value
+        if not image.get('tag') or not image.get('path'):
+            raise ValueError('Every image needs a tag and a path')
+        image['path'] = os.path.join(base_dir, image['path'])
+        if image.get('output') not in (None, '-'):
+            image['output'] = os.path.join(base_dir, image['output'])
+        images.append(image)
+    duplicates = dockerfile.duplicate_references([x['tag'] for x in images])
+    if duplicates:
+        raise ValueError('Tags given more than once in {}: {}'.format(
+            path, ', '.join(duplicates)))
+    return images
+
+
+class Pipeline(object):
+    """
+    Runs images through the generate, build and export stages.
+    """
+
+    def __init__(self, parser, namespace, builder, jobs, build_cache=None):
+        """
+        Initializes a new Pipeline.
+
+        :param parser: The argument parser in use.
+        :type parser: argparse.ArgumentParser
+        :param namespace: Namespace passed in via CLI.
+        :type namespace: argparse.Namespace
+        :param builder: The image manager to build and export with.
+        :type builder: system_buildah.managers.ImageManager
+        :param jobs: Number of images each stage works on at once.
+        :type jobs: dict
+        :param build_cache: The cache to use, if any.
+        :type build_cache: system_buildah.cache.BuildCache or None
+        """
+        self.parser = parser
+        self.namespace = namespace
+        self.builder = builder
+        self.jobs = jobs
+        self.build_cache = build_cache
+        self._defaults = command_defaults()
+
+    def image_namespace(self, image):
+        """
+        Returns the namespace the stages of an image run with.
+
+        :param image: Options of the image from the spec.
+        :type image: dict
+        :returns: The namespace
+        :rtype: argparse.Namespace
+        """
+        namespace = copy.copy(self.namespace)
+        for key, value in self._defaults.items():
+            if not hasattr(namespace, key):
+                setattr(namespace, key, copy.copy(value))
+        for key, value in image.items():
+            setattr(namespace, key, value)
+        # output is only meaningful to tar in a spec
+        namespace.output = image.get('output')
+        return namespace
+
+    def generate(self, namespace):
+        """
+        Renders and writes the files and Dockerfile of an image.
+
+        :param namespace: Namespace of the image.
+        :type namespace: argparse.Namespace
+        :returns: Content keyed by file name
+        :rtype: dict
+        :raises: subprocess.CalledProcessError
+        """
+        from system_buildah.actions.generate_dockerfile_action import (
+            GenerateDockerfileAction)
+        from system_buildah.actions.generate_files_action import (
+            GenerateFilesAction)
+
+        rendered = GenerateFilesAction('', '').render_files(
+            namespace, self.parser)
+        rendered['Dockerfile'] = GenerateDockerfileAction(
+            '', '').render_dockerfile(
+                namespace, getattr(namespace, 'name', None) or namespace.tag,
+                namespace.path)
+        util.write_files(util.mkdir(namespace.path), rendered)
+        return rendered
+
+    def build(self, namespace, rendered):
+        """
+        Builds an image from the files generate returned.
+
+        :param namespace: Namespace of the image.
+        :type namespace: argparse.Namespace
+        :param rendered: Content keyed by file name.
+        :type rendered: dict
+        :raises: subprocess.CalledProcessError
+        """
+        namespace.rendered_files = rendered
+        cache.build(self.builder, namespace, namespace.tag, self.build_cache)
+
+    def export(self, namespace, rendered):
+        """
+        Exports a built image the way the tar command does.
+
+        :param namespace: Namespace of the image.
+        :type namespace: argparse.Namespace
+        :param rendered: Unused. Present so every stage takes the same input.
+        :type rendered: dict
+        :raises: subprocess.CalledProcessError
+        :raises: ValueError on export options that can not be used
+        """
+        from system_buildah.actions.tar_action import TarAction
+
+        TarAction('', '').export_image(
+            self.builder, namespace, namespace.tag, self.build_cache)
+
+    def _run_stage(self, stage, namespace, rendered):
+        """
+        Runs one stage of an image and times it.
+
+        :param stage: Name of the stage.
+        :type stage: str
+        :param namespace: Namespace of the image.
+        :type namespace: argparse.Namespace
+        :param rendered: Output of the generate stage.
+        :type rendered: dict or None
+        :returns: (seconds, output, error message or None)
+        :rtype: tuple
+        """
+        start = time.monotonic()
+        with trace.span('pipeline ' + stage, tag=namespace.tag,
+                        manager=namespace.manager):
+            try:
+                if stage == 'generate':
+                    output = self.generate(namespace)
+                else:
+                    output = getattr(self, stage)(namespace, rendered)
+            except (subprocess.CalledProcessError, OSError,
+                    ValueError) as error:
+                return time.monotonic() - start, None, str(error)
+        return time.monotonic() - start, output, None
+
+    def _dependencies(self, namespaces):
+        """
+        Finds which images are based on other images of the pipeline.
+
+        :param namespaces: Namespace per tag.
+        :type namespaces: dict
+        :returns: The tag each tag must wait for, if any
+        :rtype: dict
+        """
+        tags = {dockerfile.normalize_reference(x): x for x in namespaces}
+        deps = {}
+        for tag, namespace in namespaces.items():
+            parent = tags.get(
+                dockerfile.normalize_reference(namespace.from_base))
+            deps[tag] = parent if parent != tag else None
+        return deps
+
+    def _prefetch(self, namespaces, deps):
+        """
+        Pulls the bases not built by the pipeline and pins the images to
+        them before anything is generated.
+
+        :param namespaces: Namespace per tag.
+        :type namespaces: dict
+        :param deps: The tag each tag must wait for, if any.
+        :type deps: dict
+        """
+        outside = [x for tag, x in namespaces.items() if deps[tag] is None]
+        pins = prefetch.prefetch(
+            self.builder, self.namespace,
+            prefetch.collect([x.from_base] for x in outside),
+            self.namespace.pull_jobs)
+        for namespace in outside:
+            namespace.from_base = pins.get(dockerfile.normalize_reference(
+                namespace.from_base)) or namespace.from_base
+
+    def run(self, images):
+        """
+        Runs every image through the stages.
+
+        :param images: One dict of options per image.
+        :type images: list
+        :returns: Results keyed by tag
+        :rtype: dict
+        """
+        namespaces = {x['tag']: self.image_namespace(x) for x in images}
+        deps = self._dependencies(namespaces)
+        if getattr(self.namespace, 'prefetch', False):
+            self._prefetch(namespaces, deps)
+        state = _State(deps)
+        pools = {x: futures.ThreadPoolExecutor(max_workers=self.jobs[x])
+                 for x in STAGES}
+        running = {}
+        run_stage = util.bind_working_directory(self._run_stage)
+
+        def submit(stage, tag, rendered=None):
+            logging.info('Scheduling %s of "%s"', stage, tag)
+            running[pools[stage].submit(
+                run_stage, stage, namespaces[tag], rendered)] = (
+                    stage, tag)
+
+        try:
+            for tag in namespaces:
+                submit('generate', tag)
+            while running:
+                done, _ = futures.wait(
+                    running, return_when=futures.FIRST_COMPLETED)
+                for future in done:
+                    stage, tag = running.pop(future)
+                    for step in state.finish(stage, tag, *future.result()):
+                        submit(*step)
+            state.skip_waiting()
+        finally:
+            for pool in pools.values():
+                pool.shutdown()
+        return state.results
+
+
+class _State(object):
+    """
+    Tracks where each image of a pipeline is.
+    """
+
+    def __init__(self, deps):
+        """
+        :param deps: The tag each tag must wait for, if any.
+        :type deps: dict
+        """
+        self.deps = deps
+        self.durations = {x: {} for x in deps}
+        self.rendered = {}
+        self.built = set()
+        self.results = {}
+
+    def _ready(self):
+        """
+        Returns the generated images whose base is built or not in the
+        pipeline, and skips those whose base failed.
+        """
+        ready = []
+        for tag in list(self.rendered):
+            parent = self.deps[tag]
+            if parent in self.results and parent not in self.built:
+                self._end(tag, 'skipped', 'build',
+                          '{} did not build'.format(parent))
+            elif parent is None or parent in self.built:
+                ready.append(('build', tag, self.rendered.pop(tag)))
+        return ready
+
+    def _end(self, tag, status, stage, error=''):
+        self.rendered.pop(tag, None)
+        self.results[tag] = PipelineResult(
+            tag, status, stage, self.durations[tag], error)
+
+    def finish(self, stage, tag, duration, output, error):
+        """
+        Records a finished stage.
+
+        :returns: (stage, tag, rendered) steps that may run now
+        :rtype: list
+        """
+        self.durations[tag][stage] = duration
+        if error is not None:
+            self._end(tag, 'failed', stage, error)
+        elif stage == 'generate':
+            self.rendered[tag] = output
+        elif stage == 'build':
+            self.built.add(tag)
+            return [('export', tag, None)] + self._ready()
+        else:
+            self._end(tag, 'success', stage)
+        return self._ready()
+
+    def skip_waiting(self):
+        """
+        Skips images still waiting for a base, which means a cycle.
+        """
+        for tag in list(self.rendered):
+            self._end(tag, 'skipped', 'build', 'dependency cycle')
@@ -0,0 +1,123 @@
+# Copyright (C) 2017 Red Hat
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Pulling the base images of many builds before the builds start.
+
+A build pulls its base image itself, so builds queued behind each other
+also wait on the registry one after another. prefetch() pulls every
+distinct base at once and returns the digest each one resolved to, so the
+builds of a batch all start from the same content even if a tag moves
+while the batch runs.
+"""
+
+import functools
+import logging
+import os
+import subprocess
+import time
+
+from concurrent import futures
+
+from system_buildah import dockerfile, trace, util
+
+
+def collect(bases, exclude=()):
+    """
+    Returns the distinct images to pull for many builds.
+
+    :param bases: The base images of each build.
+    :type bases: iterable of lists
+    :param exclude: Images built by the batch itself.
+    :type exclude: iterable
+    :returns: Normalized references in order of first use
+    :rtype: list
+    """
+    skip = {dockerfile.normalize_reference(x) for x in exclude}
+    references = []
+    for images in bases:
+        for image in images:
+            reference = dockerfile.normalize_reference(image)
+            if reference not in skip and reference not in references:
+                references.append(reference)
+    return references
+
+
+def _pull(builder, namespace, reference):
+    """
+    Pulls one image, logging instead of raising when it fails.
+
+    :returns: The pinned reference or None
+    :rtype: str or None
+    """
+    start = time.monotonic()
+    with trace.span('prefetch', image=reference) as span:
+        try:
+            span['pinned'] = builder.pull(namespace, reference)
+        except (subprocess.CalledProcessError, OSError) as error:
+            logging.warning('Unable to prefetch "%s": %s', reference, error)
+            return None
+    logging.info('Prefetched "%s" as %s in %.2fs', reference,
+                 span['pinned'], time.monotonic() - start)
+    return span['pinned']
+
+
+def prefetch(builder, namespace, references, jobs):
+    """
+    Pulls images concurrently.
+
+    An image that fails to pull is left to its builds, which then fail
+    or succeed on their own as they would without a prefetch.
+
+    :param builder: The image manager to pull with.
+    :type builder: system_buildah.managers.ImageManager
+    :param namespace: Namespace passed in via CLI.
+    :type namespace: argparse.Namespace
+    :param references: Normalized references to pull.
+    :type references: list
+    :param jobs: Images to pull at the same time.
+    :type jobs: int
+    :returns: The pinned reference, or None, keyed by reference
+    :rtype: dict
+    :raises: NotImplementedError if the manager can not pull
+    """
+    if not references:
+        return {}
+    logging.info('Prefetching %d base images', len(references))
+    pull = util.bind_working_directory(
+        functools.partial(_pull, builder, namespace))
+    with futures.ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        return dict(zip(references, pool.map(pull, references)))
+
+
+def pinned_files(path, pins):
+    """
+    Returns the Dockerfile of a build context with pinned bases.
+
+    :param path: The build context directory.
+    :type path: str
+    :param pins: Pinned references keyed by normalized reference.
+    :type pins: dict
+    :returns: The Dockerfile keyed by name for rendered_files, or None
+              when nothing was pinned or the Dockerfile can not be read
+    :rtype: dict or None
+    """
+    try:
+        with open(os.path.sep.join(
+                [util._expand_path(path), 'Dockerfile']), 'r') as source:
+            data = source.read()
+    except (IOError, OSError):
+        return None
+    pinned = dockerfile.pin_bases(data, pins)
+    return {'Dockerfile': pinned} if pinned != data else None
@@ -0,0 +1,92 @@
+# Copyright (C) 2017 Red Hat
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Shared template rendering.
+
+One jinja2 Environment is kept per template directory so each template is
+compiled once per process. Compiled bytecode is also stored in the user
+cache so new processes skip compilation as long as the source is unchanged.
+"""
+
+import logging
+import os
+import threading
+
+import jinja2
+
+from system_buildah import trace, util
+
+#: Environment variable naming a directory of override templates.
+TEMPLATE_DIR_ENV = 'SYSTEM_BUILDAH_TEMPLATE_DIR'
+
+_ENVIRONMENTS = {}
+_LOCK = threading.Lock()
+
+
+def _bytecode_cache():
+    """
+    Returns the on disk bytecode cache if the cache directory is usable.
+
+    :returns: The bytecode cache or None
+    :rtype: jinja2.FileSystemBytecodeCache or None
+    """
+    try:
+        return jinja2.FileSystemBytecodeCache(util.get_cache_dir('templates'))
+    except OSError as error:
+        logging.debug('Template bytecode cache disabled: %s', error)
+        return None
+
+
+def get_environment(template_dir=None):
+    """
+    Returns the shared Environment for a template directory.
+
+    Templates found in template_dir take precedence over the packaged ones.
+
+    :param template_dir: Directory of override templates.
+    :type template_dir: str or None
+    :returns: The Environment
+    :rtype: jinja2.Environment
+    """
+    template_dir = template_dir or os.environ.get(TEMPLATE_DIR_ENV)
+    with _LOCK:
+        if template_dir not in _ENVIRONMENTS:
+            loaders = [jinja2.PackageLoader('system_buildah')]
+            if template_dir:
+                logging.debug('Using templates from "%s"', template_dir)
+                loaders.insert(0, jinja2.FileSystemLoader(
+                    util._expand_path(template_dir)))
+            _ENVIRONMENTS[template_dir] = jinja2.Environment(
+                loader=jinja2.ChoiceLoader(loaders),
+                bytecode_cache=_bytecode_cache())
+        return _ENVIRONMENTS[template_dir]
+
+
+def render(template, template_dir=None, **context):
+    """
+    Renders a template.
+
+    :param template: Name of the template such as Dockerfile.j2.
+    :type template: str
+    :param template_dir: Directory of override templates.
+    :type template_dir: str or None
+    :param context: Variables for the template.
+    :type context: dict
+    :returns: The rendered template
+    :rtype: str
+    """
+    with trace.span('render', template=template):
+        return get_environment(template_dir).get_template(
+            template).render(**context)
@@ -0,0 +1,217 @@
+# Copyright (C) 2017 Red Hat
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Build scripts for driving buildah without a Dockerfile build.
+
+A Script holds the base image, the filesystem steps (run, copy, add and
+configuration that later steps depend on) in order, and the labels and
+metadata that are applied together in one buildah config call.
+"""
+
+import json
+import shlex
+
+from collections import namedtuple
+
+from system_buildah import dockerfile
+
+#: One filesystem step. kind is run, copy, add or config.
+Step = namedtuple('Step', ['kind', 'arguments'])
+
+#: Instructions only setting metadata, and the buildah config switch.
+METADATA = {
+    'CMD': '--cmd',
+    'ENTRYPOINT': '--entrypoint',
+    'EXPOSE': '--port',
+    'VOLUME': '--volume',
+}
+
+#: Instructions later steps depend on, and the buildah config switch.
+ENVIRONMENT = {
+    'ENV': '--env',
+    'WORKDIR': '--workingdir',
+    'USER': '--user',
+}
+
+
+def config_arguments(switch, arguments):
+    """
+    Returns the buildah config arguments setting an instruction.
+
+    :param switch: The buildah config switch such as --cmd.
+    :type switch: str
+    :param arguments: The arguments of the instruction.
+    :type arguments: str
+    :returns: Switches and their values
+    :rtype: list
+    """
+    if switch in ('--port', '--volume'):
+        if arguments.startswith('['):
+            values = json.loads(arguments)
+        else:
+            values = arguments.split()
+    elif switch == '--env':
+        words = shlex.split(arguments)
+        if words and '=' not in words[0]:
+            # The old ENV key value form
+            values = ['{}={}'.format(words[0], ' '.join(words[1:]))]
+        else:
+            values = words
+    else:
+        values = [arguments]
+    result = []
+    for value in values:
+        result += [switch, value]
+    return result
+
+
+class UnsupportedInstruction(Exception):
+    """
+    The Dockerfile can not be turned into a script.
+    """
+    pass
+
+
+class Script(object):
+    """
+    The steps building one image.
+    """
+
+    def __init__(self, base):
+        """
+        Initializes a new Script.
+
+        :param base: The image to start from.
+        :type base: str
+        """
+        self.base = base
+        self.steps = []
+        self.labels = {}
+        self.config = []
+        #: Top level paths the steps create, or None when the steps may
+        #: change anything in the base image.
+        self.roots = set()
+
+    @property
+    def reusable(self):
+        """
+        Whether the container may be reset and used for another image.
+        """
+        return self.roots is not None
+
+    def _touch(self, path):
+        """
+        Records a path the steps create.
+        """
+        if self.roots is None:
+            return
+        if not path.startswith('/') or path.strip('/') == '':
+            self.roots = None
+            return
+        self.roots.add('/' + path.strip('/').split('/')[0])
+
+    def add_label(self, arguments):
+        """
+        Adds the labels of a LABEL instruction.
+
+        :param arguments: The arguments of the instruction.
+        :type arguments: str
+        """
+        words = shlex.split(arguments)
+        if words and '=' not in words[0]:
+            # The old LABEL key value form
+            self.labels[words[0]] = ' '.join(words[1:])
+            return
+        for word in words:
+            key, _, value = word.partition('=')
+            self.labels[key] = value
+
+    def add_run(self, arguments):
+        """
+        Adds a RUN instruction.
+
+        :param arguments: The arguments of the instruction.
+        :type arguments: str
+        """
+        if arguments.startswith('['):
+            command = json.loads(arguments)
+            self.roots = None
+        else:
+            command = ['/bin/sh', '-c', arguments]
+            words = shlex.split(arguments)
+            if words[:2] == ['mkdir', '-p'] and len(words) > 2:
+                for path in words[2:]:
+                    self._touch(path)
+            else:
+                self.roots = None
+        self.steps.append(Step('run', command))
+
+    def add_copy(self, instruction, arguments):
+        """
+        Adds a COPY or ADD instruction.
+
+        :param instruction: COPY or ADD.
+        :type instruction: str
+        :param arguments: The arguments of the instruction.
+        :type arguments: str
+        :raises: UnsupportedInstruction
+        """
+        flags = []
+        if not arguments.startswith('['):
+            flags = [x for x in arguments.split() if x.startswith('--')]
+        if any(not x.startswith('--chown=') for x in flags):
+            raise UnsupportedInstruction(
+                '{} {} is not supported'.format(instruction, arguments))
+        sources, destination = dockerfile.split_copy_arguments(arguments)
+        self._touch(destination)
+        self.steps.append(Step(
+            instruction.lower(), flags + sources + [destination]))
+
+
+def from_instructions(instructions):
+    """
+    Turns Dockerfile instructions into a Script.
+
+    :param instructions: Parsed Dockerfile instructions.
+    :type instructions: list
+    :returns: The script
+    :rtype: Script
+    :raises: UnsupportedInstruction
+    """
+    froms = [x for x in instructions if x.instruction == 'FROM']
+    if len(froms) != 1 or instructions[0].instruction != 'FROM':
+        raise UnsupportedInstruction('Only single stage builds are supported')
+    if froms[0].arguments.startswith('--'):
+        raise UnsupportedInstruction(
+            'FROM {} is not supported'.format(froms[0].arguments))
+    script = Script(froms[0].arguments.split()[0])
+    for item in instructions[1:]:
+        if item.instruction == 'LABEL':
+            script.add_label(item.arguments)
+        elif item.instruction == 'RUN':
+            script.add_run(item.arguments)
+        elif item.instruction in ('COPY', 'ADD'):
+            script.add_copy(item.instruction, item.arguments)
+        elif item.instruction in METADATA:
+            script.config += config_arguments(
+                METADATA[item.instruction], item.arguments)
+        elif item.instruction in ENVIRONMENT:
+            script.steps.append(Step('config', config_arguments(
+                ENVIRONMENT[item.instruction], item.arguments)))
+            script.roots = None
+        else:
+            raise UnsupportedInstruction(
+                '{} is not supported'.format(item.instruction))
+    return script
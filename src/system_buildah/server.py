@@ -0,0 +1,387 @@
+# Copyright (C) 2017 Red Hat
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Long lived server running commands sent over a unix socket.
+
+A client sends one JSON line, {"argv": [...], "cwd": "/path"}, and reads
+JSON lines back until one holds an exit_code:
+
+* {"status": "queued" | "running"}
+* {"log": "message", "level": "INFO"}
+* {"stream": "stdout" | "stderr", "data": "text"}
+* {"exit_code": 0}
+
+Commands run in a pool of threads sharing one parser, the compiled
+templates and the loaded managers. Each resolves relative paths against
+the cwd of its client without changing the working directory of the
+server.
+"""
+
+import argparse
+import json
+import logging
+import os
+import queue
+import socket
+import socketserver
+import subprocess
+import sys
+import threading
+
+from system_buildah import cli, util
+from system_buildah.actions import LazyAction
+
+#: Environment variable naming the server socket.
+SOCKET_ENV = 'SYSTEM_BUILDAH_SOCKET'
+
+
+def default_socket():
+    """
+    Returns the socket path used when none is given.
+
+    :returns: $SYSTEM_BUILDAH_SOCKET, else a socket in $XDG_RUNTIME_DIR or
+              the user cache.
+    :rtype: str
+    """
+    if os.environ.get(SOCKET_ENV):
+        return os.environ[SOCKET_ENV]
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime_dir:
+        return os.path.join(runtime_dir, 'system-buildah.sock')
+    return os.path.join(util.get_cache_dir(), 'server.sock')
+
+
+class JobExit(Exception):
+    """
+    A job called parser.exit().
+    """
+
+    def __init__(self, status):
+        super().__init__(status)
+        self.status = status
+
+
+class JobParser(argparse.ArgumentParser):
+    """
+    Parser sending output to the job of the calling thread.
+    """
+
+    def _print_message(self, message, file=None):
+        job = util.current_job()
+        if job is None or not message:
+            return super()._print_message(message, file)
+        stream = 'stdout' if file is sys.stdout else 'stderr'
+        job.send({'stream': stream, 'data': message})
+
+    def exit(self, status=0, message=None):
+        if util.current_job() is None:
+            return super().exit(status, message)
+        if message:
+            self._print_message(message, sys.stderr)
+        raise JobExit(status)
+
+
+class Job(object):
+    """
+    A command sent by a client.
+    """
+
+    def __init__(self, argv, cwd):
+        """
+        Initializes a new Job.
+
+        :param argv: Command line arguments, without the program name.
+        :type argv: list
+        :param cwd: Directory relative paths are resolved against.
+        :type cwd: str
+        """
+        self.argv = argv
+        self.cwd = cwd
+        self.events = queue.Queue()
+        self.exit_code = None
+
+    def send(self, event):
+        """
+        Queues an event for the client.
+
+        :param event: The event to send.
+        :type event: dict
+        """
+        self.events.put(event)
+
+    def finish(self, exit_code):
+        """
+        Sends the final event.
+
+        :param exit_code: The exit code of the command.
+        :type exit_code: int
+        """
+        self.exit_code = exit_code
+        self.send({'exit_code': exit_code})
+
+
+class JobLogHandler(logging.Handler):
+    """
+    Forwards records logged by the threads working for a job to its
+    client.
+    """
+
+    def __init__(self, job):
+        super().__init__()
+        self.job = job
+        self.setFormatter(logging.Formatter('%(levelname)s:%(message)s'))
+
+    def filter(self, record):
+        # Handlers run in the thread that logged the record
+        return util.current_job() is self.job
+
+    def emit(self, record):
+        self.job.send({'log': self.format(record), 'level': record.levelname})
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    """
+    Reads a job from a client and streams its events back.
+    """
+
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline().decode('utf-8'))
+            job = Job(list(request['argv']), request['cwd'])
+        except (ValueError, KeyError, TypeError) as error:
+            return self._send({'error': 'Invalid request: {}'.format(error),
+                               'exit_code': 2})
+        if not self.server.owner.submit(job):
+            return self._send({'error': 'Server is busy', 'exit_code': 75})
+        while True:
+            event = job.events.get()
+            try:
+                self._send(event)
+            except OSError:
+                logging.debug('Client of %s went away', job.argv)
+                return
+            if 'exit_code' in event:
+                return
+
+    def _send(self, event):
+        self.wfile.write(json.dumps(event).encode('utf-8') + b'\n')
+        self.wfile.flush()
+
+
+class Server(object):
+    """
+    Runs jobs received on a unix socket.
+    """
+
+    def __init__(self, socket_path, jobs=4, queue_size=16):
+        """
+        Initializes a new Server.
+
+        :param socket_path: Path of the unix socket to listen on.
+        :type socket_path: str
+        :param jobs: Number of jobs to run at the same time.
+        :type jobs: int
+        :param queue_size: Number of jobs that may wait to run.
+        :type queue_size: int
+        :raises: OSError
+        """
+        self.socket_path = socket_path
+        self.jobs = jobs
+        self.parser = cli.build_parser(JobParser)
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._workers = []
+        self._remove_stale_socket()
+        self._server = socketserver.ThreadingUnixStreamServer(
+            socket_path, _RequestHandler)
+        os.chmod(socket_path, 0o600)
+        self._server.daemon_threads = True
+        self._server.owner = self
+
+    def _remove_stale_socket(self):
+        """
+        Removes a socket left behind by a server that is gone.
+
+        :raises: OSError when another server is listening.
+        """
+        if not os.path.exists(self.socket_path):
+            return
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(self.socket_path)
+        except OSError:
+            logging.info('Removing stale socket "%s"', self.socket_path)
+            os.unlink(self.socket_path)
+            return
+        finally:
+            probe.close()
+        raise OSError('A server is already listening on "{}"'.format(
+            self.socket_path))
+
+    def warm_up(self):
+        """
+        Imports every action and compiles the packaged templates.
+        """
+        from system_buildah import render
+
+        for action in self.parser._subparsers._group_actions:
+            for name, command in action.choices.items():
+                if name in util.FORBIDDEN_COMMANDS:
+                    continue
+                for argument in command._actions:
+                    if isinstance(argument, LazyAction):
+                        argument.load()
+        environment = render.get_environment()
+        for template in environment.list_templates():
+            environment.get_template(template)
+
+    def submit(self, job):
+        """
+        Queues a job.
+
+        :param job: The job to queue.
+        :type job: Job
+        :returns: False when the queue is full
+        :rtype: bool
+        """
+        if job.argv and job.argv[0] in util.FORBIDDEN_COMMANDS:
+            job.send({'stream': 'stderr', 'data': '{} can not be run by the '
+                      'server\n'.format(job.argv[0])})
+            job.finish(2)
+            return True
+        # A worker may start the job as soon as it is in the queue
+        job.send({'status': 'queued'})
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            return False
+        return True
+
+    def run_job(self, job):
+        """
+        Runs a job in the calling thread.
+
+        :param job: The job to run.
+        :type job: Job
+        """
+        job.send({'status': 'running'})
+        handler = JobLogHandler(job)
+        logging.getLogger().addHandler(handler)
+        exit_code = 1
+        try:
+            with util.working_for(job):
+                exit_code = self._parse_job(job)
+        finally:
+            logging.getLogger().removeHandler(handler)
+            job.finish(exit_code)
+
+    def _parse_job(self, job):
+        """
+        Runs the command of a job.
+
+        :param job: The job to run.
+        :type job: Job
+        :returns: The exit code of the command
+        :rtype: int
+        """
+        try:
+            with util.working_directory(job.cwd):
+                self.parser.parse_args(job.argv)
+        except JobExit as error:
+            return error.status
+        except subprocess.CalledProcessError as error:
+            self.parser._print_message(
+                'Unable to execute command: {}\n'.format(error), sys.stderr)
+            return 2
+        except Exception:
+            logging.exception('Job %s failed', job.argv)
+            return 1
+        return 0
+
+    def _work(self):
+        """
+        Runs queued jobs until None is queued.
+        """
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            self.run_job(job)
+
+    def start(self):
+        """
+        Starts the workers and the listener in background threads.
+        """
+        for _ in range(self.jobs):
+            worker = threading.Thread(
+                target=util.bind_working_directory(self._work), daemon=True)
+            worker.start()
+            self._workers.append(worker)
+        threading.Thread(
+            target=self._server.serve_forever, daemon=True).start()
+        logging.info('Listening on "%s" with %d workers',
+                     self.socket_path, self.jobs)
+
+    def close(self):
+        """
+        Stops listening and waits for running jobs to finish.
+        """
+        self._server.shutdown()
+        self._server.server_close()
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def submit(socket_path, argv, cwd, on_event=None):
+    """
+    Sends a job to a server and waits for it to finish.
+
+    :param socket_path: Path of the server socket.
+    :type socket_path: str
+    :param argv: Command line arguments, without the program name.
+    :type argv: list
+    :param cwd: Directory relative paths are resolved against.
+    :type cwd: str
+    :param on_event: Called with every event the server sends.
+    :type on_event: callable or None
+    :returns: The exit code of the job
+    :rtype: int
+    :raises: OSError
+    """
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(socket_path)
+        client.sendall(json.dumps(
+            {'argv': argv, 'cwd': cwd}).encode('utf-8') + b'\n')
+        with client.makefile('rb') as events:
+            for line in events:
+                event = json.loads(line.decode('utf-8'))
+                if on_event:
+                    on_event(event)
+                if 'exit_code' in event:
+                    return event['exit_code']
+    finally:
+        client.close()
+    raise OSError('The server closed the connection')
@@ -0,0 +1,304 @@
+# Copyright (C) 2017 Red Hat
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Sidecar indexes for reading single files out of a docker-archive.
+
+The index of ARCHIVE is written to ARCHIVE.index.json. It holds the byte
+offset and size of every member of the archive and of every regular file
+inside each layer, plus the layers of each image, so a file is read from
+a memory map of the archive without going through the rest of it.
+
+Only uncompressed archives with uncompressed layers can be indexed, which
+is what docker save and buildah push write.
+"""
+
+import json
+import logging
+import mmap
+import os
+import posixpath
+import tarfile
+
+from system_buildah import delta
+
+#: Version of the index format.
+VERSION = 1
+
+#: Suffix of the index next to an archive.
+SUFFIX = '.index.json'
+
+#: Size of the chunks files are written in.
+CHUNK_SIZE = 1024 * 1024
+
+#: Prefix of files marking a path deleted.
+WHITEOUT = '.wh.'
+
+#: Marks a directory hiding the same directory in lower layers.
+OPAQUE = '.wh..wh..opq'
+
+
+class TarIndexError(ValueError):
+    """
+    An archive can not be indexed or a path is not in it.
+    """
+    pass
+
+
+def index_path(archive):
+    """
+    Returns the path of the index of an archive.
+
+    :param archive: Path to the archive.
+    :type archive: str
+    :returns: Path to the index
+    :rtype: str
+    """
+    return archive + SUFFIX
+
+
+def _normalize(name):
+    """
+    Returns a member name relative to the root of its archive.
+    """
+    return posixpath.normpath('/' + name).lstrip('/')
+
+
+def _index_layer(source, member):
+    """
+    Indexes the regular files of a layer.
+
+    The layer is read in place, so the offsets of its files are offsets
+    into the archive holding it.
+
+    :param source: The archive, opened for binary reading.
+    :type source: file
+    :param member: The member holding the layer.
+    :type member: tarfile.TarInfo
+    :returns: [offset, size] keyed by path
+    :rtype: dict
+    :raises: tarfile.TarError when the layer is not an uncompressed tar
+    """
+    end = member.offset_data + member.size
+    files = {}
+    source.seek(member.offset_data)
+    with tarfile.open(fileobj=source, mode='r:') as layer:
+        for item in layer:
+            if item.offset_data + item.size > end:
+                raise tarfile.ReadError(
+                    '{} ends past its layer'.format(item.name))
+            name = _normalize(item.name)
+            if item.isfile():
+                files[name] = [item.offset_data, item.size]
+            elif item.islnk() and _normalize(item.linkname) in files:
+                files[name] = files[_normalize(item.linkname)]
+    return files
+
+
+def _index_images(outer, source, index):
+    """
+    Adds the layers of each image of an archive to its index.
+
+    :param outer: The archive.
+    :type outer: tarfile.TarFile
+    :param source: The file the archive is read from.
+    :type source: file
+    :param index: The index to fill.
+    :type index: dict
+    :raises: TarIndexError
+    """
+    manifest = json.loads(
+        outer.extractfile('manifest.json').read().decode('utf-8'))
+    for number, image in enumerate(manifest):
+        layers = []
+        for name in image.get('Layers', []):
+            try:
+                resolved = delta._resolve(outer, outer.getmember(name))
+                if resolved.name not in index['layers']:
+                    index['layers'][resolved.name] = _index_layer(
+                        source, resolved)
+            except (KeyError, AttributeError, tarfile.TarError) as error:
+                raise TarIndexError('Unable to index layer {}: {}'.format(
+                    name, error))
+            layers.append(resolved.name)
+        tags = image.get('RepoTags') or [str(number)]
+        for tag in tags:
+            index['images'][tag] = layers
+        index.setdefault('default', tags[0])
+
+
+def build(archive):
+    """
+    Indexes an archive.
+
+    :param archive: Path to the archive.
+    :type archive: str
+    :returns: The index
+    :rtype: dict
+    :raises: TarIndexError
+    :raises: OSError
+    """
+    stat = os.stat(archive)
+    index = {'version': VERSION, 'size': stat.st_size,
+             'mtime': stat.st_mtime, 'members': {}, 'layers': {},
+             'images': {}}
+    with open(archive, 'rb') as source:
+        try:
+            outer = tarfile.open(fileobj=source, mode='r:')
+            members = outer.getmembers()
+        except tarfile.TarError as error:
+            raise TarIndexError('{} is not an uncompressed tar: {}'.format(
+                archive, error))
+        for member in members:
+            resolved = delta._resolve(outer, member)
+            if resolved is not None:
+                index['members'][_normalize(member.name)] = [
+                    resolved.offset_data, resolved.size]
+        if 'manifest.json' in index['members']:
+            _index_images(outer, source, index)
+    return index
+
+
+def save(archive, index):
+    """
+    Writes the index of an archive next to it.
+
+    :param archive: Path to the archive.
+    :type archive: str
+    :param index: The index returned by build().
+    :type index: dict
+    :raises: OSError
+    """
+    path = index_path(archive)
+    with open(path + '.part', 'w') as index_file:
+        json.dump(index, index_file, sort_keys=True)
+    os.rename(path + '.part', path)
+    logging.info('Indexed %d files of "%s"', sum(
+        len(x) for x in index['layers'].values()), archive)
+
+
+def load(archive):
+    """
+    Reads the index of an archive, checking it still matches the archive.
+
+    :param archive: Path to the archive.
+    :type archive: str
+    :returns: The index or None when there is none or it is out of date
+    :rtype: dict or None
+    :raises: OSError
+    """
+    try:
+        with open(index_path(archive)) as index_file:
+            index = json.load(index_file)
+    except FileNotFoundError:
+        return None
+    except ValueError:
+        logging.warning('Ignoring the malformed index of "%s"', archive)
+        return None
+    stat = os.stat(archive)
+    if index.get('version') != VERSION or (index.get('size'), index.get(
+            'mtime')) != (stat.st_size, stat.st_mtime):
+        logging.info('The index of "%s" is out of date', archive)
+        return None
+    return index
+
+
+def _hidden(files, parts):
+    """
+    Checks whether a layer deletes a path or hides the lower layers of one
+    of its directories.
+
+    :param files: The files of the layer.
+    :type files: dict
+    :param parts: Components of the path.
+    :type parts: list
+    :returns: True when lower layers must not be looked at
+    :rtype: bool
+    """
+    for number, name in enumerate(parts):
+        parent = parts[:number]
+        if '/'.join(parent + [WHITEOUT + name]) in files:
+            return True
+        if parent and '/'.join(parent + [OPAQUE]) in files:
+            return True
+    return False
+
+
+def lookup(index, path, image=None):
+    """
+    Finds where a file is in an archive.
+
+    A path starting with / is looked up in the filesystem of the image.
+    Other paths name a member of the archive, such as manifest.json, and
+    are looked up in the image when no member has that name.
+
+    :param index: The index of the archive.
+    :type index: dict
+    :param path: The file to find.
+    :type path: str
+    :param image: The image whose filesystem to look in. Default: the
+                  first image of the archive.
+    :type image: str or None
+    :returns: (offset, size)
+    :rtype: tuple
+    :raises: TarIndexError
+    """
+    name = _normalize(path)
+    if not path.startswith('/') and name in index['members']:
+        return tuple(index['members'][name])
+    image = image or index.get('default')
+    if image not in index['images']:
+        raise TarIndexError('{} is not in the archive'.format(
+            image or 'An image'))
+    parts = name.split('/')
+    for layer in reversed(index['images'][image]):
+        files = index['layers'][layer]
+        if name in files:
+            return tuple(files[name])
+        if _hidden(files, parts):
+            break
+    raise TarIndexError('{} is not a file of {}'.format(path, image))
+
+
+def extract(archive, index, path, destination, image=None):
+    """
+    Copies one file out of an archive.
+
+    :param archive: Path to the archive.
+    :type archive: str
+    :param index: The index of the archive.
+    :type index: dict
+    :param path: The file to copy, see lookup().
+    :type path: str
+    :param destination: File opened for binary writing.
+    :type destination: file
+    :param image: The image whose filesystem to look in.
+    :type image: str or None
+    :returns: Bytes written
+    :rtype: int
+    :raises: TarIndexError
+    :raises: OSError
+    """
+    offset, size = lookup(index, path, image)
+    if not size:
+        return 0
+    with open(archive, 'rb') as source, mmap.mmap(
+            source.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        if offset + size > len(mapped):
+            raise TarIndexError('The index does not match {}'.format(archive))
+        with memoryview(mapped) as view:
+            for start in range(offset, offset + size, CHUNK_SIZE):
+                destination.write(
+                    view[start:min(start + CHUNK_SIZE, offset + size)])
+    return size
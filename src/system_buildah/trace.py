@@ -0,0 +1,310 @@
+# Copyright (C) 2017 Red Hat
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Timing spans for each phase of a command.
+
+Spans nest per thread and record their start, duration and arguments such
+as the argv and exit code of subprocesses or the bytes written. When no
+trace file was requested and nothing observes spans, span() only yields a
+throw away dict.
+"""
+
+import functools
+import json
+import logging
+import os
+import subprocess
+import threading
+import time
+
+from contextlib import contextmanager
+
+#: Formats a trace can be written in.
+FORMATS = ('chrome', 'jsonl')
+
+#: Holds the tracer and the observer of the spans of each thread.
+_LOCAL = threading.local()
+
+
+class Tracer(object):
+    """
+    Collects the spans of one traced command.
+    """
+
+    def __init__(self, path, trace_format=None):
+        """
+        Initializes a new Tracer.
+
+        :param path: File to write the trace to.
+        :type path: str
+        :param trace_format: chrome or jsonl. Default: from the extension.
+        :type trace_format: str or None
+        """
+        self.path = path
+        self.format = trace_format or (
+            'jsonl' if path.endswith('.jsonl') else 'chrome')
+        self.spans = []
+        self._ids = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _stack(self):
+        """
+        Returns the open spans of the calling thread.
+
+        :returns: The stack of span ids
+        :rtype: list
+        """
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    @contextmanager
+    def span(self, name, args):
+        """
+        Records a span around the body of the context.
+
+        :param name: Name of the phase.
+        :type name: str
+        :param args: Arguments to record. May be updated inside the context.
+        :type args: dict
+        :returns: args
+        :rtype: dict
+        """
+        stack = self._stack()
+        with self._lock:
+            self._ids += 1
+            span_id = self._ids
+        parent = stack[-1] if stack else None
+        stack.append(span_id)
+        start = time.time()
+        counter = time.perf_counter()
+        try:
+            yield args
+        except BaseException as error:
+            args.setdefault('error', repr(error))
+            raise
+        finally:
+            duration = time.perf_counter() - counter
+            # Coroutines sharing the thread may end spans out of order
+            stack.remove(span_id)
+            with self._lock:
+                self.spans.append({
+                    'id': span_id, 'parent': parent, 'name': name,
+                    'start': start, 'duration': duration,
+                    'pid': os.getpid(), 'tid': threading.get_ident(),
+                    'args': args})
+
+    def write(self):
+        """
+        Writes the spans collected so far to the trace file.
+        """
+        with self._lock:
+            spans = sorted(self.spans, key=lambda x: x['start'])
+        with open(self.path, 'w') as trace_file:
+            if self.format == 'jsonl':
+                for item in spans:
+                    trace_file.write(json.dumps(item, default=str) + '\n')
+            else:
+                self._write_chrome(trace_file, spans)
+        logging.info('Wrote %d spans to "%s"', len(spans), self.path)
+
+    def _write_chrome(self, trace_file, spans):
+        """
+        Writes spans as complete events of the Chrome trace event format.
+
+        :param trace_file: File to write to.
+        :type trace_file: file
+        :param spans: The spans to write.
+        :type spans: list
+        """
+        json.dump({
+            'displayTimeUnit': 'ms',
+            'traceEvents': [{
+                'name': x['name'], 'cat': 'system-buildah', 'ph': 'X',
+                'ts': x['start'] * 1000000,
+                'dur': x['duration'] * 1000000,
+                'pid': x['pid'], 'tid': x['tid'],
+                'args': x['args']} for x in spans],
+        }, trace_file, default=str)
+
+
+def tracer():
+    """
+    Returns the tracer of the spans of the calling thread.
+
+    :returns: The tracer or None
+    :rtype: Tracer or None
+    """
+    return getattr(_LOCAL, 'tracer', None)
+
+
+@contextmanager
+def _traced_by(active):
+    """
+    Records the spans of the calling thread with a tracer until end of
+    context.
+
+    :param active: The tracer, or None for no trace.
+    :type active: Tracer or None
+    """
+    original = tracer()
+    _LOCAL.tracer = active
+    try:
+        yield active
+    finally:
+        _LOCAL.tracer = original
+
+
+@contextmanager
+def tracing(path, trace_format=None):
+    """
+    Traces the body of the context into path.
+
+    Only the spans of the calling thread, and of the threads it hands work
+    to through bind(), are traced, so jobs running at the same time each
+    write their own trace. Without a path the spans go to the enclosing
+    trace, if any.
+
+    :param path: File to write the trace to.
+    :type path: str or None
+    :param trace_format: chrome or jsonl. Default: from the extension.
+    :type trace_format: str or None
+    :returns: The active Tracer or None
+    :rtype: Tracer or None
+    """
+    if not path:
+        yield tracer()
+        return
+    with _traced_by(Tracer(path, trace_format)) as active:
+        try:
+            yield active
+        finally:
+            active.write()
+
+
+def observer():
+    """
+    Returns the observer of the spans of the calling thread.
+
+    :returns: The observer or None
+    :rtype: callable or None
+    """
+    return getattr(_LOCAL, 'observer', None)
+
+
+@contextmanager
+def observing(function):
+    """
+    Calls function as each span of the calling thread ends inside the
+    context, whether or not a trace is being taken. It replaces the
+    observer of an enclosing context until the context ends.
+
+    :param function: Called with the name, duration in seconds and
+                     arguments of the span.
+    :type function: callable or None
+    """
+    original = observer()
+    _LOCAL.observer = function
+    try:
+        yield
+    finally:
+        _LOCAL.observer = original
+
+
+def bind(function):
+    """
+    Returns function reporting its spans to the tracer and the observer of
+    the calling thread, whichever thread it then runs in.
+
+    :param function: The function to wrap.
+    :type function: callable
+    :returns: The wrapped function
+    :rtype: callable
+    """
+    bound_tracer, bound = tracer(), observer()
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        with _traced_by(bound_tracer), observing(bound):
+            return function(*args, **kwargs)
+    return wrapper
+
+
+def active():
+    """
+    Returns whether spans are being recorded or observed.
+
+    :returns: True when spans are being recorded
+    :rtype: bool
+    """
+    return tracer() is not None or observer() is not None
+
+
+@contextmanager
+def span(name, **args):
+    """
+    Records a span if a trace is being taken or spans are observed.
+
+    :param name: Name of the phase.
+    :type name: str
+    :param args: Arguments to record.
+    :type args: dict
+    :returns: The arguments, which may be updated inside the context.
+    :rtype: dict
+    """
+    active, function = tracer(), observer()
+    if active is None and function is None:
+        yield args
+        return
+    counter = time.perf_counter()
+    try:
+        if active is None:
+            yield args
+        else:
+            with active.span(name, args) as recorded:
+                yield recorded
+    except BaseException as error:
+        args.setdefault('error', repr(error))
+        raise
+    finally:
+        duration = time.perf_counter() - counter
+        if function is not None:
+            function(name, duration, args)
+
+
+def call(function, command, **kwargs):
+    """
+    Runs a subprocess function inside a span recording argv and exit code.
+
+    :param function: Such as subprocess.check_call.
+    :type function: callable
+    :param command: The command to execute.
+    :type command: list
+    :param kwargs: Keyword arguments for function.
+    :type kwargs: dict
+    :returns: What function returns
+    :rtype: mixed
+    :raises: subprocess.CalledProcessError
+    """
+    with span('exec {}'.format(command[0]), argv=list(command),
+              cwd=kwargs.get('cwd')) as args:
+        try:
+            result = function(command, **kwargs)
+        except subprocess.CalledProcessError as error:
+            args['exit_code'] = error.returncode
+            raise
+        args['exit_code'] = 0
+        return result
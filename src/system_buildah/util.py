@@ -16,23 +16,155 @@
 Utility functions.
 """
 
+import functools
 import importlib
 import logging
 import os
+import threading
 
 from contextlib import contextmanager
 
+from system_buildah import trace
+
+_LOCAL = threading.local()
+
+#: Commands that run other commands and so can not be run by batch or serve.
+FORBIDDEN_COMMANDS = ('batch', 'serve', 'submit')
+
+
+def getcwd():
+    """
+    Returns the directory relative paths are resolved against.
+
+    This is the directory set by working_directory() in the calling thread,
+    else the working directory of the process.
+
+    :returns: A full path starting from the system root.
+    :rtype: str
+    """
+    return getattr(_LOCAL, 'cwd', None) or os.getcwd()
+
+
+@contextmanager
+def working_directory(path):
+    """
+    Resolves relative paths against a path in the calling thread until end
+    of context.
+
+    Unlike os.chdir() the working directory of the process, and so of other
+    threads, is left alone.
+
+    :param path: A file system path.
+    :type path: str
+    """
+    original = getattr(_LOCAL, 'cwd', None)
+    _LOCAL.cwd = _expand_path(path)
+    logging.debug('Resolving paths against "%s"', _LOCAL.cwd)
+    try:
+        yield _LOCAL.cwd
+    finally:
+        _LOCAL.cwd = original
+
+
+@contextmanager
+def pushd(path):
+    """
+    Changes to a path until end of context.
+
+    Kept for callers of the former API. Only the calling thread resolves
+    paths against path, see working_directory().
+
+    :param path: A file system path.
+    :type path: str
+    """
+    with working_directory(path):
+        yield
+
+
+def current_job():
+    """
+    Returns the server job the calling thread works for.
+
+    :returns: The job set by working_for() or None
+    :rtype: system_buildah.server.Job or None
+    """
+    return getattr(_LOCAL, 'job', None)
+
+
+@contextmanager
+def working_for(job):
+    """
+    Sends the output of the calling thread to a server job until end of
+    context.
+
+    :param job: The job, or None for no job.
+    :type job: system_buildah.server.Job or None
+    """
+    original = current_job()
+    _LOCAL.job = job
+    try:
+        yield job
+    finally:
+        _LOCAL.job = original
+
+
+def standard_stream(stream):
+    """
+    Returns the binary stream a - argument stands for.
+
+    The standard streams of a server are not those of its clients, so
+    server jobs can not use them.
+
+    :param stream: sys.stdin or sys.stdout.
+    :type stream: file
+    :returns: The binary buffer of stream
+    :rtype: file
+    :raises: ValueError in a server job
+    """
+    if current_job() is not None:
+        raise ValueError('- can not be used by commands sent to a server. '
+                         'Use a file instead.')
+    return stream.buffer
+
+
+def bind_working_directory(function):
+    """
+    Returns function resolving relative paths against the getcwd() of the
+    caller in whichever thread it runs.
+
+    Threads of a pool do not share the working_directory() of the thread
+    submitting work to them, nor the observer of its trace spans and the
+    server job it works for, which are carried along as well.
+
+    :param function: The function to wrap.
+    :type function: callable
+    :returns: The wrapped function
+    :rtype: callable
+    """
+    cwd = getcwd()
+    job = current_job()
+    function = trace.bind(function)
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        with working_directory(cwd), working_for(job):
+            return function(*args, **kwargs)
+    return wrapper
+
 
 def _expand_path(path):
     """
     Expands a path.
 
+    Relative paths are resolved against getcwd().
+
     :param path: A file system path.
     :type path: str
     :returns: A full path starting from the system root.
     :rtype: str
     """
-    fullpath = os.path.realpath(os.path.expanduser(path))
+    fullpath = os.path.realpath(
+        os.path.join(getcwd(), os.path.expanduser(path)))
     logging.debug('Expanded "%s" to "%s"', path, fullpath)
     return fullpath
 
@@ -47,11 +179,44 @@ def mkdir(path):
     :rtype: str
     """
     path = _expand_path(path)
-    try:
-        os.mkdir(path)
-    except FileExistsError:
-        logging.info('The path "%s" already exists. Using it.', path)
+    with trace.span('mkdir', path=path):
+        try:
+            os.mkdir(path)
+        except FileExistsError:
+            logging.info('The path "%s" already exists. Using it.', path)
+
+    return path
 
+
+def write_files(directory, files):
+    """
+    Writes rendered files into a directory.
+
+    :param directory: The directory to write to.
+    :type directory: str
+    :param files: Content keyed by file name.
+    :type files: dict
+    """
+    for name in sorted(files):
+        path = os.path.sep.join([directory, name])
+        with trace.span('write', path=path) as span, open(
+                path, 'w') as output:
+            output.write(files[name])
+            span['bytes_written'] = output.tell()
+
+
+def get_cache_dir(*parts):
+    """
+    Returns, and creates if needed, a directory under the user cache.
+
+    :param parts: Subdirectories under the system-buildah cache directory.
+    :type parts: tuple
+    :returns: The full path to the cache directory.
+    :rtype: str
+    """
+    root = os.environ.get('XDG_CACHE_HOME') or '~/.cache'
+    path = _expand_path(os.path.sep.join((root, 'system-buildah') + parts))
+    os.makedirs(path, exist_ok=True)
     return path
 
 
@@ -66,24 +231,8 @@ def get_manager_class(name):
     :raises: AttributeError
     :raises: ImportError
     """
-    mod = 'system_buildah.managers.{}'.format(name)
+    mod = 'system_buildah.managers.{}'.format(name.replace('-', '_'))
     logging.debug('Importing "%s" as the Image Manager', mod)
     cls = getattr(importlib.import_module(mod), 'Manager')
     logging.debug('Class: %s', cls)
     return cls
-
-
-@contextmanager
-def pushd(path):
-    """
-    Changes to a path until end of context.
-
-    :param path: A file system path.
-    :type path: str
-    """
-    original_cwd = os.getcwd()
-    logging.info('Original dir: "%s". Moving to "%s"', original_cwd, path)
-    os.chdir(path)
-    yield
-    logging.info('Moving back to "%s" from "%s"', original_cwd, path)
-    os.chdir(original_cwd)
@@ -0,0 +1,222 @@
+# Copyright (C) 2017  Red Hat, Inc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Fake Engine API daemon listening on a unix socket.
+"""
+
+import http.server
+import io
+import json
+import socketserver
+import tarfile
+import threading
+import time
+
+from urllib.parse import parse_qs, unquote, urlparse
+
+
+class FakeDaemonHandler(http.server.BaseHTTPRequestHandler):
+    """Answers the few Engine API calls system-buildah makes"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        self.server.daemon.connections += 1
+
+    def log_message(self, *args):
+        pass
+
+    def _read_body(self):
+        if self.headers.get('Transfer-Encoding') == 'chunked':
+            body = b''
+            while True:
+                size = int(self.rfile.readline().strip(), 16)
+                body += self.rfile.read(size)
+                self.rfile.readline()
+                if not size:
+                    return body
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def _send(self, status, body, content_type='application/json'):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _route(self, method):
+        daemon = self.server.daemon
+        url = urlparse(self.path)
+        params = {k: v[0] if len(v) == 1 and k != 'names' else v
+                  for k, v in parse_qs(url.query).items()}
+        body = self._read_body()
+        with daemon.lock:
+            daemon.requests.append((method, url.path, params))
+        handler = daemon.routes(method, unquote(url.path))
+        if handler is None:
+            return self._send(404, {'message': 'page not found'})
+        status, response = handler(params, body)
+        content_type = 'application/json'
+        if isinstance(response, bytes):
+            content_type = 'application/x-tar'
+        self._send(status, response, content_type)
+
+    def do_GET(self):
+        self._route('GET')
+
+    def do_POST(self):
+        self._route('POST')
+
+    def do_HEAD(self):
+        self._route('HEAD')
+
+
+class FakeDaemon(object):
+    """A fake docker daemon with an in memory image store"""
+
+    def __init__(self, socket_path):
+        self.socket_path = socket_path
+        self.host = 'unix://{}'.format(socket_path)
+        self.connections = 0
+        self.requests = []
+        self.images = {}
+        self.contexts = {}
+        self.dockerfiles = {}
+        self.healthy = True
+        self.build_delay = 0
+        self.building = 0
+        self.peak = 0
+        self.pull_delay = 0
+        self.pulling = 0
+        self.pull_peak = 0
+        self.pulls = []
+        self.lock = threading.Lock()
+        self._server = socketserver.ThreadingUnixStreamServer(
+            socket_path, FakeDaemonHandler)
+        self._server.daemon_threads = True
+        self._server.daemon = self
+
+    def __enter__(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def add_image(self, name, data=b'', image_id=None):
+        """Adds an image with the given archive content"""
+        image_id = image_id or 'sha256:{:064x}'.format(len(self.images) + 1)
+        self.images[name] = (image_id, data)
+        return image_id
+
+    def _find(self, name):
+        for key, value in self.images.items():
+            if name in (key, value[0]):
+                return value
+        return None
+
+    def routes(self, method, path):
+        if path == '/_ping':
+            return self.ping
+        if method == 'POST' and path == '/build':
+            return self.build
+        if method == 'POST' and path == '/images/create':
+            return self.pull
+        if method == 'GET' and path == '/images/get':
+            return self.get_many
+        if path.startswith('/images/'):
+            name, _, action = path[len('/images/'):].rpartition('/')
+            return {
+                ('GET', 'get'): lambda p, b: self.get(name),
+                ('GET', 'json'): lambda p, b: self.inspect(name),
+                ('POST', 'tag'): lambda p, b: self.tag(name, p),
+            }.get((method, action))
+        return None
+
+    def ping(self, params, body):
+        if not self.healthy:
+            return 500, {'message': 'unhealthy'}
+        return 200, b'OK'
+
+    def build(self, params, body):
+        if not self.healthy:
+            return 500, {'message': 'unhealthy'}
+        with self.lock:
+            self.building += 1
+            self.peak = max(self.peak, self.building)
+        time.sleep(self.build_delay)
+        with self.lock:
+            self.building -= 1
+        with tarfile.open(fileobj=io.BytesIO(body)) as context:
+            names = context.getnames()
+            if 'Dockerfile' in names:
+                self.dockerfiles[params['t']] = context.extractfile(
+                    'Dockerfile').read().decode('utf-8')
+        self.contexts[params['t']] = names
+        if params['t'].startswith('bad'):
+            return 200, b'{"stream": "Step 1/1\\n"}\n{"error": "failed"}\n'
+        self.add_image(params['t'], b'image ' + params['t'].encode('utf-8'))
+        return 200, b'{"stream": "Step 1/1\\n"}\n{"stream": "done\\n"}\n'
+
+    def pull(self, params, body):
+        name = '{}:{}'.format(params['fromImage'], params.get('tag', 'latest'))
+        if name.startswith('missing'):
+            return 404, {'message': 'not found'}
+        with self.lock:
+            self.pulls.append(name)
+            self.pulling += 1
+            self.pull_peak = max(self.pull_peak, self.pulling)
+        time.sleep(self.pull_delay)
+        with self.lock:
+            self.pulling -= 1
+        self.add_image(name, b'base ' + name.encode('utf-8'))
+        return 200, b'{"status": "Downloaded"}\n'
+
+    def get(self, name):
+        image = self._find(name)
+        if image is None:
+            return 404, {'message': 'No such image: {}'.format(name)}
+        return 200, image[1]
+
+    def get_many(self, params, body):
+        data = b''
+        for name in params['names']:
+            image = self._find(name)
+            if image is None:
+                return 404, {'message': 'No such image: {}'.format(name)}
+            data += image[1]
+        return 200, data
+
+    def inspect(self, name):
+        image = self._find(name)
+        if image is None:
+            return 404, {'message': 'No such image: {}'.format(name)}
+        repo = name.rsplit(':', 1)[0]
+        return 200, {
+            'Id': image[0],
+            'RepoDigests': ['{}@sha256:{}'.format(repo, image[0][-64:])],
+            'RootFS': {'Layers': ['sha256:layer-{}'.format(name)]},
+        }
+
+    def tag(self, name, params):
+        image = self._find(name)
+        if image is None:
+            return 404, {'message': 'No such image: {}'.format(name)}
+        self.images['{}:{}'.format(params['repo'], params['tag'])] = image
+        return 201, b''
@@ -0,0 +1,40 @@
+# Copyright (C) 2017  Red Hat, Inc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Stand in for the command runner of the managers.
+"""
+
+
+def fake_run(function):
+    """
+    Returns a replacement for runner.run calling function instead.
+
+    function gets the command plus cwd and stdin when they are given and
+    its return value is the output of the command.
+
+    :param function: Called once per command.
+    :type function: callable
+    :returns: The replacement coroutine function
+    :rtype: callable
+    """
+    async def run(command, cwd=None, timeout=None, capture=False,
+                  stdin=None):
+        kwargs = {}
+        if cwd is not None:
+            kwargs['cwd'] = cwd
+        if stdin is not None:
+            kwargs['stdin'] = stdin
+        return function(command, **kwargs)
+    return run
@@ -0,0 +1,136 @@
+# Copyright (C) 2017  Red Hat, Inc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for running commands concurrently in one interpreter.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+# Ensure the package is in the path
+sys.path.insert(1, os.path.realpath('./src/'))
+
+from system_buildah import batch
+from system_buildah.actions.batch_action import BatchAction
+from system_buildah.managers import runner
+
+from .constants import *
+from .fake_runner import fake_run
+
+
+def test_read_batch(tmpdir, monkeypatch):
+    """Verify batch files are parsed relative to the current directory"""
+    monkeypatch.chdir(str(tmpdir))
+    batch_file = tmpdir.join('jobs')
+    batch_file.write(
+        '# comment\n\n'
+        'generate-files out  # trailing comment\n'
+        '-C sub build -p "a b" x:1\n')
+    commands = batch.read_batch('jobs')
+    assert commands == [
+        batch.Command(['generate-files', 'out'], str(tmpdir)),
+        batch.Command(['build', '-p', 'a b', 'x:1'], str(tmpdir.join('sub')))]
+
+    for line, message in (('-C sub', '-C needs'),
+                          ('serve', 'serve can not be run'),
+                          ('submit x', 'submit can not be run')):
+        batch_file.write(line + '\n')
+        with pytest.raises(ValueError) as error:
+            batch.read_batch(str(batch_file))
+        assert 'jobs:1: ' + message in str(error.value)
+
+
+def test_batch_leaks_no_cwd(tmpdir, monkeypatch):
+    """
+    Verify concurrent generate, build and tar commands each resolve their
+    paths against their own directory.
+    """
+    lock = threading.Lock()
+    seen = []
+
+    def docker(command, cwd=None, stdin=None):
+        if stdin is not None:
+            b''.join(stdin)
+        # Give the other threads time to run in between
+        time.sleep(0.005)
+        with lock:
+            seen.append((command, cwd))
+
+    monkeypatch.setattr(runner, 'run', fake_run(docker))
+    monkeypatch.chdir(str(tmpdir))
+    original_cwd = os.getcwd()
+    commands = []
+    for number in range(12):
+        directory = tmpdir.mkdir('image{}'.format(number))
+        directory.mkdir('context').join('Dockerfile').write(
+            'FROM centos:7\nCOPY a /a\n')
+        directory.join('context', 'a').write('a')
+        for argv in (['generate-files', '-D', 'n={}'.format(number), 'files'],
+                     ['generate-dockerfile', '-o', 'out', str(number)],
+                     ['build', '-p', 'context', 'image:{}'.format(number)],
+                     ['tar', 'image:{}'.format(number)]):
+            commands.append(batch.Command(argv, str(directory)))
+
+    results = batch.run(commands, 8)
+    assert [x.exit_code for x in results] == [0] * len(commands)
+    assert os.getcwd() == original_cwd
+    for number in range(12):
+        directory = tmpdir.join('image{}'.format(number))
+        assert json.loads(directory.join('files', 'manifest.json').read())[
+            'defaultValues'] == {'n': str(number)}
+        assert directory.join('out', 'Dockerfile').check()
+        assert (['docker', 'build', '-t', 'image:{}'.format(number), '-'],
+                str(directory.join('context'))) in seen
+        assert (['docker', 'save', '-o', str(directory.join(
+            'image-{}.tar'.format(number))), 'image:{}'.format(number)],
+                None) in seen
+    assert not tmpdir.join('files').check()
+    assert not tmpdir.join('out').check()
+
+
+def test_BatchAction(tmpdir, monkeypatch, capsys):
+    """Verify BatchAction reports every command and fails if one did"""
+    monkeypatch.chdir(str(tmpdir))
+    tmpdir.join('jobs').write(
+        'generate-dockerfile -o out image\nbuild -p missing x\n')
+
+    def fail(command, **kwargs):
+        raise subprocess.CalledProcessError(1, command)
+
+    monkeypatch.setattr(runner, 'run', fake_run(fail))
+    with pytest.raises(SystemExit) as error:
+        BatchAction('', '').run(
+            argparse.ArgumentParser(), argparse.Namespace(
+                jobs=2, **GLOBAL_NAMESPACE_KWARGS), 'jobs', '')
+    assert error.value.code == 1
+    out, err = capsys.readouterr()
+    lines = out.splitlines()
+    assert lines[0].startswith('success ')
+    assert lines[0].endswith('generate-dockerfile -o out image')
+    assert lines[1].startswith('failed ')
+    assert '1 of 2 commands failed' in err
+
+    tmpdir.join('jobs').write('# nothing\n')
+    with pytest.raises(SystemExit):
+        BatchAction('', '').run(
+            argparse.ArgumentParser(), argparse.Namespace(
+                jobs=2, **GLOBAL_NAMESPACE_KWARGS), 'jobs', '')
@@ -0,0 +1,87 @@
+# Copyright (C) 2017  Red Hat, Inc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for the benchmark harness.
+"""
+
+import importlib.util
+import json
+import os
+import sys
+import tarfile
+
+import pytest
+
+BENCH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'bench')
+
+
+def _load(name):
+    """Imports a benchmark script by path, as run.py imports stub_tools"""
+    spec = importlib.util.spec_from_file_location(
+        name, os.path.join(BENCH, name + '.py'))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+stub_tools = _load('stub_tools')
+run = _load('run')
+
+
+def test_write_archive(tmpdir):
+    """Verify stub exports are valid docker archives"""
+    path = str(tmpdir.join('image.tar'))
+    with open(path, 'wb') as destination:
+        stub_tools.write_archive(destination, 'image:latest', 300000)
+    with tarfile.open(path) as archive:
+        manifest = json.loads(
+            archive.extractfile('manifest.json').read().decode('utf-8'))
+        assert manifest[0]['RepoTags'] == ['image:latest']
+        layer = archive.extractfile(manifest[0]['Layers'][0])
+        with tarfile.open(fileobj=layer) as layer_archive:
+            assert 0 < layer_archive.getmember('stub/data').size <= 300000
+
+
+def test_parse_size():
+    """Verify human readable sizes"""
+    assert run._parse_size('512') == 512
+    assert run._parse_size('2K') == 2048
+    assert run._parse_size('1.5m') == 1572864
+
+
+def test_run():
+    """Verify a scenario reports its measurements"""
+    results = run.run(['tar'], 1, 0.0, 1024)
+    assert results['tar_size_bytes'] == 1024
+    result = results['results'][0]
+    assert result['scenario'] == 'tar'
+    assert result['manager'] == 'moby'
+    assert result['bytes_written'] > 1024
+    assert result['max_rss_bytes'] > 0
+    assert result['stub_seconds']['median'] > 0
+    assert result['wall_seconds']['median'] >= (
+        result['stub_seconds']['median'])
+
+
+def test_run_once_failure(tmpdir, monkeypatch):
+    """Verify a failing CLI reports its exit status and stderr"""
+    env = dict(os.environ, STUB_LOG=str(tmpdir.join('stub.log')),
+               PYTHONPATH=os.path.join(run.ROOT, 'src'))
+    with pytest.raises(RuntimeError) as error:
+        run.run_once(str(tmpdir.join('work')), env, None, ['no-such'])
+    assert 'no-such failed with 2: ' in str(error.value)
+    assert 'invalid choice' in str(error.value)
@@ -19,26 +19,28 @@ Tests for the cli module.
 import argparse
 import logging
 import os
-import subprocess
 import sys
 
 # Ensure the package is in the path
 sys.path.insert(1, os.path.realpath('./src/'))
 
 from system_buildah.actions.build_action import BuildAction
+from system_buildah.managers import runner
 
 from .constants import *
+from .fake_runner import fake_run
 
 
 def test_BuildAction(monkeypatch):
     """Verify BuildAction runs the proper command"""
     tag = 'a'
-    def assert_call(args):
+    def assert_call(args, cwd=None):
         assert args == [
             'docker', '--tlsverify', '--host=example.org',
             'build', '-t', tag, '.']
+        assert cwd == os.path.realpath('.')
 
-    monkeypatch.setattr(subprocess, 'check_call', assert_call)
+    monkeypatch.setattr(runner, 'run', fake_run(assert_call))
     BuildAction('', '').run(
         '', argparse.Namespace(
             path='.', host='example.org', tlsverify=True,
@@ -0,0 +1,170 @@
+# Copyright (C) 2017  Red Hat, Inc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for BuildManyAction.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import threading
+
+import pytest
+
+# Ensure the package is in the path
+sys.path.insert(1, os.path.realpath('./src/'))
+
+from system_buildah import dockerfile
+from system_buildah.actions.build_many_action import BuildManyAction
+from system_buildah.managers import runner
+from system_buildah.managers.moby import Manager as MobyManager
+
+from .constants import *
+from .fake_runner import fake_run
+
+
+def _make_context(tmpdir, name, base):
+    """Creates an image context with a Dockerfile"""
+    context = tmpdir.mkdir(name)
+    context.join('Dockerfile').write('FROM {}\nRUN true\n'.format(base))
+    return str(context)
+
+
+def _namespace(**kwargs):
+    """Returns a namespace for build-many"""
+    defaults = dict(
+        path='.', host=None, tlsverify=None, jobs=2, directory=None,
+        full_context=True)
+    defaults.update(GLOBAL_NAMESPACE_KWARGS)
+    defaults.update(kwargs)
+    return argparse.Namespace(**defaults)
+
+
+def test_dockerfile_parse():
+    """Verify continuations and comments are handled"""
+    result = dockerfile.parse(
+        '# comment\nFROM a:b\n\nLABEL a="b" \\\n      c="d"\nCMD ["x"]\n')
+    assert result == [
+        ('FROM', 'a:b'), ('LABEL', 'a="b" c="d"'), ('CMD', '["x"]')]
+    assert dockerfile.get_base(result) == 'a:b'
+    assert dockerfile.normalize_reference('a') == 'a:latest'
+    assert dockerfile.normalize_reference('reg:5000/a') == 'reg:5000/a:latest'
+    assert dockerfile.normalize_reference('a:1') == 'a:1'
+
+
+def test_BuildManyAction_orders_by_base(monkeypatch, tmpdir):
+    """Verify images wait for their local base image"""
+    base = _make_context(tmpdir, 'base', 'centos:latest')
+    child = _make_context(tmpdir, 'child', 'base')
+    other = _make_context(tmpdir, 'other', 'fedora')
+    built = []
+    lock = threading.Lock()
+
+    def record_call(args, cwd=None):
+        with lock:
+            built.append(args[-2])
+
+    monkeypatch.setattr(runner, 'run', fake_run(record_call))
+    BuildManyAction('', '').run(
+        argparse.ArgumentParser(), _namespace(),
+        ['{}=child'.format(child), '{}=base'.format(base),
+         '{}=other'.format(other)], '')
+    assert sorted(built) == ['base', 'child', 'other']
+    assert built.index('base') < built.index('child')
+
+
+def test_BuildManyAction_directory(monkeypatch, tmpdir):
+    """Verify a directory of contexts is expanded"""
+    _make_context(tmpdir, 'one', 'centos')
+    _make_context(tmpdir, 'two', 'centos')
+    tmpdir.mkdir('not-a-context')
+    built = []
+
+    def record_call(args, cwd=None):
+        built.append((args[-2], cwd))
+
+    monkeypatch.setattr(runner, 'run', fake_run(record_call))
+    BuildManyAction('', '').run(
+        argparse.ArgumentParser(), _namespace(directory=str(tmpdir)), [], '')
+    assert sorted(built) == [
+        ('one', str(tmpdir.join('one'))), ('two', str(tmpdir.join('two')))]
+
+
+def test_BuildManyAction_failure_skips_dependents(monkeypatch, tmpdir):
+    """Verify a failed base skips dependents and exits non-zero"""
+    base = _make_context(tmpdir, 'base', 'centos')
+    child = _make_context(tmpdir, 'child', 'base:latest')
+
+    def failing_call(args, cwd=None):
+        if args[-2] == 'base':
+            raise subprocess.CalledProcessError(1, args)
+        pytest.fail('child should not have been built')
+
+    monkeypatch.setattr(runner, 'run', fake_run(failing_call))
+    action = BuildManyAction('', '')
+    images = [(base, 'base'), (child, 'child')]
+    results = action._schedule(
+        MobyManager(), _namespace(), images, action._dependencies(images))
+    assert results['base'].status == 'failed'
+    assert results['child'].status == 'skipped'
+
+    with pytest.raises(SystemExit) as error:
+        action.run(
+            argparse.ArgumentParser(), _namespace(),
+            ['{}=base'.format(base), '{}=child'.format(child)], '')
+    assert error.value.code == 1
+
+    # The same tag twice is refused before anything is built
+    with pytest.raises(SystemExit) as error:
+        action.run(
+            argparse.ArgumentParser(), _namespace(),
+            ['{}=base'.format(base), '{}=base:latest'.format(child)], '')
+    assert error.value.code == 2
+
+
+def test_BuildManyAction_unusable_context(monkeypatch, tmpdir):
+    """Verify a build that can not start fails alone"""
+    good = _make_context(tmpdir, 'good', 'centos')
+    missing = str(tmpdir.join('missing'))
+
+    def call(args, cwd=None):
+        if not os.path.isdir(cwd):
+            raise FileNotFoundError(2, 'No such file or directory', cwd)
+
+    monkeypatch.setattr(runner, 'run', fake_run(call))
+    action = BuildManyAction('', '')
+    images = [(good, 'good'), (missing, 'missing')]
+    results = action._schedule(
+        MobyManager(), _namespace(), images, action._dependencies(images))
+    assert results['good'].status == 'success'
+    assert results['missing'].status == 'failed'
+    assert 'No such file or directory' in results['missing'].error
+
+
+def test_BuildManyAction_jobs_checked():
+    """Verify fewer than one job is rejected"""
+    with pytest.raises(SystemExit) as error:
+        BuildManyAction('', '').run(
+            argparse.ArgumentParser(), _namespace(jobs=0), ['a=b'], '')
+    assert error.value.code == 2
+
+
+def test_BuildManyAction_cycle():
+    """Verify images depending on each other are skipped"""
+    results = BuildManyAction('', '')._schedule(
+        None, _namespace(), [('a', 'a'), ('b', 'b')],
+        {'a': {'b'}, 'b': {'a'}})
+    assert results['a'].status == results['b'].status == 'skipped'
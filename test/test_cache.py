@@ -0,0 +1,181 @@
+# Copyright (C) 2017  Red Hat, Inc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for the cache module.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+# Ensure the package is in the path
+sys.path.insert(1, os.path.realpath('./src/'))
+
+from system_buildah import cache, dockerfile, managers
+
+from .constants import *
+
+
+class RecordingManager(managers.ImageManager):
+    """Manager that records what it was asked to do"""
+
+    def __init__(self, tmpdir):
+        self.tmpdir = tmpdir
+        self.calls = []
+        self.images = {}
+
+    def build(self, namespace, tag):
+        self.calls.append(('build', tag))
+        self.images[tag] = 'sha256:{}'.format(len(self.calls))
+
+    def tar(self, namespace, output):
+        self.calls.append(('tar', output))
+        path = str(self.tmpdir.join(self.tar_path(output)))
+        with open(path, 'w') as tar:
+            tar.write('layers')
+        return path
+
+    def image_id(self, namespace, image):
+        return self.images[image]
+
+    def stream_command(self, namespace, image):
+        return ['cat', self.tar_path(image)]
+
+    def tag_image(self, namespace, image, tag):
+        if image not in self.images.values():
+            raise subprocess.CalledProcessError(1, ['tag'])
+        self.calls.append(('tag', tag))
+        self.images[tag] = image
+
+
+def _make_context(tmpdir):
+    """Creates a build context"""
+    context = tmpdir.mkdir('context')
+    context.join('Dockerfile').write(
+        'FROM centos\nCOPY init.sh /\nCOPY files/ /files\n'
+        'ADD http://example.org/a /a\n')
+    context.join('init.sh').write('#!/bin/bash\n')
+    context.mkdir('files').join('one.txt').write('one')
+    context.join('unrelated.txt').write('noise')
+    return context
+
+
+def test_get_sources():
+    """Verify COPY and ADD sources are found"""
+    instructions = dockerfile.parse(
+        'FROM a\nCOPY --chown=1:1 a b /dest/\nADD ["c d", "/x"]\n'
+        'ADD http://example.org/e /e\nCOPY --from=builder /f /f\n')
+    assert dockerfile.get_sources(instructions) == ['a', 'b', 'c d']
+
+
+def test_context_digest(tmpdir):
+    """Verify the digest follows the files that go into the build"""
+    context = _make_context(tmpdir)
+    first = cache.context_digest(str(context), 'moby')
+    assert first == cache.context_digest(str(context), 'moby')
+    assert first != cache.context_digest(str(context), 'buildah')
+
+    # Files that are not used don't matter
+    context.join('unrelated.txt').write('more noise')
+    assert first == cache.context_digest(str(context), 'moby')
+
+    # Files inside copied directories do
+    context.join('files').join('one.txt').write('changed')
+    second = cache.context_digest(str(context), 'moby')
+    assert first != second
+
+    # So do the build options and .dockerignore
+    assert second == cache.context_digest(
+        str(context), 'moby', options={'scripted': False})
+    for name in cache.BUILD_OPTIONS:
+        assert second != cache.context_digest(
+            str(context), 'moby', options={name: True})
+    context.join('.dockerignore').write('*.txt\n')
+    assert second != cache.context_digest(str(context), 'moby')
+
+
+def test_BuildCache_eviction(tmpdir):
+    """Verify entries are evicted by count and by age"""
+    build_cache = cache.BuildCache(str(tmpdir), max_entries=2, max_age=60)
+    for key in ('a', 'b', 'c'):
+        build_cache.put('builds', key, image_id=key)
+    assert build_cache.get('builds', 'a') is None
+    assert build_cache.get('builds', 'c')['image_id'] == 'c'
+
+    build_cache.max_age = 0
+    time.sleep(0.01)
+    assert build_cache.get('builds', 'b') is None
+    assert build_cache.get('builds', 'c') is None
+
+
+def test_build_skips_unchanged_context(tmpdir):
+    """Verify a second build of the same context only tags"""
+    context = _make_context(tmpdir)
+    builder = RecordingManager(tmpdir)
+    build_cache = cache.BuildCache(str(tmpdir.mkdir('cache')))
+    ns = argparse.Namespace(path=str(context), **GLOBAL_NAMESPACE_KWARGS)
+
+    assert cache.build(builder, ns, 'one', build_cache) is False
+    assert cache.build(builder, ns, 'two', build_cache) is True
+    assert builder.calls == [('build', 'one'), ('tag', 'two')]
+    assert builder.images['two'] == builder.images['one']
+
+    # Without a cache everything builds
+    assert cache.build(builder, ns, 'three') is False
+    assert builder.calls[-1] == ('build', 'three')
+
+
+def test_build_rebuilds_missing_image(tmpdir):
+    """Verify a cached image that no longer exists is rebuilt"""
+    context = _make_context(tmpdir)
+    builder = RecordingManager(tmpdir)
+    build_cache = cache.BuildCache(str(tmpdir.mkdir('cache')))
+    ns = argparse.Namespace(path=str(context), **GLOBAL_NAMESPACE_KWARGS)
+
+    cache.build(builder, ns, 'one', build_cache)
+    builder.images.clear()
+    assert cache.build(builder, ns, 'one', build_cache) is False
+    assert builder.calls == [('build', 'one'), ('build', 'one')]
+
+
+def test_tar_skips_unchanged_image(tmpdir, monkeypatch):
+    """Verify a second export of the same image reuses the tar"""
+    monkeypatch.chdir(str(tmpdir))
+    builder = RecordingManager(tmpdir)
+    builder.images['image:latest'] = 'sha256:1'
+    build_cache = cache.BuildCache(str(tmpdir.mkdir('cache')))
+    ns = argparse.Namespace(**GLOBAL_NAMESPACE_KWARGS)
+
+    path = cache.tar(builder, ns, 'image:latest', build_cache)
+    assert cache.tar(builder, ns, 'image:latest', build_cache) == path
+    assert builder.calls == [('tar', 'image:latest')]
+
+    # A changed file is exported again
+    with open(path, 'a') as tar:
+        tar.write('changed')
+    cache.tar(builder, ns, 'image:latest', build_cache)
+    assert len(builder.calls) == 2
+
+
+def test_from_namespace(tmpdir):
+    """Verify the cache is only used when requested"""
+    assert cache.from_namespace(argparse.Namespace()) is None
+    build_cache = cache.from_namespace(argparse.Namespace(
+        cache=True, cache_dir=str(tmpdir), cache_max_entries=1,
+        cache_max_age=1))
+    assert build_cache.max_age == 86400
+    assert build_cache.path == str(tmpdir)
@@ -0,0 +1,106 @@
+# Copyright (C) 2017  Red Hat, Inc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for building the command line parser.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import warnings
+
+# Ensure the package is in the path
+sys.path.insert(1, os.path.realpath('./src/'))
+
+from system_buildah import cli, compression
+from system_buildah.actions import LazyAction, SystemBuildahAction
+
+#: Modules building the parser must not import. shutil is left out as
+#: argparse itself imports it to size help output.
+HEAVY_MODULES = (
+    'jinja2', 'json', 'tempfile', 'gzip', 'hashlib', 'tarfile',
+    'concurrent.futures', 'system_buildah.render', 'system_buildah.cache',
+    'system_buildah.compression', 'system_buildah.oci',
+    'system_buildah.managers', 'system_buildah.managers.buildah')
+
+
+def _lazy_actions(parser):
+    """Yields every command name with each of its LazyActions"""
+    for action in parser._actions:
+        if isinstance(action, argparse._SubParsersAction):
+            for name, command in action.choices.items():
+                for argument in command._actions:
+                    if isinstance(argument, LazyAction):
+                        yield name, argument
+
+
+def test_build_parser_imports():
+    """Verify building the parser imports no action or heavy module"""
+    script = (
+        'import sys\n'
+        'before = set(sys.modules)\n'
+        'from system_buildah import cli\n'
+        'cli.build_parser()\n'
+        'print(" ".join(sorted(set(sys.modules) - before)))\n')
+    env = dict(os.environ, PYTHONPATH=os.path.realpath('./src/'))
+    output = subprocess.check_output(
+        [sys.executable, '-c', script], env=env)
+    loaded = output.decode('utf-8').split()
+    assert 'system_buildah.cli' in loaded
+    assert not [x for x in loaded if x.endswith('_action')]
+    assert not set(loaded) & set(HEAVY_MODULES)
+
+
+def test_lazy_actions_load():
+    """Verify every command resolves to its real action"""
+    actions = list(_lazy_actions(cli.build_parser()))
+    assert {x for x, _ in actions} == {
+        'batch', 'build', 'build-many', 'export-layout', 'extract',
+        'generate-dockerfile', 'generate-files', 'inspect-tar', 'merge-tar',
+        'pipeline', 'serve', 'submit', 'tar'}
+    for _, action in actions:
+        real = action.load()
+        assert isinstance(real, SystemBuildahAction)
+        assert type(real).__name__ == action._name
+        assert (real.dest, real.nargs) == (action.dest, action.nargs)
+
+
+def test_lazy_action_call(monkeypatch):
+    """Verify calling a LazyAction runs the real action"""
+    calls = []
+    action = LazyAction(
+        'system_buildah.actions.build_action', 'BuildAction', [], 'tag')
+    monkeypatch.setattr(
+        SystemBuildahAction, '__call__',
+        lambda self, *args: calls.append((type(self).__name__, args)))
+    action('parser', 'namespace', 'image')
+    assert calls == [('BuildAction', ('parser', 'namespace', 'image', None))]
+
+
+def test_compression_codecs():
+    """Verify the tar codec choices match the compressors"""
+    assert sorted(cli.COMPRESSION_CODECS) == sorted(compression.COMPRESSORS)
+
+
+def test_buildah_warns_on_use():
+    """Verify importing the buildah manager does not warn until used"""
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        from system_buildah.managers import buildah
+        assert caught == []
+        buildah.Manager()
+    assert [str(x.message) for x in caught] == [
+        'The buildah manager is experimental!']
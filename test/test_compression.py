@@ -0,0 +1,68 @@
+# Copyright (C) 2017  Red Hat, Inc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for the compression module.
+"""
+
+import gzip
+import io
+import lzma
+import os
+import sys
+
+import pytest
+
+# Ensure the package is in the path
+sys.path.insert(1, os.path.realpath('./src/'))
+
+from system_buildah import compression
+
+
+DATA = b''.join(
+    '{} some fairly compressible line\n'.format(x).encode('utf-8')
+    for x in range(20000))
+
+
+@pytest.mark.parametrize('codec,decompress', [
+    ('gzip', gzip.decompress),
+    ('xz', lzma.decompress),
+])
+def test_compress_stream_round_trip(codec, decompress):
+    """Verify block compressed output decompresses to the input"""
+    destination = io.BytesIO()
+    read, written = compression.compress_stream(
+        io.BytesIO(DATA), destination, codec, threads=3, block_size=4096)
+    assert read == len(DATA)
+    assert written == len(destination.getvalue())
+    assert written < read
+    assert decompress(destination.getvalue()) == DATA
+
+
+def test_compress_stream_zstd():
+    """Verify zstd output is a series of valid frames"""
+    zstandard = pytest.importorskip('zstandard')
+    destination = io.BytesIO()
+    compression.compress_stream(
+        io.BytesIO(DATA), destination, 'zstd', threads=2, block_size=65536)
+    reader = zstandard.ZstdDecompressor().stream_reader(
+        io.BytesIO(destination.getvalue()), read_across_frames=True)
+    assert reader.read() == DATA
+
+
+def test_available():
+    """Verify available knows the codecs"""
+    assert compression.available('gzip')
+    assert compression.available('xz')
+    assert not compression.available('lz4')
@@ -0,0 +1,141 @@
+# Copyright (C) 2017  Red Hat, Inc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for minimal build contexts.
+"""
+
+import argparse
+import io
+import os
+import subprocess
+import sys
+import tarfile
+
+import pytest
+
+# Ensure the package is in the path
+sys.path.insert(1, os.path.realpath('./src/'))
+
+from system_buildah import context
+from system_buildah.managers import moby, runner
+
+from .constants import *
+from .fake_runner import fake_run
+
+
+def _context(tmpdir, dockerfile):
+    """Creates a context with used and stray files"""
+    tmpdir.join('Dockerfile').write(dockerfile)
+    tmpdir.join('init.sh').write('#!/bin/sh\n')
+    tmpdir.join('.hidden').write('h')
+    tmpdir.mkdir('conf').join('app.conf').write('a=b\n')
+    tmpdir.join('stray.iso').write_binary(b'x' * 10000)
+    return str(tmpdir)
+
+
+def _names(chunks):
+    with tarfile.open(fileobj=io.BytesIO(b''.join(chunks))) as archive:
+        return archive.getnames()
+
+
+def test_plan(tmpdir):
+    """Verify only COPY and ADD sources are picked"""
+    path = _context(tmpdir, (
+        'FROM a\nCOPY init.sh /usr/bin\nADD ["conf/", "/etc/"]\n'
+        'ADD http://example.org/x /x\nCOPY --from=build /x /x\n'))
+    result = context.plan(path)
+    assert result.members == [
+        'Dockerfile', 'conf', os.path.join('conf', 'app.conf'), 'init.sh']
+    assert result.bytes_skipped == 10001
+    assert result.bytes_sent == sum(os.path.getsize(
+        os.path.join(path, x)) for x in ('Dockerfile', 'conf/app.conf',
+                                          'init.sh'))
+    assert _names(context.tar_stream(path, result.members)) == result.members
+
+
+def test_plan_wildcards(tmpdir):
+    """Verify wildcards match dot files but not across directories"""
+    path = _context(tmpdir, 'FROM a\nCOPY *.sh .h* /x/\n')
+    assert context.plan(path).members == ['.hidden', 'Dockerfile', 'init.sh']
+
+
+@pytest.mark.parametrize('dockerfile', [
+    'FROM a\nCOPY $SRC /x\n',
+    'FROM a\nCOPY missing /x\n',
+    'FROM a\nCOPY ../outside /x\n',
+    'FROM a\nCOPY . /x\n',
+])
+def test_plan_whole_context(tmpdir, dockerfile):
+    """Verify sources that can not be narrowed send everything"""
+    path = _context(tmpdir, dockerfile)
+    result = context.plan(path)
+    assert result is None or result.bytes_skipped == 0
+    assert context.plan(str(tmpdir.join('no-dockerfile'))) is None
+
+
+def test_dockerignore(tmpdir):
+    """Verify files excluded by .dockerignore are not sent"""
+    path = _context(tmpdir, 'FROM a\nCOPY conf /etc/\nCOPY . /x\n')
+    tmpdir.join('conf', 'secret.key').write('k')
+    tmpdir.join('conf').mkdir('cache').join('a.tmp').write('t')
+    tmpdir.join('.dockerignore').write(
+        '# comment\n*.iso\n**/*.key\nconf/cache\n!conf/cache/keep\n'
+        'Dockerfile\n/.h?dden\n')
+    expected = ['.dockerignore', 'Dockerfile', 'conf',
+                os.path.join('conf', 'app.conf'), 'init.sh']
+    assert context.plan(str(tmpdir)).members == expected
+    body, plan = context.build_context(argparse.Namespace(
+        path=path, full_context=True))
+    assert plan is None
+    assert sorted(_names(body())) == expected
+
+    patterns = context.read_dockerignore(path)
+    assert not context.ignored(os.path.join('conf', 'cache', 'keep'),
+                               patterns)
+    assert context.ignored(os.path.join('conf', 'cache', 'other'), patterns)
+    assert context.ignored(os.path.join('a', 'b', 'c.key'), patterns)
+    assert not context.ignored('init.sh', [(False, context._compile(
+        '[!i]*.sh'))])
+
+
+def test_moby_build_sends_minimal_context(tmpdir, monkeypatch):
+    """Verify docker build reads only the used files from stdin"""
+    path = _context(tmpdir, 'FROM a\nCOPY init.sh /usr/bin\n')
+    sent = {}
+
+    def feed(command, cwd=None, stdin=None):
+        sent['command'] = command
+        sent['names'] = _names(stdin)
+
+    monkeypatch.setattr(runner, 'run', fake_run(feed))
+    namespace = argparse.Namespace(
+        path=path, host=None, tlsverify=False, **GLOBAL_NAMESPACE_KWARGS)
+    moby.Manager().build(namespace, 'a:1')
+    assert sent['command'] == ['docker', 'build', '-t', 'a:1', '-']
+    assert sent['names'] == ['Dockerfile', 'init.sh']
+
+    def fail(command, cwd=None, stdin=None):
+        raise subprocess.CalledProcessError(3, command)
+
+    monkeypatch.setattr(runner, 'run', fake_run(fail))
+    with pytest.raises(subprocess.CalledProcessError):
+        moby.Manager().build(namespace, 'a:1')
+
+    calls = []
+    monkeypatch.setattr(runner, 'run', fake_run(
+        lambda args, cwd=None: calls.append(args)))
+    namespace.full_context = True
+    moby.Manager().build(namespace, 'a:1')
+    assert calls == [['docker', 'build', '-t', 'a:1', '.']]
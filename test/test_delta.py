@@ -0,0 +1,153 @@
+# Copyright (C) 2017  Red Hat, Inc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for delta archives.
+"""
+
+import argparse
+import io
+import json
+import os
+import sys
+import tarfile
+
+import pytest
+
+# Ensure the package is in the path
+sys.path.insert(1, os.path.realpath('./src/'))
+
+from system_buildah import delta
+from system_buildah.actions.merge_tar_action import MergeTarAction
+from system_buildah.actions.tar_action import TarAction
+from system_buildah.managers.moby import Manager as MobyManager
+
+from .constants import *
+from .test_layout import LAYERS, _archive, _digest
+
+
+def _contents(path):
+    """Returns the data of every regular file in an archive"""
+    with tarfile.open(path) as archive:
+        return {x.name: archive.extractfile(x).read()
+                for x in archive if x.isfile()}
+
+
+@pytest.mark.parametrize('oci_style', [False, True])
+def test_delta_round_trip(tmpdir, oci_style):
+    """Verify a delta leaves out shared layers and merges back"""
+    base = tmpdir.join('a.tar')
+    base.write_binary(_archive(['a:latest'], oci_style))
+    new = tmpdir.join('b.tar')
+    new.write_binary(_archive(['b:1'], oci_style))
+    output = str(tmpdir.join('b.delta.tar'))
+
+    known = set(delta.read_layers(str(base)))
+    assert known == {_digest(LAYERS['base']), _digest(LAYERS['a'])}
+    skipped, written = delta.write_delta(
+        io.BytesIO(new.read_binary()), known, output)
+    assert skipped == len(LAYERS['base'])
+    assert written == os.path.getsize(output)
+    data = _contents(output)
+    assert LAYERS['base'] not in data.values()
+    assert LAYERS['b'] in data.values()
+    omitted = json.loads(data[delta.DELTA_MEMBER].decode('utf-8'))['omitted']
+    assert list(omitted.values()) == [_digest(LAYERS['base'])]
+
+    # A delta still lists every layer, so it can be the base of the next one
+    assert delta.read_layers(output)[_digest(LAYERS['base'])] is None
+
+    merged = str(tmpdir.join('b-full.tar'))
+    delta.merge(str(base), output, merged)
+    assert _contents(merged) == _contents(str(new))
+
+
+def test_delta_to_a_stream():
+    """Verify known layers are never written, so nothing is cut again"""
+    class Pipe(io.RawIOBase):
+        def __init__(self):
+            self.data = b''
+
+        def writable(self):
+            return True
+
+        def tell(self):
+            return len(self.data)
+
+        def write(self, data):
+            self.data += bytes(data)
+            return len(data)
+
+    pipe = Pipe()
+    omitted, skipped = delta._write_delta(
+        io.BytesIO(_archive(['b:1'])), {_digest(LAYERS['base'])}, pipe)
+    assert skipped == len(LAYERS['base'])
+    assert LAYERS['base'] not in pipe.data
+    assert LAYERS['b'] in pipe.data
+
+
+def test_merge_missing_layer(tmpdir):
+    """Verify merging onto the wrong base fails without output"""
+    base = tmpdir.join('a.tar')
+    base.write_binary(_archive(['a:latest']))
+    output = str(tmpdir.join('b.delta.tar'))
+    delta.write_delta(io.BytesIO(_archive(['b:1'])),
+                      {_digest(LAYERS['base'])}, output)
+    other = tmpdir.join('other.tar')
+    other.write_binary(_archive(['b:1']))
+    with pytest.raises(delta.DeltaError):
+        delta.merge(output, str(other), str(tmpdir.join('x.tar')))
+    unrelated = tmpdir.join('unrelated.tar')
+    with tarfile.open(str(unrelated), 'w') as archive:
+        archive.addfile(tarfile.TarInfo('empty'))
+    with pytest.raises(delta.DeltaError):
+        delta.merge(str(unrelated), output, str(tmpdir.join('out.tar')))
+    assert not tmpdir.join('out.tar').check()
+    assert not tmpdir.join('out.tar.part').check()
+
+
+def test_TarAction_since(monkeypatch, tmpdir):
+    """Verify tar --since writes a delta that merge-tar completes"""
+    base = tmpdir.join('a.tar')
+    base.write_binary(_archive(['a:latest']))
+    new = tmpdir.join('save')
+    new.write_binary(_archive(['b:1']))
+    monkeypatch.setattr(MobyManager, 'stream_command',
+                        lambda s, n, i: ['cat', str(new)])
+    monkeypatch.chdir(tmpdir)
+    TarAction('', '').run(
+        '', argparse.Namespace(
+            host=None, tlsverify=False, compress=None, output=None,
+            since=str(base), **GLOBAL_NAMESPACE_KWARGS),
+        'b:1')
+    assert tmpdir.join('b-1.delta.tar').check()
+
+    MergeTarAction('', '').run(
+        argparse.ArgumentParser(), argparse.Namespace(
+            base=str(base), output='b-1.tar', **GLOBAL_NAMESPACE_KWARGS),
+        'b-1.delta.tar', None)
+    assert _contents('b-1.tar') == _contents(str(new))
+
+
+def test_TarAction_since_errors(monkeypatch, tmpdir):
+    """Verify bad --since use is reported as a usage error"""
+    parser = argparse.ArgumentParser()
+    namespace = argparse.Namespace(
+        host=None, tlsverify=False, compress='gzip', output=None,
+        since=str(tmpdir.join('missing.tar')), **GLOBAL_NAMESPACE_KWARGS)
+    with pytest.raises(SystemExit):
+        TarAction('', '').run(parser, namespace, 'b:1')
+    namespace.compress = None
+    with pytest.raises(SystemExit):
+        TarAction('', '').run(parser, namespace, 'b:1')
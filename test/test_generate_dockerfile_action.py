@@ -20,11 +20,13 @@ import argparse
 import os
 import sys
 
+import pytest
+
 # Ensure the package is in the path
 sys.path.insert(1, os.path.realpath('./src/'))
 
 from system_buildah.actions.generate_dockerfile_action import (
-    GenerateDockerfileAction)
+    EXPLAINABLE, GenerateDockerfileAction)
 
 from .constants import *
 
@@ -60,3 +62,99 @@ def test_GenerateDockerfileAction(tmpdir):
             elif k in ['output', 'add_file', 'manager']:
                 continue
             assert '{}="{}"'.format(k, v) in data
+
+
+def _copied_files(data):
+    """Returns where each COPY of a Dockerfile puts its sources"""
+    from system_buildah import dockerfile
+    placed = {}
+    for item in dockerfile.parse(data):
+        if item.instruction != 'COPY':
+            continue
+        sources, destination = dockerfile.split_copy_arguments(item.arguments)
+        for source in sources:
+            if destination.endswith('/'):
+                placed[source] = destination + os.path.basename(source)
+            else:
+                placed[source] = destination
+    return placed
+
+
+def test_GenerateDockerfileAction_compact(tmpdir):
+    """Verify the compact style places files the same with fewer layers"""
+    from system_buildah import dockerfile
+    add_file = []
+    for index in range(30):
+        name = 'file{}.conf'.format(index)
+        tmpdir.join(name).write(name)
+        add_file.append('{}=/etc/app{}/{}'.format(name, index % 3, name))
+    # Renamed on the host, or not in the context, so copied on its own
+    tmpdir.join('local.conf').write('x')
+    add_file += ['local.conf=/etc/other.conf', 'later=/etc/later']
+    namespace = argparse.Namespace(
+        output=str(tmpdir), from_base='base', maintainer='m', license='l',
+        summary='s', version='1', help_text='h', architecture='a',
+        scope='public', add_file=add_file, style='compact',
+        **GLOBAL_NAMESPACE_KWARGS)
+    messages = []
+    parser = argparse.ArgumentParser()
+    parser._print_message = lambda message, file=None: messages.append(
+        message)
+    GenerateDockerfileAction('', '').run(parser, namespace, 'name', '')
+    compact = tmpdir.join('Dockerfile').read()
+    namespace.style = 'classic'
+    classic = GenerateDockerfileAction('', '').render_dockerfile(
+        namespace, 'name', str(tmpdir))
+
+    assert _copied_files(compact) == _copied_files(classic)
+    compact_layers = dockerfile.count_layers(dockerfile.parse(compact))
+    classic_layers = dockerfile.count_layers(dockerfile.parse(classic))
+    assert classic_layers == 39
+    assert compact_layers == 8
+    assert messages == [
+        'Dockerfile layers: 39 with the classic style, 8 with the compact '
+        'style\n']
+    run = [x for x in dockerfile.parse(compact) if x.instruction == 'RUN']
+    for directory in ('/etc', '/etc/app0', '/etc/app1', '/etc/app2'):
+        assert '/export/hostfs{} '.format(directory) in run[0].arguments + ' '
+
+
+def test_GenerateDockerfileAction_cache_friendly(tmpdir):
+    """Verify labels come last and explain shows what a change rebuilds"""
+    from system_buildah import dockerfile
+    tmpdir.join('a.conf').write('a')
+    namespace = argparse.Namespace(
+        output=str(tmpdir), from_base='base', maintainer='m', license='l',
+        summary='s', version='1', help_text='h', architecture='a',
+        scope='public', add_file=['a.conf=/etc/a.conf'],
+        style='cache-friendly', explain=['version', 'a.conf'],
+        **GLOBAL_NAMESPACE_KWARGS)
+    messages = []
+    parser = argparse.ArgumentParser()
+    parser._print_message = lambda message, file=None: messages.append(
+        message)
+    action = GenerateDockerfileAction('', '')
+    action.run(parser, namespace, 'name', '')
+    instructions = dockerfile.parse(tmpdir.join('Dockerfile').read())
+    assert instructions[-1].instruction == 'LABEL'
+    assert instructions[-1].arguments.endswith('version="1"')
+
+    assert messages[1].startswith(
+        'Changing version invalidates 1 of 7 steps (0 layers):\n')
+    assert messages[2].startswith(
+        'Changing a.conf invalidates 4 of 7 steps (2 layers):\n'
+        '    4 COPY a.conf /export/hostfs/etc/\n')
+
+    # Inputs that are neither options nor added files are refused
+    namespace.explain = ['unused']
+    with pytest.raises(SystemExit):
+        action.run(parser, namespace, 'name', '')
+    assert messages[-1].endswith(
+        'Unable to explain unused. Valid inputs are: {}, init.sh, a.conf, '
+        'manifest.json, service.template, config.json.template\n'.format(
+            ', '.join(EXPLAINABLE)))
+
+    # The classic style rebuilds everything after FROM on a new version
+    namespace.style = 'classic'
+    assert action.explain(namespace, 'name', str(tmpdir), 'name').startswith(
+        'Changing name invalidates 7 of 8 steps (5 layers):\n')
@@ -17,9 +17,13 @@ Tests for GenerateFilesAction.
 """
 
 import argparse
+import json
 import os
+import subprocess
 import sys
 
+import pytest
+
 # Ensure the package is in the path
 sys.path.insert(1, os.path.realpath('./src/'))
 
@@ -83,3 +87,138 @@ def test_GenerateFilesAction__generate_ocitools_command(monkeypatch):
 
     result = GenerateFilesAction('', '')._generate_ocitools_command(ns, parser)
     assert result == cmd
+
+
+def test_GenerateFilesAction_run(monkeypatch, tmpdir):
+    """Verify GenerateFiles writes every file without ocitools"""
+    def fail(*args, **kwargs):
+        pytest.fail('ocitools should not run')
+
+    monkeypatch.setattr(subprocess, 'check_call', fail)
+    ns = argparse.Namespace(
+        description='testing', config='--cwd=/root --hostname=confighost',
+        default=['a=b'], **GLOBAL_NAMESPACE_KWARGS)
+    GenerateFilesAction('', '').run(
+        argparse.ArgumentParser(), ns, str(tmpdir), '')
+    assert sorted(os.listdir(str(tmpdir))) == [
+        'config.json.template', 'init.sh', 'manifest.json',
+        'service.template']
+    config = json.loads(tmpdir.join('config.json.template').read())
+    assert config['process']['cwd'] == '/root'
+    assert config['process']['terminal'] is False
+    assert config['hostname'] == 'confighost'
+    assert config['root']['readonly'] is True
+
+
+def test_GenerateFilesAction_run_falls_back(monkeypatch, tmpdir):
+    """Verify options the builtin generator lacks go to ocitools"""
+    calls = []
+
+    def ocitools(args, cwd):
+        calls.append(args)
+        with open(os.path.join(cwd, 'config.json'), 'w') as config:
+            json.dump({'process': {'terminal': True}}, config)
+
+    monkeypatch.setattr(subprocess, 'check_call', ocitools)
+    ns = argparse.Namespace(
+        description='testing', config='--os=linux', default=[],
+        **GLOBAL_NAMESPACE_KWARGS)
+    GenerateFilesAction('', '').run(
+        argparse.ArgumentParser(), ns, str(tmpdir), '')
+    assert calls == [
+        ['ocitools', 'generate', '--read-only', '--os', 'linux']]
+    config = json.loads(tmpdir.join('config.json.template').read())
+    assert config == {'process': {'terminal': False}}
+
+
+def test_GenerateFilesAction_inventory(monkeypatch, tmpdir):
+    """Verify an inventory generates many images sharing rendered files"""
+    calls = []
+
+    def ocitools(args, cwd):
+        calls.append(args)
+        with open(os.path.join(cwd, 'config.json'), 'w') as config:
+            json.dump({'process': {'terminal': True}}, config)
+
+    monkeypatch.setattr(subprocess, 'check_call', ocitools)
+    inventory_file = tmpdir.join('fleet.json')
+    inventory_file.write(json.dumps({
+        'defaults': {'config': ['--os=linux'], 'description': 'shared'},
+        'images': [
+            {'path': 'one', 'default': {'a': 'b'}},
+            {'path': 'group/two', 'description': 'second'},
+            {'path': 'three', 'config': '--cwd=/srv'},
+        ]}))
+    output = tmpdir.join('out')
+    ns = argparse.Namespace(
+        description='UNKNOWN', config=None, default=['x=y'], jobs=2,
+        inventory=str(inventory_file), **GLOBAL_NAMESPACE_KWARGS)
+    GenerateFilesAction('', '').run(
+        argparse.ArgumentParser(), ns, str(output), '')
+
+    # ocitools ran once for the two images sharing its options
+    assert calls == [
+        ['ocitools', 'generate', '--read-only', '--os', 'linux']]
+    for path in ('one', 'group/two', 'three'):
+        assert sorted(os.listdir(str(output.join(path)))) == [
+            'config.json.template', 'init.sh', 'manifest.json',
+            'service.template']
+    manifest = json.loads(output.join('one', 'manifest.json').read())
+    assert manifest['defaultValues'] == {'a': 'b'}
+    manifest = json.loads(output.join('three', 'manifest.json').read())
+    assert manifest['defaultValues'] == {'x': 'y'}
+    assert 'second' in output.join('group', 'two', 'service.template').read()
+    assert 'shared' in output.join('one', 'service.template').read()
+    config = json.loads(output.join('three', 'config.json.template').read())
+    assert config['process']['cwd'] == '/srv'
+
+
+def test_GenerateFilesAction_inventory_yaml_and_errors(tmpdir):
+    """Verify YAML inventories load and malformed ones are refused"""
+    yaml = pytest.importorskip('yaml')
+    from system_buildah import inventory
+
+    path = tmpdir.join('fleet.yaml')
+    path.write(yaml.safe_dump([
+        {'path': 'a', 'config': ['--cwd=/']}, {'path': 'b'}]))
+    assert inventory.load(str(path)) == [
+        {'path': 'a', 'config': '--cwd=/'}, {'path': 'b'}]
+
+    for content in ('[{"path": "a"}, {"path": "./a"}]', '[{"name": "a"}]',
+                    '[{"path": "a", "bad": 1}]', '"text"'):
+        path = tmpdir.join('bad.json')
+        path.write(content)
+        with pytest.raises(ValueError):
+            inventory.load(str(path))
+        ns = argparse.Namespace(inventory=str(path), **GLOBAL_NAMESPACE_KWARGS)
+        with pytest.raises(SystemExit):
+            GenerateFilesAction('', '').run(
+                argparse.ArgumentParser(), ns, str(tmpdir), '')
+
+
+def test_GenerateFilesAction_inventory_entries(tmpdir):
+    """Verify malformed entries and paths leaving the output are refused"""
+    from system_buildah import inventory
+
+    for content in ('[1]', '{"images": {"path": "a"}}', '[{"path": 1}]',
+                    '{"defaults": ["a"], "images": [{"path": "a"}]}'):
+        path = tmpdir.join('bad.json')
+        path.write(content)
+        with pytest.raises(ValueError):
+            inventory.load(str(path))
+
+    output = tmpdir.mkdir('out')
+    ns = argparse.Namespace(**GLOBAL_NAMESPACE_KWARGS)
+    assert inventory.entry_namespace(ns, {'path': 'a/../b'}, str(output))[
+        1] == str(output.join('b'))
+    for escape in ('../a', '/etc', 'a/../../b'):
+        with pytest.raises(ValueError):
+            inventory.entry_namespace(ns, {'path': escape}, str(output))
+
+    path = tmpdir.join('escape.json')
+    path.write('[{"path": "../escaped"}]')
+    ns = argparse.Namespace(inventory=str(path), **GLOBAL_NAMESPACE_KWARGS)
+    with pytest.raises(SystemExit):
+        GenerateFilesAction('', '').run(
+            argparse.ArgumentParser(), ns, str(output), '')
+    assert not tmpdir.join('escaped').check()
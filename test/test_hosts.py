@@ -0,0 +1,256 @@
+# Copyright (C) 2017  Red Hat, Inc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for spreading builds over several hosts.
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+
+import pytest
+
+# Ensure the package is in the path
+sys.path.insert(1, os.path.realpath('./src/'))
+
+from system_buildah import cli
+from system_buildah.managers import hosts, moby, moby_api, runner
+
+from .fake_daemon import FakeDaemon
+from .fake_runner import fake_run
+
+
+@pytest.fixture
+def daemons():
+    """Two fake daemons and the path of a socket nobody listens on"""
+    directory = tempfile.mkdtemp(prefix='sb')
+    with FakeDaemon(os.path.join(directory, 'a.sock')) as first, \
+            FakeDaemon(os.path.join(directory, 'b.sock')) as second:
+        yield first, second, 'unix://' + os.path.join(directory, 'dead.sock')
+    moby_api._CLIENTS.clear()
+    shutil.rmtree(directory)
+
+
+def _namespace(host_list, path, **kwargs):
+    """Returns a moby-api namespace spreading builds over host_list"""
+    defaults = dict(
+        host=host_list[0] if host_list else None, hosts=host_list, hosts_file=None, host_jobs=1,
+        placement='least-loaded', tlsverify=False, path=path,
+        manager='moby-api', full_context=True)
+    defaults.update(kwargs)
+    return argparse.Namespace(**defaults)
+
+
+def _context(tmpdir):
+    tmpdir.join('Dockerfile').write('FROM scratch\n')
+    return str(tmpdir)
+
+
+def test_cli_hosts():
+    """Verify -H may be repeated and the first one stays the host"""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-H', '--host', action=cli._HostAction)
+    parser.set_defaults(hosts=None)
+    namespace = parser.parse_args(['-H', 'a', '--host', 'b'])
+    assert namespace.host == 'a'
+    assert namespace.hosts == ['a', 'b']
+    namespace = parser.parse_args([])
+    assert namespace.host is None and namespace.hosts is None
+
+
+def test_read_hosts_file(tmpdir):
+    """Verify hosts files list hosts and optional limits"""
+    path = tmpdir.join('hosts')
+    path.write('# build hosts\ntcp://a:2376 4\n\ntcp://b:2376  # slow\n')
+    assert hosts.read_hosts_file(str(path), 3) == [
+        ('tcp://a:2376', 4), ('tcp://b:2376', 3)]
+    namespace = argparse.Namespace(
+        hosts=['tcp://b:2376', 'tcp://c:2376'], hosts_file=str(path),
+        host_jobs=None)
+    assert hosts.from_namespace(namespace) == [
+        ('tcp://b:2376', 2), ('tcp://c:2376', 2), ('tcp://a:2376', 4)]
+    for line in ('a 0\n', 'a b\n', 'a 1 2\n'):
+        path.write(line)
+        with pytest.raises(ValueError):
+            hosts.read_hosts_file(str(path))
+
+
+def test_pool_placement():
+    """Verify least-loaded and round-robin placement"""
+    pool = hosts.HostPool([('a', 2), ('b', 1)], lambda x: True)
+    with pool.acquire() as first, pool.acquire() as second:
+        assert (first, second) == ('a', 'b')
+        with pool.acquire() as third:
+            assert third == 'a'
+    with pool.acquire() as fourth:
+        # Both idle, b has had fewer builds
+        assert fourth == 'b'
+
+    pool = hosts.HostPool(
+        [('a', 5), ('b', 5), ('c', 5)], lambda x: True, 'round-robin')
+    placed = []
+    for _ in range(4):
+        with pool.acquire() as host:
+            placed.append(host)
+    assert placed == ['a', 'b', 'c', 'a']
+    with pytest.raises(ValueError):
+        hosts.HostPool([('a', 1)], lambda x: True, 'random')
+
+
+def test_pool_limits_and_health():
+    """Verify limits are kept and unhealthy hosts are left out"""
+    healthy = {'a': True, 'b': False}
+
+    def check(host):
+        if host == 'c':
+            raise subprocess.CalledProcessError(1, 'ping')
+        return healthy[host]
+
+    pool = hosts.HostPool([('a', 1), ('b', 1), ('c', 1)], check, recheck=0)
+    entered = threading.Event()
+    release = threading.Event()
+    order = []
+
+    def hold():
+        with pool.acquire() as host:
+            order.append(host)
+            entered.set()
+            release.wait()
+
+    holder = threading.Thread(target=hold)
+    holder.start()
+    entered.wait()
+    waiter = threading.Thread(target=hold)
+    waiter.start()
+    waiter.join(0.2)
+    # Only a is healthy and it is busy
+    assert order == ['a']
+    release.set()
+    holder.join()
+    waiter.join()
+    assert order == ['a', 'a']
+
+    # b recovers and is picked up by the next check
+    healthy['b'] = True
+    assert pool.healthy() == ['a', 'b']
+    healthy['a'] = healthy['b'] = False
+    assert not pool.check('a')
+    assert not pool.check('b')
+    with pytest.raises(hosts.NoHealthyHost) as error:
+        with pool.acquire():
+            pass
+    assert 'None of the hosts are healthy: a, b, c' == str(error.value)
+    assert isinstance(error.value, subprocess.CalledProcessError)
+
+
+def test_builds_spread_over_daemons(daemons, tmpdir):
+    """Verify builds use every healthy daemon within its limit"""
+    first, second, dead = daemons
+    first.build_delay = second.build_delay = 0.1
+    namespace = _namespace(
+        [first.host, second.host, dead], _context(tmpdir))
+    manager = moby_api.Manager()
+    threads = [threading.Thread(target=manager.build, args=(
+        namespace, 'image{}:1'.format(x))) for x in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(first.contexts) + len(second.contexts) == 6
+    assert first.contexts and second.contexts
+    assert first.peak == second.peak == 1
+
+    # Exports go to the daemon that built the image
+    built_on = first if 'image0:1' in first.contexts else second
+    other = second if built_on is first else first
+    with manager.stream(namespace, 'image0:1') as stream:
+        assert stream.read() == b'image image0:1'
+    assert ('GET', '/images/image0:1/get', {}) in built_on.requests
+    assert ('GET', '/images/image0:1/get', {}) not in other.requests
+
+    # A new process finds the image by asking each daemon
+    other_manager = moby_api.Manager()
+    assert other_manager.image_id(namespace, 'image0:1') == (
+        built_on.images['image0:1'][0])
+    with pytest.raises(hosts.ImagesOnDifferentHosts):
+        with other_manager.stream_many(namespace, [
+                next(iter(first.contexts)), next(iter(second.contexts))]):
+            pass
+
+
+def test_build_retried_on_other_daemon(daemons, tmpdir):
+    """Verify a daemon failing during a build is excluded"""
+    first, second, _ = daemons
+    namespace = _namespace([first.host, second.host], _context(tmpdir))
+    manager = moby_api.Manager()
+    pool = manager._host_pool(namespace)
+    assert pool.healthy() == [first.host, second.host]
+    first.healthy = False
+    manager.build(namespace, 'retried:1')
+    assert 'retried:1' in second.contexts
+    assert [x.address for x in pool.hosts if x.healthy] == [second.host]
+
+    # Build failures on healthy daemons are not retried
+    with pytest.raises(subprocess.CalledProcessError):
+        manager.build(namespace, 'bad:1')
+
+
+def test_moby_cli_hosts(monkeypatch, tmpdir):
+    """Verify the docker CLI is pointed at the placed host"""
+    calls = []
+
+    def record(command, cwd=None):
+        calls.append(command)
+        if command[2] == 'version' and command[1] == '--host=dead':
+            raise subprocess.CalledProcessError(1, command)
+        return b'sha256:1\n'
+
+    monkeypatch.setattr(runner, 'run', fake_run(record))
+    hosts_file = tmpdir.join('hosts')
+    hosts_file.write('one\ndead\n')
+    namespace = _namespace([], str(tmpdir), hosts_file=str(hosts_file),
+                           manager='moby')
+    manager = moby.Manager()
+    manager.build(namespace, 'a:1')
+    manager.tar(namespace, 'a:1')
+    assert ['docker', '--host=one', 'build', '-t', 'a:1', '.'] in calls
+    assert ['docker', '--host=one', 'save', '-o',
+            os.path.realpath('a-1.tar'), 'a:1'] in calls
+
+
+def test_moby_cli_tar_async_locates_image(monkeypatch, tmpdir):
+    """Verify an export on a running event loop finds the image's host"""
+    calls = []
+
+    def record(command, cwd=None):
+        calls.append(command)
+        if command[2] == 'image' and command[1] == '--host=one':
+            raise subprocess.CalledProcessError(1, command)
+        return b'sha256:1\n'
+
+    monkeypatch.setattr(runner, 'run', fake_run(record))
+    namespace = _namespace(['one', 'two'], str(tmpdir), manager='moby')
+    manager = moby.Manager()
+
+    async def export():
+        return await manager.tar_async(namespace, 'a:1')
+
+    assert runner.wait(export()) == os.path.realpath('a-1.tar')
+    assert ['docker', '--host=two', 'save', '-o',
+            os.path.realpath('a-1.tar'), 'a:1'] in calls
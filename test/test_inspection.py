@@ -0,0 +1,177 @@
+# Copyright (C) 2017  Red Hat, Inc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for the inspection module and the inspect-tar command.
+"""
+
+import argparse
+import gzip
+import io
+import json
+import os
+import sys
+import tarfile
+
+import pytest
+
+# Ensure the package is in the path
+sys.path.insert(1, os.path.realpath('./src/'))
+
+from system_buildah import dockerfile, inspection
+from system_buildah.actions.inspect_tar_action import InspectTarAction
+
+from .constants import *
+
+
+BIG = bytes(range(256)) * 64
+
+
+def _tar(members):
+    """Returns a tar of (name, data) items"""
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode='w') as archive:
+        for name, data in members:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    return buf.getvalue()
+
+
+BASE = _tar([
+    ('usr/lib/big', BIG),
+    ('etc/hosts', b'old hosts'),
+    ('etc/gone', b'x' * 100),
+    ('var/cache/a', b'y' * 50),
+])
+TOP = _tar([
+    ('etc/hosts', b'new hosts'),
+    ('etc/.wh.gone', b''),
+    ('var/cache/.wh..wh..opq', b''),
+    ('opt/copy', BIG),
+])
+CONFIG = {'history': [
+    {'created_by': '/bin/sh -c #(nop) ADD file:abc in / '},
+    {'created_by': '/bin/sh -c #(nop)  LABEL a=b', 'empty_layer': True},
+    {'created_by': 'COPY . /opt/ # buildkit'},
+]}
+
+
+def _archive(top=TOP):
+    """Returns a docker-archive of one image of two layers"""
+    return _tar([
+        ('base/layer.tar', BASE),
+        ('top/layer.tar', top),
+        ('c.json', json.dumps(CONFIG).encode()),
+        ('manifest.json', json.dumps([{
+            'RepoTags': ['app:1'], 'Config': 'c.json',
+            'Layers': ['base/layer.tar', 'top/layer.tar']}]).encode()),
+    ])
+
+
+def test_report():
+    """Verify sizes, hidden files, duplicates and history are reported"""
+    report = inspection.report(
+        inspection.scan(io.BytesIO(_archive())), top=2)
+    assert report['image'] == 'app:1'
+    base, top = report['layers']
+    assert base['size'] == base['uncompressed'] == len(BASE)
+    assert 0 < base['compressed'] < len(BASE)
+    assert (base['files'], top['files']) == (4, 2)
+    assert base['created_by'] == 'ADD file:abc in /'
+    assert top['created_by'] == 'COPY . /opt/'
+
+    assert [(x['path'], x['layer']) for x in report['largest']] == [
+        ('opt/copy', 2), ('usr/lib/big', 1)]
+    assert report['hidden_bytes'] == 9 + 100 + 50
+    assert report['hidden'][0] == {
+        'path': 'etc/gone', 'size': 100, 'layer': 1, 'by_layer': 2,
+        'how': 'deleted'}
+    assert {(x['path'], x['how']) for x in report['hidden']} == {
+        ('etc/gone', 'deleted'), ('var/cache/a', 'deleted')}
+    assert report['duplicate_bytes'] == len(BIG)
+    assert report['duplicates'] == [{'size': len(BIG), 'copies': [
+        {'layer': 1, 'path': 'usr/lib/big'},
+        {'layer': 2, 'path': 'opt/copy'}]}]
+
+    text = inspection.format_report(report)
+    assert 'Image app:1: 2 layers' in text
+    assert '#1 /etc/gone deleted by #2' in text
+    assert 'x2 #1 /usr/lib/big, #2 /opt/copy' in text
+
+
+def test_compressed_archive_and_layers():
+    """Verify compressed archives and layers are read in one pass"""
+    compressed_top = gzip.compress(TOP)
+    archive = io.BytesIO(gzip.compress(_archive(compressed_top)))
+    report = inspection.report(inspection.scan(archive))
+    top = report['layers'][1]
+    assert top['compressed'] == top['size'] == len(compressed_top)
+    assert top['uncompressed'] >= len(BIG)
+    assert report['duplicate_bytes'] == len(BIG)
+
+
+def test_attribute():
+    """Verify layers are matched to the final stage of a Dockerfile"""
+    instructions = dockerfile.parse(
+        'FROM golang AS build\nRUN make\n'
+        'FROM centos:7\nLABEL a=b\nCOPY a /a\nRUN yum -y update\n')
+    assert inspection.attribute(3, CONFIG, instructions) == [
+        'FROM centos:7', 'COPY a /a', 'RUN yum -y update']
+    # Too few layers for the Dockerfile falls back to the history
+    assert inspection.attribute(1, None, instructions) == [None]
+    assert inspection._clean_history('/bin/sh -c make') == 'RUN make'
+
+
+def test_errors():
+    """Verify unusable archives are reported"""
+    with pytest.raises(inspection.InspectError):
+        inspection.scan(io.BytesIO(b'not a tar' * 100))
+    for archive in (_tar([('base/layer.tar', BASE)]),
+                    _tar([('manifest.json', json.dumps([{
+                        'Layers': ['missing/layer.tar']}]).encode())])):
+        with pytest.raises(inspection.InspectError):
+            inspection.report(inspection.scan(io.BytesIO(archive)))
+    with pytest.raises(inspection.InspectError):
+        inspection.report(
+            inspection.scan(io.BytesIO(_archive())), image='other')
+    assert inspection.human_size(512) == '512 B'
+    assert inspection.human_size(3 * 1024 ** 3) == '3.0 GiB'
+
+
+def test_InspectTarAction(tmpdir, capsys):
+    """Verify inspect-tar prints the report attributed to a Dockerfile"""
+    tmpdir.join('app-1.tar').write_binary(_archive())
+    tmpdir.join('Dockerfile').write('FROM centos:7\nCOPY big /opt/copy\n')
+
+    def namespace(**kwargs):
+        return argparse.Namespace(
+            path=kwargs.get('path'), image='app:1', top=10,
+            json=kwargs.get('json', False), **GLOBAL_NAMESPACE_KWARGS)
+
+    archive = str(tmpdir.join('app-1.tar'))
+    InspectTarAction('', '').run(
+        argparse.ArgumentParser(), namespace(path=str(tmpdir)), archive, '')
+    out = capsys.readouterr()[0]
+    assert 'FROM centos:7' in out
+    assert 'COPY big /opt/copy' in out
+
+    InspectTarAction('', '').run(
+        argparse.ArgumentParser(), namespace(json=True), archive, '')
+    assert json.loads(capsys.readouterr()[0])['image'] == 'app:1'
+
+    with pytest.raises(SystemExit):
+        InspectTarAction('', '').run(
+            argparse.ArgumentParser(), namespace(),
+            str(tmpdir.join('missing.tar')), '')
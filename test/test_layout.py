@@ -0,0 +1,207 @@
+# Copyright (C) 2017  Red Hat, Inc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for the OCI layout export.
+"""
+
+import argparse
+import hashlib
+import io
+import json
+import os
+import sys
+import tarfile
+
+from contextlib import contextmanager
+
+import pytest
+
+# Ensure the package is in the path
+sys.path.insert(1, os.path.realpath('./src/'))
+
+from system_buildah import dockerfile, layout, managers, util
+from system_buildah.actions.export_layout_action import ExportLayoutAction
+
+from .constants import *
+
+
+def _digest(data):
+    return 'sha256:' + hashlib.sha256(data).hexdigest()
+
+
+def _layer(content):
+    """Returns a layer tar holding one file"""
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode='w') as archive:
+        info = tarfile.TarInfo('file')
+        info.size = len(content)
+        archive.addfile(info, io.BytesIO(content))
+    return buf.getvalue()
+
+
+def _add(archive, name, data=None, link=None):
+    info = tarfile.TarInfo(name)
+    if link:
+        info.type, info.linkname = tarfile.SYMTYPE, link
+        return archive.addfile(info)
+    info.size = len(data)
+    archive.addfile(info, io.BytesIO(data))
+
+
+#: Images made of named layers. a and b share their base.
+LAYERS = {x: _layer(x.encode('utf-8') * 1000) for x in ('base', 'a', 'b')}
+IMAGES = {'a:latest': ['base', 'a'], 'b:1': ['base', 'b']}
+
+
+def _config(image):
+    image = dockerfile.normalize_reference(image)
+    return json.dumps({'rootfs': {'type': 'layers', 'diff_ids': [
+        _digest(LAYERS[x]) for x in IMAGES[image]]}}).encode('utf-8')
+
+
+def _archive(images, oci_style=False):
+    """Returns a docker-archive of images as docker save writes it"""
+    buf = io.BytesIO()
+    manifest = []
+    with tarfile.open(fileobj=buf, mode='w') as archive:
+        written = set()
+        for image in map(dockerfile.normalize_reference, images):
+            config = _config(image)
+            entry = {'RepoTags': [image], 'Layers': []}
+            for name in IMAGES[image]:
+                hexdigest = _digest(LAYERS[name])[7:]
+                if oci_style:
+                    path = 'blobs/sha256/' + hexdigest
+                    if path not in written:
+                        _add(archive, path, LAYERS[name])
+                    # Older paths link to the blob
+                    _add(archive, hexdigest + '/layer.tar',
+                         link='../' + path)
+                    entry['Layers'].append(hexdigest + '/layer.tar')
+                else:
+                    path = hexdigest + '/layer.tar'
+                    if path not in written:
+                        _add(archive, hexdigest + '/json', b'{}')
+                        _add(archive, path, LAYERS[name])
+                    entry['Layers'].append(path)
+                written.add(path)
+            entry['Config'] = _digest(config)[7:] + '.json'
+            _add(archive, entry['Config'], config)
+            manifest.append(entry)
+        _add(archive, 'manifest.json', json.dumps(manifest).encode('utf-8'))
+    return buf.getvalue()
+
+
+class FakeManager(managers.ImageManager):
+    """Exports the fixed images and records what was streamed"""
+    build = tar = tag_image = stream_command = lambda s: s
+
+    def __init__(self, many=True, oci_style=False):
+        self.many = many
+        self.oci_style = oci_style
+        self.streamed = []
+
+    def image_id(self, namespace, image):
+        return _digest(_config(image))
+
+    def layer_digests(self, namespace, image):
+        image = dockerfile.normalize_reference(image)
+        return [_digest(LAYERS[x]) for x in IMAGES[image]]
+
+    @contextmanager
+    def stream(self, namespace, image):
+        self.streamed.append([image])
+        yield io.BytesIO(_archive([image], self.oci_style))
+
+    @contextmanager
+    def stream_many(self, namespace, images):
+        if not self.many:
+            raise NotImplementedError()
+        self.streamed.append(images)
+        yield io.BytesIO(_archive(images, self.oci_style))
+
+
+def _manifest(path, name):
+    """Returns the manifest index.json points name at"""
+    with open(os.path.join(path, 'index.json')) as index_file:
+        index = json.load(index_file)
+    entry = [x for x in index['manifests']
+             if x['annotations'][layout.REF_NAME] == name][0]
+    with open(os.path.join(path, 'blobs', 'sha256', entry['digest'][7:])) as m:
+        return json.load(m)
+
+
+def test_export_shares_blobs(tmpdir):
+    """Verify shared layers are stored once and reused later"""
+    path = str(tmpdir.join('layout'))
+    manager = FakeManager()
+    result = layout.export(manager, None, ['a', 'b:1'], path)
+    assert manager.streamed == [['a', 'b:1']]
+    # 3 layers, 2 configs and 2 manifests
+    assert len(os.listdir(os.path.join(path, 'blobs', 'sha256'))) == 7
+    assert result.bytes_skipped == 0
+    a, b = _manifest(path, 'a'), _manifest(path, 'b:1')
+    assert a['layers'][0] == b['layers'][0]
+    assert a['layers'][0]['digest'] == _digest(LAYERS['base'])
+    assert a['layers'][0]['mediaType'] == layout.LAYER_TYPE
+    assert a['config']['digest'] == _digest(_config('a:latest'))
+
+    # Everything is in the layout now, so nothing is read again
+    manager.streamed = []
+    result = layout.export(manager, None, ['b:1', 'a'], path)
+    assert manager.streamed == []
+    assert result.bytes_written == 0
+    with open(os.path.join(path, 'index.json')) as index_file:
+        assert len(json.load(index_file)['manifests']) == 2
+
+
+def test_export_one_at_a_time(tmpdir):
+    """Verify managers saving one image at a time skip stored blobs"""
+    path = str(tmpdir.join('layout'))
+    manager = FakeManager(many=False, oci_style=True)
+    result = layout.export(manager, None, ['a'], path)
+    written = result.bytes_written
+    manager.layer_digests = lambda namespace, image: None
+    result = layout.export(manager, None, ['b:1'], path)
+    assert manager.streamed == [['a'], ['b:1']]
+    assert result.bytes_skipped == len(LAYERS['base'])
+    assert result.bytes_written < written
+    assert _manifest(path, 'b:1')['layers'][1]['digest'] == _digest(
+        LAYERS['b'])
+
+
+def test_export_missing_image(tmpdir):
+    """Verify images missing from the export are reported"""
+    manager = FakeManager()
+    manager.stream_many = lambda namespace, images: manager.stream(
+        namespace, 'a:latest')
+    with pytest.raises(ValueError) as error:
+        layout.export(manager, None, ['a', 'b:1'], str(tmpdir))
+    assert 'b:1' in str(error.value)
+
+
+def test_ExportLayoutAction(tmpdir, monkeypatch, capsys):
+    """Verify a .tar output packs the layout into an archive"""
+    monkeypatch.setattr(util, 'get_manager_class', lambda n: FakeManager)
+    output = str(tmpdir.join('images.tar'))
+    ns = argparse.Namespace(output=output, **GLOBAL_NAMESPACE_KWARGS)
+    ExportLayoutAction('', '').run(
+        argparse.ArgumentParser(), ns, ['a', 'b:1'], None)
+    assert 'Exported 2 images' in capsys.readouterr().out
+    assert tmpdir.join('images', 'index.json').check()
+    with tarfile.open(output) as archive:
+        names = archive.getnames()
+    assert 'oci-layout' in names and 'index.json' in names
+    assert len([x for x in names if x.startswith('blobs/sha256/')]) == 7
@@ -27,13 +27,16 @@ import pytest
 sys.path.insert(1, os.path.realpath('./src/'))
 
 from system_buildah import managers, util
+from system_buildah.managers import runner
 from system_buildah.managers.buildah import Manager as BuildahManager
 from system_buildah.managers.moby import Manager as MobyManager
 
+from .fake_runner import fake_run
+
 
 # Dummy manager to test with
 class IM(managers.ImageManager):
-    tar = build = lambda s: s
+    tar = build = image_id = tag_image = stream_command = lambda s: s
 
 
 def test_ImageManager_normalize_filename():
@@ -54,9 +57,10 @@ def test_MobyManager_tar(monkeypatch):
     mm = MobyManager()
 
     def assert_call(arg):
-        assert arg == ['docker', 'save', '-o', 'output.tar', 'output']
+        assert arg == [
+            'docker', 'save', '-o', os.path.realpath('output.tar'), 'output']
 
-    monkeypatch.setattr(subprocess, 'check_call', assert_call)
+    monkeypatch.setattr(runner, 'run', fake_run(assert_call))
     mm.tar(argparse.Namespace(host=None, tlsverify=None), 'output')
 
 
@@ -66,10 +70,11 @@ def test_MobyManager_build(monkeypatch):
     """
     mm = MobyManager()
 
-    def assert_call(arg):
+    def assert_call(arg, cwd=None):
         assert arg == ['docker', 'build', '-t', 'tag', '.']
+        assert cwd == os.path.realpath('.')
 
-    monkeypatch.setattr(subprocess, 'check_call', assert_call)
+    monkeypatch.setattr(runner, 'run', fake_run(assert_call))
     mm.build(argparse.Namespace(host=None, tlsverify=None, path='.'), 'tag')
 
 
@@ -80,20 +85,21 @@ def test_BuildahManager_tar(monkeypatch):
     bm = BuildahManager()
     output = 'output:latest'
 
-    def assert_call(arg):
+    def assert_call(arg, cwd=None):
         # First call is a buildah push
         if arg[0] == 'buildah':
             assert arg[0:3] == ['buildah', 'push', output]
+            assert cwd == os.path.realpath('.')
         # Anything else is totally unexpected
         else:
             pytest.fail(
-                'Unexpected input to subprocess.check_call: {}'.format(arg))
+                'Unexpected command: {}'.format(arg))
 
     def assert_rename(src, dest):
-        assert src == 'output'
-        assert dest == 'output-latest.tar'
+        assert src == os.path.realpath('output')
+        assert dest == os.path.realpath('output-latest.tar')
 
-    monkeypatch.setattr(subprocess, 'check_call', assert_call)
+    monkeypatch.setattr(runner, 'run', fake_run(assert_call))
     monkeypatch.setattr(os, 'rename', assert_rename)
     bm.tar(argparse.Namespace(host=None, tlsverify=None), output)
 
@@ -104,8 +110,213 @@ def test_BuildahManager_build(monkeypatch):
     """
     bm = BuildahManager()
 
-    def assert_call(arg):
+    def assert_call(arg, cwd=None):
         assert arg == ['buildah', 'bud', '-t', 'tag', '.']
+        assert cwd == os.path.realpath('.')
 
-    monkeypatch.setattr(subprocess, 'check_call', assert_call)
+    monkeypatch.setattr(runner, 'run', fake_run(assert_call))
     bm.build(argparse.Namespace(host=None, tlsverify=None, path='.'), 'tag')
+
+
+def test_BuildahManager_build_rendered(monkeypatch):
+    """
+    Verify a rendered Dockerfile is built instead of the one on disk.
+    """
+    built = []
+
+    def record(arg, cwd=None):
+        with open(arg[5]) as dockerfile_file:
+            built.append((arg[:5] + arg[6:], dockerfile_file.read()))
+
+    monkeypatch.setattr(runner, 'run', fake_run(record))
+    BuildahManager().build(argparse.Namespace(
+        host=None, tlsverify=None, path='.',
+        rendered_files={'Dockerfile': 'FROM centos@sha256:1\n'}), 'tag')
+    assert built == [(['buildah', 'bud', '-t', 'tag', '-f', '.'],
+                      'FROM centos@sha256:1\n')]
+
+
+def _fake_buildah(monkeypatch, failing=()):
+    """
+    Records buildah commands, failing those starting with failing.
+    """
+    calls = []
+    containers = iter(['ctr-1', 'ctr-2'])
+
+    def check_output(arg, **kwargs):
+        calls.append(arg)
+        if arg[1] == 'from':
+            return next(containers).encode('utf-8') + b'\n'
+        return b'{"Labels": {"name": "base", "vendor": "x"}, "Cmd": ["sh"]}'
+
+    def check_call(arg, **kwargs):
+        calls.append(arg)
+        if any(arg[:len(x)] == x for x in failing):
+            raise subprocess.CalledProcessError(1, arg)
+
+    monkeypatch.setattr(runner, 'check_output', check_output)
+    monkeypatch.setattr(runner, 'check_call', check_call)
+    monkeypatch.setattr(runner, 'run', fake_run(check_call))
+    return calls
+
+
+def _scripted_namespace(dockerfile, reuse=False):
+    return argparse.Namespace(
+        host=None, tlsverify=None, path='.', scripted=True,
+        reuse_container=reuse, rendered_files={'Dockerfile': dockerfile})
+
+
+def test_BuildahManager_build_scripted(monkeypatch):
+    """
+    Verify scripted builds drive buildah and configure labels once.
+    """
+    calls = _fake_buildah(monkeypatch)
+    bm = BuildahManager()
+    bm.build(_scripted_namespace(
+        'FROM base\nLABEL a=1 b=2\nRUN mkdir -p /x\nCOPY f /x/\n'
+        'ADD --chown=1:1 g /x/\nENV k=v\nCMD ["run"]\n'), 'tag')
+    assert calls == [
+        ['buildah', 'from', 'base'],
+        ['buildah', 'inspect', '--type', 'container', '--format',
+         '{{json .OCIv1.Config}}', 'ctr-1'],
+        ['buildah', 'run', 'ctr-1', '--', '/bin/sh', '-c', 'mkdir -p /x'],
+        ['buildah', 'copy', 'ctr-1', 'f', '/x/'],
+        ['buildah', 'add', '--chown=1:1', 'ctr-1', 'g', '/x/'],
+        ['buildah', 'config', '--env', 'k=v', 'ctr-1'],
+        ['buildah', 'config', '--label', 'a=1', '--label', 'b=2',
+         '--cmd', '["run"]', 'ctr-1'],
+        ['buildah', 'commit', 'ctr-1', 'tag'],
+        ['buildah', 'rm', 'ctr-1'],
+    ]
+
+
+def test_BuildahManager_build_scripted_reuse(monkeypatch):
+    """
+    Verify a working container is reset and reused for the same base.
+    """
+    calls = _fake_buildah(monkeypatch)
+    bm = BuildahManager()
+    bm.build(_scripted_namespace(
+        'FROM base\nLABEL name=one other=1\nCOPY f /x/\nCMD ["a"]\n',
+        True), 'one')
+    del calls[:]
+    bm.build(_scripted_namespace(
+        'FROM base\nLABEL name=two\nCOPY f /x/\n', True), 'two')
+    assert calls == [
+        ['buildah', 'run', 'ctr-1', '--', 'rm', '-rf', '/x'],
+        ['buildah', 'copy', 'ctr-1', 'f', '/x/'],
+        ['buildah', 'config', '--label', 'other-', '--label', 'name=two',
+         '--cmd', '["sh"]', 'ctr-1'],
+        ['buildah', 'commit', 'ctr-1', 'two'],
+    ]
+    del calls[:]
+    bm.close()
+    bm.close()
+    assert calls == [['buildah', 'rm', 'ctr-1']]
+
+
+def test_BuildahManager_build_scripted_not_reused(monkeypatch):
+    """
+    Verify containers are removed when they can not be reset.
+    """
+    # The base already has /x so removing it would change the base
+    calls = _fake_buildah(monkeypatch, failing=[
+        ['buildah', 'run', 'ctr-1', '--', '/bin/sh', '-c', 'test ! -e /x']])
+    bm = BuildahManager()
+    bm.build(_scripted_namespace('FROM base\nCOPY f /x/\n', True), 'one')
+    assert calls[-1] == ['buildah', 'rm', 'ctr-1']
+    bm.build(_scripted_namespace('FROM base\nRUN make\n', True), 'two')
+    assert calls[-1] == ['buildah', 'rm', 'ctr-2']
+
+
+def test_BuildahManager_build_scripted_failure(monkeypatch):
+    """
+    Verify failed scripts remove their container and fall back to bud
+    for Dockerfiles that can not be scripted.
+    """
+    calls = _fake_buildah(monkeypatch, failing=[['buildah', 'commit']])
+    bm = BuildahManager()
+    with pytest.raises(subprocess.CalledProcessError):
+        bm.build(_scripted_namespace('FROM base\n', True), 'tag')
+    assert calls[-1] == ['buildah', 'rm', 'ctr-1']
+    bm.close()
+    assert calls[-1] == ['buildah', 'rm', 'ctr-1']
+
+    del calls[:]
+    bm.build(_scripted_namespace('FROM a AS b\nFROM b\n'), 'tag')
+    assert len(calls) == 1
+    assert calls[0][:5] + calls[0][6:] == [
+        'buildah', 'bud', '-t', 'tag', '-f', '.']
+
+
+def test_MobyManager_image_id_and_tag(monkeypatch):
+    """
+    Test the Moby manager image_id and tag_image commands.
+    """
+    mm = MobyManager()
+    ns = argparse.Namespace(host=None, tlsverify=None)
+
+    def assert_output(arg, **kwargs):
+        assert arg == [
+            'docker', 'image', 'inspect', '--format', '{{.Id}}', 'image']
+        return b'sha256:abc\n'
+
+    def assert_call(arg, **kwargs):
+        assert arg == ['docker', 'tag', 'sha256:abc', 'new']
+
+    monkeypatch.setattr(runner, 'check_output', assert_output)
+    monkeypatch.setattr(runner, 'check_call', assert_call)
+    assert mm.image_id(ns, 'image') == 'sha256:abc'
+    mm.tag_image(ns, 'sha256:abc', 'new')
+
+
+def test_BuildahManager_image_id_and_tag(monkeypatch):
+    """
+    Test the Buildah manager image_id and tag_image commands.
+    """
+    bm = BuildahManager()
+    ns = argparse.Namespace(host=None, tlsverify=None)
+
+    def assert_output(arg, **kwargs):
+        assert arg[:4] == ['buildah', 'inspect', '--type', 'image']
+        return b'abc\n'
+
+    def assert_call(arg, **kwargs):
+        assert arg == ['buildah', 'tag', 'abc', 'new']
+
+    monkeypatch.setattr(runner, 'check_output', assert_output)
+    monkeypatch.setattr(runner, 'check_call', assert_call)
+    assert bm.image_id(ns, 'image') == 'abc'
+    bm.tag_image(ns, 'abc', 'new')
+
+
+def test_stream_commands():
+    """
+    Verify managers export archives to stdout.
+    """
+    ns = argparse.Namespace(host='example.org', tlsverify=None)
+    assert MobyManager().stream_command(ns, 'a:b') == [
+        'docker', '--host=example.org', 'save', 'a:b']
+    assert BuildahManager().stream_command(ns, 'a:b') == [
+        'buildah', 'push', '--quiet', 'a:b', 'docker-archive:/dev/stdout:a:b']
+
+
+def test_multi_image_export(monkeypatch):
+    """
+    Verify moby saves many images at once and buildah one at a time.
+    """
+    ns = argparse.Namespace(host=None, tlsverify=None)
+    assert MobyManager().stream_many_command(ns, ['a', 'b']) == [
+        'docker', 'save', 'a', 'b']
+    with pytest.raises(NotImplementedError):
+        with BuildahManager().stream_many(ns, ['a', 'b']):
+            pass
+    assert BuildahManager().layer_digests(ns, 'a') is None
+
+    def assert_output(arg, **kwargs):
+        assert arg == ['docker', 'image', 'inspect', '--format',
+                       '{{json .RootFS.Layers}}', 'a']
+        return b'["sha256:1","sha256:2"]\n'
+
+    monkeypatch.setattr(runner, 'check_output', assert_output)
+    assert MobyManager().layer_digests(ns, 'a') == ['sha256:1', 'sha256:2']
@@ -0,0 +1,175 @@
+# Copyright (C) 2017  Red Hat, Inc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for Prometheus textfile metrics.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import threading
+
+import pytest
+
+# Ensure the package is in the path
+sys.path.insert(1, os.path.realpath('./src/'))
+
+from system_buildah import metrics, trace, util
+from system_buildah.actions.tar_action import TarAction
+from system_buildah.managers import runner
+
+from .constants import *
+from .fake_runner import fake_run
+
+BUILD = 'system_buildah_build_duration_seconds'
+
+
+def _fail(command):
+    raise subprocess.CalledProcessError(1, command)
+
+
+def _read(path):
+    with open(path) as textfile:
+        return metrics.parse(textfile.read())
+
+
+def test_recording_adds_to_the_textfile(tmpdir):
+    """Verify spans become samples added to those of earlier runs"""
+    path = str(tmpdir.join('system_buildah.prom'))
+    for _ in range(2):
+        with metrics.recording(path):
+            with trace.span('build', manager='moby', cache='miss'):
+                pass
+            with trace.span('tar', manager='moby', cache='hit') as span:
+                span['bytes_written'] = 100
+            with pytest.raises(subprocess.CalledProcessError):
+                trace.call(_fail, ['docker', 'build'])
+            with trace.span('render'):
+                pass
+    samples = _read(path)
+    moby = (('manager', 'moby'),)
+    assert samples[(BUILD + '_count', moby)] == 2
+    assert samples[(BUILD + '_bucket', (('le', '1'), ('manager', 'moby')))] \
+        == 2
+    assert samples[(BUILD + '_bucket', (('le', '+Inf'),
+                                        ('manager', 'moby')))] == 2
+    assert samples[(
+        'system_buildah_export_duration_seconds_count', moby)] == 2
+    assert samples[('system_buildah_export_bytes_total', moby)] == 200
+    assert samples[('system_buildah_subprocess_failures_total', (
+        ('command', 'docker'),))] == 2
+    assert samples[('system_buildah_cache_lookups_total', (
+        ('kind', 'build'), ('result', 'miss')))] == 2
+    assert samples[('system_buildah_cache_lookups_total', (
+        ('kind', 'export'), ('result', 'hit')))] == 2
+    assert not tmpdir.join('system_buildah.prom.part').check()
+    assert not trace.active()
+
+    text = tmpdir.join('system_buildah.prom').read()
+    assert '# TYPE {} histogram\n'.format(BUILD) in text
+    lines = text.splitlines()
+    buckets = [x for x in lines if x.startswith(BUILD + '_bucket')]
+    assert buckets[0].startswith(BUILD + '_bucket{le="1",')
+    assert buckets[-1].startswith(BUILD + '_bucket{le="+Inf",')
+
+
+def test_format_and_parse():
+    """Verify label values are escaped and read back"""
+    samples = {('other_total', (('path', 'a"b\\c\nd'),)): 1.5,
+               ('plain', ()): 3.0}
+    text = metrics.format_samples(samples)
+    assert 'plain 3\n' in text
+    assert metrics.parse(text + 'broken line\n') == samples
+
+
+def test_nested_recording_flushes(tmpdir):
+    """Verify commands inside a recorded command update the file"""
+    path = str(tmpdir.join('metrics.prom'))
+    with metrics.recording(path) as outer:
+        with metrics.recording(None) as inner:
+            assert inner is outer
+            with trace.span('GenerateFilesAction', manager='moby'):
+                pass
+        assert _read(path)[(
+            'system_buildah_generate_duration_seconds_count',
+            (('manager', 'moby'),))] == 1
+
+    with metrics.recording(None) as recorder:
+        assert recorder is None
+        assert not trace.active()
+
+
+def test_concurrent_recordings_are_separate(tmpdir):
+    """Verify jobs running at once only record their own spans"""
+    barrier = threading.Barrier(2)
+
+    def job(manager):
+        def build():
+            with trace.span('build', manager=manager):
+                barrier.wait(5)
+
+        with metrics.recording(str(tmpdir.join(manager + '.prom'))):
+            # Work handed to another thread is recorded by the job too
+            worker = threading.Thread(
+                target=util.bind_working_directory(build))
+            worker.start()
+            worker.join()
+
+    threads = [threading.Thread(target=job, args=(x,)) for x in 'ab']
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for manager in 'ab':
+        samples = _read(str(tmpdir.join(manager + '.prom')))
+        assert samples[(BUILD + '_count', (('manager', manager),))] == 1
+        assert {dict(x[1])['manager'] for x in samples} == {manager}
+
+
+def test_unwritable_textfile_keeps_samples(tmpdir):
+    """Verify samples that could not be written are not lost"""
+    recorder = metrics.Recorder(str(tmpdir.join('missing', 'metrics.prom')))
+    recorder.observe('build', 2.0, {'manager': 'buildah'})
+    recorder.flush()
+    assert recorder.samples[(BUILD + '_sum', (('manager', 'buildah'),))] \
+        == 2.0
+
+
+def test_TarAction_metrics(tmpdir, monkeypatch):
+    """Verify an export with --metrics-file records bytes and the cache"""
+    monkeypatch.chdir(str(tmpdir))
+
+    def docker(command, **kwargs):
+        if command[1] == 'save':
+            with open(command[3], 'wb') as archive:
+                archive.write(b'x' * 1024)
+        return b'sha256:1\n'
+
+    monkeypatch.setattr(runner, 'run', fake_run(docker))
+    ns = argparse.Namespace(
+        host=None, tlsverify=False, compress=None, since=None, index=False,
+        output=None, cache=True, cache_dir=str(tmpdir.join('cache')),
+        cache_max_entries=4, cache_max_age=1, log_level='info',
+        metrics_file='metrics.prom', **GLOBAL_NAMESPACE_KWARGS)
+    for _ in range(2):
+        TarAction('', '')(argparse.ArgumentParser(), ns, 'app:1')
+    samples = _read(str(tmpdir.join('metrics.prom')))
+    assert samples[('system_buildah_export_bytes_total', (
+        ('manager', 'moby'),))] == 2048
+    assert samples[('system_buildah_cache_lookups_total', (
+        ('kind', 'export'), ('result', 'miss')))] == 1
+    assert samples[('system_buildah_cache_lookups_total', (
+        ('kind', 'export'), ('result', 'hit')))] == 1
@@ -0,0 +1,232 @@
+# Copyright (C) 2017  Red Hat, Inc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for the Engine API manager.
+"""
+
+import argparse
+import io
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tarfile
+import tempfile
+
+import pytest
+
+# Ensure the package is in the path
+sys.path.insert(1, os.path.realpath('./src/'))
+
+from system_buildah import util
+from system_buildah.actions.build_many_action import BuildManyAction
+from system_buildah.managers import moby_api, runner
+
+from .fake_daemon import FakeDaemon
+
+
+@pytest.fixture
+def daemon():
+    """A fake daemon on a short unix socket path"""
+    directory = tempfile.mkdtemp(prefix='sb')
+    with FakeDaemon(os.path.join(directory, 'docker.sock')) as fake:
+        yield fake
+    moby_api._CLIENTS.clear()
+    shutil.rmtree(directory)
+
+
+def _namespace(daemon, path='.'):
+    """Returns a namespace pointing at the fake daemon"""
+    return argparse.Namespace(
+        host=daemon.host, tlsverify=False, path=path, manager='moby-api')
+
+
+def test_get_manager_class():
+    """Verify moby-api resolves to the module with an underscore"""
+    assert util.get_manager_class('moby-api') is moby_api.Manager
+
+
+def test_tar_context(tmpdir):
+    """Verify the streamed context is a valid tar"""
+    tmpdir.join('Dockerfile').write('FROM a\n')
+    tmpdir.mkdir('files').join('big').write_binary(b'x' * 200000)
+    tmpdir.join('link').mksymlinkto('Dockerfile')
+    chunks = list(moby_api.tar_context(str(tmpdir)))
+    assert max(len(x) for x in chunks) <= moby_api.CHUNK_SIZE
+    with tarfile.open(fileobj=io.BytesIO(b''.join(chunks))) as archive:
+        assert sorted(archive.getnames()) == [
+            'Dockerfile', 'files', 'files/big', 'link']
+        assert archive.extractfile('files/big').read() == b'x' * 200000
+        assert archive.getmember('link').linkname == 'Dockerfile'
+
+
+def test_tar_context_rendered(tmpdir):
+    """Verify rendered files are sent in place of those on disk"""
+    tmpdir.join('Dockerfile').write('FROM old\n')
+    tmpdir.join('extra').write('extra')
+    chunks = list(moby_api.tar_context(
+        str(tmpdir), {'Dockerfile': 'FROM new\n', 'init.sh': 'true'}))
+    with tarfile.open(fileobj=io.BytesIO(b''.join(chunks))) as archive:
+        assert sorted(archive.getnames()) == ['Dockerfile', 'extra', 'init.sh']
+        assert archive.extractfile('Dockerfile').read() == b'FROM new\n'
+
+
+def test_chunked():
+    """Verify bodies are framed the same on every Python version"""
+    assert b''.join(moby_api._chunked([b'ab', b'', b'c' * 16])) == (
+        b'2\r\nab\r\n10\r\n' + b'c' * 16 + b'\r\n0\r\n\r\n')
+
+
+def test_build_and_tar_share_a_connection(daemon, tmpdir, monkeypatch):
+    """Verify build, inspect, tag and tar reuse one connection"""
+    monkeypatch.chdir(str(tmpdir))
+    context = tmpdir.mkdir('context')
+    context.join('Dockerfile').write('FROM a\n')
+    ns = _namespace(daemon, str(context))
+    manager = moby_api.Manager()
+
+    manager.build(ns, 'image:1')
+    assert daemon.contexts['image:1'] == ['Dockerfile']
+    image_id = manager.image_id(ns, 'image:1')
+    manager.tag_image(ns, image_id, 'registry:5000/image')
+    assert daemon.images['registry:5000/image:latest'][0] == image_id
+    path = manager.tar(ns, 'image:1')
+    assert path == str(tmpdir.join('image-1.tar'))
+    assert tmpdir.join('image-1.tar').read_binary() == b'image image:1'
+
+    # A second manager for the same daemon shares the pool
+    moby_api.Manager().tar(ns, 'image:1')
+    assert daemon.connections == 1
+    assert moby_api.get_client(daemon.host, False).connections_made == 1
+
+
+def test_async_uses_the_api(daemon, tmpdir, monkeypatch):
+    """Verify the coroutines build and export without the docker CLI"""
+    monkeypatch.chdir(str(tmpdir))
+    context = tmpdir.mkdir('context')
+    context.join('Dockerfile').write('FROM a\n')
+    ns = _namespace(daemon, str(context))
+    manager = moby_api.Manager()
+
+    async def build_and_tar():
+        await manager.build_async(ns, 'image:1')
+        return await manager.tar_async(ns, 'image:1')
+
+    monkeypatch.setattr(runner, 'run', None)
+    assert runner.wait(build_and_tar()) == str(tmpdir.join('image-1.tar'))
+    assert daemon.contexts['image:1'] == ['Dockerfile']
+
+
+def test_errors(daemon, tmpdir):
+    """Verify API errors surface as CalledProcessError"""
+    tmpdir.join('Dockerfile').write('FROM a\n')
+    ns = _namespace(daemon, str(tmpdir))
+    manager = moby_api.Manager()
+
+    with pytest.raises(subprocess.CalledProcessError) as error:
+        manager.build(ns, 'bad')
+    assert 'failed' in str(error.value)
+
+    with pytest.raises(moby_api.APIError) as error:
+        manager.image_id(ns, 'missing')
+    assert error.value.returncode == 404
+    assert 'No such image: missing' in str(error.value)
+
+    # The connection is still usable after errors
+    daemon.add_image('there:latest')
+    assert manager.image_id(ns, 'there:latest')
+    assert daemon.connections == 1
+
+
+def test_stale_connection_is_replaced(daemon):
+    """Verify a pooled connection closed by the daemon is reopened"""
+    client = moby_api.Client(daemon.host)
+    with client.request('GET', '/_ping') as response:
+        assert response.read() == b'OK'
+    # Swap in a socket whose other end has gone away
+    local, remote = socket.socketpair(socket.AF_UNIX)
+    remote.close()
+    client._idle[0].sock.close()
+    client._idle[0].sock = local
+    daemon.add_image('x:latest')
+    assert client.json('GET', '/images/x:latest/json')['Id']
+    assert client.connections_made == 2
+    client.close()
+    assert client._idle == []
+
+
+def test_stream_many_and_layer_digests(daemon):
+    """Verify several images are requested in one export"""
+    daemon.add_image('a:latest', b'a')
+    daemon.add_image('b:latest', b'b')
+    ns = _namespace(daemon)
+    manager = moby_api.Manager()
+    with manager.stream_many(ns, ['a:latest', 'b:latest']) as source:
+        assert source.read() == b'ab'
+    assert ('GET', '/images/get', {'names': ['a:latest', 'b:latest']}) in (
+        daemon.requests)
+    assert manager.layer_digests(ns, 'a:latest') == ['sha256:layer-a:latest']
+
+
+def test_pull(daemon):
+    """Verify pulls resolve to the digest the daemon reports"""
+    ns = _namespace(daemon)
+    manager = moby_api.Manager()
+    pinned = manager.pull(ns, 'registry:5000/base:7')
+    assert pinned == 'registry:5000/base@sha256:' + daemon.images[
+        'registry:5000/base:7'][0][-64:]
+    assert ('POST', '/images/create', {
+        'fromImage': 'registry:5000/base', 'tag': '7'}) in daemon.requests
+    with pytest.raises(moby_api.APIError):
+        manager.pull(ns, 'missing')
+
+
+def test_build_many_prefetch(daemon, tmpdir):
+    """Verify build-many pulls the bases at once and pins the builds"""
+    for name, data in (
+            ('base', 'FROM centos:7\n'),
+            ('child', 'FROM base\n'),
+            ('multi', 'FROM golang:1.9 AS build\nFROM build\n'
+                      'FROM --platform=linux/amd64 fedora\n'),
+            ('same', 'FROM centos:7\nRUN true\n'),
+            ('gone', 'FROM missing:1\n')):
+        tmpdir.mkdir(name).join('Dockerfile').write(data)
+    daemon.pull_delay = 0.1
+    ns = argparse.Namespace(
+        host=daemon.host, tlsverify=False, manager='moby-api', jobs=2,
+        directory=str(tmpdir), full_context=False, prefetch=True,
+        pull_jobs=2)
+    BuildManyAction('', '').run(argparse.ArgumentParser(), ns, [], '')
+
+    assert sorted(daemon.pulls) == [
+        'centos:7', 'fedora:latest', 'golang:1.9']
+    assert daemon.pull_peak == 2
+
+    def pinned(name):
+        return '{}@sha256:{}'.format(
+            name.split(':')[0], daemon.images[name][0][-64:])
+
+    assert daemon.dockerfiles['base'] == 'FROM {}\n'.format(
+        pinned('centos:7'))
+    assert daemon.dockerfiles['same'].startswith('FROM {}\n'.format(
+        pinned('centos:7')))
+    assert daemon.dockerfiles['multi'] == (
+        'FROM {} AS build\nFROM build\n'
+        'FROM --platform=linux/amd64 {}\n').format(
+            pinned('golang:1.9'), pinned('fedora:latest'))
+    # Images of the batch and failed pulls are left to the build
+    assert daemon.dockerfiles['child'] == 'FROM base\n'
+    assert daemon.dockerfiles['gone'] == 'FROM missing:1\n'
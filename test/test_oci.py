@@ -0,0 +1,76 @@
+# Copyright (C) 2017  Red Hat, Inc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for the oci module.
+"""
+
+import os
+import sys
+
+import pytest
+
+# Ensure the package is in the path
+sys.path.insert(1, os.path.realpath('./src/'))
+
+from system_buildah import oci
+
+
+def test_generate_defaults():
+    """Verify the default spec matches ocitools generate --read-only"""
+    spec = oci.generate([], read_only=True)
+    assert spec['root'] == {'path': 'rootfs', 'readonly': True}
+    assert spec['process']['args'] == ['sh']
+    assert 'CAP_KILL' in spec['process']['capabilities']['bounding']
+    assert oci.generate([])['root']['readonly'] is False
+
+
+def test_generate_options():
+    """Verify supported options patch the spec"""
+    spec = oci.generate([
+        ('--hostname', 'confighost'), ('--cwd', '/root'), ('--uid', '10'),
+        ('--env', 'TERM=dumb'), ('--env', 'A=b=c'), ('--args', '/bin/run'),
+        ('--args', '-v'), ('--cap-add', 'sys_admin'),
+        ('--cap-drop', 'CAP_KILL'), ('--tty', 'false'),
+        ('--mount-label', 'label')])
+    assert spec['hostname'] == 'confighost'
+    assert spec['process']['cwd'] == '/root'
+    assert spec['process']['user']['uid'] == 10
+    assert spec['process']['env'][-2:] == ['TERM=dumb', 'A=b=c']
+    assert len([x for x in spec['process']['env'] if 'TERM' in x]) == 1
+    assert spec['process']['args'] == ['/bin/run', '-v']
+    for capabilities in spec['process']['capabilities'].values():
+        assert 'CAP_SYS_ADMIN' in capabilities
+        assert 'CAP_KILL' not in capabilities
+    assert spec['process']['terminal'] is False
+    assert spec['linux']['mountLabel'] == 'label'
+
+
+def test_generate_does_not_share_state():
+    """Verify patches never leak into the memoized base spec"""
+    oci.generate([('--cap-drop', 'CAP_KILL'), ('--hostname', 'one')])
+    spec = oci.generate([])
+    assert spec['hostname'] == 'mrsdalloway'
+    assert 'CAP_KILL' in spec['process']['capabilities']['effective']
+
+
+def test_generate_unsupported():
+    """Verify options ocitools must handle are refused"""
+    with pytest.raises(oci.UnsupportedOption):
+        oci.generate([('--seccomp-default', 'errno')])
+    with pytest.raises(oci.UnsupportedOption):
+        oci.generate([('--tty', 'maybe')])
+    for option in ('--uid', '--gid'):
+        with pytest.raises(oci.UnsupportedOption):
+            oci.generate([(option, 'root')])
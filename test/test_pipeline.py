@@ -0,0 +1,192 @@
+# Copyright (C) 2017  Red Hat, Inc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for the pipeline command.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+# Ensure the package is in the path
+sys.path.insert(1, os.path.realpath('./src/'))
+
+from system_buildah import compression, managers, pipeline, util
+from system_buildah.actions.pipeline_action import PipelineAction
+
+from .constants import *
+
+
+class FakeManager(managers.ImageManager):
+    """Records builds and exports"""
+    stream_command = tag_image = image_id = lambda s: s
+
+    def __init__(self, fail=()):
+        self.fail = fail
+        self.events = []
+        self.rendered = {}
+        self._lock = threading.Lock()
+
+    def build(self, namespace, tag):
+        with self._lock:
+            self.events.append(('build', tag))
+            self.rendered[tag] = namespace.rendered_files
+        if tag in self.fail:
+            raise subprocess.CalledProcessError(1, ['build'])
+        if tag == 'a:1':
+            # Give the next image time to be rendered meanwhile
+            deadline = time.monotonic() + 5
+            while time.monotonic() < deadline and not os.path.exists(
+                    os.path.join(os.path.dirname(namespace.path), 'b',
+                                 'Dockerfile')):
+                time.sleep(0.01)
+
+    def tar(self, namespace, image):
+        with self._lock:
+            self.events.append(('export', image))
+        return image
+
+
+def _spec(tmpdir, images, defaults=None):
+    spec = tmpdir.join('spec.json')
+    spec.write(json.dumps({'defaults': defaults or {}, 'images': images}))
+    return str(spec)
+
+
+def _namespace(**kwargs):
+    defaults = dict(
+        host=None, tlsverify=False, cache=False, template_dir=None,
+        generate_jobs=2, build_jobs=1, export_jobs=1)
+    defaults.update(GLOBAL_NAMESPACE_KWARGS)
+    defaults.update(kwargs)
+    return argparse.Namespace(**defaults)
+
+
+def test_load_spec(tmpdir):
+    """Verify defaults, mappings and paths are resolved"""
+    images = pipeline.load_spec(_spec(tmpdir, [
+        {'tag': 'a:1', 'path': 'a', 'add-file': {'x': '/etc/x'}},
+        {'tag': 'b:1', 'path': 'b', 'from_base': 'a:1', 'output': 'b.tar'},
+    ], {'from_base': 'centos:7', 'default': {'k': 'v'}}))
+    assert images[0]['from_base'] == 'centos:7'
+    assert images[0]['add_file'] == ['x=/etc/x']
+    assert images[0]['default'] == ['k=v']
+    assert images[0]['path'] == str(tmpdir.join('a'))
+    assert images[1]['from_base'] == 'a:1'
+    assert images[1]['output'] == str(tmpdir.join('b.tar'))
+
+    with pytest.raises(ValueError):
+        pipeline.load_spec(_spec(tmpdir, [{'tag': 'a', 'path': 'a', 'x': 1}]))
+    with pytest.raises(ValueError):
+        pipeline.load_spec(_spec(tmpdir, [{'tag': 'a'}]))
+    with pytest.raises(ValueError) as error:
+        pipeline.load_spec(_spec(tmpdir, [
+            {'tag': 'a', 'path': 'a'}, {'tag': 'a:latest', 'path': 'b'}]))
+    assert 'more than once' in str(error.value)
+
+
+def test_pipeline_run(tmpdir, monkeypatch):
+    """Verify images pass every stage, overlapping and in base order"""
+    monkeypatch.chdir(tmpdir)
+    builder = FakeManager()
+    images = pipeline.load_spec(_spec(tmpdir, [
+        {'tag': 'a:1', 'path': 'a'},
+        {'tag': 'b:1', 'path': 'b', 'from_base': 'a:1',
+         'default': {'k': 'v'}},
+    ]))
+    runner = pipeline.Pipeline(
+        argparse.ArgumentParser(), _namespace(), builder,
+        {'generate': 2, 'build': 1, 'export': 1})
+    results = runner.run(images)
+    assert [x.status for x in results.values()] == ['success', 'success']
+    assert builder.events.index(('build', 'a:1')) < builder.events.index(
+        ('build', 'b:1'))
+    assert ('export', 'b:1') in builder.events
+
+    # The build got the rendered files in memory, matching those on disk
+    rendered = builder.rendered['b:1']
+    assert 'FROM a:1' in rendered['Dockerfile']
+    assert json.loads(rendered['manifest.json'])['defaultValues'] == {
+        'k': 'v'}
+    for name, content in rendered.items():
+        assert tmpdir.join('b', name).read() == content
+
+
+def test_pipeline_failure_skips_dependants(tmpdir, monkeypatch):
+    """Verify a failed build skips the images based on it"""
+    monkeypatch.chdir(tmpdir)
+    builder = FakeManager(fail=('a:1',))
+    images = pipeline.load_spec(_spec(tmpdir, [
+        {'tag': 'a:1', 'path': 'a'},
+        {'tag': 'b:1', 'path': 'b', 'from_base': 'a:1'},
+        {'tag': 'c:1', 'path': 'c'},
+    ]))
+    results = pipeline.Pipeline(
+        argparse.ArgumentParser(), _namespace(), builder,
+        {'generate': 1, 'build': 2, 'export': 1}).run(images)
+    assert results['a:1'].status == 'failed'
+    assert results['a:1'].stage == 'build'
+    assert results['b:1'].status == 'skipped'
+    assert results['c:1'].status == 'success'
+    assert ('build', 'b:1') not in builder.events
+
+
+def test_pipeline_bad_export_options(tmpdir, monkeypatch):
+    """Verify unusable export options fail only their own image"""
+    monkeypatch.chdir(tmpdir)
+    monkeypatch.setattr(compression, 'available', lambda codec: False)
+    builder = FakeManager()
+    images = pipeline.load_spec(_spec(tmpdir, [
+        {'tag': 'a:1', 'path': 'a'},
+        {'tag': 'b:1', 'path': 'b', 'compress': 'zstd'},
+    ]))
+    results = pipeline.Pipeline(
+        argparse.ArgumentParser(), _namespace(), builder,
+        {'generate': 1, 'build': 1, 'export': 1}).run(images)
+    assert results['a:1'].status == 'success'
+    assert ('export', 'a:1') in builder.events
+    assert results['b:1'].status == 'failed'
+    assert results['b:1'].stage == 'export'
+    assert results['b:1'].error == 'zstd compression is not available'
+
+
+def test_PipelineAction(tmpdir, monkeypatch):
+    """Verify the action reports every image and fails on errors"""
+    monkeypatch.chdir(tmpdir)
+    builder = FakeManager(fail=('b:1',))
+    monkeypatch.setattr(util, 'get_manager_class', lambda m: lambda: builder)
+    spec = _spec(tmpdir, [{'tag': 'a:1', 'path': 'a'},
+                          {'tag': 'b:1', 'path': 'b'}])
+    parser = argparse.ArgumentParser()
+    messages = []
+    monkeypatch.setattr(
+        parser, '_print_message', lambda m, f=None: messages.append(m))
+    with pytest.raises(SystemExit) as error:
+        PipelineAction('', '').run(parser, _namespace(), spec, None)
+    assert error.value.code == 1
+    assert messages[0].startswith('success')
+    assert messages[1].startswith('failed')
+    assert messages[1].rstrip().endswith('(build Command \'[\'build\']\' '
+                                         'returned non-zero exit status 1.)')
+
+    with pytest.raises(SystemExit):
+        PipelineAction('', '').run(
+            parser, _namespace(), str(tmpdir.join('missing.json')), None)
@@ -0,0 +1,189 @@
+# Copyright (C) 2017  Red Hat, Inc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for pulling base images before a batch of builds.
+"""
+
+import argparse
+import io
+import json
+import os
+import subprocess
+import sys
+import tarfile
+import threading
+import time
+
+# Ensure the package is in the path
+sys.path.insert(1, os.path.realpath('./src/'))
+
+from system_buildah import cache, dockerfile, pipeline, prefetch
+from system_buildah.actions.build_many_action import BuildManyAction
+from system_buildah.managers import buildah, moby, runner
+
+from .constants import *
+from .fake_runner import fake_run
+from .test_pipeline import FakeManager, _namespace, _spec
+
+DIGEST = 'sha256:' + 'ab' * 32
+
+
+def test_dockerfile_bases():
+    """Verify the bases of every stage are found and pinned"""
+    data = ('FROM golang:1.9 AS build\nRUN make\n'
+            'from build\nFROM scratch\nFROM $BASE\n'
+            'FROM --platform=linux/amd64 centos\n')
+    assert dockerfile.get_bases(dockerfile.parse(data)) == [
+        'golang:1.9', 'centos']
+    assert dockerfile.pin_bases(data, {
+        'golang:1.9': 'golang@' + DIGEST, 'centos:latest': None}) == (
+            data.replace('golang:1.9', 'golang@' + DIGEST))
+    assert dockerfile.repository('reg:5000/a/b:1') == 'reg:5000/a/b'
+    assert dockerfile.repository('a@' + DIGEST) == 'a'
+    assert dockerfile.repository('reg:5000/a') == 'reg:5000/a'
+
+
+def test_collect():
+    """Verify bases are pulled once and images of the batch not at all"""
+    assert prefetch.collect(
+        [['centos', 'golang:1.9'], ['centos:latest', 'app:1']],
+        ['app:1']) == ['centos:latest', 'golang:1.9']
+
+
+def test_BuildManyAction_prefetch(tmpdir, monkeypatch):
+    """Verify bases are pulled concurrently before any build"""
+    for name, base in (('a', 'centos:7'), ('b', 'fedora'), ('c', 'ubi:8'),
+                       ('d', 'a'), ('e', 'centos:7')):
+        tmpdir.mkdir(name).join('Dockerfile').write(
+            'FROM {}\nRUN true\n'.format(base))
+    lock = threading.Lock()
+    pulling = []
+    peak = []
+    events = []
+    dockerfiles = {}
+
+    def docker(command, cwd=None, stdin=None):
+        if command[1] == 'pull':
+            with lock:
+                pulling.append(command[2])
+                peak.append(len(pulling))
+            time.sleep(0.05)
+            with lock:
+                pulling.remove(command[2])
+                events.append(('pull', command[2]))
+            if command[2] == 'ubi:8':
+                raise subprocess.CalledProcessError(1, command)
+        elif command[1] == 'image':
+            repository = command[-1].split(':')[0]
+            return json.dumps(['other@sha256:00', '{}@{}'.format(
+                repository, DIGEST)]).encode()
+        elif stdin is None:
+            # Unpinned whole directories are still sent by docker itself
+            with open(os.path.join(cwd, 'Dockerfile')) as source:
+                dockerfiles[command[-2]] = source.read()
+        else:
+            context = tarfile.open(fileobj=io.BytesIO(b''.join(stdin)))
+            with lock:
+                events.append(('build', command[-2]))
+                dockerfiles[command[-2]] = context.extractfile(
+                    'Dockerfile').read().decode()
+
+    monkeypatch.setattr(runner, 'run', fake_run(docker))
+    BuildManyAction('', '').run(argparse.ArgumentParser(), argparse.Namespace(
+        host=None, tlsverify=False, jobs=2, directory=str(tmpdir),
+        full_context=True, prefetch=True, pull_jobs=2,
+        **GLOBAL_NAMESPACE_KWARGS), [], '')
+
+    pulls = [x for x in events if x[0] == 'pull']
+    assert sorted(pulls) == [
+        ('pull', 'centos:7'), ('pull', 'fedora:latest'), ('pull', 'ubi:8')]
+    assert events[:3] == pulls
+    assert max(peak) == 2
+    assert dockerfiles['a'] == 'FROM centos@{}\nRUN true\n'.format(DIGEST)
+    assert dockerfiles['b'] == 'FROM fedora@{}\nRUN true\n'.format(DIGEST)
+    assert dockerfiles['c'] == 'FROM ubi:8\nRUN true\n'
+    assert dockerfiles['d'] == 'FROM a\nRUN true\n'
+
+
+def test_moby_pull_on_every_host(monkeypatch):
+    """Verify each healthy host of a pool pulls the base"""
+    pulled = []
+
+    def docker(command, **kwargs):
+        if command[2] == 'pull':
+            pulled.append(command[1])
+        elif command[2] == 'image':
+            return b'[]' if command[1] == '--host=a' else (
+                '["centos@' + DIGEST + '"]').encode()
+        return b'1.0'
+
+    monkeypatch.setattr(runner, 'run', fake_run(docker))
+    ns = argparse.Namespace(
+        host=None, hosts=['a', 'b'], hosts_file=None, host_jobs=1,
+        tlsverify=False, **GLOBAL_NAMESPACE_KWARGS)
+    assert moby.Manager().pull(ns, 'centos:7') == 'centos@' + DIGEST
+    assert sorted(pulled) == ['--host=a', '--host=b']
+
+
+def test_buildah_pull(monkeypatch):
+    """Verify buildah pulls and reads the digest of the image"""
+    commands = []
+
+    def run(command, **kwargs):
+        commands.append(command)
+        return (DIGEST + '\n').encode() if command[1] == 'inspect' else b''
+
+    monkeypatch.setattr(runner, 'run', fake_run(run))
+    manager = buildah.Manager()
+    ns = argparse.Namespace(**GLOBAL_NAMESPACE_KWARGS)
+    assert manager.pull(ns, 'reg:5000/centos:7') == (
+        'reg:5000/centos@' + DIGEST)
+    assert commands[0] == ['buildah', 'pull', '--quiet', 'reg:5000/centos:7']
+
+
+def test_pipeline_prefetch(tmpdir, monkeypatch):
+    """Verify the pipeline renders its images from pinned bases"""
+    monkeypatch.chdir(tmpdir)
+
+    class PullingManager(FakeManager):
+        def pull(self, namespace, image):
+            self.events.append(('pull', image))
+            return 'centos@' + DIGEST
+
+    builder = PullingManager()
+    images = pipeline.load_spec(_spec(tmpdir, [
+        {'tag': 'a:1', 'path': 'a'},
+        {'tag': 'b:1', 'path': 'b', 'from_base': 'a:1'},
+        {'tag': 'c:1', 'path': 'c'},
+    ], {'from_base': 'centos:7'}))
+    results = pipeline.Pipeline(
+        argparse.ArgumentParser(), _namespace(prefetch=True, pull_jobs=2),
+        builder, {'generate': 2, 'build': 1, 'export': 1}).run(images)
+    assert {x.status for x in results.values()} == {'success'}
+    assert builder.events[0] == ('pull', 'centos:7')
+    assert builder.events.count(('pull', 'centos:7')) == 1
+    assert 'FROM centos@{}'.format(DIGEST) in builder.rendered['a:1'][
+        'Dockerfile']
+    assert 'FROM a:1' in builder.rendered['b:1']['Dockerfile']
+
+
+def test_cache_key_follows_pinned_base(tmpdir):
+    """Verify a build pinned to another digest is not reused"""
+    tmpdir.join('Dockerfile').write('FROM centos:7\n')
+    key = cache.context_digest(str(tmpdir), 'moby')
+    pinned = cache.context_digest(
+        str(tmpdir), 'moby', 'FROM centos@{}\n'.format(DIGEST))
+    assert key != pinned
+    assert key == cache.context_digest(str(tmpdir), 'moby', 'FROM centos:7')
@@ -0,0 +1,75 @@
+# Copyright (C) 2017  Red Hat, Inc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for the render module.
+"""
+
+import os
+import sys
+
+import jinja2
+import pytest
+
+# Ensure the package is in the path
+sys.path.insert(1, os.path.realpath('./src/'))
+
+from system_buildah import render
+
+
+@pytest.fixture
+def cache_home(monkeypatch, tmpdir):
+    """Isolates the bytecode cache and the shared environments"""
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmpdir.join('cache')))
+    monkeypatch.delenv(render.TEMPLATE_DIR_ENV, raising=False)
+    monkeypatch.setattr(render, '_ENVIRONMENTS', {})
+    return tmpdir.join('cache', 'system-buildah', 'templates')
+
+
+def test_get_environment_is_shared(cache_home):
+    """Verify templates compile once per process"""
+    environment = render.get_environment()
+    assert render.get_environment() is environment
+    assert environment.get_template('init.sh.j2') is \
+        environment.get_template('init.sh.j2')
+
+
+def test_render_writes_bytecode(cache_home, monkeypatch):
+    """Verify compiled templates are stored on disk"""
+    result = render.render('service.template.j2', description='testing')
+    assert '\nDescription=testing\n' in result
+    assert len(cache_home.listdir()) == 1
+
+    # A fresh process loads from the bytecode cache without compiling
+    render._ENVIRONMENTS.clear()
+
+    def fail(*args, **kwargs):
+        pytest.fail('template was compiled again')
+
+    monkeypatch.setattr(jinja2.Environment, 'compile', fail)
+    assert render.render(
+        'service.template.j2', description='testing') == result
+
+
+def test_render_override_dir(cache_home, tmpdir, monkeypatch):
+    """Verify override templates win and others fall back"""
+    overrides = tmpdir.mkdir('overrides')
+    overrides.join('init.sh.j2').write('#!/bin/sh\n{{ extra }}')
+    assert render.render(
+        'init.sh.j2', str(overrides), extra='custom') == '#!/bin/sh\ncustom'
+    assert 'Description=x' in render.render(
+        'service.template.j2', str(overrides), description='x')
+
+    monkeypatch.setenv(render.TEMPLATE_DIR_ENV, str(overrides))
+    assert render.render('init.sh.j2', extra='env') == '#!/bin/sh\nenv'
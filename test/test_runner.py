@@ -0,0 +1,180 @@
+# Copyright (C) 2017  Red Hat, Inc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for the command runner.
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+# Ensure the package is in the path
+sys.path.insert(1, os.path.realpath('./src/'))
+
+from system_buildah import managers
+from system_buildah.managers import runner
+from system_buildah.managers.moby import Manager as MobyManager
+
+
+def test_check_call_logs_lines(caplog):
+    """Verify output is logged line by line"""
+    caplog.set_level(logging.INFO)
+    runner.check_call(['sh', '-c', 'echo one; echo two >&2'])
+    messages = [x.getMessage() for x in caplog.records]
+    assert 'sh: one' in messages
+    assert 'sh: two' in messages
+
+
+def test_check_output_and_errors(tmpdir):
+    """Verify output, cwd and exit codes"""
+    assert runner.check_output(['pwd'], cwd=str(tmpdir)) == (
+        str(tmpdir) + '\n').encode('utf-8')
+    with pytest.raises(subprocess.CalledProcessError) as error:
+        runner.check_output(['sh', '-c', 'echo out; echo bad >&2; exit 3'])
+    assert error.value.returncode == 3
+    assert error.value.output == b'out\n'
+    assert error.value.stderr == 'bad'
+    with pytest.raises(OSError):
+        runner.check_call(['/does/not/exist'])
+
+
+def test_stdin(tmpdir):
+    """Verify chunks reach the command and early exits are tolerated"""
+    runner.check_call(['sh', '-c', 'cat > out'], cwd=str(tmpdir),
+                      stdin=[b'a', b'b'])
+    assert tmpdir.join('out').read_binary() == b'ab'
+    with pytest.raises(subprocess.CalledProcessError) as error:
+        runner.check_call(['sh', '-c', 'exit 4'],
+                          stdin=(b'x' * 65536 for _ in range(64)))
+    assert error.value.returncode == 4
+
+
+def test_timeout():
+    """Verify commands running too long are killed"""
+    start = time.monotonic()
+    with pytest.raises(runner.CommandTimeout) as error:
+        runner.check_call(['sleep', '10'], timeout=0.2)
+    assert time.monotonic() - start < 5
+    assert 'timed out after 0.2 seconds' in str(error.value)
+    assert isinstance(error.value, subprocess.CalledProcessError)
+
+
+def test_stream_timeout():
+    """Verify streamed commands are killed and failures raised"""
+    with runner.stream(['echo', 'hi']) as output:
+        assert output.read() == b'hi\n'
+    start = time.monotonic()
+    with pytest.raises(runner.CommandTimeout):
+        with runner.stream(['sleep', '10'], timeout=0.2) as output:
+            output.read()
+    assert time.monotonic() - start < 5
+    with pytest.raises(subprocess.CalledProcessError):
+        with runner.stream(['false']) as output:
+            output.read()
+
+
+def test_wait_keeps_the_thread_loop():
+    """Verify wait() puts back the loop the thread already had"""
+    async def nothing():
+        pass
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        runner.wait(nothing())
+        assert asyncio.get_event_loop() is loop
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+
+
+def test_cancel_and_concurrency():
+    """Verify commands run side by side and cancelling kills them"""
+    async def scenario():
+        start = time.monotonic()
+        await asyncio.gather(*[
+            runner.run(['sleep', '0.3']) for _ in range(4)])
+        elapsed = time.monotonic() - start
+        task = asyncio.ensure_future(runner.run(['sleep', '10']))
+        await asyncio.sleep(0.2)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return elapsed, time.monotonic() - start
+
+    parallel, total = runner.wait(scenario())
+    assert parallel < 1.0
+    assert total < 5
+
+
+def test_threads():
+    """Verify loops may run outside the main thread"""
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(
+        runner.check_output(['echo', 'hi']))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == [b'hi\n'] * 4
+
+
+def test_managers_share_a_loop(monkeypatch):
+    """Verify builds and exports can be scheduled on one event loop"""
+    running = []
+    peak = []
+
+    async def run(command, cwd=None, timeout=None, capture=False,
+                  stdin=None):
+        assert timeout == 5.0
+        running.append(command)
+        peak.append(len(running))
+        await asyncio.sleep(0.05)
+        running.remove(command)
+
+    monkeypatch.setattr(runner, 'run', run)
+    namespace = argparse.Namespace(
+        host=None, tlsverify=False, path='.', full_context=True,
+        command_timeout=5.0)
+    manager = MobyManager()
+
+    async def scenario():
+        return await asyncio.gather(
+            manager.build_async(namespace, 'a'),
+            manager.build_async(namespace, 'b'),
+            manager.tar_async(namespace, 'c'))
+
+    assert runner.wait(scenario())[2] == os.path.abspath('c.tar')
+    assert max(peak) == 3
+
+
+def test_executor_fallback(monkeypatch):
+    """Verify managers without native coroutines run in the executor"""
+    calls = []
+    monkeypatch.setattr(MobyManager, 'build', lambda s, n, t: calls.append(
+        (t, threading.current_thread() is threading.main_thread())))
+
+    async def scenario():
+        await managers.ImageManager.build_async(MobyManager(), None, 'x')
+
+    runner.wait(scenario())
+    assert calls == [('x', False)]
@@ -0,0 +1,102 @@
+# Copyright (C) 2017  Red Hat, Inc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for build scripts.
+"""
+
+import os
+import sys
+
+import pytest
+
+# Ensure the package is in the path
+sys.path.insert(1, os.path.realpath('./src/'))
+
+from system_buildah import dockerfile, script
+
+
+DOCKERFILE = '''FROM centos:7
+LABEL name="test" \\
+      summary="a b"
+RUN mkdir -p /exports/hostfs/usr/bin
+COPY init.sh /exports/hostfs/usr/bin
+COPY --chown=1:1 a b /exports/
+EXPOSE 80 443
+CMD ["/usr/bin/init.sh"]
+'''
+
+
+def test_from_instructions():
+    """
+    Verify a generated Dockerfile turns into steps, labels and config.
+    """
+    result = script.from_instructions(dockerfile.parse(DOCKERFILE))
+    assert result.base == 'centos:7'
+    assert result.labels == {'name': 'test', 'summary': 'a b'}
+    assert result.steps == [
+        script.Step('run', [
+            '/bin/sh', '-c', 'mkdir -p /exports/hostfs/usr/bin']),
+        script.Step('copy', ['init.sh', '/exports/hostfs/usr/bin']),
+        script.Step('copy', ['--chown=1:1', 'a', 'b', '/exports/']),
+    ]
+    assert result.config == [
+        '--port', '80', '--port', '443', '--cmd', '["/usr/bin/init.sh"]']
+    assert result.roots == {'/exports'}
+    assert result.reusable
+
+
+def test_reusable():
+    """
+    Verify only scripts creating new top level paths are reusable.
+    """
+    for line in ('RUN yum install -y x', 'RUN ["true"]', 'ENV a=b',
+                 'COPY a relative', 'RUN mkdir -p /'):
+        result = script.from_instructions(dockerfile.parse(
+            'FROM base\n{}\n'.format(line)))
+        assert not result.reusable, line
+        # Once not reusable the script stays that way
+        result._touch('/new')
+        assert result.roots is None
+
+
+def test_config_arguments():
+    """
+    Verify instructions map to buildah config switches.
+    """
+    assert script.config_arguments('--env', 'a b c') == ['--env', 'a=b c']
+    assert script.config_arguments('--env', 'a=1 b="2 3"') == [
+        '--env', 'a=1', '--env', 'b=2 3']
+    assert script.config_arguments('--volume', '["/a", "/b"]') == [
+        '--volume', '/a', '--volume', '/b']
+    assert script.config_arguments('--user', 'root') == ['--user', 'root']
+    result = script.from_instructions(dockerfile.parse(
+        'FROM base\nLABEL key a value\nWORKDIR /srv\n'))
+    assert result.labels == {'key': 'a value'}
+    assert result.steps == [script.Step('config', ['--workingdir', '/srv'])]
+
+
+@pytest.mark.parametrize('content', [
+    'FROM a\nFROM b\n',
+    'ARG x\nFROM a\n',
+    'FROM a\nHEALTHCHECK NONE\n',
+    'FROM a\nCOPY --from=b x /y\n',
+    'FROM --platform=linux/arm64 a\n',
+])
+def test_unsupported(content):
+    """
+    Verify instructions buildah can not be scripted with are refused.
+    """
+    with pytest.raises(script.UnsupportedInstruction):
+        script.from_instructions(dockerfile.parse(content))
@@ -0,0 +1,197 @@
+# Copyright (C) 2017  Red Hat, Inc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for the serve and submit commands.
+"""
+
+import argparse
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from concurrent import futures
+
+import pytest
+
+# Ensure the package is in the path
+sys.path.insert(1, os.path.realpath('./src/'))
+
+from system_buildah import server, util
+from system_buildah.actions.generate_dockerfile_action import (
+    GenerateDockerfileAction)
+from system_buildah.actions.submit_action import SubmitAction
+
+from .constants import *
+
+
+@pytest.fixture
+def socket_path():
+    """A short unix socket path"""
+    directory = tempfile.mkdtemp(prefix='sb')
+    yield os.path.join(directory, 'server.sock')
+    shutil.rmtree(directory)
+
+
+def _submit(socket_path, argv, cwd):
+    """Submits a job and returns its exit code and events"""
+    events = []
+    exit_code = server.submit(socket_path, argv, cwd, events.append)
+    return exit_code, events
+
+
+def test_default_socket(monkeypatch, tmpdir):
+    """Verify the socket path honors the environment"""
+    monkeypatch.setenv('SYSTEM_BUILDAH_SOCKET', '/run/x.sock')
+    assert server.default_socket() == '/run/x.sock'
+    monkeypatch.delenv('SYSTEM_BUILDAH_SOCKET')
+    monkeypatch.setenv('XDG_RUNTIME_DIR', '/run/user/1')
+    assert server.default_socket() == '/run/user/1/system-buildah.sock'
+    monkeypatch.delenv('XDG_RUNTIME_DIR')
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmpdir))
+    assert server.default_socket() == str(
+        tmpdir.join('system-buildah', 'server.sock'))
+
+
+def test_jobs_run_in_their_cwd(socket_path, tmpdir, monkeypatch):
+    """Verify jobs run relative to the client directory and stream output"""
+    monkeypatch.chdir(str(tmpdir))
+    client = tmpdir.mkdir('client')
+    with server.Server(socket_path, jobs=2) as instance:
+        instance.warm_up()
+        exit_code, events = _submit(
+            socket_path, ['generate-dockerfile', '-o', 'out', 'image'],
+            str(client))
+        assert exit_code == 0
+        assert events[0] == {'status': 'queued'}
+        assert {'status': 'running'} in events
+        assert client.join('out', 'Dockerfile').check()
+        # The server itself did not move
+        assert os.getcwd() == str(tmpdir)
+
+        # Usage errors come back on stderr with the parser's exit code
+        exit_code, events = _submit(
+            socket_path, ['build'], str(tmpdir))
+        assert exit_code == 2
+        assert 'arguments are required' in ''.join(
+            x['data'] for x in events if x.get('stream') == 'stderr')
+
+        # The server can not be nested
+        exit_code, _ = _submit(socket_path, ['serve'], str(tmpdir))
+        assert exit_code == 2
+
+        # Failing commands are reported like the CLI reports them
+        def fail(*args):
+            raise subprocess.CalledProcessError(1, ['docker'])
+        monkeypatch.setattr(util, 'get_manager_class', fail)
+        exit_code, events = _submit(socket_path, ['tar', 'x'], str(tmpdir))
+        assert exit_code == 2
+        assert events[-1] == {'exit_code': 2}
+
+        # A second server refuses the busy socket
+        with pytest.raises(OSError):
+            server.Server(socket_path)
+    assert not os.path.exists(socket_path)
+
+
+def test_pool_threads_reach_the_client(socket_path, tmpdir, monkeypatch):
+    """Verify logs and output of threads working for a job are sent"""
+    def report(parser):
+        logging.warning('from the pool')
+        parser._print_message('pool output\n', sys.stdout)
+
+    def run(self, parser, namespace, values, dest, option_string=None):
+        with futures.ThreadPoolExecutor(max_workers=1) as pool:
+            pool.submit(util.bind_working_directory(report), parser).result()
+        # Threads not working for the job stay with the server
+        other = threading.Thread(target=logging.warning, args=('other',))
+        other.start()
+        other.join()
+
+    monkeypatch.setattr(GenerateDockerfileAction, 'run', run)
+    with server.Server(socket_path, jobs=1):
+        exit_code, events = _submit(
+            socket_path, ['generate-dockerfile', 'image'], str(tmpdir))
+    assert exit_code == 0
+    assert events[:2] == [{'status': 'queued'}, {'status': 'running'}]
+    assert {'log': 'WARNING:from the pool', 'level': 'WARNING'} in events
+    assert {'stream': 'stdout', 'data': 'pool output\n'} in events
+    assert not [x for x in events if 'other' in x.get('log', '')]
+
+
+def test_standard_streams_refused(socket_path, tmpdir):
+    """Verify jobs can not read or write the server's standard streams"""
+    with server.Server(socket_path, jobs=1):
+        exit_code, events = _submit(
+            socket_path, ['inspect-tar', '-'], str(tmpdir))
+    assert exit_code == 2
+    assert 'can not be used by commands sent to a server' in ''.join(
+        x['data'] for x in events if x.get('stream') == 'stderr')
+
+
+def test_queue_is_bounded(socket_path, tmpdir, monkeypatch):
+    """Verify jobs beyond the queue size are refused"""
+    started = threading.Event()
+    release = threading.Event()
+
+    def block(self, parser, namespace, values, dest, option_string=None):
+        started.set()
+        release.wait(10)
+
+    monkeypatch.setattr(GenerateDockerfileAction, 'run', block)
+    argv = ['generate-dockerfile', 'image']
+    with server.Server(socket_path, jobs=1, queue_size=1) as instance:
+        results = []
+
+        def submit():
+            results.append(_submit(socket_path, argv, str(tmpdir))[0])
+
+        threads = [threading.Thread(target=submit) for _ in range(2)]
+        threads[0].start()
+        assert started.wait(10)
+        threads[1].start()
+        # Wait until the second job is queued behind the running one
+        while instance._queue.qsize() < 1:
+            time.sleep(0.01)
+        exit_code, events = _submit(socket_path, argv, str(tmpdir))
+        release.set()
+        for thread in threads:
+            thread.join()
+    assert exit_code == 75
+    assert events == [{'error': 'Server is busy', 'exit_code': 75}]
+    assert results == [0, 0]
+
+
+def test_submit_action(socket_path, tmpdir, monkeypatch, capsys):
+    """Verify submit relays output and exit codes"""
+    monkeypatch.chdir(str(tmpdir))
+    ns = argparse.Namespace(
+        socket=socket_path, log_level='info', **GLOBAL_NAMESPACE_KWARGS)
+    parser = argparse.ArgumentParser()
+    with server.Server(socket_path):
+        SubmitAction('', '').run(
+            parser, ns, ['--', 'generate-dockerfile', 'image'], None)
+        assert tmpdir.join('Dockerfile').check()
+        with pytest.raises(SystemExit) as error:
+            SubmitAction('', '').run(parser, ns, ['build'], None)
+        assert error.value.code == 2
+    assert 'the following arguments are required' in capsys.readouterr().err
+    with pytest.raises(SystemExit):
+        SubmitAction('', '').run(parser, ns, ['build', 'x'], None)
+    assert 'Unable to reach the server' in capsys.readouterr().err
@@ -17,30 +17,71 @@ Tests for the cli module.
 """
 
 import argparse
+import gzip
 import os
 import subprocess
 import sys
 
+import pytest
+
 # Ensure the package is in the path
 sys.path.insert(1, os.path.realpath('./src/'))
 
 from system_buildah.actions.tar_action import TarAction
+from system_buildah.managers import runner
+from system_buildah.managers.moby import Manager as MobyManager
 
 from .constants import *
+from .fake_runner import fake_run
 
 
 def test_TarAction(monkeypatch):
     """Verify TarAction runs the proper command"""
     image = 'a:a'
-    tar = 'a-a.tar'
+    tar = os.path.realpath('a-a.tar')
     def assert_call(args):
         assert args == [
             'docker', '--tlsverify', '--host=example.org',
             'save', '-o', tar, image]
 
-    monkeypatch.setattr(subprocess, 'check_call', assert_call)
+    monkeypatch.setattr(runner, 'run', fake_run(assert_call))
     TarAction('', '').run(
         '', argparse.Namespace(
             host='example.org', tlsverify=True,
             **GLOBAL_NAMESPACE_KWARGS),
         image)
+
+
+def test_TarAction_compressed_stream(monkeypatch, tmpdir):
+    """Verify TarAction streams the export through a compressor"""
+    archive = tmpdir.join('save')
+    archive.write_binary(b'layer data' * 1000)
+
+    def stream_command(self, namespace, image):
+        assert image == 'a:a'
+        return ['cat', str(archive)]
+
+    monkeypatch.setattr(MobyManager, 'stream_command', stream_command)
+    output = str(tmpdir.join('a-a.tar.gz'))
+    TarAction('', '').run(
+        '', argparse.Namespace(
+            host=None, tlsverify=False, compress='gzip', output=output,
+            threads=2, **GLOBAL_NAMESPACE_KWARGS),
+        'a:a')
+    with gzip.open(output) as result:
+        assert result.read() == archive.read_binary()
+    assert not os.path.exists(output + '.part')
+
+
+def test_TarAction_compressed_stream_failure(monkeypatch, tmpdir):
+    """Verify a failed export leaves no partial file behind"""
+    monkeypatch.setattr(
+        MobyManager, 'stream_command', lambda s, n, i: ['false'])
+    output = str(tmpdir.join('a-a.tar.xz'))
+    with pytest.raises(subprocess.CalledProcessError):
+        TarAction('', '').run(
+            '', argparse.Namespace(
+                host=None, tlsverify=False, compress='xz', output=output,
+                threads=1, **GLOBAL_NAMESPACE_KWARGS),
+            'a:a')
+    assert os.listdir(str(tmpdir)) == []
@@ -0,0 +1,193 @@
+# Copyright (C) 2017  Red Hat, Inc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for the tarindex module and the extract command.
+"""
+
+import argparse
+import io
+import json
+import os
+import sys
+import tarfile
+
+import pytest
+
+# Ensure the package is in the path
+sys.path.insert(1, os.path.realpath('./src/'))
+
+from system_buildah import tarindex
+from system_buildah.actions.extract_action import ExtractAction
+from system_buildah.actions.tar_action import TarAction
+from system_buildah.managers import runner
+
+from .constants import *
+from .fake_runner import fake_run
+
+
+def _tar(members):
+    """Returns a tar of (name, data or None for a directory, link) items"""
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode='w') as archive:
+        for name, data, link in members:
+            info = tarfile.TarInfo(name)
+            if link:
+                info.type, info.linkname = link
+                archive.addfile(info)
+            elif data is None:
+                info.type = tarfile.DIRTYPE
+                archive.addfile(info)
+            else:
+                info.size = len(data)
+                archive.addfile(info, io.BytesIO(data))
+    return buf.getvalue()
+
+
+BASE = _tar([
+    ('exports', None, None),
+    ('exports/manifest.json', b'{"old": true}', None),
+    ('etc/gone', b'deleted later', None),
+    ('var/cache/a', b'hidden by an opaque directory', None),
+    ('etc/hosts', b'127.0.0.1 localhost\n' * 500, None),
+])
+TOP = _tar([
+    ('./exports/manifest.json', b'{"new": true}', None),
+    ('etc/.wh.gone', b'', None),
+    ('var/cache/.wh..wh..opq', b'', None),
+    ('var/cache/b', b'b', None),
+    ('usr/bin/tool', b'tool', None),
+    ('usr/bin/alias', None, (tarfile.LNKTYPE, 'usr/bin/tool')),
+])
+
+
+def _archive(path, oci_style=False):
+    """Writes a docker-archive of two images sharing the base layer"""
+    members = [('base/layer.tar', BASE, None)]
+    top = 'top/layer.tar'
+    if oci_style:
+        members.append(('blobs/sha256/top', TOP, None))
+        members.append((top, None, (tarfile.SYMTYPE, '../blobs/sha256/top')))
+    else:
+        members.append((top, TOP, None))
+    manifest = [
+        {'RepoTags': ['app:1'], 'Layers': ['base/layer.tar', top]},
+        {'RepoTags': ['base:1'], 'Layers': ['base/layer.tar']},
+    ]
+    members.append(('manifest.json', json.dumps(manifest).encode(), None))
+    with open(path, 'wb') as archive:
+        archive.write(_tar(members))
+    return path
+
+
+def _read(archive, index, path, image=None):
+    out = io.BytesIO()
+    size = tarindex.extract(archive, index, path, out, image)
+    assert size == len(out.getvalue())
+    return out.getvalue()
+
+
+@pytest.mark.parametrize('oci_style', (False, True))
+def test_lookup_and_extract(tmpdir, oci_style):
+    """Verify files are found honoring layer order and whiteouts"""
+    archive = _archive(str(tmpdir.join('images.tar')), oci_style)
+    index = tarindex.build(archive)
+    assert index['default'] == 'app:1'
+    assert len(index['layers']) == 2
+
+    assert _read(archive, index, '/exports/manifest.json') == (
+        b'{"new": true}')
+    assert _read(archive, index, '/exports/manifest.json', 'base:1') == (
+        b'{"old": true}')
+    assert _read(archive, index, 'etc/hosts') == (
+        b'127.0.0.1 localhost\n' * 500)
+    assert _read(archive, index, '/usr/bin/alias') == b'tool'
+    assert _read(archive, index, '/var/cache/b') == b'b'
+    assert json.loads(_read(archive, index, 'manifest.json').decode())[1][
+        'RepoTags'] == ['base:1']
+    assert _read(archive, index, '/etc/.wh.gone') == b''
+
+    for path, image in (('/etc/gone', None), ('/var/cache/a', None),
+                        ('/usr/bin/tool', 'base:1'), ('/nope', None),
+                        ('/etc/hosts', 'other:1')):
+        with pytest.raises(tarindex.TarIndexError):
+            tarindex.lookup(index, path, image)
+    assert _read(archive, index, '/etc/gone', 'base:1') == b'deleted later'
+
+
+def test_save_and_load(tmpdir):
+    """Verify an index is only used while it matches its archive"""
+    archive = _archive(str(tmpdir.join('images.tar')))
+    assert tarindex.load(archive) is None
+    index = tarindex.build(archive)
+    tarindex.save(archive, index)
+    assert tarindex.load(archive) == index
+    assert not tmpdir.join('images.tar.index.json.part').check()
+
+    os.utime(archive, (1, 1))
+    assert tarindex.load(archive) is None
+    tmpdir.join('images.tar.index.json').write('not json')
+    assert tarindex.load(archive) is None
+
+    tmpdir.join('broken.tar').write_binary(b'\x1f\x8b' + b'x' * 2000)
+    with pytest.raises(tarindex.TarIndexError):
+        tarindex.build(str(tmpdir.join('broken.tar')))
+
+
+def test_ExtractAction(tmpdir, monkeypatch, capsysbinary):
+    """Verify extract indexes the archive once and writes the file"""
+    monkeypatch.chdir(str(tmpdir))
+    _archive('images.tar')
+
+    def namespace(**kwargs):
+        return argparse.Namespace(
+            archive='images.tar', output=kwargs.get('output', '-'),
+            image=kwargs.get('image'), **GLOBAL_NAMESPACE_KWARGS)
+
+    ExtractAction('', '').run(
+        argparse.ArgumentParser(), namespace(output='manifest.out'),
+        '/exports/manifest.json', '')
+    assert tmpdir.join('manifest.out').read() == '{"new": true}'
+    assert tmpdir.join('images.tar.index.json').check()
+
+    ExtractAction('', '').run(
+        argparse.ArgumentParser(), namespace(image='base:1'),
+        '/exports/manifest.json', '')
+    assert capsysbinary.readouterr()[0] == b'{"old": true}'
+
+    with pytest.raises(SystemExit):
+        ExtractAction('', '').run(
+            argparse.ArgumentParser(), namespace(output='missing.out'),
+            '/missing', '')
+    assert not tmpdir.join('missing.out').check()
+
+
+def test_TarAction_index(tmpdir, monkeypatch):
+    """Verify tar --index writes the index next to the export"""
+    monkeypatch.chdir(str(tmpdir))
+
+    def docker(command, **kwargs):
+        _archive(command[3])
+
+    monkeypatch.setattr(runner, 'run', fake_run(docker))
+    ns = argparse.Namespace(
+        host=None, tlsverify=False, compress=None, since=None, index=True,
+        output=None, cache=False, **GLOBAL_NAMESPACE_KWARGS)
+    TarAction('', '').run(argparse.ArgumentParser(), ns, 'app:1')
+    index = tarindex.load(str(tmpdir.join('app-1.tar')))
+    assert index['images']['app:1']
+
+    ns.compress = 'gzip'
+    with pytest.raises(SystemExit):
+        TarAction('', '').run(argparse.ArgumentParser(), ns, 'app:1')
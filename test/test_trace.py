@@ -0,0 +1,136 @@
+# Copyright (C) 2017  Red Hat, Inc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for the trace module.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+
+import pytest
+
+# Ensure the package is in the path
+sys.path.insert(1, os.path.realpath('./src/'))
+
+from system_buildah import trace
+from system_buildah.actions.generate_dockerfile_action import (
+    GenerateDockerfileAction)
+
+from .constants import *
+
+
+def _read_jsonl(path):
+    """Returns the spans of a jsonl trace by name"""
+    with open(path) as trace_file:
+        spans = [json.loads(line) for line in trace_file]
+    return {x['name']: x for x in spans}
+
+
+def test_span_is_a_no_op_without_a_trace():
+    """Verify spans only yield their arguments when not tracing"""
+    assert not trace.active()
+    with trace.span('phase', a=1) as args:
+        args['b'] = 2
+    assert args == {'a': 1, 'b': 2}
+
+
+def test_nested_spans_and_subprocesses(tmpdir):
+    """Verify spans nest and record argv and exit codes"""
+    path = str(tmpdir.join('trace.jsonl'))
+    with trace.tracing(path):
+        assert trace.active()
+        with trace.span('outer'):
+            trace.call(subprocess.check_call, ['true'])
+            with pytest.raises(subprocess.CalledProcessError):
+                trace.call(subprocess.check_call, ['false'], cwd='/')
+    assert not trace.active()
+    spans = _read_jsonl(path)
+    assert spans['outer']['parent'] is None
+    assert spans['exec true']['parent'] == spans['outer']['id']
+    assert spans['exec true']['args'] == {
+        'argv': ['true'], 'cwd': None, 'exit_code': 0}
+    assert spans['exec false']['args']['exit_code'] == 1
+    assert spans['exec false']['args']['cwd'] == '/'
+    assert 'CalledProcessError' in spans['exec false']['args']['error']
+    assert spans['outer']['duration'] >= spans['exec true']['duration']
+
+
+def test_chrome_format_and_threads(tmpdir):
+    """Verify spans from threads land in a Chrome trace"""
+    path = str(tmpdir.join('trace.json'))
+    # Keeps both threads alive so their ids differ
+    barrier = threading.Barrier(2)
+
+    def work(number):
+        with trace.span('work', number=number):
+            barrier.wait()
+
+    with trace.tracing(path) as outer:
+        # Commands without a trace file of their own join the enclosing one
+        with trace.tracing(None) as inner:
+            assert inner is outer
+        threads = [threading.Thread(target=trace.bind(work), args=(x,))
+                   for x in (1, 2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    with open(path) as trace_file:
+        events = json.load(trace_file)['traceEvents']
+    assert len(events) == 2
+    assert len({x['tid'] for x in events}) == 2
+    assert {x['ph'] for x in events} == {'X'}
+    assert sorted(x['args']['number'] for x in events) == [1, 2]
+
+
+def test_concurrent_traces_are_separate(tmpdir):
+    """Verify jobs tracing at once each write only their own spans"""
+    barrier = threading.Barrier(2)
+
+    def job(name):
+        with trace.tracing(str(tmpdir.join(name + '.jsonl'))):
+            with trace.span(name):
+                barrier.wait(5)
+
+    threads = [threading.Thread(target=job, args=(x,)) for x in 'xy']
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for name in 'xy':
+        assert list(_read_jsonl(str(tmpdir.join(name + '.jsonl')))) == [name]
+
+
+def test_action_writes_trace(tmpdir):
+    """Verify an action traced with --trace-file records its phases"""
+    path = str(tmpdir.join('trace.jsonl'))
+    output = str(tmpdir.join('out'))
+    ns = argparse.Namespace(
+        output=output, from_base='base', maintainer='m', license='l',
+        summary='s', version='1', help_text='h', architecture='x86_64',
+        scope='public', add_file=[], log_level='info', template_dir=None,
+        trace_file=path, trace_format='jsonl', **GLOBAL_NAMESPACE_KWARGS)
+    GenerateDockerfileAction('', '')('', ns, 'name')
+    spans = _read_jsonl(path)
+    root = spans['GenerateDockerfileAction']
+    assert root['args'] == {'values': 'name', 'manager': 'moby'}
+    for name in ('mkdir', 'render', 'write'):
+        assert spans[name]['parent'] is not None
+    assert spans['write']['args']['bytes_written'] == os.path.getsize(
+        os.path.join(output, 'Dockerfile'))
@@ -40,13 +40,27 @@ def test_mkdir(tmpdir):
     assert util.mkdir(path) == path  # Already exists
 
 
-def test_pushd(tmpdir):
-    """Verify pushd acts like pushd in the shell"""
+def test_working_directory(tmpdir):
+    """Verify working_directory resolves paths without changing the cwd"""
     original_cwd = os.getcwd()
-    path = tmpdir.mkdir('pushd').dirname
+    path = str(tmpdir.mkdir('cwd'))
+    with util.working_directory(path) as cwd:
+        assert cwd == util.getcwd() == os.path.realpath(path)
+        assert os.getcwd() == original_cwd  # The process did not move
+        assert util._expand_path('a/b') == os.path.join(cwd, 'a', 'b')
+        with util.working_directory('inner'):
+            assert util.getcwd() == os.path.join(cwd, 'inner')
+        assert util.getcwd() == cwd
+    assert util.getcwd() == original_cwd  # Now back to the original
+
+
+def test_pushd(tmpdir):
+    """Verify pushd moves the calling thread until end of context"""
+    original_cwd = util.getcwd()
+    path = str(tmpdir.mkdir('pushd'))
     with util.pushd(path):
-        assert os.getcwd() == path  # We should have moved to dir
-    assert os.getcwd() == original_cwd  # Now back to the original
+        assert util.getcwd() == os.path.realpath(path)
+    assert util.getcwd() == original_cwd
 
 
 def test_get_manager_class():